@@ -54,12 +54,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'reservations.middleware.IdentifiantRequeteMiddleware',
+    'reservations.middleware.MetriquesMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'reservations.middleware.ProfilageMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -113,6 +116,26 @@ DATABASES = {
 }
 
 
+# Cache partagé par tous les processus (workers gunicorn et commandes de gestion) :
+# versions des horaires et des disponibilités, table des tarifs, disjoncteurs des
+# opérateurs de paiement et profils en dépendent. Table créée par
+# `python manage.py createcachetable` ; Redis si la variable REDIS_URL est définie.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_agence',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -204,6 +227,10 @@ EMAIL_HOST_PASSWORD = 'Kaneza24?!'  # Mot de passe d'application Gmail
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Les emails portent l'identifiant de la requête et sont journalisés (voir reservations/journalisation.py)
+EMAIL_BACKEND_TRACE = EMAIL_BACKEND
+EMAIL_BACKEND = 'reservations.journalisation.EmailBackendTrace'
+
 # Configuration des emails
 DEFAULT_FROM_EMAIL = 'larissakaneza04@gmail.com'  # Doit correspondre à EMAIL_HOST_USER
 DEFAULT_TO_EMAIL = 'larissakaneza04@gmail.com'  # Email par défaut pour les envois
@@ -215,6 +242,54 @@ ADMINS = [
 ]
 MANAGERS = ADMINS
 
+# Journaux : une ligne JSON par événement sur la sortie standard, écrite par un thread dédié
+# (voir reservations/journalisation.py) ; niveau des journaux de l'application : NIVEAU_JOURNAL
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'identifiant_requete': {'()': 'reservations.journalisation.FiltreIdentifiantRequete'},
+        'require_debug_false': {'()': 'django.utils.log.RequireDebugFalse'},
+    },
+    'formatters': {
+        'json': {'()': 'reservations.journalisation.FormateurJSON'},
+    },
+    'handlers': {
+        'file': {
+            '()': 'reservations.journalisation.GestionnaireFile',
+            'capacite': 10000,
+            'formatter': 'json',
+            'filters': ['identifiant_requete'],
+        },
+        'mail_admins': {
+            'level': 'ERROR',
+            'filters': ['require_debug_false'],
+            'class': 'django.utils.log.AdminEmailHandler',
+        },
+    },
+    'root': {
+        'handlers': ['file'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['file', 'mail_admins'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'reservations': {
+            'handlers': ['file'],
+            'level': os.environ.get('NIVEAU_JOURNAL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Profilage des requêtes lentes (voir reservations/profilage.py), activé par la variable PROFILAGE=1
+PROFILAGE = {
+    'ACTIVE': os.environ.get('PROFILAGE') == '1',
+}
+
 # Configuration du site
 SITE_URL = 'http://127.0.0.1:8000'  # URL de base du site
 CONTACT_PHONE = '+33 1 23 45 67 89'  # Numéro de contact de l'agence
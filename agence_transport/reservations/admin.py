@@ -1,7 +1,14 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from .models import *
+from .recherche import rechercher_reservations
+from .grilles import generer_horaires
+from .forms import AjustementTarifsForm
+from .tarifs import ajuster_horaires
+from .remboursements import demander_remboursements_depart, traiter_remboursements
 
 # Enregistrement des modèles avec des configurations personnalisées
 
@@ -23,12 +30,80 @@ class TrajetAdmin(admin.ModelAdmin):
     list_editable = ('actif',)
     ordering = ('depart__ville__nom', 'arrivee__ville__nom')
 
+class HoraireClasseInline(admin.TabularInline):
+    model = HoraireClasse
+    extra = 0
+    fields = ('classe', 'prix', 'capacite', 'vendus')
+    # Tenu par les ventes (UPDATE avec F) : les places se règlent par la capacité
+    readonly_fields = ('vendus',)
+
 class HoraireAdmin(admin.ModelAdmin):
     list_display = ('trajet', 'date_depart', 'date_arrivee', 'get_prix_standard', 'get_places_standard', 'get_prix_business', 'get_places_business', 'get_prix_premiere', 'get_places_premiere')
     list_filter = ('trajet__depart__ville', 'trajet__arrivee__ville', 'date_depart')
     search_fields = ('trajet__depart__nom', 'trajet__arrivee__nom')
     date_hierarchy = 'date_depart'
     ordering = ('-date_depart',)
+    actions = ['ajuster_tarifs', 'rembourser_voyageurs']
+    inlines = (HoraireClasseInline,)
+
+    def get_queryset(self, request):
+        # Prix et places des colonnes de la liste : une requête pour toute la page
+        return super().get_queryset(request).with_classes()
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not HoraireClasse:
+            return super().save_formset(request, form, formset, change)
+        classes = formset.save(commit=False)
+        for objet in formset.deleted_objects:
+            objet.delete()
+        for classe in classes:
+            if classe.pk:
+                # Sans écrire `vendus`, lu à l'ouverture de la page : une vente concurrente n'est pas écrasée
+                classe.save(update_fields=['classe', 'prix', 'capacite'])
+            else:
+                classe.save()
+
+    @admin.action(description="Ajuster les prix et les places des horaires sélectionnés")
+    def ajuster_tarifs(self, request, queryset):
+        form = AjustementTarifsForm(request.POST if 'apercu' in request.POST or 'appliquer' in request.POST else None)
+        apercu = None
+        if form.is_valid():
+            resultat = ajuster_horaires(
+                queryset,
+                pourcentage=form.cleaned_data['pourcentage'],
+                montant=form.cleaned_data['montant'],
+                places=form.cleaned_data['places'] or 0,
+                classes=form.cleaned_data['classes'],
+                appliquer='appliquer' in request.POST
+            )
+            if 'appliquer' in request.POST:
+                self.message_user(request, f"{resultat.get('modifies', 0)} horaire(s) modifié(s).")
+                return None
+            apercu = [
+                (cle[:-len('_avant')], valeur, resultat[cle[:-len('_avant')] + '_apres'])
+                for cle, valeur in resultat.items() if cle.endswith('_avant')
+            ]
+
+        select_across = request.POST.get('select_across') == '1'
+        return TemplateResponse(request, 'admin/reservations/horaire/ajuster_tarifs.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'apercu': apercu,
+            'nombre': queryset.count(),
+            'select_across': select_across,
+            'selection': [] if select_across else request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        })
+    
+    @admin.action(description="Départ annulé : rembourser les voyageurs des horaires sélectionnés")
+    def rembourser_voyageurs(self, request, queryset):
+        demandes = demander_remboursements_depart(queryset)
+        bilan = traiter_remboursements(Remboursement.objects.filter(paiement__reservation__horaire__in=queryset))
+        self.message_user(
+            request,
+            f"{demandes} demande(s) de remboursement créée(s) ; {bilan['traites']} remboursement(s) traité(s) "
+            f"pour un total de {bilan['montant']} BIF."
+        )
     
     def get_prix_standard(self, obj):
         return f"{obj.prix_standard} BIF"
@@ -90,6 +165,10 @@ class ReservationAdmin(admin.ModelAdmin):
     readonly_fields = ('date_reservation', 'reference')
     ordering = ('-date_reservation',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Index de recherche dédié plutôt que des LIKE '%...%' sur les tables jointes
+        return rechercher_reservations(queryset, search_term), False
+
 class BilletAdmin(admin.ModelAdmin):
     list_display = ('id', 'reservation', 'type_billet', 'prix', 'siege')
     list_filter = ('type_billet',)
@@ -109,14 +188,109 @@ class RemboursementAdmin(admin.ModelAdmin):
     search_fields = ('paiement__reservation__reference', 'motif')
     readonly_fields = ('date_demande', 'date_traitement')
     date_hierarchy = 'date_demande'
+    actions = ['traiter']
+
+    @admin.action(description="Traiter les remboursements sélectionnés")
+    def traiter(self, request, queryset):
+        bilan = traiter_remboursements(queryset)
+        ignores = queryset.filter(traite=False).count()
+        self.message_user(
+            request,
+            f"{bilan['traites']} remboursement(s) traité(s) pour un total de {bilan['montant']} BIF ; "
+            f"{ignores} ignoré(s) (paiement non encaissé)."
+        )
+
+class BlocagePlacesAdmin(admin.ModelAdmin):
+    list_display = ('reservation', 'horaire', 'type_billet', 'nombre_places', 'expire_le')
+    list_filter = ('type_billet',)
+    search_fields = ('reservation__reference',)
+    list_select_related = ('reservation', 'horaire__trajet__depart__ville', 'horaire__trajet__arrivee__ville')
+    ordering = ('expire_le',)
+
+class GrilleHoraireAdmin(admin.ModelAdmin):
+    list_display = ('trajet', 'heure_depart', 'jours_semaine', 'date_debut', 'date_fin', 'actif')
+    list_filter = ('actif', 'trajet__depart__ville', 'trajet__arrivee__ville')
+    list_select_related = ('trajet__depart__ville', 'trajet__arrivee__ville')
+    actions = ['generer_horaires_action']
+
+    @admin.action(description="Générer les horaires des grilles sélectionnées")
+    def generer_horaires_action(self, request, queryset):
+        crees = ignores = 0
+        for grille in queryset.filter(actif=True).select_related('trajet'):
+            nombre, chevauchements = generer_horaires(grille)
+            crees += nombre
+            ignores += len(chevauchements)
+        self.message_user(request, f"{crees} horaire(s) créé(s), {ignores} départ(s) ignoré(s) pour chevauchement.")
 
 class TicketBonusAdmin(admin.ModelAdmin):
-    list_display = ('code', 'client', 'montant', 'date_creation', 'date_expiration', 'utilise')
-    list_filter = ('utilise', 'date_creation', 'date_expiration')
+    list_display = ('code', 'client', 'montant', 'date_creation', 'date_expiration', 'utilise', 'expire', 'rappel_envoye_le')
+    list_filter = ('utilise', 'expire', 'date_creation', 'date_expiration')
     search_fields = ('client__user__username', 'client__user__first_name', 'client__user__last_name', 'code')
     readonly_fields = ('date_creation',)
     date_hierarchy = 'date_creation'
 
+class MouvementFideliteAdmin(admin.ModelAdmin):
+    list_display = ('date', 'client', 'type', 'places', 'points', 'reservation', 'ticket', 'seuil')
+    list_filter = ('type', 'date')
+    search_fields = ('client__user__username', 'client__user__last_name', 'reservation__reference', 'ticket__code')
+    list_select_related = ('client__user', 'reservation', 'ticket')
+    raw_id_fields = ('client', 'reservation', 'ticket')
+    date_hierarchy = 'date'
+
+    # Journal en ajout seul : ni modification ni suppression
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+class CleIdempotenceAdmin(admin.ModelAdmin):
+    list_display = ('cle', 'utilisateur', 'portee', 'statut', 'code_reponse', 'verrouille_le', 'expire_le')
+    list_filter = ('statut',)
+    search_fields = ('cle', 'portee', 'utilisateur__username')
+    list_select_related = ('utilisateur',)
+    exclude = ('corps_reponse',)
+    readonly_fields = (
+        'utilisateur', 'cle', 'portee', 'empreinte_requete', 'statut', 'code_reponse',
+        'entetes_reponse', 'empreinte_reponse', 'verrouille_le', 'expire_le',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+class EvenementPaiementAdmin(admin.ModelAdmin):
+    list_display = ('identifiant', 'operateur', 'statut', 'recu_le', 'traite_le', 'erreur')
+    list_filter = ('statut', 'operateur')
+    search_fields = ('identifiant', 'corps')
+    date_hierarchy = 'recu_le'
+    readonly_fields = ('operateur', 'identifiant', 'corps', 'recu_le', 'statut', 'traite_le', 'erreur')
+    actions = ['remettre_en_file']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Remettre les notifications sélectionnées dans la file de traitement")
+    def remettre_en_file(self, request, queryset):
+        nombre = queryset.exclude(statut=EvenementPaiement.StatutEvenement.RECU).update(
+            statut=EvenementPaiement.StatutEvenement.RECU, traite_le=None, erreur=''
+        )
+        self.message_user(request, f"{nombre} notification(s) remise(s) dans la file.")
+
+class ModificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'type_objet', 'objet_id', 'supprime', 'proprietaire', 'date')
+    list_filter = ('type_objet', 'supprime')
+    search_fields = ('=objet_id',)
+    readonly_fields = ('type_objet', 'objet_id', 'proprietaire', 'supprime', 'date')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Désenregistrer le modèle User par défaut
 admin.site.unregister(User)
 
@@ -131,3 +305,9 @@ admin.site.register(Billet, BilletAdmin)
 admin.site.register(Paiement, PaiementAdmin)
 admin.site.register(Remboursement, RemboursementAdmin)
 admin.site.register(TicketBonus, TicketBonusAdmin)
+admin.site.register(BlocagePlaces, BlocagePlacesAdmin)
+admin.site.register(GrilleHoraire, GrilleHoraireAdmin)
+admin.site.register(MouvementFidelite, MouvementFideliteAdmin)
+admin.site.register(CleIdempotence, CleIdempotenceAdmin)
+admin.site.register(EvenementPaiement, EvenementPaiementAdmin)
+admin.site.register(Modification, ModificationAdmin)
@@ -0,0 +1,337 @@
+"""
+API de lecture v1 (/api/v1/) : villes, gares, trajets et horaires avec leurs
+places restantes et leurs prix, pour les agences partenaires et
+l'application mobile.
+
+Les lignes sont lues avec values(), sans instance de modèle, paginées par
+curseur (voir pagination.py) et sérialisées par orjson. Paramètres communs
+des listes :
+
+    champs=id,nom    champs renvoyés (tous par défaut)
+    limite=50        éléments par page (TAILLE_PAGE_MAX au plus)
+    curseur=...      jeton repris des liens « suivant » et « precedent »
+
+Les montants (prix) sont renvoyés sous forme de chaînes décimales
+(« 12500.00 ») : pas d'arrondi binaire d'un nombre à virgule flottante.
+
+La réponse est mise en cache sous une clé qui inclut la version des données
+qu'elle contient (réseau pour les villes, gares et trajets, version globale
+des disponibilités et tarifs pour les horaires) : une requête répétée ne
+touche pas la base. Une page d'horaires garde aussi la version des couples
+(trajet, jour) de ses départs, vérifiée à chaque lecture : une vente ne rend
+obsolètes que les pages qui contiennent ce départ. Un départ absent d'une
+page filtrée par disponible=1 qui retrouve des places n'y apparaît qu'à
+l'expiration de l'entrée (DUREE_CACHE), comme les changements de palier
+des prix dynamiques. Elle porte un ETag, et une requête If-None-Match qui lui correspond reçoit
+une réponse 304 sans corps. Réglages :
+
+    API_V1 = {
+        'TAILLE_PAGE': 50,
+        'TAILLE_PAGE_MAX': 500,
+        'DUREE_CACHE': 60,   # secondes, cache du serveur
+        'MAX_AGE': 30,       # secondes, en-tête Cache-Control
+    }
+"""
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import orjson
+from django.conf import settings
+from django.utils import timezone
+
+from .inventaire import cle_version_trajet_jour, version_disponibilite, versions_trajets_jours
+from .itineraires import version_reseau
+from .models import Gare, Horaire, HoraireClasse, TicketBonus, Trajet, Ville
+from .pagination import paginer
+from .tarification import est_active, table_tarifs
+
+PARAMETRES_PAR_DEFAUT = {
+    'TAILLE_PAGE': 50,
+    'TAILLE_PAGE_MAX': 500,
+    'DUREE_CACHE': 60,
+    'MAX_AGE': 30,
+}
+
+VERSION = 'v1'
+
+# Écart maximal accepté entre une date demandée et aujourd'hui
+HORIZON_DATES = timedelta(days=366)
+
+
+class ParametreInvalide(ValueError):
+    """Paramètre de requête invalide (réponse 400)"""
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'API_V1', {})}
+
+
+def entier(valeur, nom):
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        raise ParametreInvalide(f"Paramètre « {nom} » invalide : nombre entier attendu.")
+
+
+def booleen(valeur, nom):
+    if valeur in ('1', 'true', 'oui'):
+        return True
+    if valeur in ('0', 'false', 'non'):
+        return False
+    raise ParametreInvalide(f"Paramètre « {nom} » invalide : 1 ou 0 attendu.")
+
+
+def date_parametre(valeur, nom='date'):
+    """
+    Date AAAA-MM-JJ d'un paramètre, à moins d'un an d'aujourd'hui : les
+    dates extrêmes (9999-12-31) feraient déborder les calculs d'horaires.
+    """
+    try:
+        jour = datetime.strptime(valeur, '%Y-%m-%d').date()
+    except ValueError:
+        raise ParametreInvalide(f"Paramètre « {nom} » invalide (format attendu : AAAA-MM-JJ).")
+    if abs(jour - timezone.localdate()) > HORIZON_DATES:
+        raise ParametreInvalide(f"Paramètre « {nom} » invalide : date à moins d'un an d'aujourd'hui attendue.")
+    return jour
+
+
+def _decimal(valeur):
+    # orjson ne sérialise pas Decimal : appelé pour les types qu'il ne connaît pas.
+    # Chaîne plutôt que float, pour renvoyer le montant exact
+    if isinstance(valeur, Decimal):
+        return str(valeur)
+    raise TypeError(type(valeur).__name__)
+
+
+def serialiser(donnees):
+    return orjson.dumps(donnees, default=_decimal)
+
+
+def dependances_a_jour(dependances):
+    """Vrai si les versions `dependances` (voir Ressource.dependances) n'ont pas changé"""
+    return not dependances or versions_trajets_jours(list(dependances)) == dependances
+
+
+def etiquette(corps):
+    """ETag d'un corps de réponse"""
+    return f'"{hashlib.blake2b(corps, digest_size=16).hexdigest()}"'
+
+
+class Ressource:
+    """
+    Liste exposée par l'API. `colonnes` associe chaque champ renvoyé à sa
+    colonne dans values(), `conversions` les valeurs à transformer ;
+    `calcules` sont les champs ajoutés par completer(). `ordre` est la clé
+    de la pagination (dernière colonne unique) et `filtres` les paramètres
+    entiers acceptés (paramètre -> lookup).
+    """
+    modele = None
+    colonnes = {}
+    conversions = {}
+    calcules = ()
+    ordre = ['id']
+    filtres = {}
+
+    @property
+    def champs(self):
+        return (*self.colonnes, *self.calcules)
+
+    def version(self):
+        """Version des données, incluse dans la clé de cache des réponses"""
+        return version_reseau()
+
+    def dependances(self, pks):
+        """
+        Versions des données des éléments `pks` qui changent plus souvent que
+        version(), gardées avec la réponse en cache et vérifiées à chaque
+        lecture : {clé de cache: version}.
+        """
+        return {}
+
+    def queryset(self, requete):
+        queryset = self.modele.objects.all()
+        for parametre, lookup in self.filtres.items():
+            valeur = requete.get(parametre)
+            if valeur is not None:
+                queryset = queryset.filter(**{lookup: entier(valeur, parametre)})
+        return queryset
+
+    def completer(self, resultats, pks, champs):
+        """Ajoute aux résultats les champs calculés demandés"""
+
+
+class Villes(Ressource):
+    modele = Ville
+    colonnes = {'id': 'id', 'nom': 'nom', 'code': 'code'}
+
+
+class Gares(Ressource):
+    modele = Gare
+    colonnes = {'id': 'id', 'nom': 'nom', 'ville': 'ville_id', 'adresse': 'adresse'}
+    filtres = {'ville': 'ville_id'}
+
+
+class Trajets(Ressource):
+    modele = Trajet
+    colonnes = {
+        'id': 'id', 'depart': 'depart_id', 'arrivee': 'arrivee_id',
+        'duree_minutes': 'duree', 'distance': 'distance', 'actif': 'actif',
+    }
+    conversions = {'duree_minutes': lambda duree: int(duree.total_seconds() // 60)}
+    filtres = {
+        'depart': 'depart_id', 'arrivee': 'arrivee_id',
+        'ville_depart': 'depart__ville_id', 'ville_arrivee': 'arrivee__ville_id',
+    }
+
+    def queryset(self, requete):
+        queryset = super().queryset(requete)
+        if 'actif' in requete:
+            queryset = queryset.filter(actif=booleen(requete['actif'], 'actif'))
+        return queryset
+
+
+class Horaires(Ressource):
+    """
+    Départs à venir. Filtres : depart et arrivee (gares, ou villes avec
+    niveau=ville), trajet, date (AAAA-MM-JJ, à moins d'un an), disponible=1 (départs qui ont
+    encore des places, dans la classe `classe` si elle est indiquée).
+    """
+    modele = Horaire
+    colonnes = {
+        'id': 'id', 'trajet': 'trajet_id', 'depart': 'trajet__depart_id', 'arrivee': 'trajet__arrivee_id',
+        'date_depart': 'date_depart', 'date_arrivee': 'date_arrivee',
+    }
+    calcules = ('classes', 'places', 'prix_min')
+    ordre = ['date_depart', 'id']
+    filtres = {'trajet': 'trajet_id'}
+
+    def version(self):
+        # Les prix dynamiques changent aussi de palier avec le temps : DUREE_CACHE borne ce décalage
+        generation = table_tarifs.generation() if est_active() else 0
+        return f'{version_disponibilite()}.{generation}'
+
+    def dependances(self, pks):
+        return versions_trajets_jours(list({
+            cle_version_trajet_jour(trajet_id, timezone.localdate(date_depart))
+            for trajet_id, date_depart in Horaire.objects.filter(pk__in=pks).values_list('trajet_id', 'date_depart')
+        }))
+
+    def queryset(self, requete):
+        queryset = super().queryset(requete)
+        if requete.get('disponible') and booleen(requete['disponible'], 'disponible'):
+            queryset = queryset.bookable(requete.get('classe'))
+        else:
+            queryset = queryset.upcoming()
+        depart, arrivee = requete.get('depart'), requete.get('arrivee')
+        if depart or arrivee:
+            queryset = queryset.between(
+                depart and entier(depart, 'depart'), arrivee and entier(arrivee, 'arrivee'),
+                gares=requete.get('niveau') != 'ville',
+            )
+        if requete.get('date'):
+            queryset = queryset.on_date(date_parametre(requete['date']))
+        return queryset
+
+    def completer(self, resultats, pks, champs):
+        if not any(champ in champs for champ in self.calcules):
+            return
+        classes = defaultdict(dict)
+        for horaire, classe, prix, capacite, vendus in HoraireClasse.objects.filter(
+            horaire_id__in=pks
+        ).values_list('horaire_id', 'classe', 'prix', 'capacite', 'vendus'):
+            classes[horaire][classe] = {'prix': prix, 'places': max(capacite - vendus, 0)}
+        if est_active():
+            # Prix courants lus dans la table de consultation des tarifs
+            for horaire, tarifs in table_tarifs.tarifs(list(classes)).items():
+                for classe, valeurs in classes[horaire].items():
+                    valeurs['prix'] = tarifs[classe]
+
+        for resultat, pk in zip(resultats, pks):
+            par_classe = classes.get(pk, {})
+            if 'classes' in champs:
+                resultat['classes'] = par_classe
+            if 'places' in champs:
+                resultat['places'] = sum(valeurs['places'] for valeurs in par_classe.values())
+            if 'prix_min' in champs:
+                prix = [valeurs['prix'] for valeurs in par_classe.values() if valeurs['places'] > 0]
+                resultat['prix_min'] = min(prix) if prix else None
+
+
+class TicketsBonus(Ressource):
+    """Tickets bonus d'un client, transmis à lui seul (voir synchronisation.py)"""
+    modele = TicketBonus
+    colonnes = {
+        'id': 'id', 'code': 'code', 'montant': 'montant', 'nombre_places': 'nombre_places',
+        'date_expiration': 'date_expiration', 'utilise': 'utilise', 'expire': 'expire',
+    }
+
+
+RESSOURCES = {
+    'villes': Villes(),
+    'gares': Gares(),
+    'trajets': Trajets(),
+    'horaires': Horaires(),
+}
+
+# Ressources propres au client connecté, absentes des listes publiques
+RESSOURCES_CLIENT = {
+    'tickets_bonus': TicketsBonus(),
+}
+
+
+def choisir_champs(ressource, demande):
+    """Champs demandés (paramètre champs=a,b), dans l'ordre de la ressource"""
+    if not demande:
+        return ressource.champs
+    demandes = {champ.strip() for champ in demande.split(',') if champ.strip()}
+    inconnus = demandes - set(ressource.champs)
+    if inconnus:
+        raise ParametreInvalide(
+            f"Champ(s) inconnu(s) : {', '.join(sorted(inconnus))}. Champs disponibles : {', '.join(ressource.champs)}."
+        )
+    return tuple(champ for champ in ressource.champs if champ in demandes)
+
+
+def lire(ressource, queryset, champs, page=None):
+    """
+    Lignes de `queryset` réduites aux `champs`, lues par values() ; avec
+    `page` = (limite, jeton), une page et ses jetons de pagination.
+    Retourne (résultats, jeton suivant, jeton précédent, clés primaires).
+    """
+    selection = [(champ, ressource.colonnes[champ], ressource.conversions.get(champ))
+                 for champ in champs if champ in ressource.colonnes]
+    colonnes = dict.fromkeys([*(colonne for _champ, colonne, _conversion in selection), *ressource.ordre])
+    queryset = queryset.values(*colonnes)
+    suivant = precedent = None
+    if page is None:
+        lignes = list(queryset)
+    else:
+        lignes, suivant, precedent = paginer(queryset, ressource.ordre, *page)
+
+    resultats = [
+        {champ: (conversion(ligne[colonne]) if conversion else ligne[colonne]) for champ, colonne, conversion in selection}
+        for ligne in lignes
+    ]
+    pks = [ligne['id'] for ligne in lignes]
+    ressource.completer(resultats, pks, champs)
+    return resultats, suivant, precedent, pks
+
+
+def lister(ressource, requete, limite, jeton=None):
+    """
+    Page de la ressource filtrée par les paramètres `requete` (QueryDict).
+    Retourne (résultats, jeton suivant, jeton précédent, dépendances) ;
+    lève ParametreInvalide ou CurseurInvalide.
+    """
+    champs = choisir_champs(ressource, requete.get('champs'))
+    resultats, suivant, precedent, pks = lire(ressource, ressource.queryset(requete), champs, (limite, jeton))
+    return resultats, suivant, precedent, ressource.dependances(pks)
+
+
+def detail(ressource, pk, requete):
+    """(élément `pk` de la ressource ou None, dépendances)"""
+    champs = choisir_champs(ressource, requete.get('champs'))
+    resultats, _suivant, _precedent, pks = lire(ressource, ressource.modele.objects.filter(pk=pk), champs)
+    return (resultats[0] if resultats else None), ressource.dependances(pks)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ReservationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservations'
+
+    def ready(self):
+        # Enregistrement des gestionnaires de signaux
+        from . import signals  # noqa: F401
+        # Mesure du rendu des gabarits et des lectures du cache
+        from .metriques import instrumenter
+        instrumenter()
@@ -0,0 +1,151 @@
+"""
+Blocage temporaire des places pendant le paiement.
+
+Une réservation est créée « en attente de paiement » et ses places sont
+retenues pendant `DUREE_BLOCAGE_PLACES` minutes. Le paiement convertit le
+blocage en réservation confirmée ; sinon la commande `liberer_blocages`
+annule la réservation et rend les places à l'horaire, par lots, ainsi que
+le ticket bonus utilisé pour la réservation.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Billet, BlocagePlaces, Reservation
+from .fidelite import restituer_tickets
+from .inventaire import restituer_places
+
+TAILLE_LOT_BLOCAGES = 500
+
+
+class BlocageExpire(Exception):
+    """Le délai de paiement de la réservation est dépassé"""
+
+
+def duree_blocage():
+    return timedelta(minutes=getattr(settings, 'DUREE_BLOCAGE_PLACES', 10))
+
+
+def creer_blocage(reservation, type_billet, nombre_places, ticket_bonus=None):
+    """
+    Enregistre le blocage des places d'une réservation en attente.
+
+    Les places doivent déjà avoir été décomptées avec `retenir_places`, et
+    le `ticket_bonus` éventuel marqué utilisé : il est rendu au client si le
+    blocage est libéré.
+    """
+    return BlocagePlaces.objects.create(
+        reservation=reservation,
+        horaire_id=reservation.horaire_id,
+        type_billet=type_billet,
+        nombre_places=nombre_places,
+        expire_le=timezone.now() + duree_blocage(),
+        ticket_bonus=ticket_bonus,
+    )
+
+
+def confirmer_blocage(reservation):
+    """
+    Convertit le blocage d'une réservation en réservation confirmée.
+
+    Lève BlocageExpire si le délai de paiement est dépassé ; les places sont
+    alors rendues immédiatement. Une réservation sans blocage (déjà confirmée)
+    est laissée telle quelle.
+    """
+    with transaction.atomic():
+        blocage = BlocagePlaces.objects.select_for_update().filter(reservation=reservation).first()
+        if blocage is None:
+            if reservation.statut == Reservation.StatutReservation.EN_ATTENTE:
+                # Le blocage a déjà été libéré par le balayage
+                raise BlocageExpire()
+            return reservation
+
+        expire = blocage.est_expire()
+        if expire:
+            _liberer([blocage])
+        else:
+            blocage.delete()
+            Reservation.objects.filter(pk=reservation.pk).update(statut=Reservation.StatutReservation.CONFIRMEE)
+
+    if expire:
+        reservation.statut = Reservation.StatutReservation.ANNULEE
+        raise BlocageExpire()
+    reservation.statut = Reservation.StatutReservation.CONFIRMEE
+    return reservation
+
+
+def verifier_blocage(reservation, marge=timedelta(0)):
+    """
+    Vérifie, avant de débiter le client, que les places de la réservation
+    restent bloquées au moins `marge` (durée de l'appel à l'opérateur).
+
+    Sinon le blocage est libéré et BlocageExpire est levée.
+    """
+    blocage = BlocagePlaces.objects.filter(reservation=reservation).only('expire_le').first()
+    if blocage is None:
+        expire = reservation.statut == Reservation.StatutReservation.EN_ATTENTE
+    else:
+        expire = blocage.expire_le <= timezone.now() + marge
+    if expire:
+        with transaction.atomic():
+            blocages = list(BlocagePlaces.objects.select_for_update().filter(reservation=reservation))
+            if blocages:
+                _liberer(blocages)
+        reservation.statut = Reservation.StatutReservation.ANNULEE
+        raise BlocageExpire()
+
+
+def _liberer(blocages):
+    """
+    Rend les places et les tickets bonus des blocages, annule leurs
+    réservations et supprime les blocages
+    """
+    places = Counter()
+    for blocage in blocages:
+        places[(blocage.horaire_id, blocage.type_billet)] += blocage.nombre_places
+
+    # Une seule mise à jour par couple (horaire, classe) du lot
+    for (horaire_id, type_billet), nombre in places.items():
+        restituer_places(horaire_id, type_billet, nombre)
+
+    reservation_ids = [blocage.reservation_id for blocage in blocages]
+    Billet.objects.filter(reservation_id__in=reservation_ids).update(annule=True)
+    Reservation.objects.filter(
+        pk__in=reservation_ids,
+        statut=Reservation.StatutReservation.EN_ATTENTE
+    ).update(statut=Reservation.StatutReservation.ANNULEE)
+    BlocagePlaces.objects.filter(pk__in=[blocage.pk for blocage in blocages]).delete()
+    restituer_tickets({
+        blocage.ticket_bonus_id: blocage.reservation_id for blocage in blocages if blocage.ticket_bonus_id
+    })
+
+
+def liberer_blocages_expires(taille_lot=TAILLE_LOT_BLOCAGES, maintenant=None):
+    """
+    Libère tous les blocages expirés, par lots de `taille_lot`.
+
+    Chaque lot est traité dans sa propre transaction ; sur PostgreSQL les
+    lignes déjà verrouillées par un autre balayage ou un paiement en cours
+    sont ignorées. Retourne le nombre de blocages libérés.
+    """
+    maintenant = maintenant or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            lot = list(
+                BlocagePlaces.objects.select_for_update(skip_locked=True).filter(
+                    expire_le__lte=maintenant
+                ).order_by('expire_le').only(
+                    'pk', 'reservation_id', 'horaire_id', 'type_billet', 'nombre_places', 'ticket_bonus_id'
+                )[:taille_lot]
+            )
+            if not lot:
+                break
+            _liberer(lot)
+        total += len(lot)
+        if len(lot) < taille_lot:
+            break
+    return total
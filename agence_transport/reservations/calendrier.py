@@ -0,0 +1,124 @@
+"""
+Calendrier des tarifs : prix le plus bas et places restantes par jour et par
+classe pour une liaison, sur une période de plusieurs semaines.
+
+Le calendrier est calculé en une seule requête groupée par jour et par classe,
+puis mis en cache sous une clé qui inclut la version globale des
+disponibilités (modification d'horaire, réconciliation...). Chaque entrée
+garde aussi la version des couples (trajet, jour) de ses départs, vérifiée à
+chaque lecture : une vente ou une annulation ne rend obsolètes que les
+calendriers qui contiennent ce départ. Ces versions n'invalident les
+calendriers de tous les workers que si le cache par défaut est partagé
+(CACHES dans settings.py).
+
+Avec la tarification dynamique, les prix sont les prix courants lus dans la
+table des tarifs (ceux qui seront facturés), et non les prix de base.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, IntegerField, Min, Q, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .inventaire import cle_version_trajet_jour, version_disponibilite, versions_trajets_jours
+from .models import Horaire, HoraireClasse, TypeBillet
+from .tarification import est_active, table_tarifs
+
+JOURS_PAR_DEFAUT = 30
+JOURS_MAX = 60
+
+
+def duree_cache():
+    return getattr(settings, 'CALENDRIER_CACHE_TIMEOUT', 300)
+
+
+def _calculer(depart, arrivee, debut, jours, par_ville):
+    """Retourne (versions des couples (trajet, jour) utilisés, calendrier)"""
+    premier = timezone.make_aware(datetime.datetime.combine(debut, datetime.time.min))
+    fin = timezone.make_aware(datetime.datetime.combine(debut + datetime.timedelta(days=jours), datetime.time.min))
+
+    horaires = Horaire.objects.upcoming().between(depart, arrivee, gares=not par_ville).filter(
+        date_depart__gte=premier, date_depart__lt=fin
+    )
+    # Versions lues avant le calcul : une vente concurrente rendra l'entrée obsolète
+    versions = versions_trajets_jours(list({
+        cle_version_trajet_jour(trajet_id, timezone.localdate(date_depart))
+        for trajet_id, date_depart in horaires.values_list('trajet_id', 'date_depart')
+    }))
+    classes = HoraireClasse.objects.filter(horaire__in=horaires.values('pk')).annotate(
+        jour=TruncDate('horaire__date_depart', tzinfo=timezone.get_current_timezone())
+    )
+    if est_active():
+        par_jour = _par_jour_tarifs_courants(classes)
+    else:
+        lignes = classes.values('jour', 'classe').annotate(
+            # Prix minimum parmi les départs qui ont encore des places dans la classe
+            prix_min=Min('prix', filter=Q(vendus__lt=F('capacite'))),
+            places=Sum(Greatest(F('capacite') - F('vendus'), 0, output_field=IntegerField())),
+        ).order_by()
+        par_jour = {(ligne['jour'], ligne['classe']): ligne for ligne in lignes}
+
+    calendrier = []
+    for decalage in range(jours):
+        jour = debut + datetime.timedelta(days=decalage)
+        classes = {}
+        for classe in TypeBillet.values:
+            ligne = par_jour.get((jour, classe))
+            prix = ligne['prix_min'] if ligne else None
+            classes[classe] = {'prix_min': prix, 'places': ligne['places'] if ligne else 0}
+        prix_jour = [valeurs['prix_min'] for valeurs in classes.values() if valeurs['prix_min'] is not None]
+        # Montants en chaînes décimales, comme dans l'API (pas d'arrondi binaire)
+        for valeurs in classes.values():
+            valeurs['prix_min'] = _montant(valeurs['prix_min'])
+        calendrier.append({
+            'date': jour.isoformat(),
+            'prix_min': _montant(min(prix_jour)) if prix_jour else None,
+            'classes': classes,
+        })
+    return versions, calendrier
+
+
+def _montant(prix):
+    return str(prix) if prix is not None else None
+
+
+def _par_jour_tarifs_courants(classes):
+    """
+    Prix minimum courant et places restantes par (jour, classe), à partir
+    des classes de chaque départ et de la table des tarifs.
+    """
+    lignes = list(classes.values_list('horaire_id', 'jour', 'classe', 'capacite', 'vendus'))
+    tarifs = table_tarifs.tarifs({horaire_id for horaire_id, *_valeurs in lignes})
+    par_jour = {}
+    for horaire_id, jour, classe, capacite, vendus in lignes:
+        ligne = par_jour.setdefault((jour, classe), {'prix_min': None, 'places': 0})
+        restantes = max(capacite - vendus, 0)
+        ligne['places'] += restantes
+        if restantes:
+            prix = tarifs[horaire_id][classe]
+            if ligne['prix_min'] is None or prix < ligne['prix_min']:
+                ligne['prix_min'] = prix
+    return par_jour
+
+
+def calendrier_tarifs(depart, arrivee, debut=None, jours=JOURS_PAR_DEFAUT, par_ville=False):
+    """
+    Liste, pour chacun des `jours` jours à partir de `debut`, du prix minimum
+    et des places restantes de chaque classe entre deux gares (ou deux villes
+    avec `par_ville`). Les jours sans départ ont un prix minimum à None.
+    """
+    debut = max(debut or timezone.localdate(), timezone.localdate())
+    jours = min(max(jours, 1), JOURS_MAX)
+    # Les prix dynamiques changent aussi de palier avec le temps : la durée du cache borne ce décalage
+    generation = table_tarifs.generation() if est_active() else 0
+    cle = 'calendrier:{}.{}:{}:{}:{}:{}:{}'.format(
+        version_disponibilite(), generation, 'ville' if par_ville else 'gare', depart, arrivee, debut.isoformat(), jours
+    )
+    entree = cache.get(cle)
+    if entree is not None and versions_trajets_jours(list(entree[0])) == entree[0]:
+        return entree[1]
+    entree = _calculer(depart, arrivee, debut, jours, par_ville)
+    cache.set(cle, entree, duree_cache())
+    return entree[1]
@@ -0,0 +1,222 @@
+"""
+Confirmation asynchrone des paiements par les opérateurs (webhooks).
+
+L'endpoint de notification vérifie la signature, enregistre la notification
+brute dans la boîte de réception (EvenementPaiement) par un seul INSERT et
+répond aussitôt ; une notification renvoyée par l'opérateur (même
+identifiant) est écartée par la contrainte d'unicité. Les workers web ne
+font rien d'autre, quelle que soit l'affluence.
+
+La commande traiter_notifications_paiement applique ensuite les
+notifications par lots : statut des paiements, confirmation ou annulation
+des réservations, puis envoi groupé des emails une fois le lot validé. Les
+lots sont verrouillés avec skip_locked (PostgreSQL) : plusieurs workers
+peuvent vider la file en parallèle.
+
+Une notification peut arriver avant l'enregistrement du paiement qu'elle
+concerne : elle reste dans la file pendant DELAI_PAIEMENT_INCONNU avant
+d'être classée en erreur.
+"""
+import json
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .emails import email_statut_paiement
+from .fidelite import crediter_reservation
+from .inventaire import liberer_reservations
+from .models import BlocagePlaces, EvenementPaiement, Paiement, Remboursement, Reservation
+from .passerelles import passerelle_notifications
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT_NOTIFICATIONS = 500
+DELAI_PAIEMENT_INCONNU = timedelta(minutes=15)
+
+Statut = EvenementPaiement.StatutEvenement
+
+
+class NotificationInvalide(Exception):
+    """Signature absente ou incorrecte, ou contenu illisible"""
+
+
+def enregistrer_notification(operateur, corps, entetes):
+    """
+    Vérifie et enregistre une notification brute d'un opérateur, sans la
+    traiter. Lève NotificationInvalide si elle n'est pas authentique.
+    """
+    adaptateur = passerelle_notifications(operateur)
+    if not adaptateur.verifier_signature(corps, entetes):
+        raise NotificationInvalide('signature')
+    try:
+        contenu = corps.decode()
+        identifiant = str(adaptateur.identifiant_evenement(json.loads(contenu)))
+    except (ValueError, KeyError, TypeError) as e:
+        raise NotificationInvalide(f'contenu illisible ({e})')
+    # Un seul INSERT ; une notification déjà reçue est ignorée
+    EvenementPaiement.objects.bulk_create(
+        [EvenementPaiement(operateur=operateur, identifiant=identifiant[:100], corps=contenu)],
+        ignore_conflicts=True,
+    )
+
+
+def enregistrer_statuts(confirmes, refuses):
+    """
+    Enregistre les paiements confirmés et refusés (instances verrouillées,
+    avec leur réservation) et met leurs réservations à jour : confirmation
+    et crédit de fidélité, remboursement si elle a été annulée entre-temps,
+    ou libération des places.
+    """
+    Paiement.objects.bulk_update(confirmes + refuses, ['statut', 'reference_paiement'])
+
+    # Réservations dont le blocage n'avait pas encore été converti
+    en_attente = [paiement.reservation_id for paiement in confirmes]
+    BlocagePlaces.objects.filter(reservation_id__in=en_attente).delete()
+    Reservation.objects.filter(
+        pk__in=en_attente, statut=Reservation.StatutReservation.EN_ATTENTE
+    ).update(statut=Reservation.StatutReservation.CONFIRMEE)
+
+    # Paiement confirmé après la libération des places : remboursement intégral
+    Remboursement.objects.bulk_create([
+        Remboursement(paiement=paiement, montant=paiement.montant, motif="Paiement confirmé après l'annulation de la réservation")
+        for paiement in confirmes if paiement.reservation.statut == Reservation.StatutReservation.ANNULEE
+    ], ignore_conflicts=True)
+
+    # Fidélité créditée au paiement effectif (une seule fois par réservation)
+    for paiement in confirmes:
+        if paiement.reservation.statut != Reservation.StatutReservation.ANNULEE:
+            crediter_reservation(paiement.reservation)
+
+    liberer_reservations(
+        [paiement.reservation_id for paiement in refuses], statut=Reservation.StatutReservation.ANNULEE
+    )
+
+
+def envoyer_emails_statut(confirmes, refuses, connexion):
+    """Informe les clients de la confirmation ou du refus de leur paiement"""
+    emails = [
+        email_statut_paiement(paiement, confirme=paiement in confirmes)
+        for paiement in confirmes + refuses if paiement.reservation.client.user.email
+    ]
+    if not emails:
+        return
+    # Un échec d'envoi n'annule pas les mises à jour déjà validées
+    try:
+        connexion.send_messages(emails)
+    except Exception:
+        logger.exception("Envoi des emails de %d paiement(s) impossible", len(emails))
+
+
+def _appliquer(lot, maintenant):
+    """
+    Applique un lot de notifications aux paiements. Retourne le statut de
+    chaque notification ({pk: (statut, erreur)}) et les paiements confirmés
+    et refusés.
+    """
+    adaptateurs = {}
+    issues = {}
+    references = defaultdict(list)
+    statuts = {}
+    for evenement in lot:
+        if evenement.operateur not in adaptateurs:
+            adaptateurs[evenement.operateur] = passerelle_notifications(evenement.operateur)
+        try:
+            lecture = adaptateurs[evenement.operateur].lire_evenement(json.loads(evenement.corps))
+        except (ValueError, KeyError, TypeError) as e:
+            statuts[evenement.pk] = (Statut.ERREUR, f'Contenu illisible : {e}'[:255])
+            continue
+        if lecture is None or lecture[1].en_attente:
+            statuts[evenement.pk] = (Statut.IGNORE, '')
+            continue
+        reference, resultat = lecture
+        # Notifications du lot dans l'ordre de réception : la dernière l'emporte
+        issues[reference] = resultat
+        references[reference].append(evenement)
+        statuts[evenement.pk] = (Statut.TRAITE, '')
+
+    paiements = {
+        paiement.reservation.reference: paiement
+        for paiement in Paiement.objects.select_for_update(of=('self',)).select_related(
+            'reservation__client__user'
+        ).filter(reservation__reference__in=list(issues))
+    }
+
+    confirmes, refuses = [], []
+    for reference, resultat in issues.items():
+        paiement = paiements.get(reference)
+        if paiement is None:
+            for evenement in references[reference]:
+                if evenement.recu_le > maintenant - DELAI_PAIEMENT_INCONNU:
+                    # Le paiement n'est peut-être pas encore enregistré : nouvel essai plus tard
+                    del statuts[evenement.pk]
+                else:
+                    statuts[evenement.pk] = (Statut.ERREUR, f'Aucun paiement pour la réservation {reference}')
+            continue
+        if resultat.accepte and paiement.statut in (Paiement.StatutPaiement.PENDING, Paiement.StatutPaiement.FAILED):
+            paiement.statut = Paiement.StatutPaiement.PAID
+            paiement.reference_paiement = resultat.reference or paiement.reference_paiement
+            confirmes.append(paiement)
+        elif resultat.refuse and paiement.statut == Paiement.StatutPaiement.PENDING:
+            paiement.statut = Paiement.StatutPaiement.FAILED
+            refuses.append(paiement)
+
+    enregistrer_statuts(confirmes, refuses)
+    return statuts, confirmes, refuses
+
+
+def traiter_notifications(taille_lot=TAILLE_LOT_NOTIFICATIONS, connexion=None):
+    """
+    Traite les notifications reçues, par lots de `taille_lot`, chacun dans sa
+    propre transaction. Retourne le nombre de notifications par statut.
+    """
+    connexion = connexion or get_connection()
+    bilan = Counter()
+    dernier = 0
+    while True:
+        maintenant = timezone.now()
+        with transaction.atomic():
+            lot = list(
+                EvenementPaiement.objects.select_for_update(skip_locked=True).filter(
+                    statut=Statut.RECU, pk__gt=dernier
+                ).order_by('pk')[:taille_lot]
+            )
+            if not lot:
+                break
+            statuts, confirmes, refuses = _appliquer(lot, maintenant)
+
+            par_statut = defaultdict(list)
+            for pk, statut in statuts.items():
+                par_statut[statut].append(pk)
+            for (statut, erreur), pks in par_statut.items():
+                EvenementPaiement.objects.filter(pk__in=pks).update(statut=statut, erreur=erreur, traite_le=maintenant)
+                bilan[statut] += len(pks)
+
+        dernier = lot[-1].pk
+
+        # Emails envoyés une fois le lot validé
+        envoyer_emails_statut(confirmes, refuses, connexion)
+        if len(lot) < taille_lot:
+            break
+    return bilan
+
+
+def purger_notifications(avant, taille_lot=TAILLE_LOT_NOTIFICATIONS):
+    """
+    Supprime, par lots, les notifications traitées ou ignorées avant `avant` ;
+    celles en erreur sont conservées. Retourne le nombre supprimé.
+    """
+    total = 0
+    while True:
+        lot = list(EvenementPaiement.objects.filter(
+            statut__in=[Statut.TRAITE, Statut.IGNORE], traite_le__lt=avant
+        ).values_list('pk', flat=True)[:taille_lot])
+        if not lot:
+            break
+        total += EvenementPaiement.objects.filter(pk__in=lot).delete()[0]
+        if len(lot) < taille_lot:
+            break
+    return total
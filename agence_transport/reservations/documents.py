@@ -0,0 +1,330 @@
+"""
+Génération des documents imprimables : billets PDF et manifestes passagers.
+
+Les PDF sont produits par un petit écrivain interne (PDF 1.4, police Helvetica
+standard) qui émet les objets au fil de l'eau : un manifeste de plusieurs
+milliers de passagers n'est jamais construit entièrement en mémoire.
+"""
+import csv
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Billet, Reservation
+
+# Format A4 en points PDF
+LARGEUR_PAGE = 595
+HAUTEUR_PAGE = 842
+MARGE = 50
+INTERLIGNE = 16
+
+# Taille des lots lus depuis la base pour les manifestes
+TAILLE_LOT_MANIFESTE = 500
+
+SEL_QR = 'reservations.billet'
+
+STATUTS_EXCLUS_MANIFESTE = [
+    Reservation.StatutReservation.ANNULEE,
+    Reservation.StatutReservation.REMBOURSEE,
+]
+
+
+def _echapper(texte):
+    """Encode un texte pour une chaîne littérale PDF (WinAnsi)"""
+    texte = str(texte).replace('→', '-')
+    donnees = texte.encode('cp1252', errors='replace')
+    return donnees.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class EcrivainPDF:
+    """
+    Écrivain PDF minimal qui produit le document par morceaux.
+
+    Chaque méthode retourne les octets à envoyer au client ; les positions des
+    objets sont mémorisées pour construire la table xref finale.
+    """
+    # Objets réservés : 1 catalogue, 2 arbre des pages, 3 police, 4 police grasse
+    PREMIER_OBJET_LIBRE = 5
+
+    def __init__(self):
+        self.position = 0
+        self.positions = {}
+        self.pages = []
+        self.prochain_objet = self.PREMIER_OBJET_LIBRE
+
+    def _emettre(self, donnees):
+        self.position += len(donnees)
+        return donnees
+
+    def _objet(self, numero, corps):
+        self.positions[numero] = self.position
+        return self._emettre(b'%d 0 obj\n' % numero + corps + b'\nendobj\n')
+
+    def _nouvel_objet(self):
+        numero = self.prochain_objet
+        self.prochain_objet += 1
+        return numero
+
+    def debut(self):
+        """En-tête du fichier et ressources partagées (polices)"""
+        morceaux = [self._emettre(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')]
+        morceaux.append(self._objet(
+            3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'
+        ))
+        morceaux.append(self._objet(
+            4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>'
+        ))
+        return b''.join(morceaux)
+
+    def page(self, lignes):
+        """
+        Ajoute une page. `lignes` est une liste de tuples (x, y, taille, texte, gras).
+        """
+        contenu = [b'BT']
+        for x, y, taille, texte, gras in lignes:
+            police = b'/F2' if gras else b'/F1'
+            contenu.append(b'%s %d Tf 1 0 0 1 %d %d Tm (%s) Tj' % (police, taille, x, y, _echapper(texte)))
+        contenu.append(b'ET')
+        flux = b'\n'.join(contenu)
+
+        numero_contenu = self._nouvel_objet()
+        numero_page = self._nouvel_objet()
+        self.pages.append(numero_page)
+
+        morceaux = [
+            self._objet(
+                numero_contenu,
+                b'<< /Length %d >>\nstream\n%s\nendstream' % (len(flux), flux)
+            ),
+            self._objet(
+                numero_page,
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                % (LARGEUR_PAGE, HAUTEUR_PAGE, numero_contenu)
+            ),
+        ]
+        return b''.join(morceaux)
+
+    def fin(self):
+        """Arbre des pages, catalogue, table xref et trailer"""
+        kids = b' '.join(b'%d 0 R' % numero for numero in self.pages)
+        morceaux = [
+            self._objet(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.pages))),
+            self._objet(1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+        ]
+        debut_xref = self.position
+        total = self.prochain_objet
+        xref = [b'xref\n0 %d\n' % total, b'0000000000 65535 f \n']
+        for numero in range(1, total):
+            xref.append(b'%010d 00000 n \n' % self.positions[numero])
+        xref.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (total, debut_xref))
+        morceaux.append(self._emettre(b''.join(xref)))
+        return b''.join(morceaux)
+
+
+def iter_pdf(pages):
+    """Sérialise un itérable de pages en morceaux d'octets PDF"""
+    ecrivain = EcrivainPDF()
+    yield ecrivain.debut()
+    vide = True
+    for lignes in pages:
+        vide = False
+        yield ecrivain.page(lignes)
+    if vide:
+        yield ecrivain.page([])
+    yield ecrivain.fin()
+
+
+def _format_date(valeur):
+    return timezone.localtime(valeur).strftime('%d/%m/%Y %H:%M')
+
+
+def _nom_passager(prenom, nom, username):
+    return f"{prenom} {nom}".strip() or username
+
+
+def payload_qr(billet, reference=None):
+    """
+    Retourne le contenu signé à encoder dans le QR code d'un billet.
+
+    La signature permet au contrôleur de vérifier le billet hors ligne.
+    """
+    return signing.dumps(
+        {'r': reference or billet.reservation.reference, 'b': billet.pk, 's': billet.siege},
+        salt=SEL_QR,
+        compress=True,
+    )
+
+
+def lire_payload_qr(payload):
+    """Vérifie et décode le contenu d'un QR code de billet"""
+    return signing.loads(payload, salt=SEL_QR)
+
+
+# ---------------------------------------------------------------------------
+# Manifeste passagers
+# ---------------------------------------------------------------------------
+
+def lignes_manifeste(horaire):
+    """
+    Itère sur les passagers d'un départ à partir d'une seule requête jointe.
+
+    Les lignes sont lues par lots depuis un curseur : la mémoire utilisée ne
+    dépend pas du nombre de passagers.
+    """
+    return Billet.objects.filter(
+        reservation__horaire=horaire
+    ).exclude(
+        reservation__statut__in=STATUTS_EXCLUS_MANIFESTE
+    ).order_by(
+        'type_billet', 'siege', 'pk'
+    ).values_list(
+        'siege',
+        'type_billet',
+        'reservation__reference',
+        'reservation__client__user__first_name',
+        'reservation__client__user__last_name',
+        'reservation__client__user__username',
+        'reservation__client__telephone',
+    ).iterator(chunk_size=TAILLE_LOT_MANIFESTE)
+
+
+def _titre_manifeste(horaire):
+    trajet = horaire.trajet
+    return (
+        f"Manifeste - {trajet.depart.ville.nom} ({trajet.depart.nom}) -> "
+        f"{trajet.arrivee.ville.nom} ({trajet.arrivee.nom})"
+    )
+
+
+def _pages_manifeste(horaire):
+    libelles = dict(Billet.TypeBillet.choices)
+    entete = [
+        (MARGE, HAUTEUR_PAGE - MARGE, 14, _titre_manifeste(horaire), True),
+        (MARGE, HAUTEUR_PAGE - MARGE - 20, 10,
+         f"Départ : {_format_date(horaire.date_depart)}   Arrivée : {_format_date(horaire.date_arrivee)}", False),
+    ]
+    colonnes = [(MARGE, 'Siège'), (MARGE + 70, 'Classe'), (MARGE + 170, 'Passager'),
+                (MARGE + 350, 'Téléphone'), (MARGE + 450, 'Réservation')]
+    y_depart = HAUTEUR_PAGE - MARGE - 50
+
+    def nouvelle_page(numero):
+        lignes = list(entete)
+        lignes.append((LARGEUR_PAGE - MARGE - 50, MARGE - 20, 8, f"Page {numero}", False))
+        lignes.extend((x, y_depart, 10, libelle, True) for x, libelle in colonnes)
+        return lignes
+
+    numero_page = 1
+    lignes = nouvelle_page(numero_page)
+    y = y_depart - INTERLIGNE
+    total = 0
+    for siege, type_billet, reference, prenom, nom, username, telephone in lignes_manifeste(horaire):
+        if y < MARGE:
+            yield lignes
+            numero_page += 1
+            lignes = nouvelle_page(numero_page)
+            y = y_depart - INTERLIGNE
+        valeurs = [siege, libelles.get(type_billet, type_billet), _nom_passager(prenom, nom, username),
+                   telephone or '-', reference]
+        lignes.extend((x, y, 9, valeur, False) for (x, _), valeur in zip(colonnes, valeurs))
+        y -= INTERLIGNE
+        total += 1
+
+    if y < MARGE + INTERLIGNE:
+        yield lignes
+        numero_page += 1
+        lignes = nouvelle_page(numero_page)
+        y = y_depart - INTERLIGNE
+    lignes.append((MARGE, y - INTERLIGNE, 10, f"Total passagers : {total}", True))
+    yield lignes
+
+
+def iter_manifeste_pdf(horaire):
+    """Flux d'octets PDF du manifeste d'un départ"""
+    return iter_pdf(_pages_manifeste(horaire))
+
+
+class _Tampon:
+    """Pseudo-fichier qui retourne directement ce qu'on y écrit (pour csv.writer)"""
+    def write(self, valeur):
+        return valeur
+
+
+def iter_manifeste_csv(horaire):
+    """Flux de lignes CSV du manifeste d'un départ"""
+    libelles = dict(Billet.TypeBillet.choices)
+    writer = csv.writer(_Tampon(), delimiter=';')
+    yield '\ufeff' + writer.writerow(['Siège', 'Classe', 'Passager', 'Téléphone', 'Réservation'])
+    for siege, type_billet, reference, prenom, nom, username, telephone in lignes_manifeste(horaire):
+        yield writer.writerow([
+            siege, libelles.get(type_billet, type_billet),
+            _nom_passager(prenom, nom, username), telephone or '', reference,
+        ])
+
+
+# ---------------------------------------------------------------------------
+# Billets PDF
+# ---------------------------------------------------------------------------
+
+def cle_cache_billet(reservation_id):
+    return f"documents:billet_pdf:{reservation_id}"
+
+
+def invalider_billet_pdf(*reservation_ids):
+    """Supprime du cache les PDF générés pour ces réservations"""
+    if reservation_ids:
+        cache.delete_many([cle_cache_billet(pk) for pk in reservation_ids])
+
+
+def _pages_billet(reservation):
+    horaire = reservation.horaire
+    trajet = horaire.trajet
+    user = reservation.client.user
+    haut = HAUTEUR_PAGE - MARGE
+    pages = []
+    for billet in reservation.billets.all():
+        lignes = [
+            (MARGE, haut, 18, 'Larissa Inspiration Spirit Travel', True),
+            (MARGE, haut - 30, 14, f"Billet {billet.get_type_billet_display()} - Siège {billet.siege}", True),
+            (MARGE, haut - 60, 11, f"Réservation : {reservation.reference}", False),
+            (MARGE, haut - 78, 11, f"Passager : {_nom_passager(user.first_name, user.last_name, user.username)}", False),
+            (MARGE, haut - 96, 11, f"Départ : {trajet.depart.ville.nom} - {trajet.depart.nom}", False),
+            (MARGE, haut - 114, 11, f"Le {_format_date(horaire.date_depart)}", False),
+            (MARGE, haut - 132, 11, f"Arrivée : {trajet.arrivee.ville.nom} - {trajet.arrivee.nom}", False),
+            (MARGE, haut - 150, 11, f"Le {_format_date(horaire.date_arrivee)}", False),
+            (MARGE, haut - 168, 11, f"Prix : {billet.prix} BIF", False),
+            (MARGE, haut - 186, 11, f"Statut : {reservation.get_statut_display()}", False),
+            (MARGE, haut - 218, 10, 'Code de contrôle (QR) :', True),
+        ]
+        # Le contenu signé peut être long : on le découpe en lignes de 80 caractères
+        payload = payload_qr(billet, reference=reservation.reference)
+        for i in range(0, len(payload), 80):
+            lignes.append((MARGE, haut - 234 - (i // 80) * 12, 8, payload[i:i + 80], False))
+        pages.append(lignes)
+    return pages
+
+
+def generer_billet_pdf(reservation_id):
+    """
+    Retourne le PDF (bytes) des billets d'une réservation.
+
+    Le document est construit depuis une seule requête (avec préchargement des
+    billets) puis conservé en cache jusqu'à la prochaine modification de la
+    réservation.
+    """
+    cle = cle_cache_billet(reservation_id)
+    pdf = cache.get(cle)
+    if pdf is not None:
+        return pdf
+
+    reservation = Reservation.objects.select_related(
+        'client__user',
+        'horaire__trajet__depart__ville',
+        'horaire__trajet__arrivee__ville',
+    ).prefetch_related('billets').get(pk=reservation_id)
+
+    pdf = b''.join(iter_pdf(_pages_billet(reservation)))
+    cache.set(cle, pdf, getattr(settings, 'DOCUMENTS_CACHE_TIMEOUT', 60 * 60 * 24))
+    return pdf
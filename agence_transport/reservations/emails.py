@@ -1,4 +1,4 @@
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
@@ -86,3 +86,66 @@ def envoyer_email_ticket_bonus(ticket_bonus):
         html_message=html_message,
         fail_silently=False,
     )
+
+def email_rappel_ticket_bonus(ticket_bonus, connection=None):
+    """
+    Prépare (sans l'envoyer) le rappel d'expiration d'un ticket bonus, pour
+    un envoi groupé avec send_messages()
+    """
+    user = ticket_bonus.client.user
+    nom_complet = f"{user.first_name} {user.last_name}".strip() or user.username
+
+    context = {
+        'ticket': ticket_bonus,
+        'client_nom': nom_complet,
+        'date_expiration': timezone.localtime(ticket_bonus.date_expiration),
+        'nombre_places': ticket_bonus.nombre_places,
+        'code': ticket_bonus.code,
+        'site_url': getattr(settings, 'SITE_URL', 'http://127.0.0.1:8000'),
+        'annee_courante': timezone.now().year
+    }
+    html_message = render_to_string('reservations/emails/rappel_ticket_bonus.html', context)
+
+    email = EmailMultiAlternatives(
+        subject='⏳ Votre ticket bonus expire bientôt',
+        body=strip_tags(html_message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[user.email],
+        connection=connection,
+    )
+    email.attach_alternative(html_message, 'text/html')
+    return email
+
+def email_statut_paiement(paiement, confirme, connection=None):
+    """
+    Prépare (sans l'envoyer) l'email annonçant au client la confirmation ou
+    le refus de son paiement par l'opérateur, pour un envoi groupé
+    """
+    reservation = paiement.reservation
+    user = reservation.client.user
+    nom_complet = f"{user.first_name} {user.last_name}".strip() or user.username
+
+    context = {
+        'reservation': reservation,
+        'paiement': paiement,
+        'confirme': confirme,
+        'client_nom': nom_complet,
+        'montant': f"{paiement.montant:,.0f}".replace(',', ' '),
+        'site_url': getattr(settings, 'SITE_URL', 'http://127.0.0.1:8000'),
+        'annee_courante': timezone.now().year
+    }
+    html_message = render_to_string('reservations/emails/statut_paiement.html', context)
+
+    if confirme:
+        subject = f'Paiement confirmé - réservation {reservation.reference}'
+    else:
+        subject = f'Paiement refusé - réservation {reservation.reference}'
+    email = EmailMultiAlternatives(
+        subject=subject,
+        body=strip_tags(html_message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[user.email],
+        connection=connection,
+    )
+    email.attach_alternative(html_message, 'text/html')
+    return email
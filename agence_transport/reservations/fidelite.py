@@ -0,0 +1,308 @@
+"""
+Programme de fidélité : journal des mouvements et tickets bonus.
+
+Chaque réservation payée ajoute au journal (MouvementFidelite) un mouvement
+d'accumulation et incrémente les compteurs du client par un seul UPDATE avec
+des expressions F, dans la transaction du paiement. Les compteurs du client
+sont l'agrégat du journal tenu à jour : les soldes se lisent sur la ligne du
+client, sans parcourir le journal.
+
+Un ticket bonus est émis à chaque multiple de FIDELITE_PLACES_BONUS places
+cumulées. Le mouvement de bonus est unique par (client, seuil) : un seuil
+n'est récompensé qu'une fois, y compris lors de deux réservations
+simultanées ou d'une annulation suivie d'une nouvelle réservation.
+
+Les tickets arrivés à échéance sont marqués expirés par un balayage
+périodique (commande balayer_tickets_bonus), par lots, qui envoie aussi les
+rappels d'expiration FIDELITE_RAPPEL_JOURS jours avant l'échéance. Le nombre
+de tickets valides de chaque client (Client.tickets_bonus_valides) est tenu
+à jour à l'émission, à l'utilisation et à l'expiration.
+
+Un ticket utilisé pour une réservation reste attaché à son blocage de
+places jusqu'au paiement : si le blocage expire ou si la réservation est
+annulée avant le paiement, le ticket est rendu au client (mouvement de
+restitution).
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .emails import email_rappel_ticket_bonus
+from .models import Client, MouvementFidelite, TicketBonus
+from .synchronisation import Type, journaliser
+
+TAILLE_LOT_RECALCUL = 1000
+TAILLE_LOT_BALAYAGE = 1000
+
+
+def places_par_bonus():
+    return getattr(settings, 'FIDELITE_PLACES_BONUS', 5)
+
+
+def delai_rappel():
+    return datetime.timedelta(days=getattr(settings, 'FIDELITE_RAPPEL_JOURS', 3))
+
+
+def points_reservation(reservation):
+    """Points gagnés par une réservation : 1 point par unité du montant payé"""
+    return int(reservation.montant_total)
+
+
+def _inserer(**valeurs):
+    """
+    Ajoute un mouvement au journal ; retourne None si une contrainte
+    d'unicité l'interdit (mouvement déjà enregistré).
+    """
+    try:
+        with transaction.atomic():
+            return MouvementFidelite.objects.create(**valeurs)
+    except IntegrityError:
+        return None
+
+
+def _emettre_bonus(client, avant, apres):
+    """Émet un ticket pour chaque seuil franchi entre `avant` et `apres` places"""
+    pas = places_par_bonus()
+    tickets = []
+    for rang in range(avant // pas + 1, apres // pas + 1):
+        try:
+            with transaction.atomic():
+                ticket = TicketBonus.creer_ticket_bonus(client=client, montant=0, nombre_places=1)
+                MouvementFidelite.objects.create(
+                    client=client, type=MouvementFidelite.TypeMouvement.BONUS, ticket=ticket, seuil=rang * pas
+                )
+        except IntegrityError:
+            # Seuil déjà récompensé : le ticket créé est annulé avec le point de sauvegarde
+            continue
+        tickets.append(ticket)
+    return tickets
+
+
+def crediter_reservation(reservation):
+    """
+    Crédite au client les places et les points d'une réservation payée, et
+    émet les tickets bonus des seuils franchis.
+
+    Sans effet si la réservation a déjà été créditée. Retourne la liste des
+    tickets bonus émis.
+    """
+    client = reservation.client
+    places = reservation.billets.filter(annule=False).count()
+    points = points_reservation(reservation)
+
+    with transaction.atomic():
+        mouvement = _inserer(
+            client=client, type=MouvementFidelite.TypeMouvement.ACCUMULATION,
+            reservation=reservation, places=places, points=points,
+        )
+        if mouvement is None:
+            return []
+        Client.objects.filter(pk=client.pk).update(
+            places_reservees=F('places_reservees') + places,
+            points_fidelite=F('points_fidelite') + points,
+        )
+        # La ligne du client reste verrouillée par l'UPDATE jusqu'au commit :
+        # une réservation simultanée lit le total après la nôtre
+        total = Client.objects.filter(pk=client.pk).values_list('places_reservees', flat=True).get()
+        return _emettre_bonus(client, total - places, total)
+
+
+def debiter_reservation(reservation):
+    """
+    Retire au client les places et les points crédités pour une réservation
+    annulée ou remboursée. Les tickets bonus déjà émis sont conservés.
+    """
+    return debiter_reservations([reservation.pk]) > 0
+
+
+def debiter_reservations(reservation_ids):
+    """
+    Version groupée de debiter_reservation : un INSERT pour les mouvements
+    d'annulation du lot et un UPDATE par client. Les réservations doivent
+    être verrouillées par l'appelant. Retourne le nombre de réservations
+    débitées.
+    """
+    credits = list(MouvementFidelite.objects.filter(
+        reservation_id__in=reservation_ids, type=MouvementFidelite.TypeMouvement.ACCUMULATION
+    ).exclude(
+        reservation__mouvements_fidelite__type=MouvementFidelite.TypeMouvement.ANNULATION
+    ).values_list('reservation_id', 'client_id', 'places', 'points'))
+    if not credits:
+        return 0
+
+    par_client = defaultdict(lambda: [0, 0])
+    for _reservation_id, client_id, places, points in credits:
+        par_client[client_id][0] += places
+        par_client[client_id][1] += points
+    with transaction.atomic():
+        MouvementFidelite.objects.bulk_create([
+            MouvementFidelite(
+                client_id=client_id, type=MouvementFidelite.TypeMouvement.ANNULATION,
+                reservation_id=reservation_id, places=-places, points=-points,
+            )
+            for reservation_id, client_id, places, points in credits
+        ])
+        for client_id, (places, points) in par_client.items():
+            Client.objects.filter(pk=client_id).update(
+                places_reservees=Greatest(F('places_reservees') - places, 0, output_field=IntegerField()),
+                points_fidelite=Greatest(F('points_fidelite') - points, 0, output_field=IntegerField()),
+            )
+    return len(credits)
+
+
+def recalculer_soldes(appliquer=True, taille_lot=TAILLE_LOT_RECALCUL):
+    """
+    Recalcule les compteurs de fidélité des clients à partir du journal et
+    le nombre de tickets bonus valides à partir des tickets.
+
+    Le journal et les tickets sont agrégés en une requête groupée par client
+    chacun ; seuls les clients dont les compteurs ont dérivé sont corrigés
+    (par lots, avec bulk_update). Retourne la liste des corrections sous la
+    forme (client_id, champ, ancienne valeur, nouvelle valeur).
+    """
+    champs = ('places_reservees', 'points_fidelite', 'tickets_bonus_valides')
+    attendus = defaultdict(lambda: [0, 0, 0])
+    for client_id, places, points in MouvementFidelite.objects.values_list('client_id').annotate(
+        places=Sum('places'), points=Sum('points')
+    ).order_by():
+        attendus[client_id][0:2] = [max(places, 0), max(points, 0)]
+    # Même définition que le compteur : tickets ni utilisés ni marqués expirés
+    for client_id, nombre in TicketBonus.objects.filter(utilise=False, expire=False).values_list('client_id').annotate(
+        nombre=Count('id')
+    ).order_by():
+        attendus[client_id][2] = nombre
+
+    corrections = []
+    a_corriger = []
+    lignes = Client.objects.values_list('pk', *champs)
+    for client_id, *actuels in lignes.iterator(chunk_size=taille_lot):
+        valeurs = attendus[client_id]
+        if actuels != valeurs:
+            corrections += [
+                (client_id, champ, actuel, valeur)
+                for champ, actuel, valeur in zip(champs, actuels, valeurs) if actuel != valeur
+            ]
+            a_corriger.append(Client(pk=client_id, **dict(zip(champs, valeurs))))
+
+    if appliquer and a_corriger:
+        Client.objects.bulk_update(a_corriger, list(champs), batch_size=taille_lot)
+    return corrections
+
+
+def _par_nombre(clients):
+    """Regroupe les clients de `clients` (client -> nombre) par nombre"""
+    par_nombre = defaultdict(list)
+    for client_id, nombre in clients.items():
+        par_nombre[nombre].append(client_id)
+    return par_nombre.items()
+
+
+def _decompter_tickets(clients):
+    """
+    Retire aux clients leurs tickets devenus invalides ; `clients` associe à
+    chaque client le nombre de tickets retirés. Une requête par nombre
+    distinct, quel que soit le nombre de clients.
+    """
+    for nombre, client_ids in _par_nombre(clients):
+        Client.objects.filter(pk__in=client_ids).update(
+            tickets_bonus_valides=Greatest(F('tickets_bonus_valides') - nombre, 0, output_field=IntegerField())
+        )
+
+
+def restituer_tickets(tickets):
+    """
+    Rend utilisables les tickets bonus des réservations abandonnées avant le
+    paiement ; `tickets` associe l'id de chaque ticket à l'id de sa
+    réservation. Un ticket n'est rendu qu'une fois. Retourne le nombre de
+    tickets rendus.
+    """
+    if not tickets:
+        return 0
+    with transaction.atomic():
+        rendus = list(TicketBonus.objects.select_for_update().filter(
+            pk__in=list(tickets), utilise=True
+        ).values_list('pk', 'client_id'))
+        if not rendus:
+            return 0
+        TicketBonus.objects.filter(pk__in=[pk for pk, _client in rendus]).update(utilise=False)
+        journaliser(
+            Type.TICKET_BONUS, [pk for pk, _client in rendus], proprietaires=[client_id for _pk, client_id in rendus]
+        )
+        MouvementFidelite.objects.bulk_create([
+            MouvementFidelite(
+                client_id=client_id, type=MouvementFidelite.TypeMouvement.RESTITUTION,
+                ticket_id=pk, reservation_id=tickets[pk],
+            )
+            for pk, client_id in rendus
+        ])
+        for nombre, client_ids in _par_nombre(Counter(client_id for _pk, client_id in rendus)):
+            Client.objects.filter(pk__in=client_ids).update(tickets_bonus_valides=F('tickets_bonus_valides') + nombre)
+    return len(rendus)
+
+
+def expirer_tickets(maintenant=None, taille_lot=TAILLE_LOT_BALAYAGE):
+    """
+    Marque expirés les tickets bonus arrivés à échéance, par lots de
+    `taille_lot`, et met à jour le nombre de tickets valides des clients.
+
+    Chaque lot est traité dans sa propre transaction ; sur PostgreSQL les
+    tickets verrouillés par une utilisation en cours sont ignorés. Retourne
+    le nombre de tickets expirés.
+    """
+    maintenant = maintenant or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            lot = list(
+                TicketBonus.objects.select_for_update(skip_locked=True).filter(
+                    utilise=False, expire=False, date_expiration__lte=maintenant
+                ).order_by('date_expiration', 'id').values_list('pk', 'client_id')[:taille_lot]
+            )
+            if not lot:
+                break
+            TicketBonus.objects.filter(pk__in=[pk for pk, _client in lot]).update(expire=True)
+            journaliser(
+                Type.TICKET_BONUS, [pk for pk, _client in lot], proprietaires=[client_id for _pk, client_id in lot]
+            )
+            _decompter_tickets(Counter(client_id for _pk, client_id in lot))
+        total += len(lot)
+        if len(lot) < taille_lot:
+            break
+    return total
+
+
+def envoyer_rappels(maintenant=None, delai=None, taille_lot=TAILLE_LOT_BALAYAGE, connexion=None):
+    """
+    Envoie le rappel d'expiration des tickets valides qui arrivent à échéance
+    dans moins de `delai` (FIDELITE_RAPPEL_JOURS par défaut).
+
+    Les emails d'un lot sont envoyés ensemble sur une seule connexion SMTP ;
+    un ticket n'est rappelé qu'une fois. Retourne le nombre de rappels envoyés.
+    """
+    maintenant = maintenant or timezone.now()
+    limite = maintenant + (delai or delai_rappel())
+    connexion = connexion or get_connection()
+    total = 0
+    while True:
+        with transaction.atomic():
+            lot = list(
+                TicketBonus.objects.select_for_update(skip_locked=True, of=('self',)).valides(maintenant).filter(
+                    rappel_envoye_le__isnull=True, date_expiration__lte=limite
+                ).select_related('client__user').order_by('date_expiration', 'id')[:taille_lot]
+            )
+            if not lot:
+                break
+            emails = [email_rappel_ticket_bonus(ticket) for ticket in lot if ticket.client.user.email]
+            # En cas d'échec d'envoi, la transaction est annulée et le lot sera repris
+            connexion.send_messages(emails)
+            TicketBonus.objects.filter(pk__in=[ticket.pk for ticket in lot]).update(rappel_envoye_le=maintenant)
+        total += len(emails)
+        if len(lot) < taille_lot:
+            break
+    return total
@@ -1,11 +1,16 @@
 from django import forms
+from django.db import transaction
+from django.db.models import F
 from django.forms import ModelForm, inlineformset_factory
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from django.forms.widgets import NumberInput, DateInput
-from .models import Billet, Client, Paiement, Reservation, Ville, Gare, Trajet, Horaire, Remboursement, TicketBonus
+from .models import (
+    Billet, Client, Paiement, Reservation, Ville, Gare, Trajet, Horaire, HoraireClasse, Remboursement, TicketBonus,
+    TypeBillet,
+)
 from datetime import datetime, timedelta
 
 class GareForm(forms.ModelForm):
@@ -93,14 +98,49 @@ class VilleForm(forms.ModelForm):
 class HoraireForm(forms.ModelForm):
     """
     Formulaire pour l'ajout et la modification d'un horaire avec différents types de billets
+
+    Les prix et places de chaque classe sont enregistrés dans HoraireClasse.
     """
+    # Champ du formulaire -> (classe, attribut de HoraireClasse)
+    CHAMPS_CLASSES = {
+        'prix_standard': (TypeBillet.STANDARD, 'prix'),
+        'prix_business': (TypeBillet.BUSINESS, 'prix'),
+        'prix_premiere': (TypeBillet.PREMIERE, 'prix'),
+        'places_standard': (TypeBillet.STANDARD, 'places'),
+        'places_business': (TypeBillet.BUSINESS, 'places'),
+        'places_premiere': (TypeBillet.PREMIERE, 'places'),
+    }
+
+    # Champs pour les prix
+    prix_standard = forms.DecimalField(
+        label='Prix Standard (BIF)', max_digits=10, decimal_places=2, min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 0, 'step': '100', 'required': True})
+    )
+    prix_business = forms.DecimalField(
+        label='Prix Business (BIF)', max_digits=10, decimal_places=2, min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 0, 'step': '100', 'required': True})
+    )
+    prix_premiere = forms.DecimalField(
+        label='Prix Première Classe (BIF)', max_digits=10, decimal_places=2, min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 0, 'step': '100', 'required': True})
+    )
+    # Champs pour les places disponibles
+    places_standard = forms.IntegerField(
+        label='Places Standard', min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 0, 'required': True})
+    )
+    places_business = forms.IntegerField(
+        label='Places Business', min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 0, 'required': True})
+    )
+    places_premiere = forms.IntegerField(
+        label='Places Première Classe', min_value=0,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': 0, 'required': True})
+    )
+
     class Meta:
         model = Horaire
-        fields = [
-            'trajet', 'date_depart', 'date_arrivee',
-            'prix_standard', 'prix_business', 'prix_premiere',
-            'places_standard', 'places_business', 'places_premiere'
-        ]
+        fields = ['trajet', 'date_depart', 'date_arrivee']
         widgets = {
             'trajet': forms.Select(attrs={
                 'class': 'form-select',
@@ -116,54 +156,21 @@ class HoraireForm(forms.ModelForm):
                 'class': 'form-control',
                 'required': True
             }),
-            # Champs pour les prix
-            'prix_standard': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': 0,
-                'step': '100',
-                'required': True
-            }),
-            'prix_business': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': 0,
-                'step': '100',
-                'required': True
-            }),
-            'prix_premiere': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': 0,
-                'step': '100',
-                'required': True
-            }),
-            # Champs pour les places disponibles
-            'places_standard': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': 0,
-                'required': True
-            }),
-            'places_business': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': 0,
-                'required': True
-            }),
-            'places_premiere': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': 0,
-                'required': True
-            })
         }
         labels = {
             'trajet': 'Trajet',
             'date_depart': 'Date et heure de départ',
             'date_arrivee': 'Date et heure d\'arrivée',
-            'prix_standard': 'Prix Standard (BIF)',
-            'prix_business': 'Prix Business (BIF)',
-            'prix_premiere': 'Prix Première Classe (BIF)',
-            'places_standard': 'Places Standard',
-            'places_business': 'Places Business',
-            'places_premiere': 'Places Première Classe'
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            classes = self.instance.classes_par_type
+            for champ, (classe, attribut) in self.CHAMPS_CLASSES.items():
+                if classe in classes:
+                    self.initial.setdefault(champ, getattr(classes[classe], attribut))
+
     def clean(self):
         cleaned_data = super().clean()
         date_depart = cleaned_data.get('date_depart')
@@ -196,6 +203,37 @@ class HoraireForm(forms.ModelForm):
 
         return cleaned_data
 
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+        with transaction.atomic():
+            horaire = super().save()
+            self.save_classes()
+        return horaire
+
+    def save_classes(self):
+        """
+        Enregistre le prix et les places de chaque classe. Les places saisies
+        sont les places restantes : la capacité est recalculée à partir des
+        places déjà vendues.
+        """
+        horaire = self.instance
+        valeurs = {}
+        for champ, (classe, attribut) in self.CHAMPS_CLASSES.items():
+            valeurs.setdefault(classe, {})[attribut] = self.cleaned_data[champ]
+        existantes = {ligne.classe: ligne for ligne in HoraireClasse.objects.filter(horaire=horaire)}
+        for classe, saisie in valeurs.items():
+            ligne = existantes.get(classe) or HoraireClasse(horaire=horaire, classe=classe)
+            ligne.prix = saisie['prix']
+            # Expression évaluée par la base : une vente concurrente n'est pas écrasée
+            if ligne.pk:
+                ligne.capacite = F('vendus') + saisie['places']
+                ligne.save(update_fields=['prix', 'capacite'])
+            else:
+                ligne.capacite = saisie['places']
+                ligne.save()
+        horaire.refresh_from_db()
+
 class TrajetForm(forms.ModelForm):
     """
     Formulaire pour l'ajout et la modification d'un trajet
@@ -340,13 +378,19 @@ class ReservationForm(forms.Form):
 
 
 class PaiementForm(forms.ModelForm):
+    # Moyens de paiement par mobile money, qui demandent le numéro du payeur
+    MOYENS_MOBILES = ('ECOCASH', 'LUMICASH', 'IHELA')
+
     class Meta:
         model = Paiement
-        fields = ['moyen_paiement']
+        fields = ['moyen_paiement', 'numero_telephone']
         
     moyen_paiement = forms.ChoiceField(
         label=_("Moyen de paiement"),
         choices=[
+            ('ECOCASH', 'Ecocash'),
+            ('LUMICASH', 'Lumicash'),
+            ('IHELA', 'Ihela Money'),
             ('CB', _('Carte bancaire')),
             ('PAYPAL', 'PayPal'),
             ('TICKET', _('Ticket bon d\'achat')),
@@ -354,6 +398,18 @@ class PaiementForm(forms.ModelForm):
         widget=forms.RadioSelect(attrs={'class': 'form-check-input'})
     )
     
+    numero_telephone = forms.RegexField(
+        label=_("Numéro de téléphone"),
+        regex=r'^\+?[0-9 ]{8,20}$',
+        required=False,
+        error_messages={'invalid': _("Numéro de téléphone invalide.")},
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'type': 'tel',
+            'placeholder': _("Votre numéro de téléphone")
+        })
+    )
+    
     code_bon = forms.CharField(
         label=_("Code bon de réduction"),
         required=False,
@@ -363,14 +419,13 @@ class PaiementForm(forms.ModelForm):
         })
     )
     
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.fields['code_bon'].widget.attrs.update({
-            'class': 'form-control mt-2',
-            'style': 'display: none;',
-            'id': 'code-bon-field',
-            'disabled': True
-        })
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('moyen_paiement') in self.MOYENS_MOBILES and not cleaned_data.get('numero_telephone'):
+            self.add_error('numero_telephone', _("Le numéro de téléphone est requis pour un paiement mobile."))
+        if cleaned_data.get('moyen_paiement') == 'TICKET' and not cleaned_data.get('code_bon'):
+            self.add_error('code_bon', _("Le code du bon d'achat est requis."))
+        return cleaned_data
 
 
 class RemboursementForm(forms.ModelForm):
@@ -540,3 +595,58 @@ class FiltreRapportForm(forms.Form):
             raise forms.ValidationError("La date de début doit être antérieure à la date de fin.")
             
         return cleaned_data
+
+class AjustementTarifsForm(forms.Form):
+    """Formulaire d'ajustement en masse des prix et des places des horaires"""
+    classes = forms.MultipleChoiceField(
+        label='Classes concernées',
+        choices=Billet.TypeBillet.choices,
+        initial=[choix for choix, _libelle in Billet.TypeBillet.choices],
+        widget=forms.CheckboxSelectMultiple
+    )
+    pourcentage = forms.DecimalField(
+        label='Variation des prix (%)',
+        max_digits=6, decimal_places=2, required=False,
+        help_text='Ex. 10 pour +10 %, -15 pour -15 %'
+    )
+    montant = forms.DecimalField(
+        label='Variation des prix (BIF)',
+        max_digits=10, decimal_places=2, required=False
+    )
+    places = forms.IntegerField(
+        label='Variation des places', required=False,
+        help_text='Ajoutées (ou retirées si négatif) aux places restantes et à la capacité'
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        pourcentage = cleaned_data.get('pourcentage')
+        montant = cleaned_data.get('montant')
+
+        if pourcentage is not None and montant is not None:
+            raise forms.ValidationError("Indiquez une variation en pourcentage ou en montant, pas les deux.")
+        if pourcentage is None and montant is None and not cleaned_data.get('places'):
+            raise forms.ValidationError("Aucune modification demandée.")
+        if pourcentage is not None and pourcentage <= -100:
+            raise forms.ValidationError({'pourcentage': "La baisse ne peut pas atteindre 100 %."})
+
+        return cleaned_data
+
+class RapprochementForm(forms.Form):
+    """Formulaire d'envoi d'un relevé d'opérateur à rapprocher des paiements"""
+    operateur = forms.ChoiceField(
+        label='Opérateur',
+        choices=Paiement.OperateurPaiement.choices,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    releve = forms.FileField(
+        label='Relevé (CSV)',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'}),
+        help_text='Colonnes attendues : référence, montant et statut de chaque transaction'
+    )
+    simulation = forms.BooleanField(
+        label='Simulation (aucune correction enregistrée)', required=False, initial=True
+    )
+    telecharger_rapport = forms.BooleanField(
+        label="Télécharger le rapport complet des anomalies (CSV)", required=False
+    )
@@ -0,0 +1,90 @@
+"""
+Génération des horaires à partir des grilles horaires récurrentes.
+
+Pour une grille, les chevauchements avec les horaires existants du trajet
+sont vérifiés en une seule requête sur toute la période, puis les nouveaux
+horaires et leurs classes sont insérés par lots avec bulk_create.
+"""
+import bisect
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .inventaire import invalider_disponibilite
+from .itineraires import invalider_jours
+from .models import Horaire, HoraireClasse, TypeBillet
+from .synchronisation import Type, journaliser
+
+TAILLE_LOT_GENERATION = 500
+
+
+def _departs(grille, debut, fin):
+    """(départ, arrivée) de chaque circulation de la grille entre `debut` et `fin` inclus"""
+    jours = grille.jours
+    duree = grille.trajet.duree
+    jour = debut
+    while jour <= fin:
+        if jour.weekday() in jours:
+            depart = timezone.make_aware(datetime.datetime.combine(jour, grille.heure_depart))
+            yield depart, depart + duree
+        jour += datetime.timedelta(days=1)
+
+
+def generer_horaires(grille, debut=None, fin=None, appliquer=True, taille_lot=TAILLE_LOT_GENERATION):
+    """
+    Crée les horaires de `grille` entre `debut` et `fin` (bornés par la
+    période de validité de la grille et par la date du jour).
+
+    Les circulations qui chevauchent un horaire existant du même trajet sont
+    ignorées. Retourne (nombre d'horaires créés, liste des départs ignorés).
+    """
+    maintenant = timezone.now()
+    debut = max(filter(None, [debut, grille.date_debut, timezone.localdate(maintenant)]))
+    fin = min(filter(None, [fin, grille.date_fin]))
+    candidats = [(depart, arrivee) for depart, arrivee in _departs(grille, debut, fin) if depart > maintenant]
+    if not candidats:
+        return 0, []
+
+    # Une seule requête pour tous les horaires du trajet sur la période
+    existants = list(Horaire.objects.filter(
+        trajet_id=grille.trajet_id,
+        date_depart__lt=candidats[-1][1],
+        date_arrivee__gt=candidats[0][0]
+    ).order_by('date_depart').values_list('date_depart', 'date_arrivee'))
+    departs_existants = [depart for depart, _arrivee in existants]
+    # Arrivée la plus tardive parmi les horaires existants partis avant chaque position
+    arrivees_max = []
+    for _depart, arrivee in existants:
+        arrivees_max.append(max(arrivee, arrivees_max[-1]) if arrivees_max else arrivee)
+
+    a_creer = []
+    ignores = []
+    fin_precedente = None
+    for depart, arrivee in candidats:
+        position = bisect.bisect_left(departs_existants, arrivee)
+        chevauche = position > 0 and arrivees_max[position - 1] > depart
+        if chevauche or (fin_precedente and fin_precedente > depart):
+            ignores.append(depart)
+            continue
+        fin_precedente = arrivee
+        a_creer.append(Horaire(trajet_id=grille.trajet_id, date_depart=depart, date_arrivee=arrivee))
+
+    if appliquer and a_creer:
+        classes = [
+            (TypeBillet.STANDARD, grille.prix_standard, grille.places_standard),
+            (TypeBillet.BUSINESS, grille.prix_business, grille.places_business),
+            (TypeBillet.PREMIERE, grille.prix_premiere, grille.places_premiere),
+        ]
+        with transaction.atomic():
+            # Les clés primaires sont renseignées par bulk_create (PostgreSQL, SQLite >= 3.35)
+            Horaire.objects.bulk_create(a_creer, batch_size=taille_lot)
+            HoraireClasse.objects.bulk_create([
+                HoraireClasse(horaire=horaire, classe=classe, prix=prix, capacite=places)
+                for horaire in a_creer for classe, prix, places in classes
+            ], batch_size=taille_lot)
+            # Aucun signal n'est émis par bulk_create
+            journaliser(Type.HORAIRE, [horaire.pk for horaire in a_creer])
+            invalider_jours(*(timezone.localdate(horaire.date_depart) for horaire in a_creer))
+            invalider_disponibilite()
+    return len(a_creer), ignores
@@ -0,0 +1,220 @@
+"""
+Idempotence des requêtes de paiement.
+
+Le formulaire de paiement porte une clé unique (champ caché
+`cle_idempotence`, ou en-tête `Idempotency-Key` pour un client d'API). La
+première requête enregistre la clé en base avant tout traitement : la
+contrainte d'unicité départage les workers et un seul traite la requête. Les
+répétitions (double clic, renvoi par un réseau mobile instable) reçoivent la
+réponse enregistrée, sans nouveau paiement ni appel à l'opérateur, pendant
+IDEMPOTENCE_DUREE_HEURES heures.
+
+Une clé réutilisée pour une requête différente est refusée. Une clé restée
+« en cours » plus de IDEMPOTENCE_DELAI_TRAITEMENT secondes (worker
+interrompu) est reprise par la tentative suivante. La commande
+`purger_cles_idempotence` supprime les clés expirées, par lots.
+"""
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+
+from .models import CleIdempotence
+
+CHAMP_CLE = 'cle_idempotence'
+ENTETE_CLE = 'HTTP_IDEMPOTENCY_KEY'
+ENTETES_CONSERVES = ('Content-Type', 'Location')
+TAILLE_LOT_PURGE = 1000
+
+
+def duree_conservation():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCE_DUREE_HEURES', 24))
+
+
+def delai_traitement():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCE_DELAI_TRAITEMENT', 60))
+
+
+def attente_max():
+    return getattr(settings, 'IDEMPOTENCE_ATTENTE_SECONDES', 5)
+
+
+def lire_cle(request):
+    """Clé fournie par l'en-tête Idempotency-Key ou, à défaut, par le formulaire"""
+    return (request.META.get(ENTETE_CLE) or request.POST.get(CHAMP_CLE) or '').strip()
+
+
+def empreinte_requete(request):
+    """Empreinte du contenu de la requête, hors jeton CSRF et clé d'idempotence"""
+    donnees = {
+        nom: sorted(valeurs) for nom, valeurs in request.POST.lists()
+        if nom not in ('csrfmiddlewaretoken', CHAMP_CLE)
+    }
+    contenu = json.dumps([request.method, request.path, donnees], sort_keys=True)
+    return hashlib.sha256(contenu.encode()).hexdigest()
+
+
+def _reserver(utilisateur, cle, portee, empreinte):
+    """
+    Enregistre la clé « en cours ». Retourne (clé, True) si la requête doit
+    être traitée par l'appelant, (clé existante, False) sinon.
+    """
+    maintenant = timezone.now()
+    try:
+        with transaction.atomic():
+            return CleIdempotence.objects.create(
+                utilisateur=utilisateur, cle=cle, portee=portee, empreinte_requete=empreinte,
+                verrouille_le=maintenant, expire_le=maintenant + duree_conservation(),
+            ), True
+    except IntegrityError:
+        pass
+
+    existante = CleIdempotence.objects.filter(utilisateur=utilisateur, cle=cle).first()
+    if existante is None or existante.expire_le <= maintenant:
+        # Clé expirée (ou purgée entre-temps) : elle ne protège plus rien
+        CleIdempotence.objects.filter(utilisateur=utilisateur, cle=cle, expire_le__lte=maintenant).delete()
+        return _reserver(utilisateur, cle, portee, empreinte)
+
+    # Traitement abandonné : un seul worker reprend la clé (mise à jour conditionnelle)
+    reprise = (
+        existante.statut == CleIdempotence.StatutCle.EN_COURS
+        and existante.verrouille_le <= maintenant - delai_traitement()
+        and CleIdempotence.objects.filter(
+            pk=existante.pk, statut=CleIdempotence.StatutCle.EN_COURS, verrouille_le=existante.verrouille_le
+        ).update(verrouille_le=maintenant, empreinte_requete=empreinte, portee=portee) == 1
+    )
+    return existante, reprise
+
+
+def _attendre(enregistrement):
+    """
+    Attend, au plus attente_max() secondes, la fin du traitement de la même
+    clé par une autre requête. Retourne None si la clé a été libérée.
+    """
+    fin = time.monotonic() + attente_max()
+    while enregistrement.statut == CleIdempotence.StatutCle.EN_COURS and time.monotonic() < fin:
+        time.sleep(0.1)
+        enregistrement = CleIdempotence.objects.filter(pk=enregistrement.pk).first()
+        if enregistrement is None:
+            return None
+    return enregistrement
+
+
+def _enregistrer(enregistrement, reponse):
+    """Conserve la réponse d'une requête traitée ; une erreur serveur libère la clé"""
+    if reponse.streaming or reponse.status_code >= 500:
+        enregistrement.delete()
+        return
+    if not getattr(reponse, 'is_rendered', True):
+        reponse.render()
+    entetes = {nom: reponse[nom] for nom in ENTETES_CONSERVES if reponse.has_header(nom)}
+    empreinte = hashlib.sha256(
+        json.dumps([reponse.status_code, entetes], sort_keys=True).encode() + reponse.content
+    ).hexdigest()
+    CleIdempotence.objects.filter(pk=enregistrement.pk).update(
+        statut=CleIdempotence.StatutCle.TERMINEE,
+        code_reponse=reponse.status_code,
+        entetes_reponse=entetes,
+        corps_reponse=reponse.content,
+        empreinte_reponse=empreinte,
+    )
+
+
+def _rejouer(request, enregistrement):
+    """Reconstruit la réponse enregistrée pour une requête répétée"""
+    reponse = HttpResponse(bytes(enregistrement.corps_reponse), status=enregistrement.code_reponse)
+    for nom, valeur in enregistrement.entetes_reponse.items():
+        reponse[nom] = valeur
+    reponse['Idempotent-Replayed'] = 'true'
+    if reponse.has_header('Location'):
+        messages.info(request, "Cette demande a déjà été prise en compte.")
+    return reponse
+
+
+def executer_idempotent(request, portee, traiter):
+    """
+    Exécute `traiter()` une seule fois par clé d'idempotence et retourne sa
+    réponse, ou la réponse enregistrée si la requête a déjà été traitée.
+
+    `portee` identifie l'opération protégée. Sans clé (ou sans utilisateur
+    connecté), la requête est traitée normalement.
+    """
+    cle = lire_cle(request)
+    if not cle or not request.user.is_authenticated:
+        return traiter()
+    if len(cle) > CleIdempotence._meta.get_field('cle').max_length:
+        return HttpResponseBadRequest("Clé d'idempotence trop longue.")
+
+    empreinte = empreinte_requete(request)
+    enregistrement, a_traiter = _reserver(request.user, cle, portee, empreinte)
+    if not a_traiter:
+        if enregistrement.portee != portee or enregistrement.empreinte_requete != empreinte:
+            return HttpResponse(
+                "Cette clé d'idempotence a déjà servi pour une autre requête.",
+                status=422, content_type='text/plain; charset=utf-8',
+            )
+        enregistrement = _attendre(enregistrement)
+        if enregistrement is None:
+            # Le premier traitement a échoué : la requête est retentée
+            return executer_idempotent(request, portee, traiter)
+        if enregistrement.statut == CleIdempotence.StatutCle.EN_COURS:
+            return HttpResponse(
+                "Cette demande est en cours de traitement, veuillez réessayer dans quelques instants.",
+                status=409, content_type='text/plain; charset=utf-8',
+            )
+        return _rejouer(request, enregistrement)
+
+    try:
+        reponse = traiter()
+    except Exception:
+        # Rien n'a abouti : la clé est libérée pour une nouvelle tentative
+        enregistrement.delete()
+        raise
+    _enregistrer(enregistrement, reponse)
+    return reponse
+
+
+def purger_cles_expirees(maintenant=None, taille_lot=TAILLE_LOT_PURGE):
+    """Supprime les clés expirées, par lots de `taille_lot` ; retourne leur nombre"""
+    maintenant = maintenant or timezone.now()
+    total = 0
+    while True:
+        lot = list(CleIdempotence.objects.filter(expire_le__lte=maintenant).values_list('pk', flat=True)[:taille_lot])
+        if not lot:
+            break
+        total += CleIdempotence.objects.filter(pk__in=lot).delete()[0]
+        if len(lot) < taille_lot:
+            break
+    return total
+
+
+class IdempotenceMixin:
+    """
+    Rend idempotentes les requêtes POST d'une vue.
+
+    Le contexte reçoit une nouvelle clé `cle_idempotence`, à placer dans le
+    formulaire en champ caché. `portee_idempotence()` identifie l'opération :
+    par défaut la vue et ses paramètres d'URL.
+    """
+
+    def portee_idempotence(self):
+        parametres = ','.join(f'{nom}={valeur}' for nom, valeur in sorted(self.kwargs.items()))
+        return f'{type(self).__name__}:{parametres}'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cle_idempotence'] = uuid.uuid4().hex
+        return context
+
+    def post(self, request, *args, **kwargs):
+        return executer_idempotent(
+            request, self.portee_idempotence(),
+            lambda: super(IdempotenceMixin, self).post(request, *args, **kwargs),
+        )
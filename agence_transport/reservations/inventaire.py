@@ -0,0 +1,220 @@
+"""
+Opérations sur l'inventaire des places des horaires.
+
+Toutes les modifications de compteurs passent par des UPDATE conditionnels
+avec des expressions F : deux réservations simultanées ne peuvent pas
+vendre la même place, même réparties sur plusieurs workers.
+"""
+import logging
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import BlocagePlaces, Billet, Horaire, HoraireClasse, Reservation
+from .fidelite import debiter_reservations, restituer_tickets
+from .synchronisation import Type, journaliser
+from .tarification import invalider_tarifs, rafraichir_horaire
+
+# Statuts pour lesquels les billets d'une réservation occupent des places
+STATUTS_OCCUPANT_PLACES = [
+    Reservation.StatutReservation.EN_ATTENTE,
+    Reservation.StatutReservation.CONFIRMEE,
+    Reservation.StatutReservation.UTILISEE,
+]
+
+CLE_VERSION_DISPONIBILITE = 'inventaire:disponibilite:version'
+
+TAILLE_LOT_RECONCILIATION = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def version_disponibilite():
+    """
+    Numéro de version globale des disponibilités, à inclure dans les clés de
+    cache des recherches : les modifications groupées de l'inventaire
+    (réconciliation, grilles, horaires modifiés) l'incrémentent. Les ventes et
+    annulations n'incrémentent que la version de leur trajet et de leur jour
+    (voir versions_trajets_jours).
+    """
+    version = cache.get(CLE_VERSION_DISPONIBILITE)
+    if version is None:
+        cache.add(CLE_VERSION_DISPONIBILITE, 1, None)
+        version = cache.get(CLE_VERSION_DISPONIBILITE, 1)
+    return version
+
+
+def invalider_disponibilite():
+    """Rend obsolètes toutes les disponibilités mises en cache"""
+    def incrementer():
+        try:
+            cache.incr(CLE_VERSION_DISPONIBILITE)
+        except ValueError:
+            cache.set(CLE_VERSION_DISPONIBILITE, 2, None)
+    # Après le commit, pour ne pas recharger le cache avec l'ancien état
+    transaction.on_commit(incrementer)
+
+
+def cle_version_trajet_jour(trajet_id, jour):
+    return f'inventaire:disponibilite:{trajet_id}:{jour.isoformat()}'
+
+
+def versions_trajets_jours(cles):
+    """Version courante de chaque clé renvoyée par cle_version_trajet_jour"""
+    valeurs = cache.get_many(cles)
+    return {cle: valeurs.get(cle, 0) for cle in cles}
+
+
+def invalider_horaires(horaire_ids):
+    """
+    Rend obsolètes les disponibilités mises en cache des trajets et des jours
+    (dates locales) de ces horaires, sans toucher aux autres liaisons.
+    """
+    horaire_ids = list(horaire_ids)
+
+    def incrementer():
+        paires = Horaire.objects.filter(pk__in=horaire_ids).values_list('trajet_id', 'date_depart')
+        for cle in {cle_version_trajet_jour(trajet_id, timezone.localdate(depart)) for trajet_id, depart in paires}:
+            if not cache.add(cle, 1, None):
+                try:
+                    cache.incr(cle)
+                except ValueError:
+                    cache.set(cle, 1, None)
+    # Après le commit, pour ne pas recharger le cache avec l'ancien état
+    transaction.on_commit(incrementer)
+
+
+def retenir_places(horaire_id, type_billet, nombre):
+    """
+    Décompte `nombre` places de l'horaire si elles sont disponibles.
+
+    Retourne False (sans rien modifier) s'il ne reste pas assez de places.
+    """
+    # Une seule ligne modifiée : celle de la classe du billet
+    retenu = HoraireClasse.objects.filter(
+        horaire_id=horaire_id, classe=type_billet, vendus__lte=F('capacite') - nombre
+    ).update(vendus=F('vendus') + nombre) == 1
+    if retenu:
+        invalider_horaires([horaire_id])
+        rafraichir_horaire(horaire_id)
+        journaliser(Type.HORAIRE, [horaire_id])
+    return retenu
+
+
+def restituer_places(horaire_id, type_billet, nombre):
+    """
+    Rend `nombre` places à l'horaire. Un compteur inférieur à `nombre` (dérive
+    à corriger avec reconcilier_places) est ramené à zéro et signalé.
+    """
+    classes = HoraireClasse.objects.filter(horaire_id=horaire_id, classe=type_billet)
+    if not classes.filter(vendus__gte=nombre).update(vendus=F('vendus') - nombre):
+        # Greatest plutôt que vendus=0 : une vente simultanée a pu relever le compteur entre-temps
+        if classes.update(vendus=Greatest(F('vendus') - nombre, Value(0))):
+            logger.warning(
+                "Places vendues inférieures aux %d places rendues (horaire %s, classe %s) : compteur ramené à zéro",
+                nombre, horaire_id, type_billet,
+            )
+    invalider_horaires([horaire_id])
+    rafraichir_horaire(horaire_id)
+    journaliser(Type.HORAIRE, [horaire_id])
+
+
+def liberer_reservation(reservation, statut=Reservation.StatutReservation.ANNULEE):
+    """
+    Passe une réservation au statut `statut` (annulée ou remboursée) et rend
+    ses places à l'horaire (et son ticket bonus si elle n'était pas encore
+    payée), le tout dans une seule transaction.
+
+    La réservation est verrouillée pendant l'opération : une annulation et un
+    remboursement simultanés ne rendent les places qu'une seule fois.
+    Retourne le nombre de places rendues.
+    """
+    rendues = liberer_reservations([reservation.pk], statut=statut)
+    reservation.statut = statut
+    return rendues
+
+
+def liberer_reservations(reservation_ids, statut=Reservation.StatutReservation.ANNULEE):
+    """
+    Version groupée de liberer_reservation : le nombre de requêtes dépend
+    des classes d'horaires concernées, pas du nombre de réservations.
+    Retourne le nombre de places rendues.
+    """
+    from .documents import invalider_billet_pdf
+
+    reservation_ids = list(reservation_ids)
+    with transaction.atomic():
+        occupantes = [
+            pk for pk, statut_actuel in Reservation.objects.select_for_update().filter(
+                pk__in=reservation_ids
+            ).values_list('pk', 'statut')
+            if statut_actuel in STATUTS_OCCUPANT_PLACES
+        ]
+        rendues = 0
+        if occupantes:
+            billets = Billet.objects.filter(reservation_id__in=occupantes, annule=False)
+            par_classe = billets.values_list('reservation__horaire_id', 'type_billet').annotate(nombre=Count('id')).order_by()
+            for horaire_id, type_billet, nombre in par_classe:
+                restituer_places(horaire_id, type_billet, nombre)
+                rendues += nombre
+            billets.update(annule=True)
+            # Réservations annulées avant le paiement : leur ticket bonus est rendu
+            blocages = BlocagePlaces.objects.filter(reservation_id__in=occupantes)
+            tickets = dict(blocages.filter(ticket_bonus__isnull=False).values_list('ticket_bonus_id', 'reservation_id'))
+            blocages.delete()
+            restituer_tickets(tickets)
+            # Places et points de fidélité crédités au paiement
+            debiter_reservations(occupantes)
+
+        Reservation.objects.filter(pk__in=reservation_ids).update(statut=statut)
+        transaction.on_commit(lambda: invalider_billet_pdf(*reservation_ids))
+    return rendues
+
+
+def reconcilier_places(appliquer=True, taille_lot=TAILLE_LOT_RECONCILIATION):
+    """
+    Recalcule les places vendues de chaque classe des horaires à partir des
+    billets.
+
+    Les billets actifs sont comptés en une seule requête groupée par horaire
+    et par classe ; seules les classes dont le compteur a dérivé sont mises à
+    jour (par lots, avec bulk_update). Retourne la liste des corrections sous
+    la forme (horaire_id, classe, places restantes avant, places restantes
+    après).
+
+    Les valeurs écrites sont absolues : à lancer hors des périodes de vente
+    intense pour ne pas écraser une réservation concurrente.
+    """
+    vendus = defaultdict(int)
+    billets_actifs = Billet.objects.filter(
+        annule=False,
+        reservation__statut__in=STATUTS_OCCUPANT_PLACES
+    ).values_list('reservation__horaire_id', 'type_billet').annotate(nombre=Count('id')).order_by()
+    for horaire_id, type_billet, nombre in billets_actifs:
+        vendus[(horaire_id, type_billet)] = nombre
+
+    corrections = []
+    a_corriger = []
+
+    lignes = HoraireClasse.objects.values_list('pk', 'horaire_id', 'classe', 'capacite', 'vendus')
+    for pk, horaire_id, classe, capacite, actuels in lignes.iterator(chunk_size=taille_lot):
+        attendus = vendus[(horaire_id, classe)]
+        if actuels != attendus:
+            corrections.append((horaire_id, classe, max(0, capacite - actuels), max(0, capacite - attendus)))
+            a_corriger.append(HoraireClasse(pk=pk, horaire_id=horaire_id, vendus=attendus))
+
+    # Écriture après la lecture complète : on ne modifie pas la table pendant
+    # que le curseur la parcourt
+    if appliquer and a_corriger:
+        for debut in range(0, len(a_corriger), taille_lot):
+            with transaction.atomic():
+                lot = a_corriger[debut:debut + taille_lot]
+                HoraireClasse.objects.bulk_update(lot, ['vendus'])
+                journaliser(Type.HORAIRE, {classe.horaire_id for classe in lot})
+                invalider_disponibilite()
+                invalider_tarifs()
+    return corrections
@@ -0,0 +1,353 @@
+"""
+Recherche d'itinéraires avec correspondances sur le réseau des horaires.
+
+Chaque horaire est une connexion (gare de départ, gare d'arrivée, heures,
+prix). Les connexions d'une journée sont chargées en une requête dans des
+tableaux compacts triés par heure de départ (BlocJour), puis conservées en
+mémoire : seules les journées dont les horaires ont changé sont rechargées.
+Les versions des journées sont lues dans le cache par défaut, qui doit être
+partagé (CACHES) : une grille générée ou des tarifs ajustés par une commande
+de gestion atteignent ainsi tous les workers.
+
+La recherche est un balayage des connexions (Connection Scan Algorithm) qui
+conserve, pour chaque gare, les étiquettes non dominées selon trois critères :
+heure d'arrivée, prix et nombre de correspondances. Elle compare les prix de
+base (en flottants, dans les tableaux compacts) ; le prix renvoyé pour chaque
+itinéraire est ensuite le prix facturé, en Decimal : prix courants de la
+tarification dynamique si elle est active, prix de base sinon.
+"""
+import bisect
+import datetime
+from array import array
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Gare, Horaire, HoraireClasse
+from .tarification import est_active, table_tarifs
+
+CLASSES = ('STD', 'BUS', 'PRE')
+
+CORRESPONDANCE_MIN = datetime.timedelta(minutes=20)
+MAX_CORRESPONDANCES = 3
+DUREE_MAX = datetime.timedelta(hours=24)
+NOMBRE_RESULTATS = 5
+# Recherches relancées au plus en excluant les départs complets
+TENTATIVES_MAX = 3
+
+CLE_VERSION_RESEAU = 'itineraires:version'
+
+# Prix d'une classe que l'horaire ne propose pas : la connexion est ignorée
+PRIX_ABSENT = float('inf')
+
+
+def _cle_version_jour(jour):
+    return f'itineraires:jour:{jour.isoformat()}'
+
+
+def _incrementer(cle):
+    if not cache.add(cle, 1, None):
+        try:
+            cache.incr(cle)
+        except ValueError:
+            cache.set(cle, 1, None)
+
+
+def invalider_jours(*jours):
+    """Signale que les horaires de ces journées (dates locales) ont changé"""
+    for jour in set(jours):
+        _incrementer(_cle_version_jour(jour))
+
+
+def invalider_reseau():
+    """Signale un changement de l'ensemble du réseau (gares d'un trajet, trajet désactivé...)"""
+    _incrementer(CLE_VERSION_RESEAU)
+
+
+def version_reseau():
+    """Version courante du réseau (gares, villes, trajets)"""
+    return cache.get(CLE_VERSION_RESEAU, 0)
+
+
+def versions_jours(jours):
+    """Version courante de chaque journée : (version du réseau, version du jour)"""
+    cles = {_cle_version_jour(jour): jour for jour in jours}
+    valeurs = cache.get_many([CLE_VERSION_RESEAU, *cles])
+    globale = valeurs.get(CLE_VERSION_RESEAU, 0)
+    return {jour: (globale, valeurs.get(cle, 0)) for cle, jour in cles.items()}
+
+
+def _horodatage(valeur):
+    return int(valeur.timestamp())
+
+
+def _jour_local(horodatage):
+    return timezone.localtime(datetime.datetime.fromtimestamp(horodatage, tz=datetime.timezone.utc)).date()
+
+
+def charger_jour(jour):
+    """
+    Connexions d'une journée, sous la forme (horaire, gare de départ, gare
+    d'arrivée, départ, arrivée, prix standard, business, première).
+    """
+    horaires = Horaire.objects.on_date(jour).filter(trajet__actif=True)
+    lignes = horaires.values_list(
+        'pk', 'trajet__depart_id', 'trajet__arrivee_id', 'date_depart', 'date_arrivee'
+    ).order_by('date_depart', 'id')
+    # Prix de toutes les classes de la journée en une seconde requête
+    prix = {}
+    for horaire, classe, valeur in HoraireClasse.objects.filter(
+        horaire__in=horaires.values('pk')
+    ).values_list('horaire_id', 'classe', 'prix'):
+        prix[(horaire, classe)] = float(valeur)
+    for pk, depart, arrivee, date_depart, date_arrivee in lignes:
+        yield (
+            pk, depart, arrivee, _horodatage(date_depart), _horodatage(date_arrivee),
+            *(prix.get((pk, classe), PRIX_ABSENT) for classe in CLASSES)
+        )
+
+
+class BlocJour:
+    """Connexions d'une journée, triées par heure de départ, en tableaux compacts"""
+    __slots__ = ('version', 'horaires', 'gares_depart', 'gares_arrivee', 'departs', 'arrivees', 'prix')
+
+    def __init__(self, lignes, version=None):
+        self.version = version
+        self.horaires = array('q')
+        self.gares_depart = array('q')
+        self.gares_arrivee = array('q')
+        self.departs = array('q')
+        self.arrivees = array('q')
+        self.prix = {classe: array('d') for classe in CLASSES}
+        for horaire, depart, arrivee, heure_depart, heure_arrivee, *prix in sorted(lignes, key=lambda l: (l[3], l[0])):
+            self.horaires.append(horaire)
+            self.gares_depart.append(depart)
+            self.gares_arrivee.append(arrivee)
+            self.departs.append(heure_depart)
+            self.arrivees.append(heure_arrivee)
+            for classe, valeur in zip(CLASSES, prix):
+                self.prix[classe].append(valeur)
+
+    def __len__(self):
+        return len(self.horaires)
+
+
+class Itineraire:
+    """Suite de trajets directs, de la gare d'origine à la destination"""
+
+    def __init__(self, etiquette):
+        self.arrivee = etiquette[0]
+        self.prix = etiquette[1]
+        self.correspondances = etiquette[2]
+        self.etapes = []
+        while etiquette is not None:
+            # (horaire, départ, arrivée) de chaque trajet
+            self.etapes.append((etiquette[3], etiquette[4], etiquette[0]))
+            etiquette = etiquette[5]
+        self.etapes.reverse()
+        self.depart = self.etapes[0][1]
+
+    @property
+    def horaires(self):
+        return [horaire for horaire, _depart, _arrivee in self.etapes]
+
+    def to_dict(self):
+        def date(horodatage):
+            return timezone.localtime(datetime.datetime.fromtimestamp(horodatage, tz=datetime.timezone.utc)).isoformat()
+
+        return {
+            'depart': date(self.depart),
+            'arrivee': date(self.arrivee),
+            'duree_minutes': (self.arrivee - self.depart) // 60,
+            # Chaîne décimale, comme les montants de l'API
+            'prix': str(self.prix),
+            'correspondances': self.correspondances,
+            'etapes': [
+                {'horaire': horaire, 'depart': date(depart), 'arrivee': date(arrivee)}
+                for horaire, depart, arrivee in self.etapes
+            ],
+        }
+
+
+def _inserer(etiquettes, nouvelle):
+    """
+    Ajoute `nouvelle` à l'ensemble de Pareto `etiquettes` si aucune étiquette
+    ne la domine (arrivée, prix et correspondances inférieurs ou égaux), en
+    retirant celles qu'elle domine. Retourne True si elle a été ajoutée.
+    """
+    arrivee, prix, correspondances = nouvelle[0], nouvelle[1], nouvelle[2]
+    conservees = []
+    for etiquette in etiquettes:
+        if etiquette[0] <= arrivee and etiquette[1] <= prix and etiquette[2] <= correspondances:
+            return False
+        if not (arrivee <= etiquette[0] and prix <= etiquette[1] and correspondances <= etiquette[2]):
+            conservees.append(etiquette)
+    conservees.append(nouvelle)
+    etiquettes[:] = conservees
+    return True
+
+
+def _domine(etiquettes, arrivee, prix, correspondances):
+    for etiquette in etiquettes:
+        if etiquette[0] <= arrivee and etiquette[1] <= prix and etiquette[2] <= correspondances:
+            return True
+    return False
+
+
+class Reseau:
+    """
+    Graphe horaire en mémoire, par journée.
+
+    `chargeur(jour)` fournit les connexions d'une journée et `versions(jours)`
+    leurs numéros de version ; une journée n'est rechargée que si sa version a
+    changé depuis le dernier chargement.
+    """
+
+    def __init__(self, chargeur=charger_jour, versions=versions_jours):
+        self.chargeur = chargeur
+        self.versions = versions
+        self.jours = {}
+
+    def blocs(self, premier_jour, dernier_jour):
+        jours = []
+        jour = premier_jour
+        while jour <= dernier_jour:
+            jours.append(jour)
+            jour += datetime.timedelta(days=1)
+
+        versions = self.versions(jours)
+        blocs = []
+        for jour in jours:
+            bloc = self.jours.get(jour)
+            if bloc is None or bloc.version != versions[jour]:
+                bloc = self.jours[jour] = BlocJour(self.chargeur(jour), versions[jour])
+            blocs.append(bloc)
+        return blocs
+
+    def oublier_avant(self, jour):
+        """Libère les journées passées"""
+        for ancien in [j for j in self.jours if j < jour]:
+            del self.jours[ancien]
+
+    def rechercher(self, origines, destinations, depart_apres, classe='STD',
+                   correspondance_min=CORRESPONDANCE_MIN, max_correspondances=MAX_CORRESPONDANCES,
+                   duree_max=DUREE_MAX, exclus=(), nombre=NOMBRE_RESULTATS):
+        """
+        Itinéraires non dominés partant d'une gare de `origines` après
+        `depart_apres` (datetime) et arrivant à une gare de `destinations`,
+        triés par heure d'arrivée, prix puis nombre de correspondances.
+        """
+        origines = set(origines)
+        destinations = set(destinations)
+        exclus = set(exclus)
+        debut = _horodatage(depart_apres)
+        horizon = debut + int(duree_max.total_seconds())
+        attente = int(correspondance_min.total_seconds())
+
+        etiquettes = {}
+        arrivees = []
+
+        for bloc in self.blocs(_jour_local(debut), _jour_local(horizon)):
+            departs = bloc.departs
+            prix_bloc = bloc.prix[classe]
+            for i in range(bisect.bisect_left(departs, debut), len(bloc)):
+                depart = departs[i]
+                if depart > horizon:
+                    break
+                gare_arrivee = bloc.gares_arrivee[i]
+                horaire = bloc.horaires[i]
+                prix = prix_bloc[i]
+                if gare_arrivee in origines or horaire in exclus or prix == PRIX_ABSENT:
+                    continue
+                gare_depart = bloc.gares_depart[i]
+                arrivee = bloc.arrivees[i]
+
+                candidats = []
+                if gare_depart in origines:
+                    candidats.append((arrivee, prix, 0, horaire, depart, None))
+                for etiquette in etiquettes.get(gare_depart, ()):
+                    if etiquette[0] + attente <= depart and etiquette[2] < max_correspondances:
+                        candidats.append((arrivee, etiquette[1] + prix, etiquette[2] + 1, horaire, depart, etiquette))
+
+                for candidat in candidats:
+                    # Inutile de poursuivre une étiquette déjà battue à destination
+                    if _domine(arrivees, candidat[0], candidat[1], candidat[2]):
+                        continue
+                    if gare_arrivee in destinations:
+                        _inserer(arrivees, candidat)
+                    else:
+                        _inserer(etiquettes.setdefault(gare_arrivee, []), candidat)
+
+        arrivees.sort(key=lambda etiquette: (etiquette[0], etiquette[1], etiquette[2]))
+        return [Itineraire(etiquette) for etiquette in arrivees[:nombre]]
+
+
+_reseau = Reseau()
+
+
+def parametres():
+    """Réglages de la recherche, surchargés par settings.ITINERAIRES"""
+    reglages = getattr(settings, 'ITINERAIRES', {})
+    return {
+        'correspondance_min': datetime.timedelta(
+            minutes=reglages.get('CORRESPONDANCE_MIN_MINUTES', CORRESPONDANCE_MIN.total_seconds() // 60)
+        ),
+        'max_correspondances': reglages.get('MAX_CORRESPONDANCES', MAX_CORRESPONDANCES),
+        'duree_max': datetime.timedelta(hours=reglages.get('DUREE_MAX_HEURES', DUREE_MAX.total_seconds() // 3600)),
+    }
+
+
+def appliquer_prix_factures(itineraires, classe):
+    """
+    Remplace le prix de recherche de chaque itinéraire par la somme des prix
+    facturés de ses trajets (Decimal), en une requête ou une lecture de la
+    table des tarifs.
+    """
+    horaires = {horaire for itineraire in itineraires for horaire in itineraire.horaires}
+    if est_active():
+        prix = {horaire: tarifs[classe] for horaire, tarifs in table_tarifs.tarifs(list(horaires)).items()}
+    else:
+        prix = dict(HoraireClasse.objects.filter(
+            horaire_id__in=horaires, classe=classe
+        ).values_list('horaire_id', 'prix'))
+    for itineraire in itineraires:
+        itineraire.prix = sum((prix[horaire] for horaire in itineraire.horaires), Decimal('0'))
+    return itineraires
+
+
+def planifier(depart, arrivee, depart_apres=None, classe='STD', par_ville=False, nombre=NOMBRE_RESULTATS):
+    """
+    Meilleurs itinéraires entre deux gares (ou deux villes avec `par_ville`).
+
+    Le graphe ne porte que les horaires et les prix ; les places des trajets
+    proposés sont vérifiées ensuite en une requête, et la recherche est
+    relancée sans les départs complets dans la classe demandée.
+    """
+    if par_ville:
+        origines = Gare.objects.filter(ville_id=depart).values_list('pk', flat=True)
+        destinations = Gare.objects.filter(ville_id=arrivee).values_list('pk', flat=True)
+    else:
+        origines, destinations = [int(depart)], [int(arrivee)]
+
+    maintenant = timezone.now()
+    depart_apres = max(depart_apres or maintenant, maintenant)
+    _reseau.oublier_avant(timezone.localdate(maintenant))
+
+    exclus = set()
+    for _tentative in range(TENTATIVES_MAX):
+        itineraires = _reseau.rechercher(
+            origines, destinations, depart_apres, classe=classe, exclus=exclus, nombre=nombre, **parametres()
+        )
+        proposes = {horaire for itineraire in itineraires for horaire in itineraire.horaires}
+        reservables = set(
+            Horaire.objects.bookable(classe).filter(pk__in=proposes).values_list('pk', flat=True)
+        )
+        complets = proposes - reservables
+        if not complets:
+            return appliquer_prix_factures(itineraires, classe)
+        exclus |= complets
+    return appliquer_prix_factures(
+        [itineraire for itineraire in itineraires if not exclus.intersection(itineraire.horaires)], classe
+    )
@@ -0,0 +1,157 @@
+"""
+Journalisation structurée : une ligne JSON par événement, portant
+l'identifiant de la requête HTTP en cours.
+
+IdentifiantRequeteMiddleware attribue à chaque requête un identifiant
+(l'en-tête X-Request-ID reçu du proxy s'il est valide, sinon un nouveau),
+le renvoie dans la réponse et le place dans un ContextVar : tous les
+événements journalisés pendant la requête (vues, paiements, envoi des
+emails...) le reprennent dans le champ « request_id », et les emails
+envoyés par EmailBackendTrace le portent dans leur en-tête X-Request-ID.
+Hors requête (commandes, workers), le champ vaut « - ».
+
+GestionnaireFile ne fait qu'ajouter l'événement, déjà mis en forme, à une
+file bornée ; un thread unique (QueueListener) l'écrit sur la sortie
+standard. Un thread de requête n'attend donc jamais l'écriture : si la
+file est pleine, l'événement est abandonné et compté.
+
+Configuration (settings.LOGGING) :
+
+    'filters': {'identifiant_requete': {'()': 'reservations.journalisation.FiltreIdentifiantRequete'}},
+    'formatters': {'json': {'()': 'reservations.journalisation.FormateurJSON'}},
+    'handlers': {
+        'file': {
+            '()': 'reservations.journalisation.GestionnaireFile',
+            'capacite': 10000,
+            'formatter': 'json',
+            'filters': ['identifiant_requete'],
+        },
+    },
+
+et, pour les emails :
+
+    EMAIL_BACKEND = 'reservations.journalisation.EmailBackendTrace'
+    EMAIL_BACKEND_TRACE = 'django.core.mail.backends.smtp.EmailBackend'
+"""
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+logger = logging.getLogger(__name__)
+
+identifiant_requete = ContextVar('identifiant_requete', default='-')
+
+# Identifiant accepté depuis l'en-tête X-Request-ID (uuid, ulid, identifiant de proxy...)
+IDENTIFIANT_VALIDE = re.compile(r'[A-Za-z0-9._:-]{8,64}')
+
+# Attributs de tout LogRecord : les autres viennent de `extra` et sont repris dans la ligne JSON
+ATTRIBUTS_STANDARD = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+class FiltreIdentifiantRequete(logging.Filter):
+    """Ajoute à chaque événement l'identifiant de la requête en cours (attribut request_id)"""
+
+    def filter(self, record):
+        record.request_id = identifiant_requete.get()
+        return True
+
+
+class FormateurJSON(logging.Formatter):
+    """Met en forme un événement sur une ligne JSON"""
+
+    def format(self, record):
+        ligne = {
+            'horodatage': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'niveau': record.levelname,
+            'journal': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', identifiant_requete.get()),
+        }
+        for cle, valeur in vars(record).items():
+            if cle not in ATTRIBUTS_STANDARD:
+                ligne[cle] = valeur
+        if record.exc_info:
+            ligne['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            ligne['pile'] = self.formatStack(record.stack_info)
+        return json.dumps(ligne, ensure_ascii=False, default=str)
+
+
+class GestionnaireFile(QueueHandler):
+    """
+    Dépose les événements mis en forme dans une file bornée de `capacite`
+    éléments, écrite sur `flux` (sortie standard) par un thread dédié. Un
+    événement qui ne trouve pas de place est abandonné (compteur `perdus`).
+    """
+
+    def __init__(self, capacite=10000, flux=None):
+        super().__init__(queue.Queue(capacite))
+        self.perdus = 0
+        destination = logging.StreamHandler(flux or sys.stdout)
+        self.listener = QueueListener(self.queue, destination)
+        self.listener.start()
+        atexit.register(self.arreter)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.perdus += 1
+
+    def arreter(self):
+        """Écrit les événements encore en file et arrête le thread d'écriture"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self.arreter()
+        super().close()
+
+
+class EmailBackendTrace(BaseEmailBackend):
+    """
+    Backend d'envoi qui ajoute l'en-tête X-Request-ID aux emails envoyés
+    pendant une requête et journalise chaque envoi, puis délègue au backend
+    EMAIL_BACKEND_TRACE.
+    """
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.backend = get_connection(settings.EMAIL_BACKEND_TRACE, fail_silently=fail_silently, **kwargs)
+
+    def open(self):
+        return self.backend.open()
+
+    def close(self):
+        return self.backend.close()
+
+    def send_messages(self, email_messages):
+        email_messages = list(email_messages)
+        if not email_messages:
+            return 0
+        identifiant = identifiant_requete.get()
+        if identifiant != '-':
+            for message in email_messages:
+                message.extra_headers.setdefault('X-Request-ID', identifiant)
+        try:
+            envoyes = self.backend.send_messages(email_messages) or 0
+        except Exception:
+            logger.exception("Envoi de %d email(s) impossible", len(email_messages))
+            raise
+        if envoyes < len(email_messages):
+            logger.warning("%d email(s) sur %d non envoyé(s)", len(email_messages) - envoyes, len(email_messages))
+        logger.info(
+            "%d email(s) envoyé(s)", envoyes,
+            extra={'sujets': sorted({message.subject for message in email_messages})[:5]},
+        )
+        return envoyes
@@ -0,0 +1,71 @@
+import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from reservations.models import Horaire
+from reservations.tarifs import CLASSES, AjustementInvalide, ajuster_horaires
+
+
+def debut_du_jour(jour):
+    return timezone.make_aware(datetime.datetime.combine(jour, datetime.time.min))
+
+
+class Command(BaseCommand):
+    help = "Modifie en une seule requête les prix et/ou les places d'un ensemble d'horaires"
+
+    def add_arguments(self, parser):
+        variation = parser.add_mutually_exclusive_group()
+        variation.add_argument('--pourcentage', type=Decimal, help="Variation des prix en pourcentage (ex. 10 ou -15)")
+        variation.add_argument('--montant', type=Decimal, help="Montant ajouté aux prix (négatif pour une baisse)")
+        parser.add_argument('--places', type=int, default=0, help="Places ajoutées (ou retirées) à chaque classe")
+        parser.add_argument('--classes', nargs='+', choices=CLASSES, help="Classes concernées (toutes par défaut)")
+        parser.add_argument('--trajet', type=int, action='append', help="Identifiant de trajet (répétable)")
+        parser.add_argument('--depart', type=int, help="Ville de départ")
+        parser.add_argument('--arrivee', type=int, help="Ville d'arrivée")
+        parser.add_argument('--du', help="Premier jour de départ concerné (AAAA-MM-JJ)")
+        parser.add_argument('--au', help="Dernier jour de départ concerné (AAAA-MM-JJ)")
+        parser.add_argument('--inclure-passes', action='store_true', help="Inclut les départs passés")
+        parser.add_argument('--dry-run', action='store_true', help="Affiche l'aperçu sans rien modifier")
+
+    def handle(self, *args, **options):
+        horaires = Horaire.objects.all() if options['inclure_passes'] else Horaire.objects.upcoming()
+        horaires = horaires.between(options['depart'], options['arrivee'])
+        if options['trajet']:
+            horaires = horaires.filter(trajet_id__in=options['trajet'])
+
+        bornes = {}
+        for nom in ('du', 'au'):
+            if options[nom]:
+                bornes[nom] = parse_date(options[nom])
+                if bornes[nom] is None:
+                    raise CommandError(f"Date invalide : {options[nom]}")
+        if 'du' in bornes:
+            horaires = horaires.filter(date_depart__gte=debut_du_jour(bornes['du']))
+        if 'au' in bornes:
+            # Fin exclue : début du lendemain du dernier jour
+            horaires = horaires.filter(date_depart__lt=debut_du_jour(bornes['au'] + datetime.timedelta(days=1)))
+
+        try:
+            apercu = ajuster_horaires(
+                horaires,
+                pourcentage=options['pourcentage'],
+                montant=options['montant'],
+                places=options['places'],
+                classes=options['classes'],
+                appliquer=not options['dry_run']
+            )
+        except AjustementInvalide as e:
+            raise CommandError(str(e))
+
+        for cle, valeur in apercu.items():
+            if cle.endswith('_avant'):
+                colonne = cle[:-len('_avant')]
+                self.stdout.write(f"{colonne} : {valeur} -> {apercu[colonne + '_apres']}")
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{apercu['nombre']} horaire(s) concerné(s) (aucune modification effectuée)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{apercu.get('modifies', 0)} horaire(s) modifié(s)."))
@@ -0,0 +1,44 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from reservations.fidelite import TAILLE_LOT_BALAYAGE, delai_rappel, envoyer_rappels, expirer_tickets
+
+
+class Command(BaseCommand):
+    help = "Marque expirés les tickets bonus arrivés à échéance et envoie les rappels d'expiration"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_BALAYAGE,
+            help="Nombre de tickets traités par transaction"
+        )
+        parser.add_argument(
+            '--jours-rappel', type=int, default=delai_rappel().days,
+            help="Rappel envoyé pour les tickets qui expirent dans moins de N jours"
+        )
+        parser.add_argument(
+            '--sans-rappels', action='store_true',
+            help="N'envoie aucun rappel, expire seulement les tickets"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=0,
+            help="Si renseigné, relance le balayage toutes les N secondes au lieu de s'arrêter"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expires = expirer_tickets(taille_lot=options['taille_lot'])
+            rappels = 0
+            if not options['sans_rappels']:
+                rappels = envoyer_rappels(
+                    delai=datetime.timedelta(days=options['jours_rappel']), taille_lot=options['taille_lot']
+                )
+            if expires or rappels or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{expires} ticket(s) bonus expiré(s), {rappels} rappel(s) envoyé(s)."
+                ))
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
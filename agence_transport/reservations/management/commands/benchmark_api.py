@@ -0,0 +1,82 @@
+import datetime
+import json
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+
+from reservations.inventaire import invalider_disponibilite
+from reservations.models import Gare, Horaire, HoraireClasse, Trajet, TypeBillet, Ville
+from reservations.views_api import api_liste
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la lecture des horaires par l'API v1 (pages calculées, servies par le cache, "
+        "réponses 304), sur des horaires synthétiques, dans une transaction annulée à la fin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horaires', type=int, default=20000, help="Horaires synthétiques")
+        parser.add_argument('--limite', type=int, default=100, help="Horaires par page")
+        parser.add_argument('--repetitions', type=int, default=5000, help="Requêtes des mesures avec cache")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.mesurer(options)
+            # Aucune donnée synthétique n'est conservée
+            transaction.set_rollback(True)
+        # Les pages mises en cache décrivent les horaires synthétiques
+        invalider_disponibilite()
+
+    def mesurer(self, options):
+        maintenant = timezone.now()
+        suffixe = int(maintenant.timestamp())
+        villes = [Ville.objects.create(nom=f'Bench {suffixe} {i}', code=f'B{i}{suffixe % 10000}') for i in range(2)]
+        gares = [Gare.objects.create(nom='Bench', ville=ville, adresse='-') for ville in villes]
+        trajet = Trajet.objects.create(depart=gares[0], arrivee=gares[1], duree=datetime.timedelta(hours=2), distance=100)
+        horaires = Horaire.objects.bulk_create([
+            Horaire(
+                trajet=trajet, date_depart=maintenant + datetime.timedelta(hours=numero + 1),
+                date_arrivee=maintenant + datetime.timedelta(hours=numero + 3),
+            )
+            for numero in range(options['horaires'])
+        ], batch_size=2000)
+        HoraireClasse.objects.bulk_create([
+            HoraireClasse(horaire=horaire, classe=classe, prix=Decimal('10000'), capacite=40)
+            for horaire in horaires for classe in TypeBillet.values
+        ], batch_size=2000)
+
+        fabrique = RequestFactory()
+        filtre = f'depart={gares[0].pk}&arrivee={gares[1].pk}&limite={options["limite"]}'
+        chemin = f'/api/v1/horaires/?{filtre}'
+
+        # Parcours de toutes les pages, chacune calculée
+        debut = time.perf_counter()
+        pages = 0
+        while chemin:
+            response = api_liste(fabrique.get(chemin), 'horaires')
+            pages += 1
+            chemin = json.loads(response.content)['suivant']
+        duree = time.perf_counter() - debut
+        self.stdout.write(
+            f"Pages calculées : {pages} pages de {options['limite']} horaires en {duree:.2f} s "
+            f"({duree / pages * 1000:.2f} ms par page)"
+        )
+
+        requete = fabrique.get(f'/api/v1/horaires/?{filtre}')
+        response = api_liste(requete, 'horaires')
+        etag = response['ETag']
+        conditionnelle = fabrique.get(f'/api/v1/horaires/?{filtre}', HTTP_IF_NONE_MATCH=etag)
+        for libelle, requete in (('Pages en cache', requete), ('Réponses 304', conditionnelle)):
+            debut = time.perf_counter()
+            for _ in range(options['repetitions']):
+                api_liste(requete, 'horaires')
+            duree = time.perf_counter() - debut
+            self.stdout.write(self.style.SUCCESS(
+                f"{libelle} : {options['repetitions'] / duree:.0f} requêtes par seconde "
+                f"({duree / options['repetitions'] * 1e6:.0f} µs chacune)"
+            ))
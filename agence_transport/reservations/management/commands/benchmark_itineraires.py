@@ -0,0 +1,75 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reservations.itineraires import Reseau
+
+
+class Command(BaseCommand):
+    help = "Mesure la recherche d'itinéraires sur un réseau synthétique (aucun accès à la base)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gares', type=int, default=300, help="Nombre de gares")
+        parser.add_argument('--hubs', type=int, default=12, help="Nombre de gares de correspondance")
+        parser.add_argument('--departs-par-jour', type=int, default=5000, help="Nombre de départs par jour")
+        parser.add_argument('--recherches', type=int, default=200, help="Nombre de recherches mesurées")
+        parser.add_argument('--graine', type=int, default=42, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        aleatoire = random.Random(options['graine'])
+        gares = list(range(1, options['gares'] + 1))
+        hubs = gares[:options['hubs']]
+
+        # Chaque gare locale est reliée à deux hubs ; les hubs sont reliés entre eux
+        lignes = [(a, b) for a in hubs for b in hubs if a != b]
+        for gare in gares[options['hubs']:]:
+            for hub in aleatoire.sample(hubs, 2):
+                lignes += [(gare, hub), (hub, gare)]
+        durees = {ligne: aleatoire.randint(30, 240) * 60 for ligne in lignes}
+
+        def chargeur(jour):
+            debut = int(timezone.make_aware(datetime.datetime.combine(jour, datetime.time.min)).timestamp())
+            generateur = random.Random(f"{options['graine']}-{jour}")
+            for numero in range(options['departs_par_jour']):
+                depart, arrivee = generateur.choice(lignes)
+                heure = debut + generateur.randint(5 * 3600, 22 * 3600)
+                prix = float(durees[(depart, arrivee)] // 60 * 100)
+                yield (
+                    jour.toordinal() * 100000 + numero, depart, arrivee,
+                    heure, heure + durees[(depart, arrivee)], prix, prix * 2, prix * 3
+                )
+
+        reseau = Reseau(chargeur=chargeur, versions=lambda jours: {jour: 0 for jour in jours})
+        demain = timezone.localdate() + datetime.timedelta(days=1)
+
+        debut = time.perf_counter()
+        reseau.blocs(demain, demain + datetime.timedelta(days=1))
+        chargement = (time.perf_counter() - debut) * 1000
+        self.stdout.write(
+            f"Réseau : {len(gares)} gares, {len(lignes)} lignes, "
+            f"{options['departs_par_jour']} départs/jour, chargement de 2 jours en {chargement:.1f} ms"
+        )
+
+        locales = gares[options['hubs']:]
+        durees_recherche = []
+        trouves = 0
+        for _ in range(options['recherches']):
+            origine, destination = aleatoire.sample(locales, 2)
+            depart_apres = timezone.make_aware(
+                datetime.datetime.combine(demain, datetime.time(aleatoire.randint(5, 14)))
+            )
+            debut = time.perf_counter()
+            itineraires = reseau.rechercher([origine], [destination], depart_apres)
+            durees_recherche.append((time.perf_counter() - debut) * 1000)
+            trouves += bool(itineraires)
+
+        durees_recherche.sort()
+        p95 = durees_recherche[int(len(durees_recherche) * 0.95) - 1]
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(durees_recherche)} recherches : médiane {statistics.median(durees_recherche):.2f} ms, "
+            f"p95 {p95:.2f} ms, max {durees_recherche[-1]:.2f} ms, {trouves} avec au moins un itinéraire"
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from reservations.middleware import MetriquesMiddleware
+
+
+class Command(BaseCommand):
+    help = "Mesure le surcoût du middleware de métriques par requête, sans et avec requêtes SQL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requetes', type=int, default=20000, help="Requêtes simulées par mesure")
+        parser.add_argument('--sql', type=int, default=5, help="Requêtes SQL par requête dans la seconde mesure")
+
+    def handle(self, *args, **options):
+        requete = RequestFactory().get('/')
+        requete.resolver_match = resolve('/')
+
+        def vue_vide(request):
+            return HttpResponse()
+
+        def vue_sql(request):
+            with connection.cursor() as curseur:
+                for _ in range(options['sql']):
+                    curseur.execute('SELECT 1')
+            return HttpResponse()
+
+        for libelle, vue in (('sans SQL', vue_vide), (f"{options['sql']} requêtes SQL", vue_sql)):
+            sans = self.mesurer(vue, requete, options['requetes'])
+            avec = self.mesurer(MetriquesMiddleware(vue), requete, options['requetes'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{libelle} : {sans:.1f} µs sans métriques, {avec:.1f} µs avec, surcoût {avec - sans:.1f} µs par requête"
+            ))
+
+    def mesurer(self, traiter, requete, nombre):
+        debut = time.perf_counter()
+        for _ in range(nombre):
+            traiter(requete)
+        return (time.perf_counter() - debut) / nombre * 1e6
@@ -0,0 +1,98 @@
+import datetime
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+
+from reservations.confirmations import TAILLE_LOT_NOTIFICATIONS, traiter_notifications
+from reservations.models import Client, Gare, Horaire, Paiement, Reservation, Trajet, Ville
+from reservations.passerelles import ACCEPTE, REFUSE, passerelle_notifications
+from reservations.views_paiement import notification_paiement
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure la réception d'une rafale de notifications de paiement par carte et leur traitement "
+        "par lots, sur des données synthétiques, dans une transaction annulée à la fin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paiements', type=int, default=10000, help="Paiements en attente de confirmation")
+        parser.add_argument('--doublons', type=float, default=0.2, help="Part des notifications renvoyées une seconde fois")
+        parser.add_argument('--taux-refus', type=float, default=0.05, help="Part des paiements refusés")
+        parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT_NOTIFICATIONS, help="Notifications par transaction")
+        parser.add_argument('--graine', type=int, default=42, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.mesurer(options, random.Random(options['graine']))
+            # Aucune donnée synthétique n'est conservée
+            transaction.set_rollback(True)
+
+    def mesurer(self, options, aleatoire):
+        maintenant = timezone.now()
+        suffixe = int(maintenant.timestamp())
+        villes = [Ville.objects.create(nom=f'Bench {suffixe} {i}', code=f'B{i}{suffixe % 10000}') for i in range(2)]
+        gares = [Gare.objects.create(nom='Bench', ville=ville, adresse='-') for ville in villes]
+        trajet = Trajet.objects.create(depart=gares[0], arrivee=gares[1], duree=datetime.timedelta(hours=2), distance=100)
+        horaire = Horaire.objects.create(
+            trajet=trajet, date_depart=maintenant + datetime.timedelta(days=3),
+            date_arrivee=maintenant + datetime.timedelta(days=3, hours=2),
+        )
+        utilisateur = User.objects.create(username=f'bench-{suffixe}', email=f'bench-{suffixe}@example.com', password='!')
+        client = Client.objects.create(user=utilisateur)
+
+        reservations = Reservation.objects.bulk_create([
+            Reservation(client=client, horaire=horaire, montant_total=Decimal('25000'), reference=f'N{numero:09d}')
+            for numero in range(options['paiements'])
+        ], batch_size=1000)
+        Paiement.objects.bulk_create([
+            Paiement(
+                reservation=reservation, montant=reservation.montant_total,
+                operateur=Paiement.OperateurPaiement.CARTE, statut=Paiement.StatutPaiement.PENDING,
+            )
+            for reservation in reservations
+        ], batch_size=1000)
+
+        # Notifications signées à l'avance : seule la réception est mesurée
+        adaptateur = passerelle_notifications(Paiement.OperateurPaiement.CARTE)
+        requetes = []
+        fabrique = RequestFactory()
+        for numero, reservation in enumerate(reservations):
+            statut = REFUSE if aleatoire.random() < options['taux_refus'] else ACCEPTE
+            corps = json.dumps(adaptateur.evenement_simule(f'evt_{numero}', reservation.reference, statut, f'pi_{numero}')).encode()
+            entetes = {f"HTTP_{nom.upper().replace('-', '_')}": valeur for nom, valeur in adaptateur.signer(corps).items()}
+            requete = fabrique.post('/', data=corps, content_type='application/json', **entetes)
+            requetes.append(requete)
+            if aleatoire.random() < options['doublons']:
+                requetes.append(fabrique.post('/', data=corps, content_type='application/json', **entetes))
+        aleatoire.shuffle(requetes)
+
+        debut = time.perf_counter()
+        codes = [notification_paiement(requete, Paiement.OperateurPaiement.CARTE).status_code for requete in requetes]
+        duree = time.perf_counter() - debut
+        self.stdout.write(
+            f"Réception : {len(requetes)} notifications en {duree:.2f} s "
+            f"({len(requetes) / duree:.0f} par seconde, {duree / len(requetes) * 1000:.2f} ms chacune), "
+            f"{codes.count(200)} acceptées"
+        )
+
+        debut = time.perf_counter()
+        bilan = traiter_notifications(
+            taille_lot=options['taille_lot'], connexion=get_connection('django.core.mail.backends.dummy.EmailBackend')
+        )
+        duree = time.perf_counter() - debut
+        traitees = sum(bilan.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Traitement : {traitees} notifications en {duree:.2f} s ({traitees / duree:.0f} par seconde) ; "
+            + ', '.join(f"{statut.label} : {nombre}" for statut, nombre in bilan.items())
+        ))
+        payes = Paiement.objects.filter(reservation__client=client, statut=Paiement.StatutPaiement.PAID).count()
+        self.stdout.write(f"Paiements confirmés : {payes} sur {len(reservations)}")
@@ -0,0 +1,64 @@
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reservations.models import Reservation
+from reservations.passerelles import ADAPTATEURS, OperateurIndisponible, parametres, passerelle
+
+
+class Command(BaseCommand):
+    help = (
+        "Envoie des demandes de paiement simultanées à un opérateur (par exemple au simulateur "
+        "local) et mesure la latence, les résultats et l'effet du disjoncteur"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('operateur', choices=sorted(ADAPTATEURS), help="Opérateur sollicité")
+        parser.add_argument('--url', help="URL de l'opérateur, à défaut celle de PASSERELLES_PAIEMENT")
+        parser.add_argument('--requetes', type=int, default=1000, help="Nombre de demandes de paiement")
+        parser.add_argument('--concurrence', type=int, default=20, help="Demandes envoyées en parallèle")
+
+    def handle(self, *args, **options):
+        operateur = options['operateur']
+        if options['url']:
+            reglages = parametres()
+            adaptateur = ADAPTATEURS[operateur](operateur, options['url'], reglages=reglages)
+        else:
+            try:
+                adaptateur = passerelle(operateur)
+            except OperateurIndisponible:
+                adaptateur = None
+            if adaptateur is None or not adaptateur.url:
+                raise CommandError(f"Aucune URL configurée pour {operateur} : utilisez --url")
+
+        def payer(numero):
+            # Réservation non enregistrée : seuls la référence et le montant sont transmis
+            reservation = Reservation(reference=f'BENCH-{numero:08d}', montant_total=Decimal('25000'))
+            debut = time.perf_counter()
+            try:
+                resultat = adaptateur.initier_paiement(reservation, '+25779000000').statut
+            except OperateurIndisponible:
+                resultat = 'indisponible'
+            return resultat, time.perf_counter() - debut
+
+        debut = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrence']) as executeur:
+            mesures = list(executeur.map(payer, range(options['requetes'])))
+        duree = time.perf_counter() - debut
+
+        resultats = Counter(resultat for resultat, _duree in mesures)
+        durees = sorted(d for _resultat, d in mesures)
+        centiles = statistics.quantiles(durees, n=100) if len(durees) > 1 else durees * 99
+        self.stdout.write(
+            f"{options['requetes']} demandes en {duree:.2f} s ({options['requetes'] / duree:.0f} par seconde), "
+            f"budget de latence {adaptateur.parametres['BUDGET_LATENCE']} s"
+        )
+        self.stdout.write(', '.join(f"{resultat} : {nombre}" for resultat, nombre in resultats.most_common()))
+        self.stdout.write(self.style.SUCCESS(
+            f"Latence : p50 {centiles[49] * 1000:.0f} ms, p95 {centiles[94] * 1000:.0f} ms, "
+            f"p99 {centiles[98] * 1000:.0f} ms, max {durees[-1] * 1000:.0f} ms"
+        ))
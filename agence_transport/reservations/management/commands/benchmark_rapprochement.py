@@ -0,0 +1,99 @@
+import datetime
+import random
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from reservations.models import Client, Gare, Horaire, Paiement, Reservation, Trajet, Ville
+from reservations.rapprochement import LIBELLES_BILAN, rapprocher
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le rapprochement d'un relevé CSV synthétique avec autant de paiements Lumicash, "
+        "dans une transaction annulée à la fin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lignes', type=int, default=500000, help="Lignes du relevé (et paiements enregistrés)")
+        parser.add_argument('--taux-attente', type=float, default=0.05, help="Part des paiements encore en attente")
+        parser.add_argument('--taux-anomalies', type=float, default=0.01, help="Part des lignes en anomalie")
+        parser.add_argument('--memoire', action='store_true', help="Mesure aussi le pic de mémoire (plus lent)")
+        parser.add_argument('--graine', type=int, default=42, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.mesurer(options, random.Random(options['graine']))
+            # Aucune donnée synthétique n'est conservée
+            transaction.set_rollback(True)
+
+    def mesurer(self, options, aleatoire):
+        maintenant = timezone.now()
+        suffixe = int(maintenant.timestamp())
+        villes = [Ville.objects.create(nom=f'Bench {suffixe} {i}', code=f'B{i}{suffixe % 10000}') for i in range(2)]
+        gares = [Gare.objects.create(nom='Bench', ville=ville, adresse='-') for ville in villes]
+        trajet = Trajet.objects.create(depart=gares[0], arrivee=gares[1], duree=datetime.timedelta(hours=2), distance=100)
+        horaire = Horaire.objects.create(
+            trajet=trajet, date_depart=maintenant + datetime.timedelta(days=3),
+            date_arrivee=maintenant + datetime.timedelta(days=3, hours=2),
+        )
+        utilisateur = User.objects.create(username=f'bench-{suffixe}', password='!')
+        client = Client.objects.create(user=utilisateur)
+
+        debut = time.perf_counter()
+        reservations = Reservation.objects.bulk_create([
+            Reservation(client=client, horaire=horaire, montant_total=Decimal('25000'), reference=f'R{numero:09d}')
+            for numero in range(options['lignes'])
+        ], batch_size=5000)
+        Paiement.objects.bulk_create([
+            Paiement(
+                reservation=reservation, montant=reservation.montant_total,
+                operateur=Paiement.OperateurPaiement.LUMICASH, reference_paiement=f'LMC{numero:010d}',
+                statut=(Paiement.StatutPaiement.PENDING if aleatoire.random() < options['taux_attente']
+                        else Paiement.StatutPaiement.PAID),
+            )
+            for numero, reservation in enumerate(reservations)
+        ], batch_size=5000)
+        del reservations
+        self.stdout.write(f"Données synthétiques créées en {time.perf_counter() - debut:.1f} s")
+
+        with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as releve:
+            releve.write('Transaction;Date;Montant;Statut\n')
+            date = maintenant.strftime('%d/%m/%Y %H:%M')
+            for numero in range(options['lignes']):
+                reference, montant, statut = f'LMC{numero:010d}', '25 000', 'SUCCES'
+                if aleatoire.random() < options['taux_anomalies']:
+                    reference, montant, statut = aleatoire.choice([
+                        (f'INC{numero:010d}', montant, statut),
+                        (reference, '24 500', statut),
+                        (reference, montant, 'REMBOURSE'),
+                        (reference, montant, '???'),
+                    ])
+                releve.write(f'{reference};{date};{montant};{statut}\n')
+            releve.seek(0)
+
+            if options['memoire']:
+                tracemalloc.start()
+            debut = time.perf_counter()
+            bilan, _anomalies = rapprocher(
+                releve, Paiement.OperateurPaiement.LUMICASH,
+                connexion=get_connection('django.core.mail.backends.dummy.EmailBackend'),
+            )
+            duree = time.perf_counter() - debut
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rapprochement : {bilan['lignes']} lignes en {duree:.2f} s ({bilan['lignes'] / duree:.0f} par seconde)"
+        ))
+        if options['memoire']:
+            _actuelle, pic = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f"Pic de mémoire : {pic / 1024 / 1024:.0f} Mo")
+        for cle, libelle in LIBELLES_BILAN.items():
+            self.stdout.write(f"{libelle} : {bilan[cle]}")
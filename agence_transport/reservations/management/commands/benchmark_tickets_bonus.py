@@ -0,0 +1,97 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from reservations.fidelite import TAILLE_LOT_BALAYAGE, envoyer_rappels, expirer_tickets, recalculer_soldes
+from reservations.models import Client, TicketBonus
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le balayage des tickets bonus (expiration, rappels) et l'affichage du bandeau "
+        "sur des données synthétiques, dans une transaction annulée à la fin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=1000000, help="Nombre de tickets bonus créés")
+        parser.add_argument('--clients', type=int, default=50000, help="Nombre de clients créés")
+        parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT_BALAYAGE, help="Tickets traités par transaction")
+        parser.add_argument('--consultations', type=int, default=2000, help="Bandeaux mesurés")
+        parser.add_argument('--graine', type=int, default=42, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.mesurer(options, random.Random(options['graine']))
+            # Aucune donnée synthétique n'est conservée
+            transaction.set_rollback(True)
+
+    def chronometrer(self, libelle, fonction, *args, **kwargs):
+        debut = time.perf_counter()
+        resultat = fonction(*args, **kwargs)
+        self.stdout.write(f"{libelle} : {time.perf_counter() - debut:.2f} s ({resultat if isinstance(resultat, int) else len(resultat)})")
+        return resultat
+
+    def mesurer(self, options, aleatoire):
+        maintenant = timezone.now()
+        lot = 10000
+
+        debut = time.perf_counter()
+        prefixe = f"bench-{int(maintenant.timestamp())}"
+        for depart in range(0, options['clients'], lot):
+            fin = min(depart + lot, options['clients'])
+            utilisateurs = User.objects.bulk_create([
+                User(username=f"{prefixe}-{numero}", email=f"{prefixe}-{numero}@example.com", password='!')
+                for numero in range(depart, fin)
+            ])
+            Client.objects.bulk_create([Client(user=utilisateur) for utilisateur in utilisateurs])
+        client_ids = list(Client.objects.filter(user__username__startswith=prefixe).values_list('pk', flat=True))
+
+        # 40 % de tickets échus, 10 % à rappeler, le reste valide plus longtemps
+        for depart in range(0, options['tickets'], lot):
+            tickets = []
+            for numero in range(depart, min(depart + lot, options['tickets'])):
+                tirage = aleatoire.random()
+                if tirage < 0.4:
+                    echeance = maintenant - datetime.timedelta(hours=aleatoire.randint(1, 24 * 30))
+                elif tirage < 0.5:
+                    echeance = maintenant + datetime.timedelta(hours=aleatoire.randint(1, 71))
+                else:
+                    echeance = maintenant + datetime.timedelta(days=aleatoire.randint(4, 30))
+                tickets.append(TicketBonus(
+                    client_id=aleatoire.choice(client_ids), montant=0, date_expiration=echeance,
+                    code=f"B{numero:019d}", utilise=aleatoire.random() < 0.1,
+                ))
+            TicketBonus.objects.bulk_create(tickets)
+        self.stdout.write(
+            f"Données : {options['clients']} clients, {options['tickets']} tickets "
+            f"créés en {time.perf_counter() - debut:.1f} s"
+        )
+
+        self.chronometrer("Compteurs initialisés", recalculer_soldes)
+        self.chronometrer("Expiration", expirer_tickets, maintenant, options['taille_lot'])
+        self.chronometrer(
+            "Rappels", envoyer_rappels, maintenant, taille_lot=options['taille_lot'],
+            connexion=get_connection('django.core.mail.backends.dummy.EmailBackend'),
+        )
+        self.chronometrer("Compteurs vérifiés (écarts)", recalculer_soldes, appliquer=False)
+
+        echantillon = [aleatoire.choice(client_ids) for _ in range(options['consultations'])]
+        durees_compteur, durees_requete = [], []
+        for client_id in echantillon:
+            debut = time.perf_counter()
+            Client.objects.filter(pk=client_id).values_list('tickets_bonus_valides', flat=True).get()
+            durees_compteur.append(time.perf_counter() - debut)
+            debut = time.perf_counter()
+            TicketBonus.objects.filter(client_id=client_id).valides(maintenant).exists()
+            durees_requete.append(time.perf_counter() - debut)
+        self.stdout.write(self.style.SUCCESS(
+            f"Bandeau : compteur du client {statistics.median(durees_compteur) * 1e6:.0f} µs, "
+            f"requête sur les tickets {statistics.median(durees_requete) * 1e6:.0f} µs (médianes)"
+        ))
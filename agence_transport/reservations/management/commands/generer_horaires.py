@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from reservations.grilles import TAILLE_LOT_GENERATION, generer_horaires
+from reservations.models import GrilleHoraire
+
+
+class Command(BaseCommand):
+    help = "Génère les horaires des grilles horaires actives sur leur période de validité"
+
+    def add_arguments(self, parser):
+        parser.add_argument('grilles', nargs='*', type=int, help="Identifiants des grilles (toutes les grilles actives par défaut)")
+        parser.add_argument('--debut', help="Première date générée (AAAA-MM-JJ)")
+        parser.add_argument('--fin', help="Dernière date générée (AAAA-MM-JJ)")
+        parser.add_argument('--dry-run', action='store_true', help="Compte les horaires sans les créer")
+        parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT_GENERATION, help="Horaires insérés par requête")
+
+    def handle(self, *args, **options):
+        bornes = {}
+        for nom in ('debut', 'fin'):
+            if options[nom]:
+                bornes[nom] = parse_date(options[nom])
+                if bornes[nom] is None:
+                    raise CommandError(f"Date invalide : {options[nom]}")
+
+        grilles = GrilleHoraire.objects.filter(actif=True).select_related('trajet')
+        if options['grilles']:
+            grilles = grilles.filter(pk__in=options['grilles'])
+
+        debut = time.perf_counter()
+        total = 0
+        for grille in grilles:
+            crees, ignores = generer_horaires(
+                grille, appliquer=not options['dry_run'], taille_lot=options['taille_lot'], **bornes
+            )
+            total += crees
+            self.stdout.write(f"{grille} : {crees} horaire(s), {len(ignores)} ignoré(s) pour chevauchement")
+
+        duree = time.perf_counter() - debut
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{total} horaire(s) à créer (aucune modification effectuée)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{total} horaire(s) créé(s) en {duree:.1f} s."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from reservations.recherche import TAILLE_LOT_INDEXATION, reindexer_tout
+
+
+class Command(BaseCommand):
+    help = "Reconstruit l'index de recherche des clients (noms, identifiants, téléphones)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_INDEXATION,
+            help="Nombre de clients indexés par lot"
+        )
+
+    def handle(self, *args, **options):
+        total = reindexer_tout(taille_lot=options['taille_lot'])
+        self.stdout.write(self.style.SUCCESS(f"{total} terme(s) indexé(s)."))
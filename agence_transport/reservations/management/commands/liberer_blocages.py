@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reservations.blocages import TAILLE_LOT_BLOCAGES, liberer_blocages_expires
+
+
+class Command(BaseCommand):
+    help = "Libère les places des réservations dont le délai de paiement est dépassé"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_BLOCAGES,
+            help="Nombre de blocages traités par transaction"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=0,
+            help="Si renseigné, relance le balayage toutes les N secondes au lieu de s'arrêter"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            total = liberer_blocages_expires(taille_lot=options['taille_lot'])
+            if total or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f"{total} blocage(s) expiré(s) libéré(s)."))
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reservations.idempotence import TAILLE_LOT_PURGE, purger_cles_expirees
+
+
+class Command(BaseCommand):
+    help = "Supprime les clés d'idempotence des paiements arrivées à expiration"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_PURGE,
+            help="Nombre de clés supprimées par requête"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=0,
+            help="Si renseigné, relance la purge toutes les N secondes au lieu de s'arrêter"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            total = purger_cles_expirees(taille_lot=options['taille_lot'])
+            if total or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f"{total} clé(s) d'idempotence expirée(s) supprimée(s)."))
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
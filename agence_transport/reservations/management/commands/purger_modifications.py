@@ -0,0 +1,39 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reservations.synchronisation import TAILLE_LOT_PURGE, parametres, purger_modifications
+
+
+class Command(BaseCommand):
+    help = "Supprime les lignes anciennes du journal de synchronisation (les jetons plus anciens sont refusés)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conserver-jours', type=int, default=None,
+            help="Conserve les N derniers jours du journal (SYNCHRONISATION['CONSERVATION_JOURS'] par défaut)"
+        )
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_PURGE,
+            help="Nombre de lignes supprimées par requête"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=0,
+            help="Si renseigné, relance la purge toutes les N secondes au lieu de s'arrêter"
+        )
+
+    def handle(self, *args, **options):
+        jours = options['conserver_jours']
+        if jours is None:
+            jours = parametres()['CONSERVATION_JOURS']
+        while True:
+            total = purger_modifications(
+                timezone.now() - datetime.timedelta(days=jours), taille_lot=options['taille_lot']
+            )
+            if total or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(f"{total} ligne(s) du journal de synchronisation supprimée(s)."))
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
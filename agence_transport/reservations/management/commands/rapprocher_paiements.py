@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reservations.models import Paiement
+from reservations.rapprochement import LIBELLES_BILAN, ReleveInvalide, rapprocher, verifier_encodage
+
+
+class Command(BaseCommand):
+    help = (
+        "Rapproche un relevé CSV d'un opérateur des paiements enregistrés : corrige les paiements "
+        "confirmés ou refusés par le relevé et produit le rapport des anomalies"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('operateur', choices=Paiement.OperateurPaiement.values, help="Opérateur du relevé")
+        parser.add_argument('releve', help="Fichier CSV du relevé")
+        parser.add_argument('--rapport', help="Fichier CSV du rapport d'anomalies ('-' : sortie standard)")
+        parser.add_argument('--encodage', default='utf-8-sig', help="Encodage du relevé")
+        parser.add_argument('--taille-lot', type=int, default=None, help="Paiements corrigés par transaction")
+        parser.add_argument(
+            '--simulation', action='store_true',
+            help="Compte les corrections sans les enregistrer"
+        )
+
+    def handle(self, *args, **options):
+        rapport = None
+        try:
+            if options['rapport'] == '-':
+                rapport = sys.stdout
+            elif options['rapport']:
+                rapport = open(options['rapport'], 'w', newline='', encoding='utf-8')
+            # Encodage vérifié sur tout le fichier avant la première correction
+            with open(options['releve'], 'rb') as releve:
+                verifier_encodage(iter(lambda: releve.read(1 << 16), b''), options['encodage'])
+            with open(options['releve'], encoding=options['encodage'], newline='') as releve:
+                bilan, _anomalies = rapprocher(
+                    releve, options['operateur'], appliquer=not options['simulation'],
+                    rapport=rapport, limite_anomalies=0, taille_lot=options['taille_lot'],
+                )
+        except (OSError, LookupError, ReleveInvalide) as e:
+            raise CommandError(f"Rapprochement impossible : {e}")
+        finally:
+            if rapport not in (None, sys.stdout):
+                rapport.close()
+
+        sortie = self.stderr if rapport is sys.stdout else self.stdout
+        if options['simulation']:
+            sortie.write("Simulation : aucune correction enregistrée.")
+        for cle, libelle in LIBELLES_BILAN.items():
+            if bilan[cle] or cle in ('lignes', 'conformes', 'corriges'):
+                sortie.write(f"{libelle} : {bilan[cle]}")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from reservations.fidelite import TAILLE_LOT_RECALCUL, recalculer_soldes
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs de fidélité et de tickets bonus des clients à partir du journal et des tickets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Affiche les écarts sans corriger les clients"
+        )
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_RECALCUL,
+            help="Nombre de clients lus et corrigés par lot"
+        )
+
+    def handle(self, *args, **options):
+        corrections = recalculer_soldes(
+            appliquer=not options['dry_run'],
+            taille_lot=options['taille_lot']
+        )
+        for client_id, champ, ancien, nouveau in corrections:
+            self.stdout.write(f"Client {client_id} : {champ} {ancien} -> {nouveau}")
+
+        clients = len({client_id for client_id, *_ in corrections})
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{clients} client(s) à corriger (aucune modification effectuée)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{clients} client(s) corrigé(s)."))
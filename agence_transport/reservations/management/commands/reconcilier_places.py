@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from reservations.inventaire import TAILLE_LOT_RECONCILIATION, reconcilier_places
+
+
+class Command(BaseCommand):
+    help = "Recalcule les places restantes de tous les horaires à partir des billets vendus"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Affiche les écarts sans corriger les horaires"
+        )
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_RECONCILIATION,
+            help="Nombre d'horaires lus et corrigés par lot"
+        )
+
+    def handle(self, *args, **options):
+        corrections = reconcilier_places(
+            appliquer=not options['dry_run'],
+            taille_lot=options['taille_lot']
+        )
+        for horaire_id, classe, ancien, nouveau in corrections:
+            self.stdout.write(f"Horaire {horaire_id} : places {classe} {ancien} -> {nouveau}")
+
+        horaires = len({horaire_id for horaire_id, *_ in corrections})
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{horaires} horaire(s) à corriger (aucune modification effectuée)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{horaires} horaire(s) corrigé(s)."))
@@ -0,0 +1,90 @@
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from reservations.passerelles import ACCEPTE, ADAPTATEURS, EN_ATTENTE, REFUSE
+
+
+class Command(BaseCommand):
+    help = (
+        "Lance un simulateur local des opérateurs de paiement (latence et taux d'échec réglables), "
+        "à déclarer dans PASSERELLES_PAIEMENT, par exemple 'URL': 'http://127.0.0.1:8765/lumicash'"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hote', default='127.0.0.1', help="Adresse d'écoute")
+        parser.add_argument('--port', type=int, default=8765, help="Port d'écoute")
+        parser.add_argument('--latence-ms', type=int, default=200, help="Latence moyenne d'une réponse")
+        parser.add_argument('--gigue-ms', type=int, default=100, help="Écart maximal autour de la latence moyenne")
+        parser.add_argument('--taux-lenteur', type=float, default=0.0,
+                            help="Part des requêtes servies avec --lenteur-ms de latence")
+        parser.add_argument('--lenteur-ms', type=int, default=10000, help="Latence des requêtes lentes")
+        parser.add_argument('--taux-erreur', type=float, default=0.0, help="Part des requêtes en erreur 503")
+        parser.add_argument('--taux-refus', type=float, default=0.05, help="Part des paiements refusés")
+        parser.add_argument('--taux-attente', type=float, default=0.0, help="Part des paiements laissés en attente")
+        parser.add_argument('--graine', type=int, default=None, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        aleatoire = random.Random(options['graine'])
+        commande = self
+
+        class Simulateur(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                operateur = self.path.strip('/').split('/')[0]
+                adaptateur = ADAPTATEURS.get(operateur)
+                if adaptateur is None or not self.path.endswith(adaptateur.chemin):
+                    return self.repondre(404, {'erreur': 'inconnu'})
+
+                if aleatoire.random() < options['taux_lenteur']:
+                    latence = options['lenteur_ms']
+                else:
+                    latence = max(options['latence_ms'] + aleatoire.randint(-options['gigue_ms'], options['gigue_ms']), 0)
+                time.sleep(latence / 1000)
+
+                tirage = aleatoire.random()
+                if tirage < options['taux_erreur']:
+                    return self.repondre(503, {'erreur': 'indisponible'})
+                tirage -= options['taux_erreur']
+                if tirage < options['taux_refus']:
+                    statut = REFUSE
+                elif tirage < options['taux_refus'] + options['taux_attente']:
+                    statut = EN_ATTENTE
+                else:
+                    statut = ACCEPTE
+                self.repondre(200, adaptateur.reponse_simulee(statut, f'SIM-{uuid.uuid4().hex[:12].upper()}'))
+
+            def repondre(self, code, donnees):
+                corps = json.dumps(donnees).encode()
+                try:
+                    self.send_response(code)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(corps)))
+                    self.end_headers()
+                    self.wfile.write(corps)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Le client a abandonné la requête (budget de latence dépassé)
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                if options['verbosity'] > 1:
+                    commande.stdout.write(format % args)
+
+        serveur = ThreadingHTTPServer((options['hote'], options['port']), Simulateur)
+        serveur.daemon_threads = True
+        self.stdout.write(self.style.SUCCESS(
+            f"Simulateur des opérateurs sur http://{options['hote']}:{options['port']}/<operateur> "
+            f"({', '.join(ADAPTATEURS)}) ; Ctrl+C pour arrêter."
+        ))
+        try:
+            serveur.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            serveur.server_close()
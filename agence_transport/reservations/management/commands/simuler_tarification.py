@@ -0,0 +1,71 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reservations.tarification import CLASSES, StockageLocal, TableTarifs
+
+
+class Command(BaseCommand):
+    help = (
+        "Rejoue un flux de réservations sur des horaires synthétiques et mesure le coût "
+        "des consultations de prix dynamiques (aucun accès à la base)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tailles', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help="Nombres d'horaires simulés")
+        parser.add_argument('--reservations', type=int, default=20000, help="Réservations rejouées par taille")
+        parser.add_argument('--consultations', type=int, default=5, help="Consultations de prix par réservation")
+        parser.add_argument('--graine', type=int, default=42, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        for taille in options['tailles']:
+            self.simuler(taille, options['reservations'], options['consultations'], random.Random(options['graine']))
+
+    def simuler(self, taille, reservations, consultations, aleatoire):
+        maintenant = timezone.now()
+        # (pk, départ, prix x3, places restantes x3, capacité x3), comme tarification.COLONNES
+        horaires = {}
+        for pk in range(1, taille + 1):
+            depart = maintenant + datetime.timedelta(hours=aleatoire.randint(2, 60 * 24))
+            base = Decimal(aleatoire.randint(50, 300) * 100)
+            capacites = [aleatoire.randint(30, 60), aleatoire.randint(5, 15), aleatoire.randint(2, 8)]
+            horaires[pk] = [pk, depart, base, base * 2, base * 3, *capacites, *capacites]
+
+        def chargeur(ids):
+            return [tuple(horaires[pk]) for pk in ids]
+
+        table = TableTarifs(stockage=StockageLocal(), chargeur=chargeur)
+        debut = time.perf_counter()
+        table.rafraichir(horaires, maintenant)
+        construction = time.perf_counter() - debut
+
+        duree_consultations = duree_rafraichissements = 0.0
+        nombre_consultations = vendues = 0
+        for _ in range(reservations):
+            for _ in range(consultations):
+                pk = aleatoire.randint(1, taille)
+                debut = time.perf_counter()
+                table.prix(pk, aleatoire.choice(CLASSES), maintenant)
+                duree_consultations += time.perf_counter() - debut
+                nombre_consultations += 1
+
+            pk = aleatoire.randint(1, taille)
+            index = 5 + CLASSES.index(aleatoire.choice(CLASSES))
+            nombre = aleatoire.randint(1, 4)
+            if horaires[pk][index] >= nombre:
+                horaires[pk][index] -= nombre
+                vendues += nombre
+                debut = time.perf_counter()
+                table.rafraichir([pk], maintenant)
+                duree_rafraichissements += time.perf_counter() - debut
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{taille} horaires : table construite en {construction * 1000:.0f} ms, "
+            f"{vendues} places vendues, consultation {duree_consultations / nombre_consultations * 1e6:.1f} µs, "
+            f"rafraîchissement après vente {duree_rafraichissements / max(reservations, 1) * 1e6:.1f} µs"
+        ))
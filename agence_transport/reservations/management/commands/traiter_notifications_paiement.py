@@ -0,0 +1,43 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reservations.confirmations import TAILLE_LOT_NOTIFICATIONS, purger_notifications, traiter_notifications
+
+
+class Command(BaseCommand):
+    help = "Applique aux paiements les notifications reçues des opérateurs, par lots"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_NOTIFICATIONS,
+            help="Nombre de notifications traitées par transaction"
+        )
+        parser.add_argument(
+            '--conserver-jours', type=int, default=30,
+            help="Supprime les notifications traitées depuis plus de N jours (0 : aucune suppression)"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=0,
+            help="Si renseigné, relance le traitement toutes les N secondes au lieu de s'arrêter"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            bilan = traiter_notifications(taille_lot=options['taille_lot'])
+            supprimees = 0
+            if options['conserver_jours']:
+                supprimees = purger_notifications(
+                    timezone.now() - datetime.timedelta(days=options['conserver_jours']),
+                    taille_lot=options['taille_lot'],
+                )
+            if bilan or supprimees or options['verbosity'] > 1:
+                details = ', '.join(f"{nombre} {statut.label.lower()}(s)" for statut, nombre in bilan.items()) or 'aucune'
+                self.stdout.write(self.style.SUCCESS(
+                    f"Notifications : {details} ; {supprimees} ancienne(s) notification(s) supprimée(s)."
+                ))
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
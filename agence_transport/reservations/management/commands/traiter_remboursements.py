@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reservations.remboursements import TAILLE_LOT_REMBOURSEMENTS, traiter_remboursements
+
+
+class Command(BaseCommand):
+    help = "Traite par lots les demandes de remboursement en attente dont le paiement a été encaissé"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=TAILLE_LOT_REMBOURSEMENTS,
+            help="Nombre de remboursements traités par transaction"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=0,
+            help="Si renseigné, relance le traitement toutes les N secondes au lieu de s'arrêter"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            bilan = traiter_remboursements(taille_lot=options['taille_lot'])
+            if bilan['traites'] or options['verbosity'] > 1:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{bilan['traites']} remboursement(s) traité(s) pour un total de {bilan['montant']} BIF."
+                ))
+            if not options['intervalle']:
+                break
+            time.sleep(options['intervalle'])
@@ -0,0 +1,326 @@
+"""
+Métriques de fonctionnement, exposées au format texte de Prometheus sur
+/metrics.
+
+Le middleware MetriquesMiddleware mesure chaque requête : durée par route
+(histogramme), nombre de requêtes SQL et temps passé en base. Le rendu des
+gabarits est chronométré par gabarit, et les lectures du cache sont
+comptées, réussies (hit) ou manquées (miss), pour en suivre le taux de
+réussite.
+
+Les valeurs sont tenues par thread : chaque thread n'écrit que dans son
+propre fragment, sans verrou, et l'export additionne les fragments. Avec
+plusieurs processus (workers gunicorn), chaque processus publie ses valeurs
+toutes les INTERVALLE_PUBLICATION secondes dans un fichier de REPERTOIRE et
+l'export additionne les fichiers de tous les processus ; ce répertoire est à
+vider au démarrage du service.
+
+    METRIQUES = {
+        'ACTIVE': True,
+        'REPERTOIRE': None,            # à défaut, variable d'environnement METRIQUES_REPERTOIRE
+        'INTERVALLE_PUBLICATION': 5,   # secondes
+        'SEUILS_DUREE': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+        'ADRESSES_AUTORISEES': ['127.0.0.1', '::1'],
+        'JETON': None,                 # accepté dans l'en-tête « Authorization: Bearer ... »
+    }
+
+/metrics est accessible depuis ADRESSES_AUTORISEES, avec le JETON, ou à un
+membre de l'équipe connecté.
+"""
+import bisect
+import hmac
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+PARAMETRES_PAR_DEFAUT = {
+    'ACTIVE': True,
+    'REPERTOIRE': os.environ.get('METRIQUES_REPERTOIRE'),
+    'INTERVALLE_PUBLICATION': 5,
+    'SEUILS_DUREE': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    'ADRESSES_AUTORISEES': ['127.0.0.1', '::1'],
+    'JETON': None,
+}
+
+# Métriques exportées : nom -> (type Prometheus, description)
+DESCRIPTIONS = {
+    'agence_requetes_total': ('counter', "Requêtes HTTP traitées, par route, méthode et code de statut"),
+    'agence_requete_duree_secondes': ('histogram', "Durée de traitement des requêtes HTTP, par route"),
+    'agence_sql_requetes_total': ('counter', "Requêtes SQL exécutées pendant les requêtes HTTP, par route"),
+    'agence_sql_duree_secondes_total': ('counter', "Temps passé dans les requêtes SQL, par route"),
+    'agence_gabarit_duree_secondes': ('histogram', "Durée de rendu des gabarits, par gabarit"),
+    'agence_cache_lectures_total': ('counter', "Lectures du cache, par résultat (hit ou miss)"),
+}
+
+_local = threading.local()
+_fragments = []
+# Uniquement pour inscrire le fragment d'un nouveau thread
+_verrou_inscription = threading.Lock()
+_seuils = None
+_prochaine_publication = 0.0
+_ABSENT = object()
+
+SUCCES = (('resultat', 'hit'),)
+ECHEC = (('resultat', 'miss'),)
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'METRIQUES', {})}
+
+
+def seuils():
+    global _seuils
+    if _seuils is None:
+        _seuils = tuple(float(seuil) for seuil in parametres()['SEUILS_DUREE'])
+    return _seuils
+
+
+class _Fragment:
+    """Valeurs écrites par un seul thread"""
+    __slots__ = ('compteurs', 'histogrammes')
+
+    def __init__(self):
+        self.compteurs = defaultdict(float)
+        # (nom, étiquettes) -> [nombre par seuil..., au-delà du dernier seuil, somme]
+        self.histogrammes = {}
+
+
+def _fragment():
+    try:
+        return _local.fragment
+    except AttributeError:
+        fragment = _local.fragment = _Fragment()
+        with _verrou_inscription:
+            _fragments.append(fragment)
+        return fragment
+
+
+def incrementer(nom, etiquettes, valeur=1):
+    """Ajoute `valeur` au compteur `nom` ; `etiquettes` est un tuple de paires (nom, valeur)"""
+    _fragment().compteurs[(nom, etiquettes)] += valeur
+
+
+def observer(nom, etiquettes, valeur):
+    """Ajoute une observation à l'histogramme `nom`"""
+    histogrammes = _fragment().histogrammes
+    cle = (nom, etiquettes)
+    valeurs = histogrammes.get(cle)
+    if valeurs is None:
+        valeurs = histogrammes[cle] = [0] * (len(seuils()) + 1) + [0.0]
+    valeurs[bisect.bisect_left(seuils(), valeur)] += 1
+    valeurs[-1] += valeur
+
+
+class MesureRequete:
+    """Compte les requêtes SQL d'une requête HTTP (voir connection.execute_wrapper)"""
+    __slots__ = ('requetes', 'duree')
+
+    def __init__(self):
+        self.requetes = 0
+        self.duree = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.requetes += 1
+            self.duree += time.perf_counter() - debut
+
+
+def enregistrer_requete(route, methode, statut, duree, mesure):
+    route = (('route', route),)
+    incrementer('agence_requetes_total', (('methode', methode), *route, ('statut', str(statut))))
+    observer('agence_requete_duree_secondes', route, duree)
+    if mesure.requetes:
+        incrementer('agence_sql_requetes_total', route, mesure.requetes)
+        incrementer('agence_sql_duree_secondes_total', route, mesure.duree)
+
+
+def _additionner(compteurs, histogrammes, autres_compteurs, autres_histogrammes):
+    for cle, valeur in autres_compteurs:
+        compteurs[cle] += valeur
+    for cle, valeurs in autres_histogrammes:
+        cumul = histogrammes.get(cle)
+        histogrammes[cle] = list(valeurs) if cumul is None else [a + b for a, b in zip(cumul, valeurs)]
+
+
+def releve_local():
+    """Valeurs du processus courant : somme des fragments de ses threads"""
+    compteurs, histogrammes = defaultdict(float), {}
+    for fragment in list(_fragments):
+        # Copies atomiques : le thread propriétaire peut écrire pendant la lecture
+        _additionner(
+            compteurs, histogrammes,
+            fragment.compteurs.copy().items(),
+            ((cle, list(valeurs)) for cle, valeurs in fragment.histogrammes.copy().items()),
+        )
+    return compteurs, histogrammes
+
+
+def _fichier(repertoire):
+    return os.path.join(repertoire, f'metriques-{os.getpid()}.json')
+
+
+def publier():
+    """Écrit les valeurs du processus dans REPERTOIRE (remplacement atomique du fichier)"""
+    repertoire = parametres()['REPERTOIRE']
+    if not repertoire:
+        return
+    compteurs, histogrammes = releve_local()
+    os.makedirs(repertoire, exist_ok=True)
+    fichier = _fichier(repertoire)
+    temporaire = f'{fichier}.{threading.get_ident()}.tmp'
+    with open(temporaire, 'w') as sortie:
+        json.dump({
+            'compteurs': [[nom, etiquettes, valeur] for (nom, etiquettes), valeur in compteurs.items()],
+            'histogrammes': [[nom, etiquettes, valeurs] for (nom, etiquettes), valeurs in histogrammes.items()],
+        }, sortie)
+    os.replace(temporaire, fichier)
+
+
+def publier_periodiquement():
+    """Publie les valeurs du processus si la dernière publication est assez ancienne"""
+    global _prochaine_publication
+    maintenant = time.monotonic()
+    if maintenant >= _prochaine_publication:
+        _prochaine_publication = maintenant + parametres()['INTERVALLE_PUBLICATION']
+        publier()
+
+
+def releve():
+    """Valeurs de tous les processus (ou du seul processus courant sans REPERTOIRE)"""
+    repertoire = parametres()['REPERTOIRE']
+    if not repertoire:
+        return releve_local()
+    publier()
+    compteurs, histogrammes = defaultdict(float), {}
+    for nom_fichier in os.listdir(repertoire):
+        if not (nom_fichier.startswith('metriques-') and nom_fichier.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(repertoire, nom_fichier)) as entree:
+                contenu = json.load(entree)
+        except (OSError, ValueError):
+            continue
+        _additionner(
+            compteurs, histogrammes,
+            (((nom, tuple(map(tuple, etiquettes))), valeur) for nom, etiquettes, valeur in contenu['compteurs']),
+            (((nom, tuple(map(tuple, etiquettes))), valeurs) for nom, etiquettes, valeurs in contenu['histogrammes']),
+        )
+    return compteurs, histogrammes
+
+
+def _nombre(valeur):
+    return str(int(valeur)) if float(valeur).is_integer() else repr(float(valeur))
+
+
+def _etiquettes(etiquettes):
+    if not etiquettes:
+        return ''
+    echapper = lambda texte: str(texte).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{nom}="{echapper(valeur)}"' for nom, valeur in etiquettes) + '}'
+
+
+def exporter():
+    """Toutes les métriques au format texte de Prometheus"""
+    compteurs, histogrammes = releve()
+    series = defaultdict(list)
+    for (nom, etiquettes), valeur in compteurs.items():
+        series[nom].append((etiquettes, valeur))
+    for (nom, etiquettes), valeurs in histogrammes.items():
+        series[nom].append((etiquettes, valeurs))
+
+    limites = [_nombre(seuil) for seuil in seuils()] + ['+Inf']
+    lignes = []
+    for nom, (type_metrique, description) in DESCRIPTIONS.items():
+        lignes.append(f'# HELP {nom} {description}')
+        lignes.append(f'# TYPE {nom} {type_metrique}')
+        for etiquettes, valeur in sorted(series[nom]):
+            if type_metrique != 'histogram':
+                lignes.append(f'{nom}{_etiquettes(etiquettes)} {_nombre(valeur)}')
+                continue
+            cumul = 0
+            for limite, nombre in zip(limites, valeur[:-1]):
+                cumul += nombre
+                lignes.append(f'{nom}_bucket{_etiquettes(etiquettes + (("le", limite),))} {cumul}')
+            lignes.append(f'{nom}_sum{_etiquettes(etiquettes)} {_nombre(valeur[-1])}')
+            lignes.append(f'{nom}_count{_etiquettes(etiquettes)} {cumul}')
+    return '\n'.join(lignes) + '\n'
+
+
+def acces_autorise(request):
+    reglages = parametres()
+    if request.META.get('REMOTE_ADDR') in reglages['ADRESSES_AUTORISEES']:
+        return True
+    if reglages['JETON']:
+        entete = request.headers.get('Authorization', '')
+        if hmac.compare_digest(entete.encode(), f"Bearer {reglages['JETON']}".encode()):
+            return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def _instrumenter_cache(classe):
+    """Compte les lectures (get, get_many) des caches de la classe `classe`"""
+    from django.core.cache.backends.base import BaseCache
+
+    if getattr(classe, '_lectures_comptees', False):
+        return
+    get = classe.get
+
+    def get_compte(self, key, default=None, version=None):
+        valeur = get(self, key, _ABSENT, version=version)
+        if valeur is _ABSENT:
+            incrementer('agence_cache_lectures_total', ECHEC)
+            return default
+        incrementer('agence_cache_lectures_total', SUCCES)
+        return valeur
+
+    classe.get = get_compte
+    # BaseCache.get_many lit les clés une à une avec get, déjà compté
+    if classe.get_many is not BaseCache.get_many:
+        get_many = classe.get_many
+
+        def get_many_compte(self, keys, version=None):
+            keys = list(keys)
+            valeurs = get_many(self, keys, version=version)
+            incrementer('agence_cache_lectures_total', SUCCES, len(valeurs))
+            incrementer('agence_cache_lectures_total', ECHEC, len(keys) - len(valeurs))
+            return valeurs
+
+        classe.get_many = get_many_compte
+    classe._lectures_comptees = True
+
+
+def _instrumenter_gabarits():
+    """Chronomètre le rendu des gabarits du moteur de Django"""
+    from django.template.backends.django import Template
+
+    if getattr(Template, '_rendu_chronometre', False):
+        return
+    render = Template.render
+
+    def render_chronometre(self, context=None, request=None):
+        debut = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            gabarit = self.origin.template_name or 'inline'
+            observer('agence_gabarit_duree_secondes', (('gabarit', str(gabarit)),), time.perf_counter() - debut)
+
+    Template.render = render_chronometre
+    Template._rendu_chronometre = True
+
+
+def instrumenter():
+    """Installe la mesure des gabarits et du cache (appelé au chargement de l'application)"""
+    if not parametres()['ACTIVE']:
+        return
+    _instrumenter_gabarits()
+    for configuration in settings.CACHES.values():
+        _instrumenter_cache(import_string(configuration['BACKEND']))
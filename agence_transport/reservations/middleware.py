@@ -0,0 +1,105 @@
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metriques, profilage
+from .journalisation import IDENTIFIANT_VALIDE, identifiant_requete
+
+
+class IdentifiantRequeteMiddleware:
+    """
+    Attribue à chaque requête un identifiant, repris par les journaux et les
+    emails (voir journalisation.py) et renvoyé dans l'en-tête X-Request-ID.
+    L'identifiant reçu d'un proxy dans ce même en-tête est conservé s'il est
+    valide. À placer en tête de MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identifiant = request.headers.get('X-Request-ID', '')
+        if not IDENTIFIANT_VALIDE.fullmatch(identifiant):
+            identifiant = uuid.uuid4().hex
+        request.request_id = identifiant
+        jeton = identifiant_requete.set(identifiant)
+        try:
+            response = self.get_response(request)
+        finally:
+            identifiant_requete.reset(jeton)
+        response['X-Request-ID'] = identifiant
+        return response
+
+
+class MetriquesMiddleware:
+    """
+    Mesure la durée de chaque requête et ses requêtes SQL (voir
+    metriques.py). À placer en tête de MIDDLEWARE pour inclure le temps
+    passé dans les autres middlewares.
+    """
+
+    def __init__(self, get_response):
+        if not metriques.parametres()['ACTIVE']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.alias = list(connections)
+
+    def __call__(self, request):
+        mesure = metriques.MesureRequete()
+        debut = time.perf_counter()
+        if len(self.alias) == 1:
+            with connections[self.alias[0]].execute_wrapper(mesure):
+                response = self.get_response(request)
+        else:
+            with ExitStack() as pile:
+                for alias in self.alias:
+                    pile.enter_context(connections[alias].execute_wrapper(mesure))
+                response = self.get_response(request)
+        duree = time.perf_counter() - debut
+
+        correspondance = request.resolver_match
+        route = correspondance.view_name if correspondance else 'non_resolue'
+        metriques.enregistrer_requete(route, request.method, response.status_code, duree, mesure)
+        metriques.publier_periodiquement()
+        return response
+
+
+class ProfilageMiddleware:
+    """
+    Journalise les requêtes lentes avec leurs requêtes SQL et profile les
+    requêtes échantillonnées ou qui le demandent (voir profilage.py). À
+    placer après AuthenticationMiddleware, qui identifie l'équipe.
+    """
+
+    def __init__(self, get_response):
+        if not profilage.parametres()['ACTIVE']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.alias = list(connections)
+
+    def __call__(self, request):
+        reglages = profilage.parametres()
+        releve = profilage.ReleveSQL(reglages['MAX_REQUETES_SQL'], reglages['SEUIL_SQL_LENT'])
+        origine = profilage.origine_profil(request, reglages)
+        profileur = profilage.demarrer_profileur() if origine else None
+        debut = time.perf_counter()
+        try:
+            with ExitStack() as pile:
+                for alias in self.alias:
+                    pile.enter_context(connections[alias].execute_wrapper(releve))
+                response = self.get_response(request)
+        finally:
+            profil = profilage.arreter_profileur(profileur) if profileur else None
+        duree = time.perf_counter() - debut
+
+        correspondance = request.resolver_match
+        route = correspondance.view_name if correspondance else 'non_resolue'
+        if duree >= reglages['SEUIL_REQUETE_LENTE']:
+            profilage.journaliser_requete_lente(request, route, response.status_code, duree, releve)
+        if profil is not None:
+            numero = profilage.enregistrer_profil(request, route, response.status_code, duree, releve, origine, profil)
+            response['X-Profil'] = str(numero)
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0004_alter_horaire_options_client_places_reservees_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='statut',
+            field=models.CharField(choices=[('ATTE', 'En attente de paiement'), ('CONF', 'Confirmée'), ('ANNU', 'Annulée'), ('UTIL', 'Utilisée'), ('REMB', 'Remboursée')], default='CONF', max_length=4),
+        ),
+        migrations.CreateModel(
+            name='BlocagePlaces',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_billet', models.CharField(choices=[('STD', 'Standard'), ('PRE', 'Première Classe'), ('BUS', 'Business')], max_length=3)),
+                ('nombre_places', models.PositiveIntegerField()),
+                ('expire_le', models.DateTimeField(db_index=True)),
+                ('horaire', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocages', to='reservations.horaire')),
+                ('reservation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='blocage', to='reservations.reservation')),
+            ],
+            options={
+                'verbose_name': 'Blocage de places',
+                'verbose_name_plural': 'Blocages de places',
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:25
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def initialiser_capacites(apps, schema_editor):
+    """
+    Marque les billets des réservations annulées ou remboursées et calcule la
+    capacité de chaque horaire : places restantes + billets actifs.
+    """
+    Billet = apps.get_model('reservations', 'Billet')
+    Horaire = apps.get_model('reservations', 'Horaire')
+
+    Billet.objects.filter(reservation__statut__in=['ANNU', 'REMB']).update(annule=True)
+
+    vendus = {}
+    for horaire_id, type_billet, nombre in Billet.objects.filter(annule=False).values_list(
+        'reservation__horaire_id', 'type_billet'
+    ).annotate(nombre=Count('id')).order_by():
+        vendus[(horaire_id, type_billet)] = nombre
+
+    horaires = list(Horaire.objects.all())
+    for horaire in horaires:
+        horaire.capacite_standard = horaire.places_standard + vendus.get((horaire.pk, 'STD'), 0)
+        horaire.capacite_business = horaire.places_business + vendus.get((horaire.pk, 'BUS'), 0)
+        horaire.capacite_premiere = horaire.places_premiere + vendus.get((horaire.pk, 'PRE'), 0)
+    Horaire.objects.bulk_update(
+        horaires, ['capacite_standard', 'capacite_business', 'capacite_premiere'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0005_blocageplaces'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billet',
+            name='annule',
+            field=models.BooleanField(default=False, help_text="Billet annulé, sa place a été rendue à l'horaire"),
+        ),
+        migrations.AddField(
+            model_name='horaire',
+            name='capacite_business',
+            field=models.PositiveIntegerField(default=0, verbose_name='Capacité Business'),
+        ),
+        migrations.AddField(
+            model_name='horaire',
+            name='capacite_premiere',
+            field=models.PositiveIntegerField(default=0, verbose_name='Capacité Première Classe'),
+        ),
+        migrations.AddField(
+            model_name='horaire',
+            name='capacite_standard',
+            field=models.PositiveIntegerField(default=0, verbose_name='Capacité Standard'),
+        ),
+        migrations.RunPython(initialiser_capacites, migrations.RunPython.noop),
+    ]
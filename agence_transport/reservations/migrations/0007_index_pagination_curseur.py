@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_horaire_capacite_billet_annule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='horaire',
+            index=models.Index(fields=['date_depart', 'id'], name='horaire_depart_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='horaire',
+            index=models.Index(fields=['trajet', 'date_depart', 'id'], name='horaire_trajet_depart_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['date_reservation', 'id'], name='reservation_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['client', 'date_reservation', 'id'], name='reservation_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['statut', 'date_reservation', 'id'], name='reservation_statut_date_idx'),
+        ),
+    ]
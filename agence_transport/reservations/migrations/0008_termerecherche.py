@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:29
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copie figée du découpage de reservations.recherche à la création de la
+# table : la migration ne doit pas dépendre du code actuel de l'application.
+def termes_client(telephone, prenom, nom, username, email):
+    termes = set()
+    for valeur in (prenom, nom, username, (email or '').split('@')[0]):
+        texte = unicodedata.normalize('NFKD', str(valeur or ''))
+        texte = ''.join(c for c in texte if not unicodedata.combining(c)).lower()
+        termes.update(mot for mot in re.split(r'[^0-9a-z]+', texte) if mot)
+    numero = re.sub(r'\D', '', telephone or '')
+    if numero:
+        termes.add(numero)
+        termes.add(numero[-8:])
+    return {terme[:40] for terme in termes}
+
+
+def indexer_clients_existants(apps, schema_editor):
+    Client = apps.get_model('reservations', 'Client')
+    TermeRecherche = apps.get_model('reservations', 'TermeRecherche')
+    termes = []
+    for pk, *valeurs in Client.objects.values_list(
+        'pk', 'telephone', 'user__first_name', 'user__last_name', 'user__username', 'user__email'
+    ).iterator():
+        termes.extend(TermeRecherche(client_id=pk, terme=terme) for terme in termes_client(*valeurs))
+    TermeRecherche.objects.bulk_create(termes, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_index_pagination_curseur'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermeRecherche',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terme', models.CharField(db_index=True, max_length=40)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='termes_recherche', to='reservations.client')),
+            ],
+            options={
+                'verbose_name': 'Terme de recherche',
+                'verbose_name_plural': 'Termes de recherche',
+                'unique_together': {('terme', 'client')},
+            },
+        ),
+        migrations.RunPython(indexer_clients_existants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:34
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0008_termerecherche'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GrilleHoraire',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jours_semaine', models.CharField(help_text='Jours de circulation : 0 = lundi ... 6 = dimanche (ex. 01234 pour la semaine)', max_length=7, validators=[django.core.validators.RegexValidator('^[0-6]{1,7}$', 'Chiffres de 0 (lundi) à 6 (dimanche).')], verbose_name='Jours de la semaine')),
+                ('heure_depart', models.TimeField(verbose_name='Heure de départ')),
+                ('date_debut', models.DateField(verbose_name='Début de validité')),
+                ('date_fin', models.DateField(verbose_name='Fin de validité')),
+                ('prix_standard', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix Standard (BIF)')),
+                ('prix_business', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix Business (BIF)')),
+                ('prix_premiere', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix Première Classe (BIF)')),
+                ('places_standard', models.PositiveIntegerField(verbose_name='Places Standard')),
+                ('places_business', models.PositiveIntegerField(verbose_name='Places Business')),
+                ('places_premiere', models.PositiveIntegerField(verbose_name='Places Première Classe')),
+                ('actif', models.BooleanField(default=True)),
+                ('trajet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grilles', to='reservations.trajet')),
+            ],
+            options={
+                'verbose_name': 'Grille horaire',
+                'verbose_name_plural': 'Grilles horaires',
+                'ordering': ['trajet', 'heure_depart'],
+            },
+        ),
+    ]
@@ -0,0 +1,159 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:41
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+COLONNES = {
+    'STD': ('prix_standard', 'places_standard', 'capacite_standard'),
+    'BUS': ('prix_business', 'places_business', 'capacite_business'),
+    'PRE': ('prix_premiere', 'places_premiere', 'capacite_premiere'),
+}
+
+
+def copier_classes(apps, schema_editor):
+    """
+    Crée une ligne HoraireClasse par horaire et par classe à partir des
+    colonnes de l'horaire : places vendues = capacité - places restantes.
+    """
+    Horaire = apps.get_model('reservations', 'Horaire')
+    HoraireClasse = apps.get_model('reservations', 'HoraireClasse')
+
+    champs = [champ for colonnes in COLONNES.values() for champ in colonnes]
+    lot = []
+    for pk, *valeurs in Horaire.objects.values_list('pk', *champs).iterator(chunk_size=1000):
+        valeurs = dict(zip(champs, valeurs))
+        for classe, (prix, places, capacite) in COLONNES.items():
+            lot.append(HoraireClasse(
+                horaire_id=pk,
+                classe=classe,
+                prix=valeurs[prix],
+                capacite=valeurs[capacite],
+                vendus=max(valeurs[capacite] - valeurs[places], 0),
+            ))
+        if len(lot) >= 1500:
+            HoraireClasse.objects.bulk_create(lot)
+            lot = []
+    HoraireClasse.objects.bulk_create(lot)
+
+
+def restaurer_colonnes(apps, schema_editor):
+    """
+    Retour arrière : recopie les classes dans les colonnes de l'horaire
+    (recréées par l'annulation des RemoveField) ; places restantes =
+    capacité - places vendues.
+    """
+    Horaire = apps.get_model('reservations', 'Horaire')
+    HoraireClasse = apps.get_model('reservations', 'HoraireClasse')
+
+    champs = [champ for colonnes in COLONNES.values() for champ in colonnes]
+    horaires = {}
+    for horaire_id, classe, prix, capacite, vendus in HoraireClasse.objects.filter(
+        classe__in=list(COLONNES)
+    ).values_list('horaire_id', 'classe', 'prix', 'capacite', 'vendus').iterator(chunk_size=1000):
+        horaire = horaires.setdefault(horaire_id, Horaire(pk=horaire_id))
+        colonne_prix, colonne_places, colonne_capacite = COLONNES[classe]
+        setattr(horaire, colonne_prix, prix)
+        setattr(horaire, colonne_capacite, capacite)
+        setattr(horaire, colonne_places, max(capacite - vendus, 0))
+    # Une classe absente garde la valeur par défaut des colonnes recréées
+    Horaire.objects.bulk_update(list(horaires.values()), champs, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0009_grillehoraire'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HoraireClasse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('classe', models.CharField(choices=[('STD', 'Standard'), ('PRE', 'Première Classe'), ('BUS', 'Business')], max_length=3)),
+                ('prix', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix (BIF)')),
+                ('capacite', models.PositiveIntegerField(verbose_name='Capacité')),
+                ('vendus', models.PositiveIntegerField(default=0, verbose_name='Places vendues')),
+                ('horaire', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='classes', to='reservations.horaire')),
+            ],
+            options={
+                'verbose_name': "Classe d'un horaire",
+                'verbose_name_plural': 'Classes des horaires',
+                'unique_together': {('horaire', 'classe')},
+            },
+        ),
+        migrations.RunPython(copier_classes, restaurer_colonnes),
+        # Valeur par défaut (état seulement) pour que le retour arrière puisse
+        # recréer les colonnes de prix et de places avant que restaurer_colonnes les remplisse
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='horaire',
+                    name='prix_standard',
+                    field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix Standard (BIF)'),
+                ),
+                migrations.AlterField(
+                    model_name='horaire',
+                    name='prix_business',
+                    field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix Business (BIF)'),
+                ),
+                migrations.AlterField(
+                    model_name='horaire',
+                    name='prix_premiere',
+                    field=models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Prix Première Classe (BIF)'),
+                ),
+                migrations.AlterField(
+                    model_name='horaire',
+                    name='places_standard',
+                    field=models.PositiveIntegerField(default=0, verbose_name='Places Standard'),
+                ),
+                migrations.AlterField(
+                    model_name='horaire',
+                    name='places_business',
+                    field=models.PositiveIntegerField(default=0, verbose_name='Places Business'),
+                ),
+                migrations.AlterField(
+                    model_name='horaire',
+                    name='places_premiere',
+                    field=models.PositiveIntegerField(default=0, verbose_name='Places Première Classe'),
+                ),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='capacite_business',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='capacite_premiere',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='capacite_standard',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='places_business',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='places_premiere',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='places_standard',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='prix_business',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='prix_premiere',
+        ),
+        migrations.RemoveField(
+            model_name='horaire',
+            name='prix_standard',
+        ),
+    ]
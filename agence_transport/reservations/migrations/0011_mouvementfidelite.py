@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def reprendre_soldes(apps, schema_editor):
+    """
+    Ouvre le journal de chaque client avec un mouvement de reprise égal à ses
+    compteurs actuels, pour que le journal et les compteurs concordent.
+    """
+    Client = apps.get_model('reservations', 'Client')
+    MouvementFidelite = apps.get_model('reservations', 'MouvementFidelite')
+
+    soldes = Client.objects.exclude(places_reservees=0, points_fidelite=0).values_list(
+        'pk', 'places_reservees', 'points_fidelite'
+    )
+    MouvementFidelite.objects.bulk_create([
+        MouvementFidelite(client_id=pk, type='REP', places=places, points=points)
+        for pk, places, points in soldes.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0010_horaireclasse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MouvementFidelite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('ACC', 'Accumulation'), ('ANN', 'Annulation'), ('BON', 'Ticket bonus émis'), ('UTI', 'Ticket bonus utilisé'), ('REP', 'Reprise du solde')], max_length=3)),
+                ('places', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+                ('seuil', models.PositiveIntegerField(blank=True, null=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mouvements_fidelite', to='reservations.client')),
+                ('reservation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mouvements_fidelite', to='reservations.reservation')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mouvements_fidelite', to='reservations.ticketbonus')),
+            ],
+            options={
+                'verbose_name': 'Mouvement de fidélité',
+                'verbose_name_plural': 'Mouvements de fidélité',
+                'ordering': ['-date', '-id'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('type', 'BON')), fields=('client', 'seuil'), name='fidelite_bonus_par_seuil'), models.UniqueConstraint(condition=models.Q(('type__in', ['ACC', 'ANN'])), fields=('reservation', 'type'), name='fidelite_mouvement_par_reservation')],
+            },
+        ),
+        migrations.RunPython(reprendre_soldes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:47
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils import timezone
+
+
+def initialiser_compteurs(apps, schema_editor):
+    """
+    Marque expirés les tickets déjà échus et initialise le nombre de tickets
+    valides de chaque client.
+    """
+    Client = apps.get_model('reservations', 'Client')
+    TicketBonus = apps.get_model('reservations', 'TicketBonus')
+
+    TicketBonus.objects.filter(utilise=False, date_expiration__lte=timezone.now()).update(expire=True)
+    par_nombre = defaultdict(list)
+    for client_id, nombre in TicketBonus.objects.filter(utilise=False, expire=False).values_list(
+        'client_id'
+    ).annotate(nombre=Count('id')).order_by():
+        par_nombre[nombre].append(client_id)
+    for nombre, client_ids in par_nombre.items():
+        Client.objects.filter(pk__in=client_ids).update(tickets_bonus_valides=nombre)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0011_mouvementfidelite'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='tickets_bonus_valides',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ticketbonus',
+            name='expire',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='ticketbonus',
+            name='rappel_envoye_le',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ticketbonus',
+            index=models.Index(fields=['utilise', 'expire', 'date_expiration'], name='ticketbonus_balayage_idx'),
+        ),
+        migrations.RunPython(initialiser_compteurs, migrations.RunPython.noop),
+    ]
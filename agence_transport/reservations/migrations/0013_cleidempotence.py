@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0012_ticketbonus_balayage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleIdempotence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=100)),
+                ('portee', models.CharField(max_length=200)),
+                ('empreinte_requete', models.CharField(max_length=64)),
+                ('statut', models.CharField(choices=[('ENC', 'En cours'), ('TER', 'Terminée')], default='ENC', max_length=3)),
+                ('code_reponse', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('entetes_reponse', models.JSONField(blank=True, default=dict)),
+                ('corps_reponse', models.BinaryField(blank=True, default=b'')),
+                ('empreinte_reponse', models.CharField(blank=True, max_length=64)),
+                ('verrouille_le', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expire_le', models.DateTimeField(db_index=True)),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cles_idempotence', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Clé d'idempotence",
+                'verbose_name_plural': "Clés d'idempotence",
+                'constraints': [models.UniqueConstraint(fields=('utilisateur', 'cle'), name='idempotence_cle_par_utilisateur')],
+            },
+        ),
+    ]
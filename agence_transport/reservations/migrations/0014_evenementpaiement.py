@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0013_cleidempotence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvenementPaiement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operateur', models.CharField(choices=[('lumicash', 'Lumicash'), ('ecocash', 'Ecocash'), ('ihela', 'Ihela'), ('paypal', 'PayPal'), ('carte', 'Carte bancaire')], max_length=20)),
+                ('identifiant', models.CharField(max_length=100)),
+                ('corps', models.TextField()),
+                ('recu_le', models.DateTimeField(default=django.utils.timezone.now)),
+                ('statut', models.CharField(choices=[('REC', 'Reçu'), ('TRA', 'Traité'), ('IGN', 'Ignoré'), ('ERR', 'En erreur')], default='REC', max_length=3)),
+                ('traite_le', models.DateTimeField(blank=True, null=True)),
+                ('erreur', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'verbose_name': 'Notification de paiement',
+                'verbose_name_plural': 'Notifications de paiement',
+                'indexes': [models.Index(condition=models.Q(('statut', 'REC')), fields=['id'], name='evenement_paiement_file_idx'), models.Index(fields=['traite_le'], name='evenement_paiement_purge_idx')],
+                'constraints': [models.UniqueConstraint(fields=('operateur', 'identifiant'), name='evenement_paiement_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0014_evenementpaiement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Modification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_objet', models.CharField(choices=[('villes', 'Ville'), ('gares', 'Gare'), ('trajets', 'Trajet'), ('horaires', 'Horaire'), ('tickets_bonus', 'Ticket bonus')], max_length=13)),
+                ('objet_id', models.PositiveBigIntegerField()),
+                ('proprietaire', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('supprime', models.BooleanField(default=False)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Modification synchronisée',
+                'verbose_name_plural': 'Modifications synchronisées',
+                'indexes': [models.Index(fields=['date'], name='modification_purge_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0015_modification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blocageplaces',
+            name='ticket_bonus',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='blocages', to='reservations.ticketbonus'),
+        ),
+        migrations.AlterField(
+            model_name='mouvementfidelite',
+            name='type',
+            field=models.CharField(choices=[('ACC', 'Accumulation'), ('ANN', 'Annulation'), ('BON', 'Ticket bonus émis'), ('UTI', 'Ticket bonus utilisé'), ('RES', 'Ticket bonus restitué'), ('REP', 'Reprise du solde')], max_length=3),
+        ),
+    ]
@@ -1,9 +1,16 @@
-from django.db import models
+import datetime
+import logging
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.core.validators import MinValueValidator
+from django.core.validators import MinValueValidator, RegexValidator
 from django.utils.translation import gettext_lazy as _
 
+logger = logging.getLogger(__name__)
+
 class Ville(models.Model):
     nom = models.CharField(max_length=100, unique=True)
     code = models.CharField(max_length=10, unique=True)
@@ -35,114 +42,315 @@ class Trajet(models.Model):
     def __str__(self):
         return f"{self.depart} → {self.arrivee} ({self.duree})"
 
+class TypeBillet(models.TextChoices):
+    STANDARD = 'STD', _('Standard')
+    PREMIERE = 'PRE', _('Première Classe')
+    BUSINESS = 'BUS', _('Business')
+
+
+class HoraireQuerySet(models.QuerySet):
+    """
+    Requêtes de recherche des départs.
+
+    Les méthodes se combinent (ex. ``Horaire.objects.bookable().between(a, b)
+    .on_date(d).with_min_price()``) et n'emploient que des conditions que les
+    index (trajet, date_depart, id) et (date_depart, id) peuvent servir.
+    """
+
+    def upcoming(self, maintenant=None):
+        """Départs pas encore partis"""
+        return self.filter(date_depart__gt=maintenant or timezone.now())
+
+    def bookable(self, classe=None, maintenant=None):
+        """
+        Départs à venir qui ont encore des places, dans la classe `classe`
+        ('STD', 'BUS', 'PRE') ou dans au moins une classe.
+        """
+        disponibles = HoraireClasse.objects.filter(horaire=models.OuterRef('pk'), vendus__lt=models.F('capacite'))
+        if classe:
+            disponibles = disponibles.filter(classe=classe)
+        return self.upcoming(maintenant).filter(models.Exists(disponibles))
+
+    def between(self, depart=None, arrivee=None, gares=False):
+        """
+        Départs entre deux villes (ou deux gares avec `gares=True`).
+
+        Les trajets sont sélectionnés par une sous-requête, ce qui laisse la
+        base parcourir l'index (trajet, date_depart) des horaires.
+        """
+        if not depart and not arrivee:
+            return self
+        niveau = '' if gares else '__ville'
+        trajets = Trajet.objects.all()
+        if depart:
+            trajets = trajets.filter(**{f'depart{niveau}_id': depart})
+        if arrivee:
+            trajets = trajets.filter(**{f'arrivee{niveau}_id': arrivee})
+        return self.filter(trajet_id__in=trajets.values('pk'))
+
+    def on_date(self, jour):
+        """Départs du jour `jour` (date locale), par intervalle sur date_depart"""
+        debut = timezone.make_aware(datetime.datetime.combine(jour, datetime.time.min))
+        fin = timezone.make_aware(datetime.datetime.combine(jour + datetime.timedelta(days=1), datetime.time.min))
+        return self.filter(date_depart__gte=debut, date_depart__lt=fin)
+
+    def with_classes(self):
+        """Précharge les classes (prix et places) de tous les horaires en une requête"""
+        return self.prefetch_related('classes')
+
+    def with_min_price(self):
+        """
+        Annote `prix_min` : prix le plus bas parmi les classes qui ont encore
+        des places (0 si le départ est complet), comme Horaire.get_prix_min().
+        """
+        prix = HoraireClasse.objects.filter(
+            horaire=models.OuterRef('pk'), vendus__lt=models.F('capacite')
+        ).order_by('prix').values('prix')[:1]
+        return self.annotate(prix_min=Coalesce(
+            models.Subquery(prix), models.Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        ))
+
+
+class _ValeurClasse:
+    """
+    Lecture d'une valeur de l'une des classes de l'horaire, par exemple
+    ``horaire.prix_standard`` ou ``horaire.places_business`` dans les templates.
+    """
+
+    def __init__(self, classe, attribut, defaut=0):
+        self.classe = classe
+        self.attribut = attribut
+        self.defaut = defaut
+
+    def __get__(self, horaire, owner=None):
+        if horaire is None:
+            return self
+        classe = horaire.classes_par_type.get(self.classe)
+        if classe and self.attribut == 'prix' and horaire.tarifs_courants is not None:
+            return horaire.tarifs_courants[self.classe]
+        return getattr(classe, self.attribut) if classe else self.defaut
+
+
 class Horaire(models.Model):
     trajet = models.ForeignKey(Trajet, on_delete=models.CASCADE, related_name='horaires')
     date_depart = models.DateTimeField()
     date_arrivee = models.DateTimeField()
-    
-    # Prix pour chaque type de billet
-    prix_standard = models.DecimalField(
-        max_digits=10, 
-        decimal_places=2, 
-        validators=[MinValueValidator(0)],
-        verbose_name="Prix Standard (BIF)"
-    )
-    prix_business = models.DecimalField(
-        max_digits=10, 
-        decimal_places=2, 
-        validators=[MinValueValidator(0)],
-        verbose_name="Prix Business (BIF)"
-    )
-    prix_premiere = models.DecimalField(
-        max_digits=10, 
-        decimal_places=2, 
-        validators=[MinValueValidator(0)],
-        verbose_name="Prix Première Classe (BIF)"
-    )
-    
-    # Places disponibles pour chaque type de billet
-    places_standard = models.PositiveIntegerField(verbose_name="Places Standard")
-    places_business = models.PositiveIntegerField(verbose_name="Places Business")
-    places_premiere = models.PositiveIntegerField(verbose_name="Places Première Classe")
+
+    objects = HoraireQuerySet.as_manager()
+
+    # Prix courants de la tarification dynamique, à afficher à la place des
+    # prix de base (renseignés par tarification.appliquer_tarifs)
+    tarifs_courants = None
+
+    # Prix et places de chaque classe, portés par HoraireClasse
+    prix_standard = _ValeurClasse(TypeBillet.STANDARD, 'prix')
+    prix_business = _ValeurClasse(TypeBillet.BUSINESS, 'prix')
+    prix_premiere = _ValeurClasse(TypeBillet.PREMIERE, 'prix')
+    places_standard = _ValeurClasse(TypeBillet.STANDARD, 'places')
+    places_business = _ValeurClasse(TypeBillet.BUSINESS, 'places')
+    places_premiere = _ValeurClasse(TypeBillet.PREMIERE, 'places')
     
     class Meta:
         ordering = ['date_depart']
         verbose_name = "Horaire"
         verbose_name_plural = "Horaires"
+        indexes = [
+            # Clés de la pagination par curseur
+            models.Index(fields=['date_depart', 'id'], name='horaire_depart_id_idx'),
+            models.Index(fields=['trajet', 'date_depart', 'id'], name='horaire_trajet_depart_idx'),
+        ]
         
     def __str__(self):
         return f"{self.trajet} - {self.date_depart.strftime('%d/%m/%Y %H:%M')}"
+
+    def refresh_from_db(self, *args, **kwargs):
+        self.__dict__.pop('_classes_par_type', None)
+        super().refresh_from_db(*args, **kwargs)
+
+    @property
+    def classes_par_type(self):
+        """Classes de l'horaire par type de billet (utilise le préchargement with_classes())"""
+        if '_classes_par_type' not in self.__dict__:
+            classes = self.classes.all() if self.pk else []
+            self._classes_par_type = {classe.classe: classe for classe in classes}
+        return self._classes_par_type
     
     @property
     def places_disponibles_total(self):
         """Retourne le nombre total de places disponibles"""
-        return self.places_standard + self.places_business + self.places_premiere
+        return sum(classe.places for classe in self.classes_par_type.values())
     
     def get_prix_par_type(self, type_billet):
         """Retourne le prix en fonction du type de billet"""
-        prix_par_type = {
-            'STD': self.prix_standard,
-            'BUS': self.prix_business,
-            'PRE': self.prix_premiere,
-        }
-        return prix_par_type.get(type_billet, self.prix_standard)
+        classe = self.classes_par_type.get(type_billet) or self.classes_par_type.get(TypeBillet.STANDARD)
+        if classe and self.tarifs_courants is not None:
+            return self.tarifs_courants[classe.classe]
+        return classe.prix if classe else Decimal('0')
     
     def get_places_disponibles(self, type_billet):
         """Retourne le nombre de places disponibles pour un type de billet"""
-        places_par_type = {
-            'STD': self.places_standard,
-            'BUS': self.places_business,
-            'PRE': self.places_premiere,
-        }
-        return places_par_type.get(type_billet, 0)
+        classe = self.classes_par_type.get(type_billet)
+        return classe.places if classe else 0
         
     def get_prix_min(self):
         """Retourne le prix minimum parmi les classes disponibles"""
-        prix_disponibles = []
-        
-        if self.places_standard > 0:
-            prix_disponibles.append(self.prix_standard)
-        if self.places_business > 0:
-            prix_disponibles.append(self.prix_business)
-        if self.places_premiere > 0:
-            prix_disponibles.append(self.prix_premiere)
-            
+        # Valeur calculée par la requête (HoraireQuerySet.with_min_price)
+        if hasattr(self, 'prix_min') and self.tarifs_courants is None:
+            return self.prix_min
+
+        prix_disponibles = [
+            self.get_prix_par_type(classe.classe) for classe in self.classes_par_type.values() if classe.places > 0
+        ]
         return min(prix_disponibles) if prix_disponibles else 0
 
+
+class HoraireClasse(models.Model):
+    """
+    Prix et inventaire d'une classe de billets pour un horaire.
+
+    Une ligne par classe : une vente ne met à jour que la ligne de sa classe,
+    et les classes s'ajoutent sans modifier le schéma.
+    """
+    horaire = models.ForeignKey(Horaire, on_delete=models.CASCADE, related_name='classes')
+    classe = models.CharField(max_length=3, choices=TypeBillet.choices)
+    prix = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        validators=[MinValueValidator(0)],
+        verbose_name="Prix (BIF)"
+    )
+    capacite = models.PositiveIntegerField(verbose_name="Capacité")
+    vendus = models.PositiveIntegerField(default=0, verbose_name="Places vendues")
+
+    class Meta:
+        unique_together = ('horaire', 'classe')
+        verbose_name = "Classe d'un horaire"
+        verbose_name_plural = "Classes des horaires"
+
+    def __str__(self):
+        return f"{self.horaire_id} - {self.get_classe_display()}"
+
+    @property
+    def places(self):
+        """Places restantes"""
+        return max(self.capacite - self.vendus, 0)
+
+class GrilleHoraire(models.Model):
+    """
+    Départ récurrent d'un trajet (jours de la semaine, heure, période de
+    validité) à partir duquel les horaires sont générés par lots.
+    """
+    trajet = models.ForeignKey(Trajet, on_delete=models.CASCADE, related_name='grilles')
+    jours_semaine = models.CharField(
+        max_length=7,
+        validators=[RegexValidator(r'^[0-6]{1,7}$', "Chiffres de 0 (lundi) à 6 (dimanche).")],
+        help_text="Jours de circulation : 0 = lundi ... 6 = dimanche (ex. 01234 pour la semaine)",
+        verbose_name="Jours de la semaine"
+    )
+    heure_depart = models.TimeField(verbose_name="Heure de départ")
+    date_debut = models.DateField(verbose_name="Début de validité")
+    date_fin = models.DateField(verbose_name="Fin de validité")
+
+    prix_standard = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name="Prix Standard (BIF)")
+    prix_business = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name="Prix Business (BIF)")
+    prix_premiere = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)], verbose_name="Prix Première Classe (BIF)")
+    places_standard = models.PositiveIntegerField(verbose_name="Places Standard")
+    places_business = models.PositiveIntegerField(verbose_name="Places Business")
+    places_premiere = models.PositiveIntegerField(verbose_name="Places Première Classe")
+
+    actif = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['trajet', 'heure_depart']
+        verbose_name = "Grille horaire"
+        verbose_name_plural = "Grilles horaires"
+
+    def __str__(self):
+        return f"{self.trajet} - {self.heure_depart.strftime('%H:%M')} ({self.jours_semaine})"
+
+    @property
+    def jours(self):
+        """Numéros des jours de circulation (0 = lundi)"""
+        return {int(jour) for jour in self.jours_semaine}
+
 class Client(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     telephone = models.CharField(max_length=20, blank=True, null=True)
     date_naissance = models.DateField(blank=True, null=True)
     points_fidelite = models.PositiveIntegerField(default=0)
+    # Soldes du programme de fidélité : agrégat du journal MouvementFidelite
     places_reservees = models.PositiveIntegerField(default=0, help_text="Nombre total de places réservées")
+    # Tickets bonus ni utilisés ni marqués expirés, tenu à jour par les opérations sur les tickets
+    tickets_bonus_valides = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         return f"{self.user.get_full_name() or self.user.username}"
         
-    def verifier_bonus_places(self, nombre_places=5):
-        """
-        Vérifie si le client a atteint le nombre de places nécessaires pour un bonus
-        Retourne le nombre de tickets bonus gagnés
-        """
-        tickets_gagnes = 0
-        # Vérifier si le client a atteint le seuil de 5 places
-        if self.places_reservees >= nombre_places:
-            tickets_gagnes = self.places_reservees // nombre_places
-            self.places_reservees = self.places_reservees % nombre_places
-            self.save()
-        return tickets_gagnes
-    
-    def ajouter_reservation(self, nombre_places):
+    @property
+    def places_vers_bonus(self):
+        """Places réservées depuis le dernier ticket bonus (progression vers le prochain)"""
+        from .fidelite import places_par_bonus
+        return self.places_reservees % places_par_bonus()
+
+class TermeRecherche(models.Model):
+    """
+    Terme normalisé (nom, identifiant, téléphone) d'un client.
+
+    Table d'index tenue à jour à l'enregistrement du client ou de son
+    utilisateur ; elle permet la recherche par préfixe au guichet sans
+    parcourir les tables jointes.
+    """
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='termes_recherche')
+    terme = models.CharField(max_length=40, db_index=True)
+
+    class Meta:
+        unique_together = ('terme', 'client')
+        verbose_name = "Terme de recherche"
+        verbose_name_plural = "Termes de recherche"
+
+    def __str__(self):
+        return f"{self.terme} - {self.client_id}"
+
+class ReservationQuerySet(models.QuerySet):
+    def with_display_status(self, maintenant=None):
         """
-        Ajoute le nombre de places réservées et vérifie si un bonus est gagné
-        Retourne le nombre de tickets bonus gagnés (0 ou 1)
+        Annote chaque réservation avec son statut affiché (`statut_affiche`)
+        et la classe CSS de son badge (`classe_badge`), calculés en SQL à
+        partir du statut et de la date de départ : mêmes règles que
+        get_display_status() et get_status_badge_class().
         """
-        self.places_reservees += nombre_places
-        self.save()
-        return self.verifier_bonus_places()
+        maintenant = maintenant or timezone.now()
+        Statut = Reservation.StatutReservation
+        a_venir = models.Q(horaire__date_depart__gt=maintenant)
+
+        statut_affiche = models.Case(
+            *[
+                models.When(statut=statut, then=models.Value(str(statut.label)))
+                for statut in (Statut.ANNULEE, Statut.REMBOURSEE, Statut.EN_ATTENTE)
+            ],
+            models.When(statut='FAIL', then=models.Value('Échoué')),
+            models.When(a_venir, then=models.Value('À venir')),
+            models.When(statut=Statut.UTILISEE, then=models.Value('Effectué')),
+            default=models.Value('Passé'),
+            output_field=models.CharField(),
+        )
+        classe_badge = models.Case(
+            models.When(statut=Statut.ANNULEE, then=models.Value('secondary')),
+            models.When(statut=Statut.REMBOURSEE, then=models.Value('info')),
+            models.When(statut=Statut.EN_ATTENTE, then=models.Value('warning')),
+            models.When(statut='FAIL', then=models.Value('danger')),
+            models.When(a_venir & models.Q(statut__in=[Statut.CONFIRMEE, Statut.UTILISEE]), then=models.Value('primary')),
+            models.When(a_venir, then=models.Value('secondary')),
+            models.When(statut=Statut.UTILISEE, then=models.Value('success')),
+            default=models.Value('warning'),
+            output_field=models.CharField(),
+        )
+        return self.annotate(statut_affiche=statut_affiche, classe_badge=classe_badge)
 
 class Reservation(models.Model):
     class StatutReservation(models.TextChoices):
+        EN_ATTENTE = 'ATTE', _('En attente de paiement')
         CONFIRMEE = 'CONF', _('Confirmée')
         ANNULEE = 'ANNU', _('Annulée')
         UTILISEE = 'UTIL', _('Utilisée')
@@ -158,9 +366,17 @@ class Reservation(models.Model):
     )
     montant_total = models.DecimalField(max_digits=10, decimal_places=2)
     reference = models.CharField(max_length=10, unique=True)
+
+    objects = ReservationQuerySet.as_manager()
     
     class Meta:
         ordering = ['-date_reservation']
+        indexes = [
+            # Clés de la pagination par curseur
+            models.Index(fields=['date_reservation', 'id'], name='reservation_date_id_idx'),
+            models.Index(fields=['client', 'date_reservation', 'id'], name='reservation_client_date_idx'),
+            models.Index(fields=['statut', 'date_reservation', 'id'], name='reservation_statut_date_idx'),
+        ]
         
     def __str__(self):
         return f"Réservation {self.reference} - {self.client}"
@@ -169,11 +385,16 @@ class Reservation(models.Model):
         """
         Retourne le statut à afficher en fonction de la date de départ et du statut actuel
         """
+        # Valeur calculée par la requête (ReservationQuerySet.with_display_status)
+        if hasattr(self, 'statut_affiche'):
+            return self.statut_affiche
+
         now = timezone.now()
         
-        # Si la réservation est annulée, remboursée ou échouée, on affiche ce statut
+        # Si la réservation est annulée, remboursée, en attente ou échouée, on affiche ce statut
         if self.statut in [self.StatutReservation.ANNULEE, 
-                          self.StatutReservation.REMBOURSEE]:
+                          self.StatutReservation.REMBOURSEE,
+                          self.StatutReservation.EN_ATTENTE]:
             return self.get_statut_display()
         elif self.statut == 'FAIL':
             return 'Échoué'
@@ -193,6 +414,9 @@ class Reservation(models.Model):
         """
         Retourne la classe CSS à utiliser pour le badge de statut
         """
+        if hasattr(self, 'classe_badge'):
+            return self.classe_badge
+
         now = timezone.now()
         
         # Si la réservation est annulée, remboursée ou échouée
@@ -200,6 +424,8 @@ class Reservation(models.Model):
             return 'secondary'  # Gris pour les réservations annulées
         elif self.statut == self.StatutReservation.REMBOURSEE:
             return 'info'  # Bleu clair pour les remboursements
+        elif self.statut == self.StatutReservation.EN_ATTENTE:
+            return 'warning'  # Orange pour les réservations en attente de paiement
         elif self.statut == 'FAIL':  # Si jamais ce statut est utilisé
             return 'danger'  # Rouge pour les échecs
             
@@ -221,10 +447,7 @@ class Reservation(models.Model):
         return 'secondary'
 
 class Billet(models.Model):
-    class TypeBillet(models.TextChoices):
-        STANDARD = 'STD', _('Standard')
-        PREMIERE = 'PRE', _('Première Classe')
-        BUSINESS = 'BUS', _('Business')
+    TypeBillet = TypeBillet
     
     reservation = models.ForeignKey(Reservation, on_delete=models.CASCADE, related_name='billets')
     type_billet = models.CharField(
@@ -234,11 +457,39 @@ class Billet(models.Model):
     )
     prix = models.DecimalField(max_digits=10, decimal_places=2)
     siege = models.CharField(max_length=10)
+    annule = models.BooleanField(default=False, help_text="Billet annulé, sa place a été rendue à l'horaire")
     code_qr = models.ImageField(upload_to='qrcodes/', blank=True, null=True)
     
     def __str__(self):
         return f"Billet {self.id} - {self.get_type_billet_display()}"
 
+class BlocagePlaces(models.Model):
+    """
+    Places retenues pour une réservation en attente de paiement.
+
+    Les places sont déjà décomptées de l'horaire ; elles lui sont rendues si
+    le paiement n'intervient pas avant `expire_le`.
+    """
+    reservation = models.OneToOneField(Reservation, on_delete=models.CASCADE, related_name='blocage')
+    horaire = models.ForeignKey(Horaire, on_delete=models.CASCADE, related_name='blocages')
+    type_billet = models.CharField(max_length=3, choices=Billet.TypeBillet.choices)
+    nombre_places = models.PositiveIntegerField()
+    expire_le = models.DateTimeField(db_index=True)
+    # Ticket bonus utilisé pour la réservation, rendu au client si le blocage expire
+    ticket_bonus = models.ForeignKey(
+        'TicketBonus', on_delete=models.SET_NULL, null=True, blank=True, related_name='blocages'
+    )
+
+    class Meta:
+        verbose_name = "Blocage de places"
+        verbose_name_plural = "Blocages de places"
+
+    def __str__(self):
+        return f"{self.nombre_places} place(s) {self.type_billet} - {self.reservation} (jusqu'à {self.expire_le:%H:%M})"
+
+    def est_expire(self):
+        return self.expire_le <= timezone.now()
+
 class Paiement(models.Model):
     class StatutPaiement(models.TextChoices):
         PENDING = 'PEND', _('En attente')
@@ -285,9 +536,87 @@ class Remboursement(models.Model):
     def __str__(self):
         return f"Remboursement {self.id} - {self.montant}€"
 
+class CleIdempotence(models.Model):
+    """
+    Clé d'idempotence d'une requête de paiement.
+
+    La clé est enregistrée « en cours » avant le traitement de la requête,
+    puis la réponse obtenue y est conservée jusqu'à `expire_le` : une requête
+    répétée avec la même clé reçoit cette réponse sans nouveau traitement.
+    """
+    class StatutCle(models.TextChoices):
+        EN_COURS = 'ENC', _('En cours')
+        TERMINEE = 'TER', _('Terminée')
+
+    utilisateur = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cles_idempotence')
+    cle = models.CharField(max_length=100)
+    # Opération protégée, par exemple « PaiementCreateView:pk=42 »
+    portee = models.CharField(max_length=200)
+    empreinte_requete = models.CharField(max_length=64)
+    statut = models.CharField(max_length=3, choices=StatutCle.choices, default=StatutCle.EN_COURS)
+    code_reponse = models.PositiveSmallIntegerField(null=True, blank=True)
+    entetes_reponse = models.JSONField(default=dict, blank=True)
+    corps_reponse = models.BinaryField(default=b'', blank=True)
+    empreinte_reponse = models.CharField(max_length=64, blank=True)
+    # Début du traitement en cours ; une clé abandonnée peut être reprise
+    verrouille_le = models.DateTimeField(default=timezone.now)
+    expire_le = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Clé d'idempotence"
+        verbose_name_plural = "Clés d'idempotence"
+        constraints = [
+            models.UniqueConstraint(fields=['utilisateur', 'cle'], name='idempotence_cle_par_utilisateur'),
+        ]
+
+    def __str__(self):
+        return f"{self.cle} - {self.portee} ({self.get_statut_display()})"
+
+class EvenementPaiement(models.Model):
+    """
+    Notification d'un opérateur de paiement (webhook), conservée telle que
+    reçue. Elle est appliquée aux paiements plus tard, par lots.
+    """
+    class StatutEvenement(models.TextChoices):
+        RECU = 'REC', _('Reçu')
+        TRAITE = 'TRA', _('Traité')
+        IGNORE = 'IGN', _('Ignoré')
+        ERREUR = 'ERR', _('En erreur')
+
+    operateur = models.CharField(max_length=20, choices=Paiement.OperateurPaiement.choices)
+    # Identifiant de la notification chez l'opérateur
+    identifiant = models.CharField(max_length=100)
+    corps = models.TextField()
+    recu_le = models.DateTimeField(default=timezone.now)
+    statut = models.CharField(max_length=3, choices=StatutEvenement.choices, default=StatutEvenement.RECU)
+    traite_le = models.DateTimeField(null=True, blank=True)
+    erreur = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = "Notification de paiement"
+        verbose_name_plural = "Notifications de paiement"
+        constraints = [
+            # Une notification renvoyée par l'opérateur n'est enregistrée qu'une fois
+            models.UniqueConstraint(fields=['operateur', 'identifiant'], name='evenement_paiement_unique'),
+        ]
+        indexes = [
+            # File des notifications à traiter : l'index ne contient que celles-ci
+            models.Index(fields=['id'], condition=models.Q(statut='REC'), name='evenement_paiement_file_idx'),
+            models.Index(fields=['traite_le'], name='evenement_paiement_purge_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_operateur_display()} {self.identifiant} ({self.get_statut_display()})"
+
 import uuid
 from datetime import timedelta
 
+class TicketBonusQuerySet(models.QuerySet):
+    def valides(self, maintenant=None):
+        """Tickets ni utilisés ni expirés"""
+        return self.filter(utilise=False, expire=False, date_expiration__gt=maintenant or timezone.now())
+
+
 class TicketBonus(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='tickets_bonus')
     montant = models.DecimalField(max_digits=10, decimal_places=2, help_text="Montant du bon de réduction")
@@ -296,6 +625,17 @@ class TicketBonus(models.Model):
     utilise = models.BooleanField(default=False)
     code = models.CharField(max_length=20, unique=True, default=uuid.uuid4, editable=False)
     nombre_places = models.PositiveIntegerField(default=1, help_text="Nombre de places offertes par ce ticket")
+    # Renseignés par le balayage périodique (commande balayer_tickets_bonus)
+    expire = models.BooleanField(default=False)
+    rappel_envoye_le = models.DateTimeField(null=True, blank=True)
+
+    objects = TicketBonusQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Sélection des tickets à expirer ou à rappeler
+            models.Index(fields=['utilise', 'expire', 'date_expiration'], name='ticketbonus_balayage_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         # Si c'est une nouvelle instance, définir la date d'expiration à 30 jours
@@ -308,28 +648,44 @@ class TicketBonus(models.Model):
     
     def est_valide(self):
         """Vérifie si le ticket est valide (non utilisé et non expiré)"""
-        return not self.utilise and self.date_expiration > timezone.now()
+        return not self.utilise and not self.expire and self.date_expiration > timezone.now()
     
     def utiliser(self):
-        """Marque le ticket comme utilisé"""
-        if self.est_valide():
+        """
+        Marque le ticket comme utilisé, par une mise à jour conditionnelle : un
+        ticket n'est utilisé qu'une fois, même par deux réservations simultanées.
+        """
+        utilise = TicketBonus.objects.filter(pk=self.pk).valides().update(utilise=True) == 1
+        if utilise:
+            from .synchronisation import journaliser
+
             self.utilise = True
-            self.save()
-            return True
-        return False
+            journaliser(Modification.TypeObjet.TICKET_BONUS, [self.pk], proprietaires=[self.client_id])
+            Client.objects.filter(pk=self.client_id).update(
+                tickets_bonus_valides=Greatest(models.F('tickets_bonus_valides') - 1, 0, output_field=models.IntegerField())
+            )
+            MouvementFidelite.objects.create(
+                client_id=self.client_id, type=MouvementFidelite.TypeMouvement.UTILISATION, ticket=self
+            )
+        return utilise
     
     @classmethod
     def creer_ticket_bonus(cls, client, montant=0, nombre_places=1):
         """
         Crée un nouveau ticket bonus pour un client et envoie une notification par email
+        après la validation de la transaction
         """
         ticket = cls.objects.create(
             client=client,
             montant=montant,
             nombre_places=nombre_places
         )
-        
-        # Envoyer un email de notification de manière asynchrone
+        Client.objects.filter(pk=client.pk).update(tickets_bonus_valides=models.F('tickets_bonus_valides') + 1)
+        transaction.on_commit(ticket.notifier)
+        return ticket
+
+    def notifier(self):
+        """Envoie au client l'email annonçant le ticket bonus"""
         from django.core.mail import send_mail
         from django.template.loader import render_to_string
         from django.utils.html import strip_tags
@@ -337,15 +693,15 @@ class TicketBonus(models.Model):
         from django.utils import timezone
         
         try:
-            user = client.user
+            user = self.client.user
             subject = '🎉 Félicitations ! Vous avez gagné un ticket bonus !'
             
             context = {
-                'ticket': ticket,
+                'ticket': self,
                 'client_nom': f"{user.first_name} {user.last_name}".strip() or user.username,
-                'date_expiration': ticket.date_expiration,
-                'nombre_places': ticket.nombre_places,
-                'code': ticket.code,
+                'date_expiration': self.date_expiration,
+                'nombre_places': self.nombre_places,
+                'code': self.code,
                 'site_url': getattr(settings, 'SITE_URL', 'http://127.0.0.1:8000'),
                 'contact_email': getattr(settings, 'DEFAULT_FROM_EMAIL', 'contact@agence-voyage.com'),
                 'contact_phone': getattr(settings, 'CONTACT_PHONE', '+33 1 23 45 67 89'),
@@ -363,13 +719,93 @@ class TicketBonus(models.Model):
                 html_message=html_message,
                 fail_silently=True,
             )
-        except Exception as e:
+        except Exception:
             # En cas d'erreur d'envoi d'email, on ne fait rien pour ne pas perturber le flux
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Erreur lors de l'envoi de l'email de ticket bonus: {str(e)}")
-        
-        return ticket
+            logger.exception("Envoi de l'email du ticket bonus %s impossible", self.code)
     
     def __str__(self):
         return f"Ticket Bonus {self.code} - {self.nombre_places} place(s) offerte(s) - {'Valide' if self.est_valide() else 'Expiré'}"
+
+
+class MouvementFidelite(models.Model):
+    """
+    Journal du programme de fidélité : une ligne par événement, jamais
+    modifiée ni supprimée.
+
+    Les compteurs du client (places_reservees, points_fidelite) sont la somme
+    des mouvements ; ils sont mis à jour dans la même transaction que
+    l'insertion du mouvement.
+    """
+    class TypeMouvement(models.TextChoices):
+        ACCUMULATION = 'ACC', _('Accumulation')
+        ANNULATION = 'ANN', _('Annulation')
+        BONUS = 'BON', _('Ticket bonus émis')
+        UTILISATION = 'UTI', _('Ticket bonus utilisé')
+        RESTITUTION = 'RES', _('Ticket bonus restitué')
+        REPRISE = 'REP', _('Reprise du solde')
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='mouvements_fidelite')
+    type = models.CharField(max_length=3, choices=TypeMouvement.choices)
+    places = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    reservation = models.ForeignKey(
+        Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='mouvements_fidelite'
+    )
+    ticket = models.ForeignKey(
+        TicketBonus, on_delete=models.SET_NULL, null=True, blank=True, related_name='mouvements_fidelite'
+    )
+    # Nombre de places cumulées récompensé par un ticket bonus
+    seuil = models.PositiveIntegerField(null=True, blank=True)
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date', '-id']
+        verbose_name = "Mouvement de fidélité"
+        verbose_name_plural = "Mouvements de fidélité"
+        constraints = [
+            # Un seuil n'est récompensé qu'une fois par client
+            models.UniqueConstraint(
+                fields=['client', 'seuil'], condition=models.Q(type='BON'), name='fidelite_bonus_par_seuil'
+            ),
+            # Une réservation n'est créditée (ou débitée) qu'une fois
+            models.UniqueConstraint(
+                fields=['reservation', 'type'], condition=models.Q(type__in=['ACC', 'ANN']),
+                name='fidelite_mouvement_par_reservation'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_type_display()} - {self.client} ({self.places:+d} place(s), {self.points:+d} point(s))"
+
+
+class Modification(models.Model):
+    """
+    Journal des modifications du réseau, des horaires et des tickets bonus,
+    lu par les clients qui en tiennent une copie (voir synchronisation.py) :
+    une ligne par enregistrement ou suppression, jamais modifiée. L'id,
+    croissant, sert de numéro de séquence.
+    """
+    class TypeObjet(models.TextChoices):
+        VILLE = 'villes', _('Ville')
+        GARE = 'gares', _('Gare')
+        TRAJET = 'trajets', _('Trajet')
+        HORAIRE = 'horaires', _('Horaire')
+        TICKET_BONUS = 'tickets_bonus', _('Ticket bonus')
+
+    type_objet = models.CharField(max_length=13, choices=TypeObjet.choices)
+    objet_id = models.PositiveBigIntegerField()
+    # Client auquel l'objet est réservé (tickets bonus), vide pour les données publiques
+    proprietaire = models.PositiveBigIntegerField(null=True, blank=True)
+    supprime = models.BooleanField(default=False)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Modification synchronisée"
+        verbose_name_plural = "Modifications synchronisées"
+        indexes = [
+            models.Index(fields=['date'], name='modification_purge_idx'),
+        ]
+
+    def __str__(self):
+        action = 'suppression' if self.supprime else 'modification'
+        return f"{self.pk} - {self.get_type_objet_display()} {self.objet_id} ({action})"
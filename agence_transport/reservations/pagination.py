@@ -0,0 +1,205 @@
+"""
+Pagination par curseur (keyset) pour les listes volumineuses.
+
+Au lieu d'un OFFSET et d'un COUNT(*) sur tout le jeu filtré, chaque page
+reprend après la clé de tri de la dernière ligne affichée, par exemple
+(date_reservation, id). Avec un index sur ces colonnes, la page 5 000 coûte
+autant que la première.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+SUIVANT = 'n'
+PRECEDENT = 'p'
+
+
+class CurseurInvalide(Exception):
+    """Le jeton de pagination fourni ne peut pas être décodé"""
+
+
+def encoder_curseur(valeurs, sens):
+    """Sérialise une clé de tri en jeton opaque utilisable dans une URL"""
+    # isoformat() complet : les microsecondes font partie de la clé
+    valeurs = [valeur.isoformat() if hasattr(valeur, 'isoformat') else valeur for valeur in valeurs]
+    donnees = json.dumps([sens] + valeurs, separators=(',', ':'))
+    return base64.urlsafe_b64encode(donnees.encode()).decode().rstrip('=')
+
+
+def decoder_curseur(jeton, champs):
+    """
+    Décode un jeton et convertit ses valeurs selon les champs du modèle.
+
+    Retourne (sens, valeurs) ; lève CurseurInvalide si le jeton est altéré.
+    """
+    try:
+        donnees = base64.urlsafe_b64decode(jeton + '=' * (-len(jeton) % 4))
+        sens, *valeurs = json.loads(donnees)
+        if sens not in (SUIVANT, PRECEDENT) or len(valeurs) != len(champs):
+            raise ValueError(jeton)
+        return sens, [champ.to_python(valeur) for champ, valeur in zip(champs, valeurs)]
+    except (ValueError, TypeError, ValidationError) as e:
+        raise CurseurInvalide(str(e))
+
+
+def estimer_nombre(queryset):
+    """
+    Estimation du nombre de lignes d'une requête, sans COUNT(*).
+
+    Sur PostgreSQL l'estimation provient du planificateur (EXPLAIN) ; les
+    autres moteurs n'en fournissent pas et la fonction retourne None.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def filtre_apres(ordre, valeurs):
+    """
+    Construit la condition « strictement après la clé `valeurs` » pour un
+    tri `ordre` (ex. ['-date_reservation', '-id']).
+    """
+    condition = Q()
+    egalites = {}
+    for critere, valeur in zip(ordre, valeurs):
+        nom = critere.lstrip('-')
+        operateur = 'lt' if critere.startswith('-') else 'gt'
+        condition |= Q(**egalites, **{f'{nom}__{operateur}': valeur})
+        egalites[nom] = valeur
+    return condition
+
+
+def inverser_ordre(ordre):
+    return [critere[1:] if critere.startswith('-') else f'-{critere}' for critere in ordre]
+
+
+class PageCurseur:
+    """Page de résultats, compatible avec l'usage de `page_obj` dans les templates"""
+
+    def __init__(self, object_list, jeton_suivant=None, jeton_precedent=None,
+                 url_suivante=None, url_precedente=None, url_premiere=None, total_estime=None):
+        self.object_list = object_list
+        self.jeton_suivant = jeton_suivant
+        self.jeton_precedent = jeton_precedent
+        self.url_suivante = url_suivante
+        self.url_precedente = url_precedente
+        self.url_premiere = url_premiere
+        self.total_estime = total_estime
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.jeton_suivant is not None
+
+    def has_previous(self):
+        return self.jeton_precedent is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginer(queryset, ordre, taille, jeton=None):
+    """
+    Retourne (lignes, jeton_suivant, jeton_precedent) pour une page de
+    `taille` éléments après (ou avant) le curseur `jeton`.
+
+    `ordre` doit se terminer par une colonne unique (id) pour que la clé de tri
+    soit totale.
+    """
+    noms = [critere.lstrip('-') for critere in ordre]
+    champs = [queryset.model._meta.get_field(nom) for nom in noms]
+
+    sens, valeurs = SUIVANT, None
+    if jeton:
+        sens, valeurs = decoder_curseur(jeton, champs)
+
+    if sens == PRECEDENT:
+        ordre_requete = inverser_ordre(ordre)
+    else:
+        ordre_requete = list(ordre)
+
+    requete = queryset.order_by(*ordre_requete)
+    if valeurs is not None:
+        requete = requete.filter(filtre_apres(ordre_requete, valeurs))
+
+    # Une ligne de plus pour savoir s'il existe une page au-delà
+    lignes = list(requete[:taille + 1])
+    encore = len(lignes) > taille
+    lignes = lignes[:taille]
+    if sens == PRECEDENT:
+        lignes.reverse()
+
+    def cle(objet):
+        # Instances de modèle, ou dictionnaires d'un queryset values()
+        if isinstance(objet, dict):
+            return [objet[champ.attname] for champ in champs]
+        return [getattr(objet, champ.attname) for champ in champs]
+
+    jeton_suivant = jeton_precedent = None
+    if lignes:
+        if sens == SUIVANT:
+            jeton_suivant = encoder_curseur(cle(lignes[-1]), SUIVANT) if encore else None
+            jeton_precedent = encoder_curseur(cle(lignes[0]), PRECEDENT) if valeurs is not None else None
+        else:
+            jeton_suivant = encoder_curseur(cle(lignes[-1]), SUIVANT)
+            jeton_precedent = encoder_curseur(cle(lignes[0]), PRECEDENT) if encore else None
+    return lignes, jeton_suivant, jeton_precedent
+
+
+class PaginationCurseurMixin:
+    """
+    Remplace la pagination par numéro de page d'une ListView par une
+    pagination par curseur.
+
+    `ordre_curseur` donne la clé de tri (dernière colonne unique) ; le jeton
+    de la page est lu dans le paramètre GET `curseur`. Avec
+    `estimer_total = True`, le contexte reçoit une estimation du nombre total
+    de résultats (PostgreSQL uniquement).
+    """
+    ordre_curseur = ['-id']
+    parametre_curseur = 'curseur'
+    estimer_total = False
+
+    def lien_curseur(self, jeton=None):
+        parametres = self.request.GET.copy()
+        parametres.pop('page', None)
+        parametres.pop(self.parametre_curseur, None)
+        if jeton:
+            parametres[self.parametre_curseur] = jeton
+        return f'?{parametres.urlencode()}'
+
+    def paginate_queryset(self, queryset, page_size):
+        jeton = self.request.GET.get(self.parametre_curseur)
+        try:
+            lignes, suivant, precedent = paginer(queryset, self.ordre_curseur, page_size, jeton)
+        except CurseurInvalide:
+            # Jeton altéré ou obsolète : retour à la première page
+            lignes, suivant, precedent = paginer(queryset, self.ordre_curseur, page_size)
+
+        page = PageCurseur(
+            lignes,
+            jeton_suivant=suivant,
+            jeton_precedent=precedent,
+            url_suivante=self.lien_curseur(suivant) if suivant else None,
+            url_precedente=self.lien_curseur(precedent) if precedent else None,
+            url_premiere=self.lien_curseur() if precedent else None,
+            total_estime=estimer_nombre(queryset) if self.estimer_total else None,
+        )
+        return None, page, lignes, page.has_other_pages()
@@ -0,0 +1,491 @@
+"""
+Passerelles des opérateurs de paiement.
+
+Chaque opérateur (Paiement.OperateurPaiement) est servi par un adaptateur qui
+traduit une demande de paiement en appel HTTP vers l'API de l'opérateur et
+interprète sa réponse. Les appels d'un opérateur partagent une session HTTP
+par thread (connexions maintenues ouvertes) et sont bornés par le budget de
+latence : si l'opérateur ne répond pas à temps, le paiement reste « en
+attente » de sa confirmation et la réservation n'attend pas davantage. Le
+délai de lecture de requests s'applique à chaque lecture sur la socket ;
+l'appel est donc fait par un pool de threads et attendu au plus
+BUDGET_LATENCE secondes au total.
+
+Un disjoncteur par opérateur, partagé entre les workers par le cache, coupe
+les appels après SEUIL_ECHECS échecs consécutifs : pendant DUREE_OUVERTURE
+secondes les paiements sont refusés immédiatement, puis un nouvel échec
+rouvre aussitôt le circuit.
+
+Sans URL configurée, un opérateur est indisponible, sauf en mode DEBUG ou
+avec PASSERELLE_FICTIVE : il est alors servi par une passerelle fictive qui
+accepte le paiement sans appel réseau (jamais en production). Le simulateur
+local (commande
+simuler_operateurs) répond comme les opérateurs, avec une latence et des
+taux d'échec réglables :
+
+    PASSERELLES_PAIEMENT = {
+        'BUDGET_LATENCE': 3.0,       # secondes, connexion comprise
+        'DELAI_CONNEXION': 0.5,
+        'SEUIL_ECHECS': 5,
+        'DUREE_OUVERTURE': 30,
+        'TAILLE_POOL': 20,
+        'PASSERELLE_FICTIVE': None,  # None : suit DEBUG
+        'OPERATEURS': {
+            'lumicash': {'URL': 'http://127.0.0.1:8765/lumicash', 'CLE_API': '...', 'SECRET_WEBHOOK': '...'},
+            'carte': {'URL': 'http://127.0.0.1:8765/carte', 'CLE_API': '...'},
+        },
+    }
+
+Les adaptateurs lisent aussi les notifications asynchrones des opérateurs
+(webhooks, voir confirmations.py) : vérification de la signature avec
+SECRET_WEBHOOK (STRIPE_WEBHOOK_SECRET pour la carte) et lecture du statut.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+PARAMETRES_PAR_DEFAUT = {
+    'BUDGET_LATENCE': 3.0,
+    'DELAI_CONNEXION': 0.5,
+    'SEUIL_ECHECS': 5,
+    'DUREE_OUVERTURE': 30,
+    'TAILLE_POOL': 20,
+    'PASSERELLE_FICTIVE': None,
+    'OPERATEURS': {},
+}
+
+ACCEPTE = 'accepte'
+REFUSE = 'refuse'
+EN_ATTENTE = 'en_attente'
+
+# Sessions HTTP par thread : requests.Session n'est pas garanti thread-safe
+_local = threading.local()
+
+# Threads qui font les appels HTTP, attendus au plus BUDGET_LATENCE secondes
+_executeur = None
+_verrou_executeur = threading.Lock()
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'PASSERELLES_PAIEMENT', {})}
+
+
+def budget_latence():
+    return timedelta(seconds=parametres()['BUDGET_LATENCE'])
+
+
+def passerelle_fictive_autorisee():
+    autorisee = parametres()['PASSERELLE_FICTIVE']
+    return settings.DEBUG if autorisee is None else autorisee
+
+
+def executeur():
+    global _executeur
+    with _verrou_executeur:
+        if _executeur is None:
+            _executeur = ThreadPoolExecutor(
+                max_workers=parametres()['TAILLE_POOL'], thread_name_prefix='passerelles'
+            )
+    return _executeur
+
+
+class OperateurIndisponible(Exception):
+    """L'opérateur ne répond pas, répond en erreur, ou son circuit est ouvert"""
+
+
+class ResultatPaiement:
+    """Réponse d'un opérateur à une demande de paiement"""
+
+    def __init__(self, statut, reference='', message=''):
+        self.statut = statut
+        self.reference = reference
+        self.message = message
+
+    @property
+    def accepte(self):
+        return self.statut == ACCEPTE
+
+    @property
+    def refuse(self):
+        return self.statut == REFUSE
+
+    @property
+    def en_attente(self):
+        return self.statut == EN_ATTENTE
+
+    def __repr__(self):
+        return f'ResultatPaiement({self.statut!r}, {self.reference!r})'
+
+
+class Disjoncteur:
+    """
+    Disjoncteur d'un opérateur, stocké dans le cache pour être partagé par
+    les workers : le cache par défaut doit être partagé (CACHES dans
+    settings.py), sinon chaque processus a le sien.
+    """
+
+    def __init__(self, operateur, seuil, duree_ouverture):
+        self.cle_echecs = f'passerelle:{operateur}:echecs'
+        self.cle_ouvert = f'passerelle:{operateur}:ouvert'
+        self.cle_essai = f'passerelle:{operateur}:essai'
+        self.seuil = seuil
+        self.duree_ouverture = duree_ouverture
+
+    def est_ouvert(self):
+        return cache.get(self.cle_ouvert) is not None
+
+    def ouvrir(self):
+        cache.set(self.cle_ouvert, True, self.duree_ouverture)
+        # À la fermeture, le circuit est « à l'essai » : un échec le rouvre
+        cache.set(self.cle_essai, True, self.duree_ouverture * 10)
+        cache.delete(self.cle_echecs)
+
+    def succes(self):
+        cache.delete_many([self.cle_echecs, self.cle_essai])
+
+    def echec(self):
+        if cache.get(self.cle_essai) is not None:
+            self.ouvrir()
+            return
+        cache.add(self.cle_echecs, 0, self.duree_ouverture)
+        try:
+            echecs = cache.incr(self.cle_echecs)
+        except ValueError:
+            # Compteur expiré entre add() et incr()
+            echecs = 1
+            cache.set(self.cle_echecs, echecs, self.duree_ouverture)
+        if echecs >= self.seuil:
+            self.ouvrir()
+
+
+class Passerelle:
+    """
+    Adaptateur d'un opérateur. Les sous-classes décrivent le format de
+    l'API : corps de la requête, lecture de la réponse et réponse simulée
+    (utilisée par le simulateur local).
+    """
+    chemin = '/paiements'
+    entete_signature = 'X-Signature'
+
+    def __init__(self, operateur, url, cle_api='', reglages=None):
+        self.operateur = operateur
+        self.url = url.rstrip('/')
+        self.cle_api = cle_api
+        self.parametres = reglages or parametres()
+        self.disjoncteur = Disjoncteur(
+            operateur, self.parametres['SEUIL_ECHECS'], self.parametres['DUREE_OUVERTURE']
+        )
+
+    def session(self):
+        sessions = _local.__dict__.setdefault('sessions', {})
+        session = sessions.get(self.url)
+        if session is None:
+            session = requests.Session()
+            # Pas de nouvelle tentative automatique : un paiement n'est pas rejoué à l'aveugle
+            adaptateur = HTTPAdapter(pool_maxsize=self.parametres['TAILLE_POOL'], max_retries=0)
+            session.mount('http://', adaptateur)
+            session.mount('https://', adaptateur)
+            sessions[self.url] = session
+        return session
+
+    def delais(self):
+        """(connexion, lecture) : la somme ne dépasse pas le budget de latence"""
+        budget = self.parametres['BUDGET_LATENCE']
+        connexion = min(self.parametres['DELAI_CONNEXION'], budget)
+        return connexion, max(budget - connexion, 0.1)
+
+    def envoyer(self, corps, reference):
+        """Appel HTTP de l'opérateur, exécuté par un thread de executeur()"""
+        return self.session().post(
+            self.url + self.chemin,
+            json=corps,
+            headers={'Authorization': f'Bearer {self.cle_api}', 'Idempotency-Key': reference},
+            timeout=self.delais(),
+        )
+
+    def corps_requete(self, reservation, numero_telephone):
+        raise NotImplementedError
+
+    def lire_reponse(self, donnees):
+        raise NotImplementedError
+
+    @classmethod
+    def reponse_simulee(cls, statut, reference):
+        raise NotImplementedError
+
+    def identifiant_evenement(self, donnees):
+        """Identifiant unique d'une notification, pour écarter les renvois"""
+        raise NotImplementedError
+
+    def lire_evenement(self, donnees):
+        """
+        Référence de la réservation et ResultatPaiement d'une notification, ou
+        None si la notification ne concerne pas l'issue d'un paiement.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def evenement_simule(cls, identifiant, reference, statut, transaction):
+        raise NotImplementedError
+
+    def secret_webhook(self):
+        return self.parametres['OPERATEURS'].get(self.operateur, {}).get('SECRET_WEBHOOK', '')
+
+    def signer(self, corps, horodatage=None):
+        """En-têtes de signature d'une notification : HMAC-SHA256 du corps"""
+        signature = hmac.new(self.secret_webhook().encode(), corps, hashlib.sha256).hexdigest()
+        return {self.entete_signature: f'sha256={signature}'}
+
+    def verifier_signature(self, corps, entetes):
+        # Sans secret configuré, aucune notification n'est acceptée
+        if not self.secret_webhook():
+            return False
+        attendue = self.signer(corps)[self.entete_signature]
+        return hmac.compare_digest(attendue, entetes.get(self.entete_signature, ''))
+
+    def initier_paiement(self, reservation, numero_telephone=None):
+        """
+        Demande le paiement de la réservation à l'opérateur.
+
+        Retourne un ResultatPaiement ; sans réponse dans le budget de
+        latence, le résultat est « en attente » (l'opérateur a pu recevoir la
+        demande). Lève OperateurIndisponible si la demande n'a pas pu aboutir.
+        """
+        if self.disjoncteur.est_ouvert():
+            raise OperateurIndisponible(f"{self.operateur} : circuit ouvert")
+        appel = executeur().submit(self.envoyer, self.corps_requete(reservation, numero_telephone), reservation.reference)
+        try:
+            reponse = appel.result(timeout=self.parametres['BUDGET_LATENCE'])
+        except TimeoutError:
+            if appel.cancel():
+                # Demande jamais envoyée : tous les threads étaient occupés
+                raise OperateurIndisponible(f"{self.operateur} : trop de demandes en cours")
+            self.disjoncteur.echec()
+            logger.warning("Opérateur %s : pas de réponse dans le budget de latence (%s)", self.operateur, reservation.reference)
+            return ResultatPaiement(EN_ATTENTE, message="Réponse de l'opérateur en attente")
+        except requests.ConnectTimeout as e:
+            self.disjoncteur.echec()
+            raise OperateurIndisponible(f"{self.operateur} : connexion impossible ({e})")
+        except requests.Timeout:
+            self.disjoncteur.echec()
+            logger.warning("Opérateur %s : pas de réponse dans le budget de latence (%s)", self.operateur, reservation.reference)
+            return ResultatPaiement(EN_ATTENTE, message="Réponse de l'opérateur en attente")
+        except requests.RequestException as e:
+            self.disjoncteur.echec()
+            raise OperateurIndisponible(f"{self.operateur} : {e}")
+
+        if reponse.status_code >= 500:
+            self.disjoncteur.echec()
+            raise OperateurIndisponible(f"{self.operateur} : erreur {reponse.status_code}")
+        self.disjoncteur.succes()
+        try:
+            return self.lire_reponse(reponse.json())
+        except (ValueError, KeyError, TypeError) as e:
+            raise OperateurIndisponible(f"{self.operateur} : réponse illisible ({e})")
+
+
+class PasserelleMobile(Passerelle):
+    """Opérateurs de mobile money (Lumicash, Ecocash, Ihela)"""
+    STATUTS = {'SUCCES': ACCEPTE, 'ECHEC': REFUSE, 'EN_COURS': EN_ATTENTE}
+
+    def corps_requete(self, reservation, numero_telephone):
+        return {
+            'telephone': numero_telephone,
+            'montant': str(reservation.montant_total),
+            'devise': 'BIF',
+            'reference_marchand': reservation.reference,
+        }
+
+    def lire_reponse(self, donnees):
+        return ResultatPaiement(self.STATUTS[donnees['statut']], donnees.get('transaction', ''), donnees.get('message', ''))
+
+    @classmethod
+    def reponse_simulee(cls, statut, reference):
+        code = {valeur: cle for cle, valeur in cls.STATUTS.items()}[statut]
+        return {'statut': code, 'transaction': reference, 'message': ''}
+
+    def identifiant_evenement(self, donnees):
+        return donnees['evenement']
+
+    def lire_evenement(self, donnees):
+        resultat = ResultatPaiement(self.STATUTS[donnees['statut']], donnees.get('transaction', ''), donnees.get('message', ''))
+        return donnees['reference_marchand'], resultat
+
+    @classmethod
+    def evenement_simule(cls, identifiant, reference, statut, transaction):
+        return {'evenement': identifiant, 'reference_marchand': reference, **cls.reponse_simulee(statut, transaction)}
+
+
+class PasserellePaypal(Passerelle):
+    """
+    PayPal. Les notifications sont signées par HMAC comme celles des autres
+    opérateurs (relais de signature), et non vérifiées par l'API de PayPal.
+    """
+    chemin = '/v2/checkout/orders'
+    STATUTS = {'COMPLETED': ACCEPTE, 'DECLINED': REFUSE, 'PENDING': EN_ATTENTE}
+
+    def corps_requete(self, reservation, numero_telephone):
+        return {
+            'intent': 'CAPTURE',
+            'purchase_units': [{
+                'invoice_id': reservation.reference,
+                'amount': {'currency_code': 'BIF', 'value': str(reservation.montant_total)},
+            }],
+        }
+
+    def lire_reponse(self, donnees):
+        return ResultatPaiement(self.STATUTS[donnees['status']], donnees.get('id', ''))
+
+    @classmethod
+    def reponse_simulee(cls, statut, reference):
+        return {'id': reference, 'status': {valeur: cle for cle, valeur in cls.STATUTS.items()}[statut]}
+
+    def identifiant_evenement(self, donnees):
+        return donnees['id']
+
+    def lire_evenement(self, donnees):
+        statut = self.STATUTS.get(donnees['event_type'].rsplit('.', 1)[-1])
+        if statut is None:
+            return None
+        ressource = donnees['resource']
+        return ressource['invoice_id'], ResultatPaiement(statut, ressource.get('id', ''))
+
+    @classmethod
+    def evenement_simule(cls, identifiant, reference, statut, transaction):
+        code = {valeur: cle for cle, valeur in cls.STATUTS.items()}[statut]
+        return {
+            'id': identifiant,
+            'event_type': f'PAYMENT.CAPTURE.{code}',
+            'resource': {'id': transaction, 'invoice_id': reference},
+        }
+
+
+class PasserelleCarte(Passerelle):
+    """Paiement par carte, sur le modèle de l'API Stripe (signature Stripe-Signature)"""
+    chemin = '/v1/payment_intents'
+    STATUTS = {'succeeded': ACCEPTE, 'canceled': REFUSE, 'processing': EN_ATTENTE}
+    EVENEMENTS = {
+        'payment_intent.succeeded': ACCEPTE,
+        'payment_intent.payment_failed': REFUSE,
+        'payment_intent.processing': EN_ATTENTE,
+    }
+    entete_signature = 'Stripe-Signature'
+    # Écart toléré entre l'horodatage signé et la réception (rejeu d'une ancienne notification)
+    TOLERANCE_SIGNATURE = 300
+
+    def corps_requete(self, reservation, numero_telephone):
+        return {
+            # Le franc burundais n'a pas de subdivision : montant entier
+            'amount': int(Decimal(reservation.montant_total).to_integral_value()),
+            'currency': 'bif',
+            'confirm': True,
+            'metadata': {'reference': reservation.reference},
+        }
+
+    def lire_reponse(self, donnees):
+        erreur = (donnees.get('last_payment_error') or {}).get('message', '')
+        return ResultatPaiement(self.STATUTS[donnees['status']], donnees.get('id', ''), erreur)
+
+    @classmethod
+    def reponse_simulee(cls, statut, reference):
+        return {'id': reference, 'status': {valeur: cle for cle, valeur in cls.STATUTS.items()}[statut]}
+
+    def identifiant_evenement(self, donnees):
+        return donnees['id']
+
+    def lire_evenement(self, donnees):
+        statut = self.EVENEMENTS.get(donnees['type'])
+        if statut is None:
+            return None
+        objet = donnees['data']['object']
+        erreur = (objet.get('last_payment_error') or {}).get('message', '')
+        return objet['metadata']['reference'], ResultatPaiement(statut, objet.get('id', ''), erreur)
+
+    @classmethod
+    def evenement_simule(cls, identifiant, reference, statut, transaction):
+        return {
+            'id': identifiant,
+            'type': {valeur: cle for cle, valeur in cls.EVENEMENTS.items()}[statut],
+            'data': {'object': {'id': transaction, 'metadata': {'reference': reference}}},
+        }
+
+    def secret_webhook(self):
+        return super().secret_webhook() or getattr(settings, 'STRIPE_WEBHOOK_SECRET', '')
+
+    def signer(self, corps, horodatage=None):
+        horodatage = int(horodatage or time.time())
+        signature = hmac.new(self.secret_webhook().encode(), f'{horodatage}.'.encode() + corps, hashlib.sha256).hexdigest()
+        return {self.entete_signature: f't={horodatage},v1={signature}'}
+
+    def verifier_signature(self, corps, entetes):
+        if not self.secret_webhook():
+            return False
+        elements = dict(
+            partie.split('=', 1) for partie in entetes.get(self.entete_signature, '').split(',') if '=' in partie
+        )
+        try:
+            horodatage = int(elements.get('t', ''))
+        except ValueError:
+            return False
+        if abs(time.time() - horodatage) > self.TOLERANCE_SIGNATURE:
+            return False
+        attendue = self.signer(corps, horodatage)[self.entete_signature]
+        return hmac.compare_digest(attendue, f"t={horodatage},v1={elements.get('v1', '')}")
+
+
+class PasserelleFictive(Passerelle):
+    """Accepte tout paiement, sans appel réseau (opérateur non configuré)"""
+
+    def __init__(self, operateur, reglages=None):
+        super().__init__(operateur, '', reglages=reglages)
+
+    def initier_paiement(self, reservation, numero_telephone=None):
+        return ResultatPaiement(ACCEPTE, f'FICT-{uuid.uuid4().hex[:12].upper()}')
+
+
+ADAPTATEURS = {
+    'lumicash': PasserelleMobile,
+    'ecocash': PasserelleMobile,
+    'ihela': PasserelleMobile,
+    'paypal': PasserellePaypal,
+    'carte': PasserelleCarte,
+}
+
+
+def passerelle(operateur):
+    """
+    Passerelle configurée pour un opérateur. Lève OperateurIndisponible si
+    l'opérateur n'a pas d'URL et que la passerelle fictive n'est pas permise.
+    """
+    reglages = parametres()
+    configuration = reglages['OPERATEURS'].get(operateur, {})
+    if not configuration.get('URL'):
+        if not passerelle_fictive_autorisee():
+            raise OperateurIndisponible(f"{operateur} : opérateur non configuré")
+        return PasserelleFictive(operateur, reglages)
+    return ADAPTATEURS[operateur](operateur, configuration['URL'], configuration.get('CLE_API', ''), reglages)
+
+
+def passerelle_notifications(operateur):
+    """Adaptateur d'un opérateur pour lire ses notifications, même sans URL d'API configurée"""
+    reglages = parametres()
+    configuration = reglages['OPERATEURS'].get(operateur, {})
+    return ADAPTATEURS[operateur](operateur, configuration.get('URL', ''), configuration.get('CLE_API', ''), reglages)
+
+
+def initier_paiement(operateur, reservation, numero_telephone=None):
+    """Demande le paiement d'une réservation à un opérateur (voir Passerelle.initier_paiement)"""
+    return passerelle(operateur).initier_paiement(reservation, numero_telephone)
@@ -0,0 +1,220 @@
+"""
+Profilage des requêtes lentes, à activer en production le temps d'une
+enquête (paramètre PROFILAGE, désactivé par défaut).
+
+Le middleware ProfilageMiddleware relève les requêtes SQL de chaque requête
+(texte et durée, par connection.execute_wrapper). Une requête plus longue
+que SEUIL_REQUETE_LENTE est journalisée (journal reservations.profilage,
+niveau WARNING) avec ses MAX_REQUETES_SQL premières requêtes SQL ; une
+requête SQL plus longue que SEUIL_SQL_LENT l'est aussi, seule.
+
+POURCENTAGE_ECHANTILLON % des requêtes sont en outre profilées avec
+cProfile, de même que celles qui le demandent : en-tête ENTETE portant le
+JETON, ou paramètre PARAMETRE (?profiler=1) pour un membre de l'équipe
+connecté. Les profils, compressés, sont conservés dans un tampon circulaire
+de TAILLE_TAMPON emplacements dans le cache par défaut, commun à tous les
+processus s'il est partagé (CACHES dans settings.py), consultable par l'équipe (rapports/profils/) et
+téléchargeable au format de pstats (snakeviz, python -m pstats...).
+Un seul profil est pris à la fois par processus : une requête à profiler
+pendant qu'une autre l'est passe sans profil.
+
+    PROFILAGE = {
+        'ACTIVE': False,
+        'SEUIL_REQUETE_LENTE': 1.0,    # secondes
+        'SEUIL_SQL_LENT': 0.2,         # secondes
+        'MAX_REQUETES_SQL': 50,
+        'POURCENTAGE_ECHANTILLON': 0,
+        'ENTETE': 'X-Profilage',
+        'JETON': None,                 # sans jeton, l'en-tête est ignoré
+        'PARAMETRE': 'profiler',
+        'TAILLE_TAMPON': 50,
+        'DUREE_CONSERVATION': 7 * 24 * 3600,
+        'LIGNES_RAPPORT': 40,
+    }
+"""
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+import types
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PARAMETRES_PAR_DEFAUT = {
+    'ACTIVE': False,
+    'SEUIL_REQUETE_LENTE': 1.0,
+    'SEUIL_SQL_LENT': 0.2,
+    'MAX_REQUETES_SQL': 50,
+    'POURCENTAGE_ECHANTILLON': 0,
+    'ENTETE': 'X-Profilage',
+    'JETON': None,
+    'PARAMETRE': 'profiler',
+    'TAILLE_TAMPON': 50,
+    'DUREE_CONSERVATION': 7 * 24 * 3600,
+    'LIGNES_RAPPORT': 40,
+}
+
+# Origine d'un profil
+ECHANTILLON = 'echantillon'
+ENTETE = 'entete'
+PARAMETRE = 'parametre'
+
+CLE_COMPTEUR = 'profilage:compteur'
+PREFIXE_CLE = 'profilage:profil:'
+
+# cProfile ne peut profiler qu'un thread à la fois
+_verrou_profileur = threading.Lock()
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'PROFILAGE', {})}
+
+
+class ReleveSQL:
+    """
+    Execute wrapper qui relève la durée de chaque requête SQL et le texte
+    des `limite` premières.
+    """
+
+    def __init__(self, limite, seuil_lent):
+        self.limite = limite
+        self.seuil_lent = seuil_lent
+        self.nombre = 0
+        self.duree = 0.0
+        self.requetes = []
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duree = time.perf_counter() - debut
+            self.nombre += 1
+            self.duree += duree
+            if len(self.requetes) < self.limite:
+                self.requetes.append((sql, round(duree, 6)))
+            if duree >= self.seuil_lent:
+                logger.warning(
+                    "Requête SQL lente (%.3f s)", duree,
+                    extra={'sql': sql, 'alias': context['connection'].alias},
+                )
+
+
+def origine_profil(request, reglages):
+    """Raison de profiler la requête (ECHANTILLON, ENTETE, PARAMETRE), ou None"""
+    jeton = reglages['JETON']
+    recu = request.headers.get(reglages['ENTETE'])
+    if jeton and recu and hmac.compare_digest(recu.encode(), str(jeton).encode()):
+        return ENTETE
+    if reglages['PARAMETRE'] in request.GET:
+        utilisateur = getattr(request, 'user', None)
+        if utilisateur is not None and utilisateur.is_staff:
+            return PARAMETRE
+    if random.random() * 100 < reglages['POURCENTAGE_ECHANTILLON']:
+        return ECHANTILLON
+    return None
+
+
+def demarrer_profileur():
+    """Profileur démarré, ou None si un autre thread est déjà profilé"""
+    if not _verrou_profileur.acquire(blocking=False):
+        return None
+    profileur = cProfile.Profile()
+    try:
+        profileur.enable()
+    except ValueError:
+        # Un autre outil de profilage est actif (débogueur, coverage...)
+        _verrou_profileur.release()
+        return None
+    return profileur
+
+
+def arreter_profileur(profileur):
+    """Arrête le profileur et retourne ses statistiques, compressées, au format de pstats"""
+    try:
+        profileur.disable()
+    finally:
+        _verrou_profileur.release()
+    profileur.create_stats()
+    return zlib.compress(marshal.dumps(profileur.stats))
+
+
+def journaliser_requete_lente(request, route, statut, duree, releve):
+    logger.warning(
+        "Requête lente %s %s (%.3f s, %d requêtes SQL en %.3f s)",
+        request.method, request.path, duree, releve.nombre, releve.duree,
+        extra={
+            'route': route, 'statut': statut, 'duree': round(duree, 6),
+            'requetes_sql': releve.nombre, 'duree_sql': round(releve.duree, 6),
+            'sql': [{'sql': sql, 'duree': duree_sql} for sql, duree_sql in releve.requetes],
+        },
+    )
+
+
+def enregistrer_profil(request, route, statut, duree, releve, origine, profil):
+    """Range un profil dans le tampon circulaire ; retourne son numéro"""
+    reglages = parametres()
+    cache.add(CLE_COMPTEUR, 0, timeout=None)
+    try:
+        numero = cache.incr(CLE_COMPTEUR)
+    except ValueError:
+        # Compteur évincé du cache entre add() et incr()
+        cache.set(CLE_COMPTEUR, 1, timeout=None)
+        numero = 1
+    cache.set(PREFIXE_CLE + str(numero % reglages['TAILLE_TAMPON']), {
+        'numero': numero,
+        'date': timezone.now(),
+        'methode': request.method,
+        'chemin': request.get_full_path()[:500],
+        'route': route,
+        'statut': statut,
+        'duree': duree,
+        'requetes_sql': releve.nombre,
+        'duree_sql': releve.duree,
+        'sql': releve.requetes,
+        'request_id': getattr(request, 'request_id', '-'),
+        'origine': origine,
+        'profil': profil,
+    }, reglages['DUREE_CONSERVATION'])
+    logger.info("Profil %d enregistré (%s %s, %.3f s)", numero, request.method, request.path, duree)
+    return numero
+
+
+def profils():
+    """Profils du tampon, du plus récent au plus ancien"""
+    taille = parametres()['TAILLE_TAMPON']
+    entrees = cache.get_many([PREFIXE_CLE + str(emplacement) for emplacement in range(taille)])
+    return sorted(entrees.values(), key=lambda entree: entree['numero'], reverse=True)
+
+
+def profil(numero):
+    """Profil `numero`, ou None s'il a été remplacé ou a expiré"""
+    entree = cache.get(PREFIXE_CLE + str(numero % parametres()['TAILLE_TAMPON']))
+    if entree is None or entree['numero'] != numero:
+        return None
+    return entree
+
+
+def donnees_pstats(entree):
+    """Statistiques du profil, au format des fichiers de pstats (dump_stats)"""
+    return zlib.decompress(entree['profil'])
+
+
+def rapport(entree, tri='cumulative', lignes=None):
+    """Fonctions les plus coûteuses du profil, mises en forme par pstats"""
+    # pstats.Stats accepte tout objet doté de create_stats() et de stats
+    source = types.SimpleNamespace(create_stats=lambda: None, stats=marshal.loads(donnees_pstats(entree)))
+    sortie = io.StringIO()
+    statistiques = pstats.Stats(source, stream=sortie)
+    statistiques.strip_dirs().sort_stats(tri).print_stats(lignes or parametres()['LIGNES_RAPPORT'])
+    return sortie.getvalue()
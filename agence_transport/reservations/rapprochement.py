@@ -0,0 +1,279 @@
+"""
+Rapprochement des paiements avec les relevés des opérateurs.
+
+Un relevé est un fichier CSV exporté par l'opérateur (Lumicash, Ecocash,
+Ihela...) : une ligne par transaction, avec au moins sa référence
+(Paiement.reference_paiement), son montant et son statut. Le fichier est lu
+ligne par ligne sans jamais être chargé en mémoire ; chaque ligne est
+retrouvée dans un index (référence -> paiement) construit une seule fois,
+par une seule requête, sur les paiements de l'opérateur.
+
+Seuls les écarts sans ambiguïté sont corrigés, par lots (bulk_update) :
+paiement en attente confirmé ou refusé par le relevé, paiement échoué
+finalement encaissé. Les réservations suivent comme pour une notification
+de l'opérateur (voir confirmations.py). Les autres écarts ne modifient rien
+et forment le rapport d'anomalies : référence inconnue, montant ou statut
+divergent, ligne en double ou illisible. L'encodage du fichier est vérifié
+en entier avant toute correction (verifier_encodage) : un relevé mal encodé
+est refusé sans qu'aucun lot n'ait été enregistré.
+
+Les noms de colonnes et les libellés de statut reconnus (sans tenir compte
+de la casse) se règlent avec le paramètre RAPPROCHEMENT_PAIEMENTS :
+
+    RAPPROCHEMENT_PAIEMENTS = {
+        'COLONNES': {
+            'reference': ['reference', 'référence', 'transaction', 'transaction_id', 'id'],
+            'montant': ['montant', 'amount'],
+            'statut': ['statut', 'status', 'etat', 'état'],
+        },
+        'STATUTS': {
+            'PAID': ['succes', 'succès', 'success', 'successful', 'completed', 'reussi', 'réussi', 'paye', 'payé'],
+            'FAIL': ['echec', 'échec', 'failed', 'rejected', 'rejete', 'rejeté', 'expired', 'cancelled'],
+            'PEND': ['en attente', 'pending', 'processing'],
+            'REFD': ['rembourse', 'remboursé', 'refunded', 'reversed'],
+        },
+        'TAILLE_LOT': 2000,
+    }
+"""
+import codecs
+import csv
+import itertools
+import re
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+
+from .confirmations import enregistrer_statuts, envoyer_emails_statut
+from .models import Paiement
+
+PARAMETRES_PAR_DEFAUT = {
+    'COLONNES': {
+        'reference': ['reference', 'référence', 'transaction', 'transaction_id', 'id'],
+        'montant': ['montant', 'amount'],
+        'statut': ['statut', 'status', 'etat', 'état'],
+    },
+    'STATUTS': {
+        'PAID': ['succes', 'succès', 'success', 'successful', 'completed', 'reussi', 'réussi', 'paye', 'payé'],
+        'FAIL': ['echec', 'échec', 'failed', 'rejected', 'rejete', 'rejeté', 'expired', 'cancelled'],
+        'PEND': ['en attente', 'pending', 'processing'],
+        'REFD': ['rembourse', 'remboursé', 'refunded', 'reversed'],
+    },
+    'TAILLE_LOT': 2000,
+}
+
+# Anomalies du rapport
+REFERENCE_INCONNUE = 'reference_inconnue'
+MONTANT_DIFFERENT = 'montant_different'
+STATUT_DIVERGENT = 'statut_divergent'
+LIGNE_EN_DOUBLE = 'ligne_en_double'
+LIGNE_ILLISIBLE = 'ligne_illisible'
+ANOMALIES = (REFERENCE_INCONNUE, MONTANT_DIFFERENT, STATUT_DIVERGENT, LIGNE_EN_DOUBLE, LIGNE_ILLISIBLE)
+
+COLONNES_RAPPORT = (
+    'ligne', 'reference', 'anomalie', 'detail',
+    'montant_releve', 'montant_paiement', 'statut_releve', 'statut_paiement',
+)
+
+LIBELLES_BILAN = {
+    'lignes': 'Lignes du relevé',
+    'conformes': 'Paiements conformes',
+    'corriges': 'Paiements corrigés',
+    'non_corriges': 'Paiements modifiés pendant le rapprochement (non corrigés)',
+    REFERENCE_INCONNUE: 'Références inconnues',
+    MONTANT_DIFFERENT: 'Montants différents',
+    STATUT_DIVERGENT: 'Statuts divergents',
+    LIGNE_EN_DOUBLE: 'Lignes en double',
+    LIGNE_ILLISIBLE: 'Lignes illisibles',
+}
+
+# Corrections appliquées : (statut du paiement, statut du relevé)
+TRANSITIONS = {
+    (Paiement.StatutPaiement.PENDING, Paiement.StatutPaiement.PAID),
+    (Paiement.StatutPaiement.FAILED, Paiement.StatutPaiement.PAID),
+    (Paiement.StatutPaiement.PENDING, Paiement.StatutPaiement.FAILED),
+}
+
+
+class ReleveInvalide(Exception):
+    """Relevé vide ou sans les colonnes attendues"""
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'RAPPROCHEMENT_PAIEMENTS', {})}
+
+
+def verifier_encodage(morceaux, encodage='utf-8-sig'):
+    """
+    Vérifie que le relevé (itérable de blocs d'octets) se décode entièrement
+    dans `encodage`, sans le garder en mémoire. Lève ReleveInvalide sinon.
+    """
+    decodeur = codecs.getincrementaldecoder(encodage)()
+    try:
+        for morceau in morceaux:
+            decodeur.decode(morceau)
+        decodeur.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise ReleveInvalide(f"Le relevé doit être un fichier CSV encodé en {codecs.lookup(encodage).name}.")
+
+
+def lire_montant(texte):
+    """
+    Montant d'un relevé (« 25 000 », « 25000,00 », « 25,000.00 BIF »...),
+    ou None s'il est illisible.
+    """
+    texte = re.sub(r'[^\d,.\-]', '', texte)
+    if ',' in texte and '.' in texte:
+        texte = texte.replace(',', '')
+    else:
+        texte = texte.replace(',', '.')
+    try:
+        return Decimal(texte)
+    except InvalidOperation:
+        return None
+
+
+def lire_releve(lignes, colonnes):
+    """
+    Parcourt un relevé CSV (itérable de lignes de texte, séparateur détecté
+    sur l'en-tête) et produit, ligne par ligne, (numéro de ligne, référence,
+    montant, statut), ou (numéro de ligne, None, None, None) pour une ligne
+    incomplète.
+    """
+    lignes = iter(lignes)
+    premiere = next(lignes, '')
+    if not premiere.strip():
+        raise ReleveInvalide("Le relevé est vide.")
+    try:
+        dialecte = csv.Sniffer().sniff(premiere, delimiters=',;\t|')
+    except csv.Error:
+        dialecte = csv.excel
+    lecteur = csv.reader(itertools.chain([premiere], lignes), dialecte)
+
+    entete = [nom.strip().lower() for nom in next(lecteur)]
+    positions = []
+    for champ in ('reference', 'montant', 'statut'):
+        noms = [nom.lower() for nom in colonnes[champ]]
+        position = next((i for i, nom in enumerate(entete) if nom in noms), None)
+        if position is None:
+            raise ReleveInvalide(f"Colonne « {champ} » introuvable dans l'en-tête : {', '.join(entete)}.")
+        positions.append(position)
+
+    derniere = max(positions)
+    for ligne in lecteur:
+        if not any(ligne):
+            continue
+        if len(ligne) <= derniere:
+            yield lecteur.line_num, None, None, None
+        else:
+            yield lecteur.line_num, *(ligne[position].strip() for position in positions)
+
+
+def _corriger(corrections, connexion):
+    """
+    Applique un lot de corrections ({pk: (statut attendu, nouveau statut)}).
+    Un paiement modifié depuis la construction de l'index est laissé tel
+    quel. Retourne le nombre de paiements corrigés.
+    """
+    with transaction.atomic():
+        confirmes, refuses = [], []
+        for paiement in Paiement.objects.select_for_update(of=('self',)).select_related(
+            'reservation__client__user'
+        ).filter(pk__in=list(corrections)):
+            attendu, nouveau = corrections[paiement.pk]
+            if paiement.statut != attendu:
+                continue
+            paiement.statut = nouveau
+            (confirmes if nouveau == Paiement.StatutPaiement.PAID else refuses).append(paiement)
+        enregistrer_statuts(confirmes, refuses)
+
+    envoyer_emails_statut(confirmes, refuses, connexion)
+    return len(confirmes) + len(refuses)
+
+
+def rapprocher(lignes, operateur, appliquer=True, rapport=None, limite_anomalies=100, taille_lot=None, connexion=None):
+    """
+    Rapproche un relevé (itérable de lignes de texte CSV) des paiements de
+    `operateur`. Les corrections ne sont enregistrées que si `appliquer` est
+    vrai. Chaque anomalie est écrite dans `rapport` (fichier texte, au
+    format CSV) s'il est fourni.
+
+    Retourne le bilan (voir LIBELLES_BILAN) et les `limite_anomalies`
+    premières anomalies.
+    """
+    reglages = parametres()
+    taille_lot = taille_lot or reglages['TAILLE_LOT']
+    statuts_releve = {
+        libelle.lower(): statut
+        for statut, libelles in reglages['STATUTS'].items() for libelle in libelles
+    }
+    connexion = connexion or get_connection()
+    ecrivain = None
+    if rapport is not None:
+        ecrivain = csv.writer(rapport)
+        ecrivain.writerow(COLONNES_RAPPORT)
+
+    # Index construit en une requête ; une référence déjà rencontrée y est remplacée par None
+    index = {
+        reference: (pk, montant, statut)
+        for reference, pk, montant, statut in Paiement.objects.filter(
+            operateur=operateur, reference_paiement__isnull=False
+        ).values_list('reference_paiement', 'pk', 'montant', 'statut').iterator(chunk_size=10000)
+    }
+
+    bilan = Counter()
+    anomalies = []
+    corrections = {}
+
+    def signaler(anomalie, numero, reference, detail='', montant_releve='', montant='', statut_releve='', statut=''):
+        bilan[anomalie] += 1
+        ligne = (numero, reference, anomalie, detail, montant_releve, montant, statut_releve, statut)
+        if ecrivain is not None:
+            ecrivain.writerow(ligne)
+        if len(anomalies) < limite_anomalies:
+            anomalies.append(dict(zip(COLONNES_RAPPORT, ligne)))
+
+    def vider():
+        corriges = _corriger(corrections, connexion) if appliquer else len(corrections)
+        bilan['corriges'] += corriges
+        bilan['non_corriges'] += len(corrections) - corriges
+        corrections.clear()
+
+    for numero, reference, montant_texte, statut_texte in lire_releve(lignes, reglages['COLONNES']):
+        bilan['lignes'] += 1
+        if not reference:
+            signaler(LIGNE_ILLISIBLE, numero, reference or '', "Ligne incomplète ou sans référence")
+            continue
+        if reference not in index:
+            signaler(REFERENCE_INCONNUE, numero, reference, "Aucun paiement de l'opérateur avec cette référence",
+                     montant_releve=montant_texte, statut_releve=statut_texte)
+            continue
+        entree = index[reference]
+        if entree is None:
+            signaler(LIGNE_EN_DOUBLE, numero, reference, "Référence déjà présente plus haut dans le relevé",
+                     montant_releve=montant_texte, statut_releve=statut_texte)
+            continue
+        index[reference] = None
+
+        pk, montant, statut = entree
+        montant_releve = lire_montant(montant_texte)
+        statut_releve = statuts_releve.get(statut_texte.lower())
+        if montant_releve is None or statut_releve is None:
+            signaler(LIGNE_ILLISIBLE, numero, reference, "Montant ou statut non reconnu",
+                     montant_texte, montant, statut_texte, statut)
+        elif montant_releve != montant:
+            signaler(MONTANT_DIFFERENT, numero, reference, f"Écart de {montant_releve - montant}",
+                     montant_releve, montant, statut_releve, statut)
+        elif statut_releve in (statut, Paiement.StatutPaiement.PENDING):
+            bilan['conformes'] += 1
+        elif (statut, statut_releve) in TRANSITIONS:
+            corrections[pk] = (statut, statut_releve)
+            if len(corrections) >= taille_lot:
+                vider()
+        else:
+            signaler(STATUT_DIVERGENT, numero, reference, "Statut à vérifier manuellement",
+                     montant_releve, montant, statut_releve, statut)
+    vider()
+    return bilan, anomalies
@@ -0,0 +1,118 @@
+"""
+Recherche rapide des réservations par référence, nom ou téléphone.
+
+Les noms et téléphones des clients sont découpés en termes normalisés (sans
+accents, en minuscules) dans la table TermeRecherche ; la référence est
+interrogée directement sur son index unique. Chaque mot saisi est cherché
+comme préfixe, avec une condition que l'index peut servir : LIKE 'x%' sur
+PostgreSQL (index *_like), intervalle [x, x + U+FFFF[ sur les autres moteurs.
+"""
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import Client, TermeRecherche
+
+LONGUEUR_TERME = 40
+# Numéro local (sans indicatif pays) indexé en plus du numéro complet
+CHIFFRES_NUMERO_LOCAL = 8
+TAILLE_LOT_INDEXATION = 1000
+
+_SEPARATEURS = re.compile(r'[^0-9a-z]+')
+_TELEPHONE = re.compile(r'^[0-9+().\s-]+$')
+
+
+def normaliser(texte):
+    """Minuscules sans accents"""
+    texte = unicodedata.normalize('NFKD', str(texte or ''))
+    return ''.join(c for c in texte if not unicodedata.combining(c)).lower()
+
+
+def decouper(texte):
+    return [mot for mot in _SEPARATEURS.split(normaliser(texte)) if mot]
+
+
+def chiffres(texte):
+    return re.sub(r'\D', '', texte or '')
+
+
+def termes_client(telephone, prenom, nom, username, email):
+    """Ensemble des termes indexés pour un client"""
+    termes = set()
+    for valeur in (prenom, nom, username, (email or '').split('@')[0]):
+        termes.update(decouper(valeur))
+    numero = chiffres(telephone)
+    if numero:
+        termes.add(numero)
+        termes.add(numero[-CHIFFRES_NUMERO_LOCAL:])
+    return {terme[:LONGUEUR_TERME] for terme in termes}
+
+
+def indexer_clients(client_ids):
+    """Recalcule les termes de recherche des clients indiqués"""
+    client_ids = list(client_ids)
+    if not client_ids:
+        return 0
+    termes = []
+    for pk, *valeurs in Client.objects.filter(pk__in=client_ids).values_list(
+        'pk', 'telephone', 'user__first_name', 'user__last_name', 'user__username', 'user__email'
+    ):
+        termes.extend(TermeRecherche(client_id=pk, terme=terme) for terme in termes_client(*valeurs))
+    TermeRecherche.objects.filter(client_id__in=client_ids).delete()
+    TermeRecherche.objects.bulk_create(termes, batch_size=TAILLE_LOT_INDEXATION, ignore_conflicts=True)
+    return len(termes)
+
+
+def reindexer_tout(taille_lot=TAILLE_LOT_INDEXATION):
+    """Reconstruit l'index de tous les clients, par lots"""
+    total = 0
+    dernier = 0
+    while True:
+        lot = list(Client.objects.filter(pk__gt=dernier).order_by('pk').values_list('pk', flat=True)[:taille_lot])
+        if not lot:
+            return total
+        total += indexer_clients(lot)
+        dernier = lot[-1]
+
+
+def filtre_prefixe(champ, prefixe, alias='default'):
+    """Condition « `champ` commence par `prefixe` » qui peut utiliser un index B-tree"""
+    if connections[alias].vendor == 'postgresql':
+        return Q(**{f'{champ}__startswith': prefixe})
+    return Q(**{f'{champ}__gte': prefixe, f'{champ}__lt': prefixe + '\uffff'})
+
+
+def rechercher_reservations(queryset, recherche):
+    """
+    Filtre `queryset` (réservations) : chaque mot de `recherche` doit être le
+    début de la référence, ou d'un nom, identifiant ou téléphone du client.
+    """
+    recherche = (recherche or '').strip()
+    if not recherche:
+        return queryset
+    alias = queryset.db
+
+    def clients_avec_prefixe(prefixe):
+        return TermeRecherche.objects.filter(
+            filtre_prefixe('terme', prefixe[:LONGUEUR_TERME], alias)
+        ).values('client_id')
+
+    # Un numéro saisi avec espaces ou indicatif est cherché comme un seul terme
+    if _TELEPHONE.match(recherche) and chiffres(recherche):
+        numero = chiffres(recherche)
+        return queryset.filter(
+            filtre_prefixe('reference', recherche.upper(), alias) |
+            Q(client_id__in=clients_avec_prefixe(numero))
+        )
+
+    for mot in recherche.split():
+        condition_nom = Q()
+        for partie in decouper(mot):
+            condition_nom &= Q(client_id__in=clients_avec_prefixe(partie))
+        condition = filtre_prefixe('reference', mot.upper(), alias)
+        if condition_nom:
+            condition |= condition_nom
+        queryset = queryset.filter(condition)
+    return queryset
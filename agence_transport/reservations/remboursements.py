@@ -0,0 +1,146 @@
+"""
+Remboursements : calcul des montants et traitement par lots.
+
+Le montant remboursé est le montant payé multiplié par le taux du palier
+d'annulation (jours restant avant le départ), calculé en Decimal et arrondi
+au multiple de ARRONDI le plus proche ; il ne dépasse jamais le montant
+payé. Les voyageurs d'un départ annulé par l'agence sont remboursés au taux
+TAUX_DEPART_ANNULE :
+
+    POLITIQUE_REMBOURSEMENT = {
+        # (jours avant le départ au moins, taux remboursé) ; rien après le départ
+        'PALIERS_ANNULATION': [(0, '0.80')],
+        'TAUX_DEPART_ANNULE': '1.00',
+        'ARRONDI': '0.01',
+    }
+
+Les demandes en attente sont traitées par lots (commande
+traiter_remboursements, actions de l'administration) : dans la transaction
+d'un lot, les remboursements sont marqués traités, les paiements remboursés
+et les réservations remboursées par un UPDATE chacun, et les places encore
+occupées sont rendues aux horaires. Seules les demandes dont le paiement a
+été encaissé sont traitées. Le reversement des fonds par l'opérateur reste
+à effectuer en dehors de l'application.
+"""
+from collections import Counter
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .inventaire import liberer_reservations
+from .models import Paiement, Remboursement, Reservation
+
+PARAMETRES_PAR_DEFAUT = {
+    'PALIERS_ANNULATION': [(0, '0.80')],
+    'TAUX_DEPART_ANNULE': '1.00',
+    'ARRONDI': '0.01',
+}
+
+TAILLE_LOT_REMBOURSEMENTS = 500
+
+MOTIF_DEPART_ANNULE = "Départ annulé par l'agence"
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'POLITIQUE_REMBOURSEMENT', {})}
+
+
+def taux_annulation(date_depart, maintenant=None):
+    """Taux remboursé pour une annulation par le client, selon le délai avant le départ"""
+    maintenant = maintenant or timezone.now()
+    if date_depart <= maintenant:
+        return Decimal('0')
+    jours = (date_depart - maintenant).days
+    for seuil, taux in sorted(parametres()['PALIERS_ANNULATION'], reverse=True):
+        if jours >= seuil:
+            return Decimal(taux)
+    return Decimal('0')
+
+
+def montant_rembourse(montant, taux):
+    """Montant remboursé pour un paiement de `montant` au taux `taux`"""
+    arrondi = Decimal(parametres()['ARRONDI'])
+    valeur = (montant * Decimal(taux) / arrondi).quantize(Decimal('1'), rounding=ROUND_HALF_UP) * arrondi
+    return min(valeur, montant)
+
+
+def demander_remboursement(reservation, motif, taux=None):
+    """
+    Enregistre la demande de remboursement d'une réservation payée, au taux
+    `taux` ou à défaut à celui de la politique d'annulation. Retourne la
+    demande (existante ou créée), ou None si rien n'est à rembourser.
+    """
+    paiement = Paiement.objects.filter(
+        reservation=reservation, statut=Paiement.StatutPaiement.PAID
+    ).first()
+    if paiement is None:
+        return None
+    if taux is None:
+        taux = taux_annulation(reservation.horaire.date_depart)
+    montant = montant_rembourse(paiement.montant, taux)
+    if not montant:
+        return None
+    remboursement, _cree = Remboursement.objects.get_or_create(
+        paiement=paiement, defaults={'montant': montant, 'motif': motif}
+    )
+    return remboursement
+
+
+def demander_remboursements_depart(horaires, motif=MOTIF_DEPART_ANNULE):
+    """
+    Enregistre en un INSERT les demandes de remboursement des réservations
+    payées des horaires `horaires` (départs annulés), au taux
+    TAUX_DEPART_ANNULE. Retourne le nombre de demandes créées.
+    """
+    taux = Decimal(parametres()['TAUX_DEPART_ANNULE'])
+    paiements = Paiement.objects.filter(
+        reservation__horaire__in=horaires,
+        reservation__statut__in=[Reservation.StatutReservation.EN_ATTENTE, Reservation.StatutReservation.CONFIRMEE],
+        statut=Paiement.StatutPaiement.PAID,
+        montant__gt=0,
+        remboursement__isnull=True,
+    ).values_list('pk', 'montant')
+    demandes = [
+        Remboursement(paiement_id=pk, montant=montant_rembourse(montant, taux), motif=motif)
+        for pk, montant in paiements
+    ]
+    demandes = [demande for demande in demandes if demande.montant]
+    # Une demande déjà enregistrée entre-temps pour le même paiement est conservée
+    Remboursement.objects.bulk_create(demandes, ignore_conflicts=True)
+    return len(demandes)
+
+
+def traiter_remboursements(remboursements=None, taille_lot=TAILLE_LOT_REMBOURSEMENTS):
+    """
+    Traite les demandes de remboursement en attente (toutes, ou celles du
+    queryset `remboursements`), par lots de `taille_lot`, chacun dans sa
+    propre transaction. Retourne le nombre de demandes traitées et leur
+    montant total.
+    """
+    demandes = Remboursement.objects.all() if remboursements is None else remboursements
+    demandes = demandes.filter(traite=False, paiement__statut=Paiement.StatutPaiement.PAID)
+    bilan = Counter(traites=0, montant=Decimal('0'))
+    dernier = 0
+    while True:
+        maintenant = timezone.now()
+        with transaction.atomic():
+            lot = list(
+                demandes.select_for_update(skip_locked=True, of=('self',)).filter(pk__gt=dernier).order_by('pk')
+                .values_list('pk', 'paiement_id', 'paiement__reservation_id', 'montant')[:taille_lot]
+            )
+            if not lot:
+                break
+            pks, paiement_ids, reservation_ids, montants = zip(*lot)
+
+            liberer_reservations(reservation_ids, statut=Reservation.StatutReservation.REMBOURSEE)
+            Paiement.objects.filter(pk__in=paiement_ids).update(statut=Paiement.StatutPaiement.REFUNDED)
+            Remboursement.objects.filter(pk__in=pks).update(traite=True, date_traitement=maintenant)
+
+        bilan['traites'] += len(lot)
+        bilan['montant'] += sum(montants)
+        dernier = pks[-1]
+        if len(lot) < taille_lot:
+            break
+    return bilan
@@ -0,0 +1,136 @@
+"""
+Signaux de l'application : maintien des caches et index dérivés des réservations.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.utils import timezone
+from django.dispatch import receiver
+
+from .models import Billet, Client, Gare, Horaire, HoraireClasse, Modification, Paiement, Reservation, TicketBonus, Trajet, Ville
+from .documents import invalider_billet_pdf
+from .recherche import indexer_clients
+from .itineraires import invalider_jours, invalider_reseau
+from .inventaire import invalider_disponibilite
+from .synchronisation import journaliser
+from .tarification import rafraichir_horaire
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def invalider_documents_reservation(sender, instance, **kwargs):
+    invalider_billet_pdf(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Billet)
+@receiver([post_save, post_delete], sender=Paiement)
+def invalider_documents_lies(sender, instance, **kwargs):
+    invalider_billet_pdf(instance.reservation_id)
+
+
+@receiver(post_save, sender=Horaire)
+def invalider_documents_horaire(sender, instance, created, **kwargs):
+    # Les billets reprennent les dates du départ : un changement d'horaire les rend obsolètes
+    if not created:
+        invalider_billet_pdf(*instance.reservations.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Client)
+def indexer_client(sender, instance, **kwargs):
+    indexer_clients([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def indexer_utilisateur(sender, instance, created, **kwargs):
+    # Nom et identifiant du client sont portés par l'utilisateur
+    if not created:
+        indexer_clients(Client.objects.filter(user_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Horaire)
+def memoriser_jour_horaire(sender, instance, **kwargs):
+    # Jour de départ avant modification, pour recharger aussi l'ancienne journée
+    if instance.pk:
+        instance._date_depart_precedente = Horaire.objects.filter(pk=instance.pk).values_list(
+            'date_depart', flat=True
+        ).first()
+
+
+@receiver([post_save, post_delete], sender=Horaire)
+def invalider_reseau_horaire(sender, instance, **kwargs):
+    dates = [instance.date_depart, getattr(instance, '_date_depart_precedente', None)]
+    invalider_jours(*(timezone.localdate(date) for date in dates if date))
+
+
+@receiver([post_save, post_delete], sender=Horaire)
+def invalider_disponibilite_horaire(sender, instance, **kwargs):
+    # Prix et places des calendriers de tarifs
+    invalider_disponibilite()
+
+
+@receiver(post_save, sender=Horaire)
+def rafraichir_tarifs_horaire(sender, instance, **kwargs):
+    rafraichir_horaire(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=HoraireClasse)
+def invalider_classe_horaire(sender, instance, **kwargs):
+    # Prix ou capacité d'une classe modifiés hors des opérations d'inventaire
+    invalider_disponibilite()
+    rafraichir_horaire(instance.horaire_id)
+    depart = Horaire.objects.filter(pk=instance.horaire_id).values_list('date_depart', flat=True).first()
+    if depart:
+        invalider_jours(timezone.localdate(depart))
+
+
+@receiver([post_save, post_delete], sender=Trajet)
+def invalider_reseau_trajet(sender, instance, **kwargs):
+    invalider_reseau()
+
+
+@receiver([post_save, post_delete], sender=Gare)
+@receiver([post_save, post_delete], sender=Ville)
+def invalider_reseau_gare(sender, instance, **kwargs):
+    # Noms des gares et des villes repris par l'API (voir api.py)
+    invalider_reseau()
+
+
+# Journal de la synchronisation incrémentale (voir synchronisation.py)
+TYPES_SYNCHRONISES = {
+    Ville: Modification.TypeObjet.VILLE,
+    Gare: Modification.TypeObjet.GARE,
+    Trajet: Modification.TypeObjet.TRAJET,
+    Horaire: Modification.TypeObjet.HORAIRE,
+}
+
+
+@receiver(post_save, sender=Ville)
+@receiver(post_save, sender=Gare)
+@receiver(post_save, sender=Trajet)
+@receiver(post_save, sender=Horaire)
+def journaliser_enregistrement(sender, instance, **kwargs):
+    journaliser(TYPES_SYNCHRONISES[sender], [instance.pk])
+
+
+@receiver(post_delete, sender=Ville)
+@receiver(post_delete, sender=Gare)
+@receiver(post_delete, sender=Trajet)
+@receiver(post_delete, sender=Horaire)
+def journaliser_suppression(sender, instance, **kwargs):
+    journaliser(TYPES_SYNCHRONISES[sender], [instance.pk], supprime=True)
+
+
+@receiver([post_save, post_delete], sender=HoraireClasse)
+def journaliser_classe_horaire(sender, instance, **kwargs):
+    # Prix et places font partie de l'horaire synchronisé
+    journaliser(Modification.TypeObjet.HORAIRE, [instance.horaire_id])
+
+
+@receiver(post_save, sender=TicketBonus)
+def journaliser_ticket_bonus(sender, instance, **kwargs):
+    journaliser(Modification.TypeObjet.TICKET_BONUS, [instance.pk], proprietaires=[instance.client_id])
+
+
+@receiver(post_delete, sender=TicketBonus)
+def journaliser_suppression_ticket_bonus(sender, instance, **kwargs):
+    journaliser(
+        Modification.TypeObjet.TICKET_BONUS, [instance.pk], supprime=True, proprietaires=[instance.client_id]
+    )
@@ -0,0 +1,187 @@
+"""
+Synchronisation incrémentale des copies du réseau et des horaires tenues
+par l'application mobile et les agences partenaires.
+
+Chaque enregistrement ou suppression d'une ville, d'une gare, d'un trajet,
+d'un horaire (places et prix de ses classes compris) ou d'un ticket bonus
+ajoute une ligne au journal Modification : par les signaux pour les
+enregistrements unitaires, par journaliser() pour les opérations en masse
+(update, bulk_create, bulk_update), qui n'en émettent pas. L'id de la ligne
+est le numéro de séquence de la modification.
+
+La ligne est insérée une fois la transaction de la modification validée,
+par une courte transaction qui ne contient que cet INSERT : une longue
+transaction (ajustement des tarifs, génération des horaires, lots de
+remboursements...) n'occupe donc pas un numéro pendant toute sa durée, et
+une transaction annulée n'est pas journalisée. En contrepartie, une
+modification validée n'est pas journalisée si le processus s'arrête entre
+les deux transactions (un échec de l'insertion est journalisé) : seule une
+synchronisation complète du client la rattrape.
+
+Un client demande d'abord /sync sans jeton, qui retourne le numéro de
+séquence courant, puis charge les listes complètes de /api/v1/. Il demande
+ensuite /sync?since=<jeton> et reçoit, pour au plus TAILLE_LOT lignes du
+journal, l'état actuel des objets modifiés depuis (mêmes champs que
+/api/v1/), les identifiants des objets supprimés et le jeton de la demande
+suivante ; « suite » indique qu'un autre lot est déjà disponible. Les
+tickets bonus ne sont transmis qu'à leur propriétaire connecté.
+
+Les insertions simultanées ne sont pas validées dans l'ordre de leurs
+numéros : une ligne du journal peut apparaître après une ligne plus
+récente. Le flux s'arrête donc avant un numéro manquant tant que la ligne
+qui le suit a moins de DELAI_STABILISATION secondes ; chaque insertion
+étant validée aussitôt, un numéro qui manque encore après ce délai est
+celui d'une insertion échouée.
+
+Le journal est purgé après CONSERVATION_JOURS jours (commande
+purger_modifications) ; un client dont le jeton est plus ancien reçoit une
+réponse 410 et recommence par une synchronisation complète.
+
+    SYNCHRONISATION = {
+        'TAILLE_LOT': 1000,
+        'DELAI_STABILISATION': 30,   # secondes
+        'CONSERVATION_JOURS': 30,
+    }
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import Modification
+
+PARAMETRES_PAR_DEFAUT = {
+    'TAILLE_LOT': 1000,
+    'DELAI_STABILISATION': 30,
+    'CONSERVATION_JOURS': 30,
+}
+
+TAILLE_LOT_PURGE = 5000
+
+logger = logging.getLogger(__name__)
+
+Type = Modification.TypeObjet
+
+
+class JetonInvalide(ValueError):
+    """Jeton illisible, ou antérieur à la purge du journal : synchronisation complète nécessaire"""
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'SYNCHRONISATION', {})}
+
+
+def journaliser(type_objet, objet_ids, supprime=False, proprietaires=None):
+    """
+    Ajoute au journal une ligne par objet de `objet_ids`, après la
+    validation de la transaction en cours. Pour des objets réservés à un
+    client, `proprietaires` donne l'id du client de chacun.
+    """
+    objet_ids = list(objet_ids)
+    if not objet_ids:
+        return
+    proprietaires = [None] * len(objet_ids) if proprietaires is None else list(proprietaires)
+
+    def inserer():
+        try:
+            with transaction.atomic():
+                maintenant = timezone.now()
+                Modification.objects.bulk_create([
+                    Modification(
+                        type_objet=type_objet, objet_id=pk, proprietaire=proprietaire, supprime=supprime,
+                        date=maintenant,
+                    )
+                    for pk, proprietaire in zip(objet_ids, proprietaires)
+                ], batch_size=TAILLE_LOT_PURGE)
+        except Exception:
+            logger.exception("Journalisation de %d modification(s) %s impossible", len(objet_ids), type_objet)
+    transaction.on_commit(inserer)
+
+
+def sequence_courante():
+    """Numéro de la dernière modification journalisée (jeton d'une synchronisation complète)"""
+    return Modification.objects.aggregate(dernier=Max('id'))['dernier'] or 0
+
+
+def lire_jeton(jeton):
+    try:
+        depuis = int(jeton)
+    except (TypeError, ValueError):
+        raise JetonInvalide(jeton)
+    if depuis < 0:
+        raise JetonInvalide(jeton)
+    return depuis
+
+
+def modifications(depuis, client_id=None, taille_lot=None, maintenant=None):
+    """
+    Objets modifiés après le numéro `depuis`, dans au plus `taille_lot`
+    lignes du journal. Retourne ({type: {id: supprimé}}, numéro de la
+    dernière ligne lue, suite) ; lève JetonInvalide si des lignes
+    postérieures à `depuis` ont été purgées.
+    """
+    reglages = parametres()
+    taille_lot = taille_lot or reglages['TAILLE_LOT']
+    stabilisation = (maintenant or timezone.now()) - timedelta(seconds=reglages['DELAI_STABILISATION'])
+
+    bornes = Modification.objects.aggregate(premier=Min('id'), dernier=Max('id'))
+    if bornes['premier'] is not None and not bornes['premier'] - 1 <= depuis <= bornes['dernier']:
+        raise JetonInvalide(depuis)
+
+    lignes = list(
+        Modification.objects.filter(id__gt=depuis).order_by('id')
+        .values_list('id', 'type_objet', 'objet_id', 'proprietaire', 'supprime', 'date')[:taille_lot]
+    )
+    objets = defaultdict(dict)
+    dernier = depuis
+    for numero, type_objet, objet_id, proprietaire, supprime, date in lignes:
+        if numero != dernier + 1 and date > stabilisation:
+            # Un numéro plus ancien appartient peut-être à une transaction pas encore validée
+            return objets, dernier, False
+        dernier = numero
+        if proprietaire is None or proprietaire == client_id:
+            # La dernière ligne d'un objet donne son état
+            objets[type_objet][objet_id] = supprime
+    return objets, dernier, len(lignes) == taille_lot
+
+
+def flux(depuis, client_id=None, taille_lot=None):
+    """
+    Réponse de /sync?since=`depuis` : état actuel des objets modifiés,
+    identifiants des objets supprimés, jeton suivant.
+    """
+    from . import api
+
+    objets, dernier, suite = modifications(depuis, client_id, taille_lot)
+    modifies, supprimes = {}, {}
+    for type_objet, etats in objets.items():
+        ressource = api.RESSOURCES.get(type_objet) or api.RESSOURCES_CLIENT[type_objet]
+        queryset = ressource.modele.objects.filter(pk__in=[pk for pk, supprime in etats.items() if not supprime])
+        if type_objet == Type.TICKET_BONUS:
+            queryset = queryset.filter(client_id=client_id)
+        resultats, _suivant, _precedent, _pks = api.lire(ressource, queryset, ressource.champs)
+        presents = {resultat['id'] for resultat in resultats}
+        if resultats:
+            modifies[type_objet] = resultats
+        # Objet supprimé, ou modifié puis supprimé dans une transaction validée depuis
+        absents = sorted(pk for pk in etats if pk not in presents)
+        if absents:
+            supprimes[type_objet] = absents
+    return {'jeton': str(dernier), 'suite': suite, 'modifies': modifies, 'supprimes': supprimes}
+
+
+def purger_modifications(avant, taille_lot=TAILLE_LOT_PURGE):
+    """Supprime, par lots, les lignes du journal antérieures à `avant` ; retourne leur nombre"""
+    total = 0
+    while True:
+        lot = list(Modification.objects.filter(date__lt=avant).values_list('pk', flat=True)[:taille_lot])
+        if not lot:
+            break
+        total += Modification.objects.filter(pk__in=lot).delete()[0]
+        if len(lot) < taille_lot:
+            break
+    return total
@@ -0,0 +1,261 @@
+"""
+Tarification dynamique des horaires (yield management).
+
+Le prix courant d'une classe est le prix de base saisi par l'équipe, multiplié
+par un coefficient de remplissage (places vendues / capacité) et par un
+coefficient d'anticipation (jours avant le départ), puis arrondi.
+
+Les prix courants ne sont pas recalculés à chaque requête : ils sont stockés
+dans une table de consultation (horaire -> prix des trois classes et date de
+fin de validité), rafraîchie après chaque vente ou restitution de places et
+lorsque le palier d'anticipation change. Une consultation est une lecture de
+cache, quel que soit le nombre d'horaires.
+
+Le moteur est désactivé par défaut ; il s'active et se règle avec le
+paramètre TARIFICATION_DYNAMIQUE :
+
+    TARIFICATION_DYNAMIQUE = {
+        'ACTIVE': True,
+        # (taux de remplissage strictement inférieur à, coefficient)
+        'PALIERS_REMPLISSAGE': [(0.5, '1.00'), (0.75, '1.10'), (0.9, '1.25'), (1.01, '1.40')],
+        # (jours avant le départ au moins, coefficient)
+        'PALIERS_ANTICIPATION': [(30, '0.90'), (7, '1.00'), (2, '1.10'), (0, '1.20')],
+        'ARRONDI': 100,
+        'DUREE_DEVIS_MINUTES': 15,
+    }
+"""
+import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Horaire, HoraireClasse
+
+CLASSES = ('STD', 'BUS', 'PRE')
+
+PARAMETRES_PAR_DEFAUT = {
+    'ACTIVE': False,
+    'PALIERS_REMPLISSAGE': [(0.5, '1.00'), (0.75, '1.10'), (0.9, '1.25'), (1.01, '1.40')],
+    'PALIERS_ANTICIPATION': [(30, '0.90'), (7, '1.00'), (2, '1.10'), (0, '1.20')],
+    'ARRONDI': 100,
+    'DUREE_DEVIS_MINUTES': 15,
+}
+
+CLE_SESSION_DEVIS = 'devis_tarifs'
+
+# Valeurs décrivant un horaire pour le calcul de ses prix (voir charger_lignes)
+COLONNES = (
+    'pk', 'date_depart',
+    'prix_STD', 'prix_BUS', 'prix_PRE',
+    'places_STD', 'places_BUS', 'places_PRE',
+    'capacite_STD', 'capacite_BUS', 'capacite_PRE',
+)
+
+
+def parametres():
+    return {**PARAMETRES_PAR_DEFAUT, **getattr(settings, 'TARIFICATION_DYNAMIQUE', {})}
+
+
+def est_active():
+    return parametres()['ACTIVE']
+
+
+def coefficient_remplissage(vendus, capacite, paliers):
+    taux = vendus / capacite if capacite else 1
+    for seuil, coefficient in paliers:
+        if taux < seuil:
+            return Decimal(coefficient)
+    return Decimal(paliers[-1][1])
+
+
+def palier_anticipation(depart, maintenant, paliers):
+    """
+    Coefficient d'anticipation et instant où il cesse de s'appliquer (passage
+    au palier suivant, ou départ).
+    """
+    delai = depart - maintenant
+    for jours, coefficient in paliers:
+        limite = datetime.timedelta(days=jours)
+        if delai >= limite:
+            return Decimal(coefficient), depart - limite
+    return Decimal(paliers[-1][1]), depart
+
+
+def calculer_tarifs(ligne, maintenant, reglages):
+    """
+    Prix courants des trois classes d'un horaire décrit par `ligne` (valeurs
+    de COLONNES) et fin de validité de ces prix.
+    """
+    _pk, depart, *valeurs = ligne
+    prix_base, places, capacites = valeurs[0:3], valeurs[3:6], valeurs[6:9]
+    anticipation, expiration = palier_anticipation(depart, maintenant, reglages['PALIERS_ANTICIPATION'])
+    arrondi = Decimal(reglages['ARRONDI'])
+
+    prix = []
+    for base, restantes, capacite in zip(prix_base, places, capacites):
+        coefficient = coefficient_remplissage(capacite - restantes, capacite, reglages['PALIERS_REMPLISSAGE'])
+        valeur = Decimal(base) * coefficient * anticipation
+        prix.append((valeur / arrondi).quantize(Decimal('1'), rounding=ROUND_HALF_UP) * arrondi)
+    return expiration.timestamp(), tuple(prix)
+
+
+def charger_lignes(horaire_ids):
+    """
+    Lignes de COLONNES des horaires indiqués, assemblées à partir de leurs
+    classes (deux requêtes quel que soit le nombre d'horaires). Une classe
+    absente a un prix et une capacité nuls.
+    """
+    classes = {}
+    for horaire, classe, prix, capacite, vendus in HoraireClasse.objects.filter(
+        horaire_id__in=horaire_ids
+    ).values_list('horaire_id', 'classe', 'prix', 'capacite', 'vendus'):
+        classes[(horaire, classe)] = (prix, max(capacite - vendus, 0), capacite)
+
+    lignes = []
+    for pk, depart in Horaire.objects.filter(pk__in=horaire_ids).values_list('pk', 'date_depart'):
+        valeurs = [classes.get((pk, classe), (Decimal('0'), 0, 0)) for classe in CLASSES]
+        lignes.append((pk, depart, *(colonne for colonnes in zip(*valeurs) for colonne in colonnes)))
+    return lignes
+
+
+class StockageLocal:
+    """Stockage en mémoire du processus, avec l'interface get_many/set_many du cache"""
+
+    def __init__(self):
+        self.donnees = {}
+
+    def get_many(self, cles):
+        return {cle: self.donnees[cle] for cle in cles if cle in self.donnees}
+
+    def set_many(self, valeurs, timeout=None):
+        self.donnees.update(valeurs)
+
+
+class TableTarifs:
+    """
+    Table de consultation des prix courants : une entrée par horaire,
+    (fin de validité, (prix STD, prix BUS, prix PRE)).
+
+    Les clés portent un numéro de génération : invalider() rend toutes les
+    entrées obsolètes d'un coup (après une modification de prix en masse).
+    Avec le cache par défaut, la génération et les entrées ne sont communes
+    aux workers et aux commandes de gestion que si ce cache est partagé
+    (CACHES dans settings.py).
+    """
+    prefixe = 'tarifs:horaire'
+    cle_generation = 'tarifs:generation'
+    duree_stockage = 24 * 3600
+
+    def __init__(self, stockage=cache, chargeur=charger_lignes):
+        self.stockage = stockage
+        self.chargeur = chargeur
+
+    def generation(self):
+        return self.stockage.get_many([self.cle_generation]).get(self.cle_generation, 0)
+
+    def invalider(self):
+        self.stockage.set_many({self.cle_generation: self.generation() + 1}, None)
+
+    def rafraichir(self, horaire_ids, maintenant=None, generation=None):
+        """Recalcule les entrées des horaires indiqués, en une requête"""
+        maintenant = maintenant or timezone.now()
+        generation = self.generation() if generation is None else generation
+        reglages = parametres()
+        entrees = {
+            ligne[0]: calculer_tarifs(ligne, maintenant, reglages)
+            for ligne in self.chargeur(list(horaire_ids))
+        }
+        self.stockage.set_many(
+            {f'{self.prefixe}:{generation}:{pk}': entree for pk, entree in entrees.items()}, self.duree_stockage
+        )
+        return entrees
+
+    def tarifs(self, horaire_ids, maintenant=None):
+        """{horaire_id: {classe: prix}} ; les entrées absentes ou périmées sont recalculées"""
+        maintenant = maintenant or timezone.now()
+        horodatage = maintenant.timestamp()
+        generation = self.generation()
+        cles = {f'{self.prefixe}:{generation}:{pk}': pk for pk in horaire_ids}
+        entrees = {cles[cle]: entree for cle, entree in self.stockage.get_many(list(cles)).items()}
+
+        a_recalculer = [pk for pk in cles.values() if pk not in entrees or entrees[pk][0] <= horodatage]
+        if a_recalculer:
+            entrees.update(self.rafraichir(a_recalculer, maintenant, generation))
+        return {pk: dict(zip(CLASSES, entree[1])) for pk, entree in entrees.items()}
+
+    def prix(self, horaire_id, classe, maintenant=None):
+        return self.tarifs([horaire_id], maintenant)[horaire_id][classe]
+
+
+table_tarifs = TableTarifs()
+
+
+def rafraichir_horaire(horaire_id):
+    """À appeler après toute modification des places ou des prix d'un horaire"""
+    if est_active():
+        transaction.on_commit(lambda: table_tarifs.rafraichir([horaire_id]))
+
+
+def invalider_tarifs():
+    """À appeler après une modification en masse des horaires"""
+    if est_active():
+        transaction.on_commit(table_tarifs.invalider)
+
+
+def appliquer_tarifs(horaires):
+    """
+    Renseigne les prix courants des horaires à afficher (listes de départs),
+    lus en une consultation de la table : leurs prix et leur prix minimum
+    sont alors ceux qui seront facturés. Sans effet si la tarification
+    dynamique est désactivée. Retourne la liste des horaires.
+    """
+    horaires = list(horaires)
+    if est_active() and horaires:
+        tarifs = table_tarifs.tarifs([horaire.pk for horaire in horaires])
+        for horaire in horaires:
+            horaire.tarifs_courants = tarifs[horaire.pk]
+    return horaires
+
+
+def tarifs_courants(horaire):
+    """Prix courants des trois classes de `horaire`"""
+    if not est_active():
+        return {classe: horaire.get_prix_par_type(classe) for classe in CLASSES}
+    return table_tarifs.tarifs([horaire.pk])[horaire.pk]
+
+
+def coter(session, horaire):
+    """
+    Retourne les prix courants de `horaire` et les garantit dans la session
+    pendant DUREE_DEVIS_MINUTES : une réservation faite dans ce délai paie le
+    prix affiché, même si le tarif a augmenté entre-temps.
+    """
+    tarifs = tarifs_courants(horaire)
+    maintenant = timezone.now()
+    expiration = maintenant + datetime.timedelta(minutes=parametres()['DUREE_DEVIS_MINUTES'])
+
+    devis = {
+        cle: valeur for cle, valeur in session.get(CLE_SESSION_DEVIS, {}).items()
+        if valeur['expire'] > maintenant.timestamp()
+    }
+    devis[str(horaire.pk)] = {
+        'prix': {classe: str(prix) for classe, prix in tarifs.items()},
+        'expire': expiration.timestamp(),
+    }
+    session[CLE_SESSION_DEVIS] = devis
+    return tarifs
+
+
+def prix_reservation(session, horaire, classe):
+    """
+    Prix à facturer : le prix courant, plafonné par celui du devis s'il est
+    encore valide.
+    """
+    prix = tarifs_courants(horaire)[classe]
+    devis = session.get(CLE_SESSION_DEVIS, {}).get(str(horaire.pk))
+    if devis and devis['expire'] > timezone.now().timestamp():
+        prix = min(prix, Decimal(devis['prix'][classe]))
+    return prix
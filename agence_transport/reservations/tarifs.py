@@ -0,0 +1,102 @@
+"""
+Ajustement en masse des prix et des places des horaires.
+
+Les modifications sont appliquées par un seul UPDATE ensembliste sur les
+classes des horaires (HoraireClasse) avec des expressions F, sans charger les
+horaires en Python ; l'aperçu (dry-run) est calculé par agrégation sur la
+même sélection.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count, DecimalField, F, IntegerField, Max, Min, Q, Sum, Value
+from django.db.models.functions import Greatest, Round
+
+from .inventaire import invalider_disponibilite
+from .itineraires import invalider_reseau
+from .models import HoraireClasse, TypeBillet
+from .synchronisation import Type, journaliser
+from .tarification import invalider_tarifs
+
+CLASSES = TypeBillet.values
+
+
+class AjustementInvalide(ValueError):
+    """Paramètres d'ajustement incohérents"""
+
+
+def expression_prix(pourcentage=None, montant=None):
+    """
+    Nouveau prix d'une classe : variation en pourcentage ou montant ajouté,
+    arrondi à l'unité et jamais négatif.
+    """
+    sortie = DecimalField(max_digits=10, decimal_places=2)
+    if pourcentage is not None:
+        expression = F('prix') * Value(1 + Decimal(pourcentage) / 100, output_field=sortie)
+    else:
+        expression = F('prix') + Value(Decimal(montant), output_field=sortie)
+    return Greatest(Round(expression, 0, output_field=sortie), Value(Decimal('0'), output_field=sortie), output_field=sortie)
+
+
+def _modifications(pourcentage, montant, places):
+    if pourcentage is not None and montant is not None:
+        raise AjustementInvalide("Indiquer un pourcentage ou un montant, pas les deux.")
+    if pourcentage is None and montant is None and not places:
+        raise AjustementInvalide("Aucune modification demandée.")
+
+    modifications = {}
+    if pourcentage is not None or montant is not None:
+        modifications['prix'] = expression_prix(pourcentage, montant)
+    if places:
+        # La capacité ne descend pas sous les places déjà vendues
+        modifications['capacite'] = Greatest(F('capacite') + places, F('vendus'), output_field=IntegerField())
+    return modifications
+
+
+def ajuster_horaires(queryset, pourcentage=None, montant=None, places=0, classes=None, appliquer=True):
+    """
+    Applique aux horaires de `queryset` une variation de prix (`pourcentage`
+    ou `montant`) et/ou de places (`places`, positif ou négatif) pour les
+    classes `classes` (toutes par défaut).
+
+    Retourne l'aperçu calculé avant modification : nombre d'horaires et, pour
+    chaque classe, prix minimum, moyen et maximum avant et après (ou total des
+    places restantes). Avec `appliquer=False`, rien n'est modifié.
+    """
+    classes = list(classes or CLASSES)
+    modifications = _modifications(pourcentage, montant, places)
+    lignes = HoraireClasse.objects.filter(horaire__in=queryset.order_by().values('pk'), classe__in=classes)
+
+    agregats = {'nombre': Count('horaire_id', distinct=True)}
+    for classe in classes:
+        filtre = Q(classe=classe)
+        if 'prix' in modifications:
+            prix = modifications['prix']
+            agregats.update({
+                f'prix_{classe}_min_avant': Min('prix', filter=filtre),
+                f'prix_{classe}_moyen_avant': Avg('prix', filter=filtre),
+                f'prix_{classe}_max_avant': Max('prix', filter=filtre),
+                f'prix_{classe}_min_apres': Min(prix, filter=filtre),
+                f'prix_{classe}_moyen_apres': Avg(prix, filter=filtre),
+                f'prix_{classe}_max_apres': Max(prix, filter=filtre),
+            })
+        if 'capacite' in modifications:
+            agregats.update({
+                f'places_{classe}_avant': Sum(F('capacite') - F('vendus'), filter=filtre, output_field=IntegerField()),
+                f'places_{classe}_apres': Sum(
+                    modifications['capacite'] - F('vendus'), filter=filtre, output_field=IntegerField()
+                ),
+            })
+
+    apercu = lignes.aggregate(**agregats)
+
+    if appliquer and apercu['nombre']:
+        with transaction.atomic():
+            journaliser(Type.HORAIRE, lignes.order_by().values_list('horaire_id', flat=True).distinct())
+            lignes.update(**modifications)
+            apercu['modifies'] = apercu['nombre']
+            # Les mises à jour en masse n'émettent pas de signaux
+            invalider_disponibilite()
+            invalider_tarifs()
+            transaction.on_commit(invalider_reseau)
+    return apercu
@@ -1,3 +1,1549 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .blocages import creer_blocage, liberer_blocages_expires
+from .calendrier import calendrier_tarifs
+from .confirmations import DELAI_PAIEMENT_INCONNU, enregistrer_statuts, traiter_notifications
+from .documents import cle_cache_billet, lire_payload_qr, payload_qr
+from .fidelite import crediter_reservation, debiter_reservations, envoyer_rappels, expirer_tickets, recalculer_soldes
+from .grilles import generer_horaires
+from . import itineraires, metriques, profilage
+from .idempotence import _reserver, delai_traitement, duree_conservation, empreinte_requete, executer_idempotent
+from .itineraires import Reseau, planifier
+from .inventaire import liberer_reservation, reconcilier_places, restituer_places, retenir_places
+from .journalisation import FiltreIdentifiantRequete, FormateurJSON, GestionnaireFile, identifiant_requete
+from .models import (
+    Billet, BlocagePlaces, CleIdempotence, Client, EvenementPaiement, Gare, GrilleHoraire, Horaire, HoraireClasse, Modification, MouvementFidelite, Paiement,
+    Remboursement, Reservation, TicketBonus, Trajet, Ville,
+)
+from .pagination import CurseurInvalide, decoder_curseur, paginer
+from .passerelles import ACCEPTE, REFUSE, OperateurIndisponible, PasserelleFictive, PasserelleMobile, passerelle
+from .passerelles import parametres as parametres_passerelles
+from .rapprochement import LIGNE_EN_DOUBLE, LIGNE_ILLISIBLE, MONTANT_DIFFERENT, REFERENCE_INCONNUE, rapprocher
+from .recherche import rechercher_reservations
+from .remboursements import (
+    demander_remboursement, demander_remboursements_depart, montant_rembourse, taux_annulation, traiter_remboursements,
+)
+from .synchronisation import modifications, sequence_courante
+from .tarifs import AjustementInvalide, ajuster_horaires
+from .tarification import prix_reservation, tarifs_courants
+
+
+class DonneesReservationMixin:
+    """Horaire avec une classe Standard de 40 places et un client"""
+
+    @classmethod
+    def setUpTestData(cls):
+        villes = [Ville.objects.create(nom=nom, code=code) for nom, code in (('Bujumbura', 'BJM'), ('Gitega', 'GIT'))]
+        gares = [Gare.objects.create(nom='Gare centrale', ville=ville, adresse='-') for ville in villes]
+        trajet = Trajet.objects.create(
+            depart=gares[0], arrivee=gares[1], duree=datetime.timedelta(hours=2), distance=100
+        )
+        depart = timezone.now() + datetime.timedelta(days=2)
+        cls.horaire = Horaire.objects.create(
+            trajet=trajet, date_depart=depart, date_arrivee=depart + datetime.timedelta(hours=2)
+        )
+        HoraireClasse.objects.create(
+            horaire=cls.horaire, classe=Billet.TypeBillet.STANDARD, prix=Decimal('10000'), capacite=40
+        )
+        cls.user = User.objects.create_user('client', 'client@example.com', 'motdepasse')
+        cls.client_reservation = Client.objects.create(user=cls.user)
+
+    def places_vendues(self):
+        return HoraireClasse.objects.get(horaire=self.horaire, classe=Billet.TypeBillet.STANDARD).vendus
+
+    def client_actuel(self):
+        return Client.objects.get(pk=self.client_reservation.pk)
+
+    def reserver(self, nombre=1, prix=Decimal('10000'), statut=Reservation.StatutReservation.EN_ATTENTE, reference='RES-1'):
+        self.assertTrue(retenir_places(self.horaire.pk, Billet.TypeBillet.STANDARD, nombre))
+        reservation = Reservation.objects.create(
+            client=self.client_reservation, horaire=self.horaire, montant_total=prix * nombre,
+            reference=reference, statut=statut,
+        )
+        for numero in range(nombre):
+            Billet.objects.create(
+                reservation=reservation, type_billet=Billet.TypeBillet.STANDARD, prix=prix, siege=f'STD-{numero + 1}'
+            )
+        return reservation
+
+
+class BilletPDFTests(DonneesReservationMixin, TestCase):
+    """Billets PDF d'une réservation, seulement une fois payée"""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def telecharger(self, reservation):
+        return self.client.get(reverse('reservations:billet-pdf', args=[reservation.pk]))
+
+    def test_reservation_payee(self):
+        for statut in (Reservation.StatutReservation.CONFIRMEE, Reservation.StatutReservation.UTILISEE):
+            with self.subTest(statut=statut):
+                response = self.telecharger(self.reserver(statut=statut, reference=f'RES-{statut}'))
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_pas_de_billet_sans_paiement_valable(self):
+        statuts = (
+            Reservation.StatutReservation.EN_ATTENTE,
+            Reservation.StatutReservation.ANNULEE,
+            Reservation.StatutReservation.REMBOURSEE,
+        )
+        for statut in statuts:
+            with self.subTest(statut=statut):
+                response = self.telecharger(self.reserver(statut=statut, reference=f'RES-{statut}'))
+
+                self.assertEqual(response.status_code, 404)
+
+    def test_reservation_d_un_autre_client(self):
+        reservation = self.reserver(statut=Reservation.StatutReservation.CONFIRMEE)
+        self.client.force_login(User.objects.create_user('autre', 'autre@example.com', 'motdepasse'))
+
+        self.assertEqual(self.telecharger(reservation).status_code, 403)
+
+
+    def test_pdf_regenere_apres_modification(self):
+        reservation = self.reserver(statut=Reservation.StatutReservation.CONFIRMEE)
+        self.telecharger(reservation)
+        self.assertIsNotNone(cache.get(cle_cache_billet(reservation.pk)))
+
+        reservation.statut = Reservation.StatutReservation.UTILISEE
+        reservation.save()
+
+        self.assertIsNone(cache.get(cle_cache_billet(reservation.pk)))
+
+    def test_payload_qr_signe(self):
+        billet = self.reserver(statut=Reservation.StatutReservation.CONFIRMEE).billets.get()
+        payload = payload_qr(billet)
+
+        self.assertEqual(lire_payload_qr(payload), {'r': 'RES-1', 'b': billet.pk, 's': 'STD-1'})
+        with self.assertRaises(signing.BadSignature):
+            lire_payload_qr(payload[:-2] + ('A' if payload[-2] != 'A' else 'B') + payload[-1])
+
+
+class ManifesteTests(DonneesReservationMixin, TestCase):
+    """Manifeste passagers d'un départ"""
+
+    def manifeste(self, **parametres):
+        return self.client.get(reverse('reservations:horaire-manifeste', args=[self.horaire.pk]), parametres)
+
+    def test_csv_sans_reservations_annulees(self):
+        self.reserver(nombre=2, statut=Reservation.StatutReservation.CONFIRMEE, reference='RES-OK')
+        self.reserver(statut=Reservation.StatutReservation.ANNULEE, reference='RES-ANNULEE')
+        self.client.force_login(User.objects.create_user('agent', 'agent@example.com', 'motdepasse', is_staff=True))
+
+        response = self.manifeste(format='csv')
+
+        self.assertEqual(response.status_code, 200)
+        lignes = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lignes[0], 'Siège;Classe;Passager;Téléphone;Réservation')
+        self.assertEqual([ligne.split(';')[0] for ligne in lignes[1:]], ['STD-1', 'STD-2'])
+        self.assertNotIn('RES-ANNULEE', '\n'.join(lignes))
+
+    def test_pdf(self):
+        self.reserver(statut=Reservation.StatutReservation.CONFIRMEE)
+        self.client.force_login(User.objects.create_user('agent', 'agent@example.com', 'motdepasse', is_staff=True))
+
+        response = self.manifeste()
+
+        contenu = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(contenu.startswith(b'%PDF-'))
+        self.assertTrue(contenu.rstrip().endswith(b'%%EOF'))
+
+    def test_reserve_a_l_equipe(self):
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.manifeste().status_code, 403)
+
+
+class PaginationCurseurTests(DonneesReservationMixin, TestCase):
+    """Pagination par curseur des listes de réservations"""
+
+    ordre = ['-date_reservation', '-id']
+
+    def setUp(self):
+        self.reservations = [self.reserver(reference=f'RES-{numero}') for numero in range(5)]
+        # Dates identiques : l'id départage les lignes
+        Reservation.objects.update(date_reservation=timezone.now())
+        self.attendu = [reservation.pk for reservation in reversed(self.reservations)]
+
+    def test_parcours_dans_les_deux_sens(self):
+        pages, jeton = [], None
+        while True:
+            lignes, suivant, precedent = paginer(Reservation.objects.all(), self.ordre, 2, jeton)
+            pages.append([reservation.pk for reservation in lignes])
+            self.assertEqual(precedent is None, jeton is None)
+            if suivant is None:
+                break
+            jeton = suivant
+        self.assertEqual(pages, [self.attendu[0:2], self.attendu[2:4], self.attendu[4:]])
+
+        lignes, suivant, precedent = paginer(Reservation.objects.all(), self.ordre, 2, precedent)
+        self.assertEqual([reservation.pk for reservation in lignes], self.attendu[2:4])
+        lignes, suivant, precedent = paginer(Reservation.objects.all(), self.ordre, 2, precedent)
+        self.assertEqual([reservation.pk for reservation in lignes], self.attendu[0:2])
+        self.assertIsNone(precedent)
+
+    def test_jeton_altere(self):
+        champs = [Reservation._meta.get_field('date_reservation'), Reservation._meta.get_field('id')]
+        for jeton in ('pas-un-jeton', 'WyJ4IiwxXQ'):
+            with self.subTest(jeton=jeton), self.assertRaises(CurseurInvalide):
+                decoder_curseur(jeton, champs)
+
+        # Dans une vue, un jeton altéré ramène à la première page
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('reservations:mes-reservations'), {'curseur': 'pas-un-jeton'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([reservation.pk for reservation in response.context['reservations']], self.attendu)
+
+
+class BlocageTicketBonusTests(DonneesReservationMixin, TestCase):
+    """Ticket bonus d'une réservation abandonnée avant le paiement"""
+
+    def setUp(self):
+        self.ticket = TicketBonus.creer_ticket_bonus(self.client_reservation)
+
+    def reserver_avec_ticket(self):
+        self.assertTrue(self.ticket.utiliser())
+        reservation = self.reserver(prix=Decimal('0'))
+        blocage = creer_blocage(reservation, Billet.TypeBillet.STANDARD, 1, ticket_bonus=self.ticket)
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 0)
+        return reservation, blocage
+
+    def assertTicketRendu(self, reservation):
+        self.ticket.refresh_from_db()
+        self.assertFalse(self.ticket.utilise)
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 1)
+        self.assertTrue(MouvementFidelite.objects.filter(
+            type=MouvementFidelite.TypeMouvement.RESTITUTION, ticket=self.ticket, reservation=reservation
+        ).exists())
+
+    def test_expiration_du_blocage_rend_le_ticket(self):
+        reservation, blocage = self.reserver_avec_ticket()
+
+        liberes = liberer_blocages_expires(maintenant=blocage.expire_le + datetime.timedelta(seconds=1))
+
+        self.assertEqual(liberes, 1)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.statut, Reservation.StatutReservation.ANNULEE)
+        self.assertEqual(self.places_vendues(), 0)
+        self.assertTicketRendu(reservation)
+
+        # Un second balayage ne rend rien de plus
+        self.assertEqual(liberer_blocages_expires(maintenant=blocage.expire_le + datetime.timedelta(seconds=1)), 0)
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 1)
+
+    def test_annulation_avant_paiement_rend_le_ticket(self):
+        reservation, _blocage = self.reserver_avec_ticket()
+
+        liberer_reservation(reservation)
+
+        self.assertFalse(BlocagePlaces.objects.filter(reservation=reservation).exists())
+        self.assertTicketRendu(reservation)
+
+    def test_ticket_rendu_reutilisable(self):
+        _reservation, blocage = self.reserver_avec_ticket()
+        liberer_blocages_expires(maintenant=blocage.expire_le + datetime.timedelta(seconds=1))
+
+        self.ticket.refresh_from_db()
+        self.assertTrue(self.ticket.utiliser())
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 0)
+
+
+class FideliteTests(DonneesReservationMixin, TestCase):
+    """Crédit, débit et recalcul des compteurs de fidélité (un ticket bonus toutes les 5 places)"""
+
+    def reserver_payee(self, nombre, reference):
+        return self.reserver(nombre=nombre, statut=Reservation.StatutReservation.CONFIRMEE, reference=reference)
+
+    def soldes(self):
+        client = self.client_actuel()
+        return client.places_reservees, client.points_fidelite, client.tickets_bonus_valides
+
+    def test_credit_une_seule_fois_par_reservation(self):
+        reservation = self.reserver_payee(2, 'RES-1')
+
+        crediter_reservation(reservation)
+        self.assertEqual(crediter_reservation(reservation), [])
+
+        self.assertEqual(self.soldes(), (2, 20000, 0))
+        self.assertEqual(MouvementFidelite.objects.filter(reservation=reservation).count(), 1)
+
+    def test_un_bonus_par_seuil_franchi(self):
+        self.assertEqual(crediter_reservation(self.reserver_payee(4, 'RES-1')), [])
+
+        tickets = crediter_reservation(self.reserver_payee(7, 'RES-2'))
+
+        self.assertEqual(len(tickets), 2)
+        self.assertEqual(self.soldes(), (11, 110000, 2))
+        self.assertCountEqual(
+            MouvementFidelite.objects.filter(type=MouvementFidelite.TypeMouvement.BONUS).values_list('seuil', flat=True),
+            [5, 10],
+        )
+
+    def test_annulation_puis_nouvelle_reservation(self):
+        premiere = self.reserver_payee(5, 'RES-1')
+        self.assertEqual(len(crediter_reservation(premiere)), 1)
+
+        liberer_reservation(premiere)
+        # Places et points retirés, ticket bonus conservé
+        self.assertEqual(self.soldes(), (0, 0, 1))
+        # Une réservation annulée n'est pas créditée de nouveau
+        self.assertEqual(crediter_reservation(premiere), [])
+        self.assertEqual(self.soldes(), (0, 0, 1))
+
+        # Le seuil de 5 places a déjà été récompensé
+        self.assertEqual(crediter_reservation(self.reserver_payee(5, 'RES-2')), [])
+        self.assertEqual(self.soldes(), (5, 50000, 1))
+
+    def test_debit_une_seule_fois(self):
+        reservation = self.reserver_payee(3, 'RES-1')
+        crediter_reservation(reservation)
+
+        self.assertEqual(debiter_reservations([reservation.pk]), 1)
+        self.assertEqual(debiter_reservations([reservation.pk]), 0)
+
+        self.assertEqual(self.soldes(), (0, 0, 0))
+        self.assertEqual(
+            MouvementFidelite.objects.filter(reservation=reservation, type=MouvementFidelite.TypeMouvement.ANNULATION).count(),
+            1,
+        )
+
+    def test_recalcul_des_soldes(self):
+        annulee = self.reserver_payee(3, 'RES-1')
+        crediter_reservation(annulee)
+        crediter_reservation(self.reserver_payee(4, 'RES-2'))
+        debiter_reservations([annulee.pk])
+        # Les compteurs tenus à jour sont l'agrégat du journal
+        self.assertEqual(recalculer_soldes(), [])
+
+        Client.objects.filter(pk=self.client_reservation.pk).update(places_reservees=99, tickets_bonus_valides=0)
+
+        self.assertCountEqual(recalculer_soldes(appliquer=False), [
+            (self.client_reservation.pk, 'places_reservees', 99, 4),
+            (self.client_reservation.pk, 'tickets_bonus_valides', 0, 1),
+        ])
+        self.assertEqual(self.soldes(), (99, 40000, 0))
+        recalculer_soldes()
+        self.assertEqual(self.soldes(), (4, 40000, 1))
+        self.assertEqual(recalculer_soldes(), [])
+
+
+@override_settings(PASSERELLES_PAIEMENT={'PASSERELLE_FICTIVE': True})
+class PaiementMobileTests(DonneesReservationMixin, TestCase):
+    """Paiement d'une réservation par mobile money depuis la page de paiement"""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.reservation = self.reserver()
+        creer_blocage(self.reservation, Billet.TypeBillet.STANDARD, 1)
+        self.url = reverse('reservations:paiement-create', args=[self.reservation.pk])
+
+    def test_page_de_paiement_propose_les_operateurs_mobiles(self):
+        response = self.client.get(self.url)
+
+        self.assertContains(response, 'value="LUMICASH"')
+        self.assertContains(response, 'name="numero_telephone"')
+        self.assertContains(response, 'name="cle_idempotence"')
+
+    def test_paiement_mobile(self):
+        response = self.client.post(self.url, {
+            'moyen_paiement': 'LUMICASH', 'numero_telephone': '79123456', 'cle_idempotence': 'cle-mobile-1',
+        })
+
+        self.assertRedirects(
+            response, reverse('reservations:reservation-detail', args=[self.reservation.pk]),
+            fetch_redirect_response=False,
+        )
+        paiement = Paiement.objects.get(reservation=self.reservation)
+        self.assertEqual(paiement.operateur, Paiement.OperateurPaiement.LUMICASH)
+        self.assertEqual(paiement.numero_telephone, '79123456')
+        self.assertEqual(paiement.statut, Paiement.StatutPaiement.PAID)
+
+    def test_numero_requis_pour_un_paiement_mobile(self):
+        response = self.client.post(self.url, {'moyen_paiement': 'ECOCASH', 'cle_idempotence': 'cle-mobile-2'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Paiement.objects.filter(reservation=self.reservation).exists())
+
+
+@override_settings(PASSERELLES_PAIEMENT={'PASSERELLE_FICTIVE': True})
+class IdempotencePaiementTests(DonneesReservationMixin, TestCase):
+    """Requêtes de paiement répétées avec la même clé d'idempotence"""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.reservation = self.reserver()
+        creer_blocage(self.reservation, Billet.TypeBillet.STANDARD, 1)
+        self.url = reverse('reservations:paiement-create', args=[self.reservation.pk])
+        self.donnees = {'moyen_paiement': 'LUMICASH', 'numero_telephone': '79123456', 'cle_idempotence': 'cle-1'}
+        self.appels = 0
+
+    def requete(self, **donnees):
+        request = RequestFactory().post(self.url, {**self.donnees, **donnees})
+        request.user = self.user
+        return request
+
+    def traiter(self, statut=200):
+        def traiter():
+            self.appels += 1
+            return HttpResponse('traité', status=statut)
+        return traiter
+
+    def cle_abandonnee(self, depuis):
+        maintenant = timezone.now()
+        return CleIdempotence.objects.create(
+            utilisateur=self.user, cle='cle-1', portee='paiement', empreinte_requete=empreinte_requete(self.requete()),
+            verrouille_le=maintenant - depuis, expire_le=maintenant + duree_conservation(),
+        )
+
+    def test_double_envoi_rejoue_la_reponse(self):
+        premiere = self.client.post(self.url, self.donnees)
+        seconde = self.client.post(self.url, self.donnees)
+
+        self.assertEqual(Paiement.objects.filter(reservation=self.reservation).count(), 1)
+        self.assertEqual(premiere.status_code, 302)
+        self.assertEqual(seconde.status_code, 302)
+        self.assertEqual(seconde['Location'], premiere['Location'])
+        self.assertEqual(seconde['Idempotent-Replayed'], 'true')
+        self.assertFalse(premiere.has_header('Idempotent-Replayed'))
+
+    def test_cle_reutilisee_pour_une_autre_requete(self):
+        self.client.post(self.url, self.donnees)
+
+        response = self.client.post(self.url, {**self.donnees, 'numero_telephone': '79000000'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Paiement.objects.get(reservation=self.reservation).numero_telephone, '79123456')
+
+    def test_exception_libere_la_cle(self):
+        def echec():
+            raise RuntimeError('opérateur')
+
+        with self.assertRaises(RuntimeError):
+            executer_idempotent(self.requete(), 'paiement', echec)
+        self.assertFalse(CleIdempotence.objects.exists())
+
+        response = executer_idempotent(self.requete(), 'paiement', self.traiter())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.appels, 1)
+
+    def test_erreur_serveur_libere_la_cle(self):
+        executer_idempotent(self.requete(), 'paiement', self.traiter(503))
+        self.assertFalse(CleIdempotence.objects.exists())
+
+        executer_idempotent(self.requete(), 'paiement', self.traiter())
+        self.assertEqual(self.appels, 2)
+        self.assertEqual(CleIdempotence.objects.get().statut, CleIdempotence.StatutCle.TERMINEE)
+
+    def test_reponse_enregistree_rejouee_sans_traitement(self):
+        executer_idempotent(self.requete(), 'paiement', self.traiter(201))
+
+        response = executer_idempotent(self.requete(), 'paiement', self.traiter())
+
+        self.assertEqual(self.appels, 1)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.content, 'traité'.encode())
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    @override_settings(IDEMPOTENCE_ATTENTE_SECONDES=0)
+    def test_cle_en_cours_sur_un_autre_worker(self):
+        self.cle_abandonnee(depuis=datetime.timedelta(seconds=1))
+
+        response = executer_idempotent(self.requete(), 'paiement', self.traiter())
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.appels, 0)
+
+    def test_cle_abandonnee_reprise_une_seule_fois(self):
+        cle = self.cle_abandonnee(depuis=delai_traitement() + datetime.timedelta(seconds=1))
+        empreinte = cle.empreinte_requete
+
+        # Deux workers voient la même clé abandonnée : un seul la reprend
+        _cle, premier = _reserver(self.user, 'cle-1', 'paiement', empreinte)
+        _cle, second = _reserver(self.user, 'cle-1', 'paiement', empreinte)
+
+        self.assertEqual((premier, second), (True, False))
+
+    def test_cle_abandonnee_traitee_par_la_tentative_suivante(self):
+        self.cle_abandonnee(depuis=delai_traitement() + datetime.timedelta(seconds=1))
+
+        response = executer_idempotent(self.requete(), 'paiement', self.traiter())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.appels, 1)
+        self.assertEqual(CleIdempotence.objects.get().statut, CleIdempotence.StatutCle.TERMINEE)
+
+
+class PaiementBonAchatTests(DonneesReservationMixin, TestCase):
+    """Paiement d'une réservation par ticket bon d'achat"""
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.reservation = self.reserver()
+        self.blocage = creer_blocage(self.reservation, Billet.TypeBillet.STANDARD, 1)
+        self.bon = TicketBonus.creer_ticket_bonus(self.client_reservation)
+        self.url = reverse('reservations:paiement-create', args=[self.reservation.pk])
+
+    def payer(self, code):
+        return self.client.post(self.url, {'moyen_paiement': 'TICKET', 'code_bon': code})
+
+    def assertNonPayee(self):
+        self.assertFalse(Paiement.objects.filter(reservation=self.reservation).exists())
+        self.reservation.refresh_from_db()
+        self.bon.refresh_from_db()
+        self.assertFalse(self.bon.utilise)
+        return self.reservation
+
+    def test_bon_valable(self):
+        response = self.payer(str(self.bon.code).upper())
+
+        self.assertRedirects(
+            response, reverse('reservations:reservation-detail', args=[self.reservation.pk]),
+            fetch_redirect_response=False,
+        )
+        paiement = Paiement.objects.get(reservation=self.reservation)
+        self.assertEqual(paiement.statut, Paiement.StatutPaiement.PAID)
+        self.assertEqual(paiement.reference_paiement, str(self.bon.code))
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.statut, Reservation.StatutReservation.CONFIRMEE)
+        self.bon.refresh_from_db()
+        self.assertTrue(self.bon.utilise)
+
+    def test_code_requis(self):
+        response = self.payer('')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.assertNonPayee().statut, Reservation.StatutReservation.EN_ATTENTE)
+
+    def test_bon_inconnu_ou_d_un_autre_client(self):
+        autre = Client.objects.create(user=User.objects.create_user('autre', 'autre@example.com', 'motdepasse'))
+        bon_autre = TicketBonus.creer_ticket_bonus(autre)
+
+        for code in ('BONUS-INCONNU', str(bon_autre.code)):
+            with self.subTest(code=code):
+                self.assertRedirects(self.payer(code), self.url, fetch_redirect_response=False)
+                self.assertEqual(self.assertNonPayee().statut, Reservation.StatutReservation.EN_ATTENTE)
+
+    def test_bon_rendu_si_les_places_expirent_pendant_le_paiement(self):
+        BlocagePlaces.objects.filter(pk=self.blocage.pk).update(expire_le=timezone.now() - datetime.timedelta(seconds=1))
+
+        # Blocage encore valable à la vérification, expiré à la confirmation
+        with mock.patch('reservations.views_paiement.verifier_blocage'):
+            self.payer(str(self.bon.code))
+
+        self.assertEqual(self.assertNonPayee().statut, Reservation.StatutReservation.ANNULEE)
+        self.assertEqual(self.places_vendues(), 0)
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 1)
+
+
+class PasserellesTests(DonneesReservationMixin, TestCase):
+    """Choix de la passerelle d'un opérateur et budget de latence"""
+
+    def test_operateur_non_configure_indisponible(self):
+        with self.assertRaises(OperateurIndisponible):
+            passerelle('lumicash')
+
+        with override_settings(PASSERELLES_PAIEMENT={'PASSERELLE_FICTIVE': True}):
+            self.assertIsInstance(passerelle('lumicash'), PasserelleFictive)
+
+    def test_paiement_refuse_sans_operateur_configure(self):
+        self.client.force_login(self.user)
+        reservation = self.reserver()
+        creer_blocage(reservation, Billet.TypeBillet.STANDARD, 1)
+        url = reverse('reservations:paiement-create', args=[reservation.pk])
+
+        response = self.client.post(url, {'moyen_paiement': 'LUMICASH', 'numero_telephone': '79123456'})
+
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertFalse(Paiement.objects.filter(reservation=reservation).exists())
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.statut, Reservation.StatutReservation.EN_ATTENTE)
+
+    def test_budget_de_latence_total(self):
+        class PasserelleLente(PasserelleMobile):
+            def envoyer(self, corps, reference):
+                # Réponse envoyée au compte-gouttes : chaque lecture respecte son délai
+                time.sleep(1)
+
+        reglages = {**parametres_passerelles(), 'BUDGET_LATENCE': 0.2}
+        adaptateur = PasserelleLente('lumicash', 'http://operateur.invalid', reglages=reglages)
+        debut = time.monotonic()
+
+        resultat = adaptateur.initier_paiement(self.reserver(), '79123456')
+
+        self.assertTrue(resultat.en_attente)
+        self.assertLess(time.monotonic() - debut, 0.8)
+
+
+class ConfirmationPaiementFideliteTests(DonneesReservationMixin, TestCase):
+    """Crédit de fidélité des paiements confirmés après coup par l'opérateur"""
+
+    def setUp(self):
+        self.reservation = self.reserver()
+        creer_blocage(self.reservation, Billet.TypeBillet.STANDARD, 1)
+        self.paiement = Paiement.objects.create(
+            reservation=self.reservation, montant=self.reservation.montant_total,
+            operateur=Paiement.OperateurPaiement.ECOCASH, statut=Paiement.StatutPaiement.PENDING,
+        )
+
+    def paiement_verrouille(self):
+        return Paiement.objects.select_related('reservation__client__user').get(pk=self.paiement.pk)
+
+    def test_paiement_confirme_credite_la_fidelite(self):
+        paiement = self.paiement_verrouille()
+        paiement.statut = Paiement.StatutPaiement.PAID
+
+        enregistrer_statuts([paiement], [])
+
+        self.assertEqual(self.client_actuel().places_reservees, 1)
+        self.assertEqual(self.client_actuel().points_fidelite, 10000)
+
+    def test_paiement_refuse_ne_credite_rien(self):
+        paiement = self.paiement_verrouille()
+        paiement.statut = Paiement.StatutPaiement.FAILED
+
+        enregistrer_statuts([], [paiement])
+
+        self.assertEqual(self.client_actuel().places_reservees, 0)
+        self.assertFalse(MouvementFidelite.objects.filter(reservation=self.reservation).exists())
+
+
+@override_settings(TARIFICATION_DYNAMIQUE={'ACTIVE': True})
+class TarificationDynamiqueAffichageTests(DonneesReservationMixin, TestCase):
+    """Les prix affichés par les listes, le calendrier et l'API sont ceux facturés"""
+
+    def setUp(self):
+        cache.clear()
+        self.prix = tarifs_courants(self.horaire)['STD']
+        # Un départ dans deux jours est plus cher que son prix de base
+        self.assertNotEqual(self.prix, Decimal('10000'))
+
+    def test_liste_des_departs(self):
+        response = self.client.get(reverse('reservations:home'))
+
+        horaire = next(horaire for horaire in response.context['horaires'] if horaire.pk == self.horaire.pk)
+        self.assertEqual(horaire.get_prix_min(), self.prix)
+        self.assertEqual(horaire.prix_standard, self.prix)
+
+    def test_calendrier(self):
+        trajet = self.horaire.trajet
+        jours = calendrier_tarifs(trajet.depart_id, trajet.arrivee_id)
+
+        jour = next(jour for jour in jours if jour['date'] == timezone.localdate(self.horaire.date_depart).isoformat())
+        self.assertEqual(jour['classes']['STD']['prix_min'], str(self.prix))
+        self.assertEqual(jour['prix_min'], str(self.prix))
+
+    def test_itineraires(self):
+        itineraires._reseau.jours.clear()
+        trajet = self.horaire.trajet
+
+        itineraire, = planifier(
+            trajet.depart_id, trajet.arrivee_id, depart_apres=self.horaire.date_depart - datetime.timedelta(hours=1)
+        )
+
+        self.assertEqual(itineraire.prix, self.prix)
+        self.assertEqual(itineraire.to_dict()['prix'], str(self.prix))
+
+    def test_api_et_montant_facture(self):
+        response = self.client.get(reverse('reservations:api-v1-liste', args=['horaires']))
+
+        resultat = next(resultat for resultat in response.json()['resultats'] if resultat['id'] == self.horaire.pk)
+        self.assertEqual(resultat['prix_min'], str(self.prix))
+        self.assertEqual(prix_reservation(self.client.session, self.horaire, 'STD'), self.prix)
+
+
+class CalendrierCacheTests(DonneesReservationMixin, TestCase):
+    """Une vente ne rend obsolètes que les calendriers qui contiennent son départ"""
+
+    def setUp(self):
+        cache.clear()
+        trajet = self.horaire.trajet
+        retour = Trajet.objects.create(
+            depart=trajet.arrivee, arrivee=trajet.depart, duree=trajet.duree, distance=trajet.distance
+        )
+        self.horaire_retour = Horaire.objects.create(
+            trajet=retour, date_depart=self.horaire.date_depart, date_arrivee=self.horaire.date_arrivee
+        )
+        HoraireClasse.objects.create(
+            horaire=self.horaire_retour, classe=Billet.TypeBillet.STANDARD, prix=Decimal('10000'), capacite=40
+        )
+
+    @contextmanager
+    def assertLectureDuCacheSeule(self):
+        """Aucune requête hors de la table du cache (DatabaseCache)"""
+        with CaptureQueriesContext(connection) as requetes:
+            yield
+        self.assertEqual([requete['sql'] for requete in requetes if 'cache_agence' not in requete['sql']], [])
+
+    def places_du_jour(self):
+        trajet = self.horaire.trajet
+        jours = calendrier_tarifs(trajet.depart_id, trajet.arrivee_id)
+        jour = timezone.localdate(self.horaire.date_depart).isoformat()
+        return next(valeurs for valeurs in jours if valeurs['date'] == jour)['classes']['STD']['places']
+
+    def test_vente_sur_une_autre_liaison(self):
+        self.assertEqual(self.places_du_jour(), 40)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            retenir_places(self.horaire_retour.pk, Billet.TypeBillet.STANDARD, 2)
+
+        with self.assertLectureDuCacheSeule():
+            self.assertEqual(self.places_du_jour(), 40)
+
+    def test_vente_sur_la_liaison(self):
+        self.assertEqual(self.places_du_jour(), 40)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            retenir_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 3)
+        self.assertEqual(self.places_du_jour(), 37)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            restituer_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 3)
+        self.assertEqual(self.places_du_jour(), 40)
+
+
+class ApiHorairesCacheTests(CalendrierCacheTests):
+    """Pages d'horaires de l'API en cache : montants exacts, versions par trajet et par jour"""
+
+    def page(self):
+        response = self.client.get(
+            reverse('reservations:api-v1-liste', args=['horaires']), {'trajet': self.horaire.trajet_id}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['resultats'][0]
+
+    def test_prix_en_chaine_decimale(self):
+        resultat = self.page()
+
+        self.assertEqual(resultat['prix_min'], '10000.00')
+        self.assertEqual(resultat['classes']['STD']['prix'], '10000.00')
+
+    def test_vente_sur_une_autre_liaison(self):
+        self.assertEqual(self.page()['places'], 40)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            retenir_places(self.horaire_retour.pk, Billet.TypeBillet.STANDARD, 2)
+
+        with self.assertLectureDuCacheSeule():
+            self.assertEqual(self.page()['places'], 40)
+
+    def test_vente_sur_la_liaison(self):
+        self.assertEqual(self.page()['places'], 40)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            retenir_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 3)
+        self.assertEqual(self.page()['places'], 37)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            restituer_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 3)
+        self.assertEqual(self.page()['places'], 40)
+
+
+class ParametresDatesTests(DonneesReservationMixin, TestCase):
+    """Dates demandées à l'API et à la recherche d'itinéraires, bornées à un an"""
+
+    def setUp(self):
+        cache.clear()
+
+    def requetes(self, date):
+        trajet = self.horaire.trajet
+        return [
+            self.client.get(reverse('reservations:api-v1-liste', args=['horaires']), {'date': date}),
+            self.client.get(reverse('reservations:api-itineraires'), {
+                'depart': trajet.depart_id, 'arrivee': trajet.arrivee_id, 'date': date,
+            }),
+            self.client.get(reverse('reservations:api-calendrier-tarifs'), {
+                'depart': trajet.depart_id, 'arrivee': trajet.arrivee_id, 'debut': date,
+            }),
+        ]
+
+    def test_dates_hors_limites(self):
+        for date in ('9999-12-31', '0001-01-01', '2026-02-30'):
+            with self.subTest(date=date):
+                self.assertEqual([response.status_code for response in self.requetes(date)], [400, 400, 400])
+
+    def test_date_du_depart(self):
+        date = timezone.localdate(self.horaire.date_depart).isoformat()
+
+        api, itineraires, calendrier = self.requetes(date)
+
+        self.assertEqual([resultat['id'] for resultat in api.json()['resultats']], [self.horaire.pk])
+        self.assertEqual(itineraires.status_code, 200)
+        self.assertEqual(calendrier.json()['jours'][0]['date'], date)
+
+
+class AdminHoraireClassesTests(DonneesReservationMixin, TestCase):
+    """Modification des classes d'un horaire dans l'administration"""
+
+    def test_enregistrement_ne_remplace_pas_les_places_vendues(self):
+        staff = User.objects.create_superuser('admin', 'admin@example.com', 'motdepasse')
+        self.client.force_login(staff)
+        classe = HoraireClasse.objects.get(horaire=self.horaire)
+        depart = timezone.localtime(self.horaire.date_depart)
+        arrivee = timezone.localtime(self.horaire.date_arrivee)
+        donnees = {
+            'trajet': self.horaire.trajet_id,
+            'date_depart_0': depart.strftime('%Y-%m-%d'), 'date_depart_1': depart.strftime('%H:%M:%S'),
+            'date_arrivee_0': arrivee.strftime('%Y-%m-%d'), 'date_arrivee_1': arrivee.strftime('%H:%M:%S'),
+            'classes-TOTAL_FORMS': '1', 'classes-INITIAL_FORMS': '1',
+            'classes-MIN_NUM_FORMS': '0', 'classes-MAX_NUM_FORMS': '1000',
+            'classes-0-id': classe.pk, 'classes-0-horaire': self.horaire.pk,
+            'classes-0-classe': 'STD', 'classes-0-prix': '12000', 'classes-0-capacite': '50',
+            'classes-0-vendus': '0',
+        }
+        # Places vendues pendant que la page était ouverte
+        self.reserver(nombre=3)
+
+        response = self.client.post(reverse('admin:reservations_horaire_change', args=[self.horaire.pk]), donnees)
+
+        self.assertEqual(response.status_code, 302)
+        classe.refresh_from_db()
+        self.assertEqual((classe.prix, classe.capacite, classe.vendus), (Decimal('12000'), 50, 3))
+
+
+class RestitutionPlacesTests(DonneesReservationMixin, TestCase):
+    """Places rendues à un horaire"""
+
+    def test_places_rendues(self):
+        self.reserver(nombre=3)
+        restituer_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 2)
+        self.assertEqual(self.places_vendues(), 1)
+
+    def test_compteur_inferieur_ramene_a_zero(self):
+        self.reserver(nombre=1)
+        with self.assertLogs('reservations.inventaire', 'WARNING'):
+            restituer_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 3)
+        self.assertEqual(self.places_vendues(), 0)
+
+    def test_annulation_rend_les_places_une_seule_fois(self):
+        reservation = self.reserver(nombre=2, statut=Reservation.StatutReservation.CONFIRMEE)
+
+        self.assertEqual(liberer_reservation(reservation), 2)
+        # Remboursement concurrent arrivé après l'annulation : rien de plus à rendre
+        self.assertEqual(liberer_reservation(reservation, Reservation.StatutReservation.REMBOURSEE), 0)
+
+        self.assertEqual(self.places_vendues(), 0)
+        self.assertFalse(reservation.billets.filter(annule=False).exists())
+
+    def test_reconciliation_depuis_les_billets(self):
+        self.reserver(nombre=3, statut=Reservation.StatutReservation.CONFIRMEE)
+        HoraireClasse.objects.filter(horaire=self.horaire).update(vendus=7)
+
+        self.assertEqual(reconcilier_places(appliquer=False), [(self.horaire.pk, 'STD', 33, 37)])
+        self.assertEqual(self.places_vendues(), 7)
+
+        reconcilier_places()
+        self.assertEqual(self.places_vendues(), 3)
+        self.assertEqual(reconcilier_places(), [])
+
+
+class JournalModificationsTests(DonneesReservationMixin, TestCase):
+    """Lignes du journal de synchronisation"""
+
+    def test_journalise_apres_la_validation(self):
+        depuis = sequence_courante()
+        with self.captureOnCommitCallbacks(execute=True) as rappels:
+            with transaction.atomic():
+                retenir_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 1)
+                # Rien n'est journalisé tant que la transaction est ouverte
+                self.assertEqual(sequence_courante(), depuis)
+        self.assertTrue(rappels)
+
+        objets, _dernier, _suite = modifications(depuis)
+        self.assertIn(self.horaire.pk, objets[Modification.TypeObjet.HORAIRE])
+
+    def test_transaction_annulee_non_journalisee(self):
+        depuis = sequence_courante()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                retenir_places(self.horaire.pk, Billet.TypeBillet.STANDARD, 1)
+                transaction.set_rollback(True)
+
+        self.assertEqual(sequence_courante(), depuis)
+
+
+class RapprochementPaiementsTests(DonneesReservationMixin, TestCase):
+    """Rapprochement d'un relevé d'opérateur avec les paiements"""
+
+    def setUp(self):
+        self.paiements = []
+        for numero in range(2):
+            reservation = self.reserver(reference=f'RES-{numero + 1}')
+            self.paiements.append(Paiement.objects.create(
+                reservation=reservation, montant=Decimal('10000'), operateur='lumicash',
+                reference_paiement=f'TX-{numero + 1}',
+            ))
+
+    def envoyer_releve(self, contenu, simulation=False):
+        equipe = User.objects.create_user('finance', 'finance@example.com', 'motdepasse', is_staff=True)
+        self.client.force_login(equipe)
+        donnees = {'operateur': 'lumicash', 'releve': SimpleUploadedFile('releve.csv', contenu, 'text/csv')}
+        if simulation:
+            donnees['simulation'] = 'on'
+        return self.client.post(reverse('reservations:rapprochement-paiements'), donnees)
+
+    def statuts(self):
+        return [Paiement.objects.get(pk=paiement.pk).statut for paiement in self.paiements]
+
+    @override_settings(RAPPROCHEMENT_PAIEMENTS={'TAILLE_LOT': 1})
+    def test_encodage_invalide_rien_applique(self):
+        # Le premier lot est valide, l'octet illisible n'arrive qu'après
+        contenu = 'reference;montant;statut\nTX-1;10000;succès\n'.encode() + b'TX-2;10000;r\xe9ussi\n'
+
+        response = self.envoyer_releve(contenu)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('releve', response.context['form'].errors)
+        self.assertEqual(self.statuts(), [Paiement.StatutPaiement.PENDING] * 2)
+
+    def test_dialectes_csv(self):
+        releves = (
+            'reference;montant;statut\nTX-1;10 000;succès\n',
+            'Transaction,Amount,Status\nTX-1,"10,000.00 BIF",completed\n',
+            'id\tmontant\tetat\nTX-1\t10000,00\tpayé\n',
+        )
+        for releve in releves:
+            with self.subTest(releve=releve):
+                bilan, anomalies = rapprocher(releve.splitlines(keepends=True), 'lumicash', appliquer=False)
+
+                self.assertEqual((bilan['corriges'], anomalies), (1, []))
+
+    def test_anomalies(self):
+        releve = (
+            'reference;montant;statut\n'
+            'TX-1;9000;succès\n'
+            'TX-2;10000;succès\n'
+            'TX-2;10000;succès\n'
+            'TX-9;10000;succès\n'
+            'TX-3\n'
+        )
+
+        bilan, anomalies = rapprocher(releve.splitlines(keepends=True), 'lumicash')
+
+        self.assertEqual(
+            [(anomalie['ligne'], anomalie['anomalie']) for anomalie in anomalies],
+            [(2, MONTANT_DIFFERENT), (4, LIGNE_EN_DOUBLE), (5, REFERENCE_INCONNUE), (6, LIGNE_ILLISIBLE)],
+        )
+        # Seul le paiement au montant conforme est corrigé
+        self.assertEqual(bilan['corriges'], 1)
+        self.assertEqual(self.statuts(), [Paiement.StatutPaiement.PENDING, Paiement.StatutPaiement.PAID])
+
+    def test_simulation_sans_modification(self):
+        response = self.envoyer_releve('reference;montant;statut\nTX-1;10000;succès\n'.encode(), simulation=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuts(), [Paiement.StatutPaiement.PENDING] * 2)
+
+
+class RechercheReservationsTests(DonneesReservationMixin, TestCase):
+    """Recherche des réservations par l'équipe"""
+
+    def setUp(self):
+        self.user.first_name, self.user.last_name = 'Anaïs', 'Ndayishimiye'
+        self.user.save()
+        Client.objects.filter(pk=self.client_reservation.pk).update(telephone='+257 79 12 34 56')
+        # update() ne déclenche pas les signaux : réindexation par la sauvegarde du client
+        self.client_actuel().save()
+        self.reservation = self.reserver(reference='LIS-ABC123')
+
+        autre = Client.objects.create(user=User.objects.create_user('autre', 'autre@example.com', 'motdepasse'))
+        self.autre = Reservation.objects.create(
+            client=autre, horaire=self.horaire, montant_total=Decimal('10000'), reference='LIS-XYZ789',
+        )
+
+    def rechercher(self, recherche):
+        return list(rechercher_reservations(Reservation.objects.all(), recherche).values_list('reference', flat=True))
+
+    def test_nom_sans_accents_ni_casse(self):
+        self.assertEqual(self.rechercher('anais ndayi'), ['LIS-ABC123'])
+
+    def test_telephone_avec_indicatif_ou_numero_local(self):
+        self.assertEqual(self.rechercher('+257 79 12'), ['LIS-ABC123'])
+        self.assertEqual(self.rechercher('7912 3456'), ['LIS-ABC123'])
+
+    def test_reference(self):
+        self.assertEqual(self.rechercher('lis-xyz'), ['LIS-XYZ789'])
+        self.assertEqual(sorted(self.rechercher('LIS')), ['LIS-ABC123', 'LIS-XYZ789'])
+
+    def test_index_suit_les_modifications(self):
+        self.user.last_name = 'Irakoze'
+        self.user.save()
+
+        self.assertEqual(self.rechercher('irakoze'), ['LIS-ABC123'])
+        self.assertEqual(self.rechercher('ndayishimiye'), [])
+
+
+class StatutAfficheTests(DonneesReservationMixin, TestCase):
+    """Statut affiché et badge calculés en SQL"""
+
+    def test_memes_regles_qu_en_python(self):
+        depart = timezone.now() - datetime.timedelta(days=3)
+        passe = Horaire.objects.create(
+            trajet=self.horaire.trajet, date_depart=depart, date_arrivee=depart + datetime.timedelta(hours=2)
+        )
+        for numero, (horaire, statut) in enumerate(
+            (horaire, statut) for horaire in (self.horaire, passe) for statut in Reservation.StatutReservation.values
+        ):
+            Reservation.objects.create(
+                client=self.client_reservation, horaire=horaire, montant_total=Decimal('10000'),
+                reference=f'RES-{numero}', statut=statut,
+            )
+
+        with self.assertNumQueries(1):
+            annotees = list(Reservation.objects.with_display_status().order_by('pk'))
+        for annotee, reservation in zip(annotees, Reservation.objects.order_by('pk')):
+            with self.subTest(statut=reservation.statut, depart=reservation.horaire.date_depart):
+                self.assertEqual(annotee.get_display_status(), reservation.get_display_status())
+                self.assertEqual(annotee.get_status_badge_class(), reservation.get_status_badge_class())
+        self.assertEqual(len(annotees), 2 * len(Reservation.StatutReservation.values))
+
+
+class HoraireQuerySetTests(DonneesReservationMixin, TestCase):
+    """Méthodes de recherche de Horaire.objects"""
+
+    def setUp(self):
+        # Classe Business moins chère mais complète
+        HoraireClasse.objects.create(
+            horaire=self.horaire, classe=Billet.TypeBillet.BUSINESS, prix=Decimal('8000'), capacite=2, vendus=2,
+        )
+        depart = self.horaire.date_depart + datetime.timedelta(days=1)
+        self.complet = Horaire.objects.create(
+            trajet=self.horaire.trajet, date_depart=depart, date_arrivee=depart + datetime.timedelta(hours=2)
+        )
+        HoraireClasse.objects.create(
+            horaire=self.complet, classe=Billet.TypeBillet.STANDARD, prix=Decimal('9000'), capacite=1, vendus=1,
+        )
+        depart = timezone.now() - datetime.timedelta(hours=1)
+        self.parti = Horaire.objects.create(
+            trajet=self.horaire.trajet, date_depart=depart, date_arrivee=depart + datetime.timedelta(hours=2)
+        )
+        HoraireClasse.objects.create(
+            horaire=self.parti, classe=Billet.TypeBillet.STANDARD, prix=Decimal('9000'), capacite=10,
+        )
+
+    def test_upcoming_et_bookable(self):
+        self.assertEqual(set(Horaire.objects.upcoming()), {self.horaire, self.complet})
+        self.assertEqual(list(Horaire.objects.bookable()), [self.horaire])
+        self.assertEqual(list(Horaire.objects.bookable(Billet.TypeBillet.STANDARD)), [self.horaire])
+        self.assertEqual(list(Horaire.objects.bookable(Billet.TypeBillet.BUSINESS)), [])
+
+    def test_between(self):
+        trajet = self.horaire.trajet
+        villes = (trajet.depart.ville_id, trajet.arrivee.ville_id)
+        self.assertEqual(Horaire.objects.between(*villes).count(), 3)
+        self.assertEqual(Horaire.objects.between(trajet.depart_id, trajet.arrivee_id, gares=True).count(), 3)
+        self.assertFalse(Horaire.objects.between(villes[1], villes[0]).exists())
+        self.assertEqual(Horaire.objects.between(arrivee=villes[1]).count(), 3)
+
+    def test_on_date(self):
+        jour = timezone.localdate(self.horaire.date_depart)
+
+        self.assertEqual(list(Horaire.objects.on_date(jour)), [self.horaire])
+        self.assertEqual(list(Horaire.objects.on_date(jour + datetime.timedelta(days=1))), [self.complet])
+
+    def test_with_min_price(self):
+        horaires = {horaire.pk: horaire for horaire in Horaire.objects.with_min_price()}
+
+        # Les classes complètes ne comptent pas ; un départ complet vaut 0
+        self.assertEqual(horaires[self.horaire.pk].prix_min, Decimal('10000'))
+        self.assertEqual(horaires[self.complet.pk].prix_min, Decimal('0'))
+        for horaire in horaires.values():
+            self.assertEqual(horaire.prix_min, Horaire.objects.get(pk=horaire.pk).get_prix_min())
+
+
+class ItinerairesTests(DonneesReservationMixin, TestCase):
+    """Recherche d'itinéraires avec correspondances"""
+
+    def reseau(self, debut):
+        def heure(heures, minutes=0):
+            return int((debut + datetime.timedelta(hours=heures, minutes=minutes)).timestamp())
+
+        # (horaire, gare de départ, gare d'arrivée, départ, arrivée, prix STD, BUS, PRE)
+        lignes = [
+            (1, 1, 2, heure(0), heure(2), 5000.0, 0.0, 0.0),
+            (2, 2, 3, heure(2, 10), heure(3), 5000.0, 0.0, 0.0),
+            (3, 2, 3, heure(2, 30), heure(4), 5000.0, 0.0, 0.0),
+            (4, 1, 3, heure(1), heure(3, 30), 15000.0, 0.0, 0.0),
+        ]
+        jour = timezone.localdate(debut)
+        return Reseau(
+            chargeur=lambda j: lignes if j == jour else [],
+            versions=lambda jours: {j: 0 for j in jours},
+        )
+
+    def test_correspondance_minimale(self):
+        debut = timezone.make_aware(datetime.datetime(2026, 11, 2, 6))
+        reseau = self.reseau(debut)
+
+        itineraires = reseau.rechercher([1], [3], debut, correspondance_min=datetime.timedelta(minutes=20))
+
+        # Le direct arrive plus tôt, la correspondance (l'horaire 2 part 10 minutes après l'arrivée : trop tôt) coûte moins
+        self.assertEqual([itineraire.horaires for itineraire in itineraires], [[4], [1, 3]])
+        self.assertEqual([(itineraire.prix, itineraire.correspondances) for itineraire in itineraires],
+                         [(15000.0, 0), (10000.0, 1)])
+
+    def test_itineraires_domines_ecartes(self):
+        debut = timezone.make_aware(datetime.datetime(2026, 11, 2, 6))
+
+        itineraires = self.reseau(debut).rechercher([1], [3], debut, correspondance_min=datetime.timedelta(0))
+
+        # 1 puis 2 arrive plus tôt et coûte moins que 1 puis 3 ; le direct reste, sans correspondance
+        self.assertEqual([itineraire.horaires for itineraire in itineraires], [[1, 2], [4]])
+
+    def test_departs_complets_exclus(self):
+        itineraires._reseau.jours.clear()
+        depart = self.horaire.date_depart + datetime.timedelta(hours=1)
+        suivant = Horaire.objects.create(
+            trajet=self.horaire.trajet, date_depart=depart, date_arrivee=depart + datetime.timedelta(hours=2)
+        )
+        HoraireClasse.objects.create(horaire=suivant, classe=Billet.TypeBillet.STANDARD, prix=Decimal('12000'), capacite=10)
+        HoraireClasse.objects.filter(horaire=self.horaire).update(vendus=F('capacite'))
+        trajet = self.horaire.trajet
+
+        resultats = planifier(
+            trajet.depart_id, trajet.arrivee_id, depart_apres=self.horaire.date_depart - datetime.timedelta(hours=1)
+        )
+
+        self.assertEqual([itineraire.horaires for itineraire in resultats], [[suivant.pk]])
+        self.assertEqual(resultats[0].prix, Decimal('12000'))
+
+
+class GenerationHorairesTests(DonneesReservationMixin, TestCase):
+    """Horaires générés à partir d'une grille récurrente"""
+
+    def setUp(self):
+        demain = timezone.localdate() + datetime.timedelta(days=1)
+        self.grille = GrilleHoraire.objects.create(
+            trajet=self.horaire.trajet, jours_semaine='0123456',
+            # Même heure que l'horaire existant : la circulation de son jour le chevauche
+            heure_depart=timezone.localtime(self.horaire.date_depart).time(),
+            date_debut=demain, date_fin=demain + datetime.timedelta(days=6),
+            prix_standard=Decimal('10000'), prix_business=Decimal('15000'), prix_premiere=Decimal('20000'),
+            places_standard=40, places_business=10, places_premiere=5,
+        )
+
+    def test_chevauchements_ignores(self):
+        crees, ignores = generer_horaires(self.grille)
+
+        self.assertEqual(crees, 6)
+        self.assertEqual(ignores, [self.horaire.date_depart])
+        self.assertEqual(Horaire.objects.filter(trajet=self.horaire.trajet).count(), 7)
+        self.assertEqual(
+            HoraireClasse.objects.exclude(horaire=self.horaire).filter(classe=Billet.TypeBillet.BUSINESS, capacite=10).count(), 6
+        )
+        # Une seconde génération ne recrée rien
+        self.assertEqual(generer_horaires(self.grille)[0], 0)
+
+    def test_simulation(self):
+        crees, _ignores = generer_horaires(self.grille, appliquer=False)
+
+        self.assertEqual(crees, 6)
+        self.assertEqual(Horaire.objects.count(), 1)
+
+
+class AjustementTarifsTests(DonneesReservationMixin, TestCase):
+    """Ajustement en masse des prix et des places"""
+
+    def setUp(self):
+        depart = self.horaire.date_depart + datetime.timedelta(days=1)
+        self.autre = Horaire.objects.create(
+            trajet=self.horaire.trajet, date_depart=depart, date_arrivee=depart + datetime.timedelta(hours=2)
+        )
+        HoraireClasse.objects.create(
+            horaire=self.autre, classe=Billet.TypeBillet.STANDARD, prix=Decimal('12345'), capacite=20, vendus=15,
+        )
+
+    def classes(self):
+        return HoraireClasse.objects.filter(classe=Billet.TypeBillet.STANDARD).order_by('prix')
+
+    def test_apercu_identique_a_la_modification(self):
+        horaires = Horaire.objects.all()
+        apercu = ajuster_horaires(horaires, pourcentage=Decimal('7.5'), classes=['STD'], appliquer=False)
+        self.assertEqual(list(self.classes().values_list('prix', flat=True)), [Decimal('10000'), Decimal('12345')])
+
+        applique = ajuster_horaires(horaires, pourcentage=Decimal('7.5'), classes=['STD'])
+
+        prix = list(self.classes().values_list('prix', flat=True))
+        # Arrondi à l'unité : 10 750 et 13 270,875 -> 13 271
+        self.assertEqual(prix, [Decimal('10750'), Decimal('13271')])
+        self.assertEqual((apercu['prix_STD_min_apres'], apercu['prix_STD_max_apres']), tuple(prix))
+        self.assertEqual(applique['modifies'], apercu['nombre'])
+
+    def test_prix_jamais_negatif(self):
+        ajuster_horaires(Horaire.objects.all(), montant=Decimal('-11000'))
+
+        self.assertEqual(list(self.classes().values_list('prix', flat=True)), [Decimal('0'), Decimal('1345')])
+
+    def test_capacite_jamais_sous_les_places_vendues(self):
+        apercu = ajuster_horaires(Horaire.objects.filter(pk=self.autre.pk), places=-10, appliquer=False)
+        self.assertEqual((apercu['places_STD_avant'], apercu['places_STD_apres']), (5, 0))
+
+        ajuster_horaires(Horaire.objects.filter(pk=self.autre.pk), places=-10)
+
+        classe = HoraireClasse.objects.get(horaire=self.autre)
+        self.assertEqual((classe.capacite, classe.vendus), (15, 15))
+
+    def test_parametres_incoherents(self):
+        with self.assertRaises(AjustementInvalide):
+            ajuster_horaires(Horaire.objects.all(), pourcentage=5, montant=100)
+        with self.assertRaises(AjustementInvalide):
+            ajuster_horaires(Horaire.objects.all())
+
+
+class BalayageTicketsBonusTests(DonneesReservationMixin, TestCase):
+    """Expiration et rappels des tickets bonus par lots"""
+
+    def ticket(self, echeance, client=None, **valeurs):
+        client = client or self.client_reservation
+        ticket = TicketBonus.objects.create(client=client, montant=Decimal('10000'), **valeurs)
+        # save() fixe l'échéance à 30 jours
+        TicketBonus.objects.filter(pk=ticket.pk).update(date_expiration=timezone.now() + echeance)
+        if not ticket.utilise:
+            Client.objects.filter(pk=client.pk).update(tickets_bonus_valides=F('tickets_bonus_valides') + 1)
+        return ticket
+
+    def test_expiration_par_lots(self):
+        expires = [self.ticket(-datetime.timedelta(days=jours)) for jours in (1, 2)]
+        valable = self.ticket(datetime.timedelta(days=5))
+        utilise = self.ticket(-datetime.timedelta(days=1), utilise=True)
+
+        self.assertEqual(expirer_tickets(taille_lot=1), 2)
+
+        self.assertEqual(set(TicketBonus.objects.filter(expire=True)), set(expires))
+        self.assertFalse(TicketBonus.objects.filter(pk__in=[valable.pk, utilise.pk], expire=True).exists())
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 1)
+        self.assertEqual(expirer_tickets(), 0)
+
+    def test_rappel_envoye_une_fois(self):
+        proche = self.ticket(datetime.timedelta(days=1))
+        self.ticket(datetime.timedelta(days=10))
+        sans_email = Client.objects.create(user=User.objects.create_user('anonyme', '', 'motdepasse'))
+        self.ticket(datetime.timedelta(days=2), client=sans_email)
+
+        self.assertEqual(envoyer_rappels(taille_lot=1), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['client@example.com']])
+        self.assertEqual(TicketBonus.objects.filter(rappel_envoye_le__isnull=False).count(), 2)
+        self.assertTrue(TicketBonus.objects.filter(pk=proche.pk, rappel_envoye_le__isnull=False).exists())
+
+        self.assertEqual(envoyer_rappels(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_compteur_recalcule(self):
+        self.ticket(datetime.timedelta(days=5))
+        Client.objects.filter(pk=self.client_reservation.pk).update(tickets_bonus_valides=4)
+
+        recalculer_soldes()
+
+        self.assertEqual(self.client_actuel().tickets_bonus_valides, 1)
+
+
+@override_settings(PASSERELLES_PAIEMENT={'OPERATEURS': {'lumicash': {'SECRET_WEBHOOK': 'secret-test'}}})
+class NotificationsPaiementTests(DonneesReservationMixin, TestCase):
+    """Notifications des opérateurs (webhooks), enregistrées puis traitées par lots"""
+
+    def setUp(self):
+        self.reservation = self.reserver()
+        self.paiement = Paiement.objects.create(
+            reservation=self.reservation, montant=Decimal('10000'), operateur='lumicash',
+        )
+
+    def notifier(self, identifiant, statut, reference='RES-1', signature=None):
+        corps = json.dumps(PasserelleMobile.evenement_simule(identifiant, reference, statut, f'TX-{identifiant}')).encode()
+        adaptateur = PasserelleMobile('lumicash', '', '', parametres_passerelles())
+        entetes = adaptateur.signer(corps) if signature is None else {adaptateur.entete_signature: signature}
+        return self.client.post(
+            reverse('reservations:notification-paiement', args=['lumicash']), corps,
+            content_type='application/json', headers=entetes,
+        )
+
+    def test_renvoi_ecarte(self):
+        for _renvoi in range(2):
+            self.assertEqual(self.notifier('EV-1', ACCEPTE).status_code, 200)
+        self.assertEqual(EvenementPaiement.objects.count(), 1)
+
+        self.assertEqual(traiter_notifications(), {EvenementPaiement.StatutEvenement.TRAITE: 1})
+
+        self.paiement.refresh_from_db()
+        self.reservation.refresh_from_db()
+        self.assertEqual((self.paiement.statut, self.paiement.reference_paiement), ('PAID', 'TX-EV-1'))
+        self.assertEqual(self.reservation.statut, Reservation.StatutReservation.CONFIRMEE)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_signature_incorrecte(self):
+        self.assertEqual(self.notifier('EV-1', ACCEPTE, signature='sha256=0000').status_code, 400)
+        self.assertFalse(EvenementPaiement.objects.exists())
+
+    def test_echec_arrive_apres_la_confirmation(self):
+        self.notifier('EV-1', ACCEPTE)
+        traiter_notifications()
+        self.notifier('EV-2', REFUSE)
+
+        traiter_notifications()
+
+        self.paiement.refresh_from_db()
+        self.assertEqual(self.paiement.statut, Paiement.StatutPaiement.PAID)
+        self.assertEqual(self.places_vendues(), 1)
+
+    def test_derniere_notification_du_lot_l_emporte(self):
+        self.notifier('EV-1', REFUSE)
+        self.notifier('EV-2', ACCEPTE)
+
+        traiter_notifications()
+
+        self.paiement.refresh_from_db()
+        self.assertEqual(self.paiement.statut, Paiement.StatutPaiement.PAID)
+
+    def test_paiement_pas_encore_enregistre(self):
+        self.notifier('EV-1', ACCEPTE, reference='RES-INCONNUE')
+
+        # Reste dans la file tant que le paiement peut encore être enregistré
+        self.assertEqual(traiter_notifications(), {})
+        EvenementPaiement.objects.update(recu_le=timezone.now() - DELAI_PAIEMENT_INCONNU - datetime.timedelta(minutes=1))
+        self.assertEqual(traiter_notifications(), {EvenementPaiement.StatutEvenement.ERREUR: 1})
+
+
+@override_settings(POLITIQUE_REMBOURSEMENT={
+    'PALIERS_ANNULATION': [(7, '1.00'), (1, '0.50'), (0, '0.25')], 'ARRONDI': '100',
+})
+class RemboursementsTests(DonneesReservationMixin, TestCase):
+    """Politique de remboursement et traitement des demandes par lots"""
+
+    def payer(self, reservation):
+        return Paiement.objects.create(
+            reservation=reservation, montant=reservation.montant_total, statut=Paiement.StatutPaiement.PAID,
+            operateur='lumicash',
+        )
+
+    def test_paliers_d_annulation(self):
+        maintenant = timezone.now()
+        for jours, taux in ((10, '1.00'), (7, '1.00'), (3, '0.50'), (1, '0.50'), (0, '0.25'), (-1, '0')):
+            with self.subTest(jours=jours):
+                depart = maintenant + datetime.timedelta(days=jours, minutes=1)
+                self.assertEqual(taux_annulation(depart, maintenant), Decimal(taux))
+
+    def test_montant_arrondi_sans_depasser_le_paiement(self):
+        self.assertEqual(montant_rembourse(Decimal('12345'), Decimal('0.25')), Decimal('3100'))
+        # 12 400 après arrondi, plafonné au montant payé
+        self.assertEqual(montant_rembourse(Decimal('12380'), Decimal('1.00')), Decimal('12380'))
+
+    def test_traitement_par_lots(self):
+        reservations = [
+            self.reserver(statut=Reservation.StatutReservation.CONFIRMEE, reference=f'RES-{numero}') for numero in range(3)
+        ]
+        for reservation in reservations:
+            self.payer(reservation)
+        # Départ dans un à deux jours : palier à 50 %
+        demande = demander_remboursement(reservations[0], 'Annulation')
+        self.assertEqual(demande.montant, Decimal('5000'))
+        self.assertEqual(demander_remboursements_depart(Horaire.objects.filter(pk=self.horaire.pk)), 2)
+
+        bilan = traiter_remboursements(taille_lot=2)
+
+        self.assertEqual(bilan, {'traites': 3, 'montant': Decimal('25000')})
+        self.assertEqual(self.places_vendues(), 0)
+        self.assertFalse(Remboursement.objects.filter(traite=False).exists())
+        self.assertEqual(
+            set(Reservation.objects.values_list('statut', flat=True)), {Reservation.StatutReservation.REMBOURSEE}
+        )
+        self.assertEqual(traiter_remboursements(), {'traites': 0, 'montant': Decimal('0')})
+
+    def test_paiement_non_encaisse_ignore(self):
+        paiement = self.payer(self.reserver(statut=Reservation.StatutReservation.CONFIRMEE))
+        Remboursement.objects.create(paiement=paiement, montant=Decimal('10000'), motif='Annulation')
+        Paiement.objects.filter(pk=paiement.pk).update(statut=Paiement.StatutPaiement.PENDING)
+
+        self.assertEqual(traiter_remboursements()['traites'], 0)
+        self.assertEqual(self.places_vendues(), 1)
+
+
+class MetriquesTests(DonneesReservationMixin, TestCase):
+    """Métriques des requêtes et endpoint /metrics"""
+
+    def compteur(self, nom, *etiquettes):
+        compteurs, _histogrammes = metriques.releve_local()
+        return compteurs.get((nom, etiquettes), 0)
+
+    def test_requete_mesuree(self):
+        self.client.force_login(self.user)
+        route = ('route', 'reservations:mes-reservations')
+        requetes = self.compteur('agence_requetes_total', ('methode', 'GET'), route, ('statut', '200'))
+        sql = self.compteur('agence_sql_requetes_total', route)
+
+        self.client.get(reverse('reservations:mes-reservations'))
+
+        self.assertEqual(self.compteur('agence_requetes_total', ('methode', 'GET'), route, ('statut', '200')), requetes + 1)
+        self.assertGreater(self.compteur('agence_sql_requetes_total', route), sql)
+        _compteurs, histogrammes = metriques.releve_local()
+        self.assertGreaterEqual(sum(histogrammes[('agence_requete_duree_secondes', (route,))][:-1]), 1)
+
+    def test_format_prometheus(self):
+        metriques.observer('agence_gabarit_duree_secondes', (('gabarit', 'test/format.html'),), 0.02)
+
+        texte = metriques.exporter()
+
+        self.assertIn('# TYPE agence_gabarit_duree_secondes histogram', texte)
+        self.assertIn('agence_gabarit_duree_secondes_bucket{gabarit="test/format.html",le="0.01"} 0', texte)
+        self.assertIn('agence_gabarit_duree_secondes_bucket{gabarit="test/format.html",le="0.025"} 1', texte)
+        self.assertIn('agence_gabarit_duree_secondes_bucket{gabarit="test/format.html",le="+Inf"} 1', texte)
+        self.assertIn('agence_gabarit_duree_secondes_count{gabarit="test/format.html"} 1', texte)
+
+    def test_processus_additionnes(self):
+        cle = ('agence_cache_lectures_total', (('resultat', 'test-processus'),))
+        with tempfile.TemporaryDirectory() as repertoire, override_settings(METRIQUES={'REPERTOIRE': repertoire}):
+            # Valeurs publiées par un autre worker
+            with open(os.path.join(repertoire, 'metriques-0.json'), 'w') as sortie:
+                json.dump({'compteurs': [[cle[0], [list(cle[1][0])], 3]], 'histogrammes': []}, sortie)
+            metriques.incrementer(*cle, 2)
+
+            compteurs, _histogrammes = metriques.releve()
+
+        self.assertEqual(compteurs[cle], 5)
+
+    @override_settings(METRIQUES={'ADRESSES_AUTORISEES': [], 'JETON': 'jeton-test'})
+    def test_acces_restreint(self):
+        url = reverse('reservations:metriques')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer autre'}).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer jeton-test'}).status_code, 200)
+
+        self.client.force_login(User.objects.create_user('agent', 'agent@example.com', 'motdepasse', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class JournalisationTests(DonneesReservationMixin, TestCase):
+    """Journaux JSON et identifiant de requête"""
+
+    def evenement(self, message='Paiement %s reçu', *args, **extra):
+        record = logging.makeLogRecord({'name': 'reservations.test', 'levelname': 'INFO', 'msg': message, 'args': args})
+        for cle, valeur in extra.items():
+            setattr(record, cle, valeur)
+        return record
+
+    def test_identifiant_renvoye(self):
+        self.client.force_login(self.user)
+
+        recu = self.client.get(reverse('reservations:mes-reservations'), headers={'X-Request-ID': 'proxy-1234abcd'})
+        invalide = self.client.get(reverse('reservations:mes-reservations'), headers={'X-Request-ID': 'a b<script>'})
+        absent = self.client.get(reverse('reservations:mes-reservations'))
+
+        self.assertEqual(recu['X-Request-ID'], 'proxy-1234abcd')
+        self.assertRegex(invalide['X-Request-ID'], r'^[0-9a-f]{32}$')
+        self.assertRegex(absent['X-Request-ID'], r'^[0-9a-f]{32}$')
+        self.assertEqual(identifiant_requete.get(), '-')
+
+    def test_ligne_json(self):
+        record = self.evenement('Paiement %s reçu', 'RES-1', reservation=7)
+        jeton = identifiant_requete.set('requete-42abcdef')
+        try:
+            FiltreIdentifiantRequete().filter(record)
+        finally:
+            identifiant_requete.reset(jeton)
+
+        ligne = json.loads(FormateurJSON().format(record))
+
+        self.assertEqual(ligne['message'], 'Paiement RES-1 reçu')
+        self.assertEqual(ligne['niveau'], 'INFO')
+        self.assertEqual(ligne['request_id'], 'requete-42abcdef')
+        self.assertEqual(ligne['reservation'], 7)
+        self.assertNotIn('args', ligne)
+
+    def test_file_ecrite_et_bornee(self):
+        flux = io.StringIO()
+        gestionnaire = GestionnaireFile(capacite=2, flux=flux)
+        gestionnaire.setFormatter(FormateurJSON())
+        gestionnaire.handle(self.evenement('Premier'))
+        gestionnaire.arreter()
+        self.assertEqual(json.loads(flux.getvalue())['message'], 'Premier')
+
+        # Sans thread d'écriture, la file se remplit : l'événement suivant est abandonné
+        for message in ('Deuxième', 'Troisième', 'Quatrième'):
+            gestionnaire.handle(self.evenement(message))
+        self.assertEqual(gestionnaire.perdus, 1)
+        gestionnaire.close()
+
+    @override_settings(
+        EMAIL_BACKEND='reservations.journalisation.EmailBackendTrace',
+        EMAIL_BACKEND_TRACE='django.core.mail.backends.locmem.EmailBackend',
+    )
+    def test_email_porte_identifiant(self):
+        jeton = identifiant_requete.set('requete-42abcdef')
+        try:
+            with self.assertLogs('reservations.journalisation', 'INFO'):
+                mail.send_mail('Confirmation', 'Corps', None, ['client@example.com'])
+        finally:
+            identifiant_requete.reset(jeton)
+        mail.send_mail('Rappel', 'Corps', None, ['client@example.com'])
+
+        self.assertEqual(mail.outbox[0].extra_headers['X-Request-ID'], 'requete-42abcdef')
+        self.assertNotIn('X-Request-ID', mail.outbox[1].extra_headers)
+
+
+@override_settings(PROFILAGE={'ACTIVE': True, 'JETON': 'jeton-test'})
+class ProfilageTests(DonneesReservationMixin, TestCase):
+    """Profilage à la demande et journalisation des requêtes lentes"""
+
+    def setUp(self):
+        super().setUp()
+        self.agent = User.objects.create_user('agent', 'agent@example.com', 'motdepasse', is_staff=True)
+        self.url = reverse('reservations:mes-reservations')
+
+    def test_parametre_reserve_a_l_equipe(self):
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Profil', self.client.get(self.url, {'profiler': '1'}))
+
+        self.client.force_login(self.agent)
+        response = self.client.get(self.url, {'profiler': '1'})
+
+        entree = profilage.profil(int(response['X-Profil']))
+        self.assertEqual(entree['origine'], profilage.PARAMETRE)
+        self.assertEqual(entree['route'], 'reservations:mes-reservations')
+        self.assertEqual(self.client.get(reverse('reservations:profil-telecharger', args=[entree['numero']])).status_code, 200)
+
+    def test_entete_avec_jeton(self):
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Profil', self.client.get(self.url, headers={'X-Profilage': 'autre'}))
+
+        response = self.client.get(self.url, headers={'X-Profilage': 'jeton-test'})
+
+        self.assertEqual(profilage.profil(int(response['X-Profil']))['origine'], profilage.ENTETE)
+        # Les profils ne sont consultables que par l'équipe
+        self.assertEqual(self.client.get(reverse('reservations:profils')).status_code, 403)
+
+    @override_settings(PROFILAGE={'ACTIVE': True, 'SEUIL_REQUETE_LENTE': 0, 'MAX_REQUETES_SQL': 1})
+    def test_requete_lente_journalisee(self):
+        self.client.force_login(self.user)
+
+        with self.assertLogs('reservations.profilage', 'WARNING') as journaux:
+            response = self.client.get(self.url)
+
+        self.assertNotIn('X-Profil', response)
+        record = journaux.records[-1]
+        self.assertEqual(record.route, 'reservations:mes-reservations')
+        self.assertGreater(record.requetes_sql, 1)
+        self.assertEqual(len(record.sql), 1)
@@ -2,7 +2,13 @@ from django.urls import path
 from django.views.generic import TemplateView
 from . import views
 from .views import SearchView, ajouter_ville, ajouter_trajet, ajouter_horaire, ajouter_gare
-from .views_paiement import PaiementCreateView
+from .views_paiement import PaiementCreateView, RapprochementPaiementsView, notification_paiement
+from .views_documents import BilletPDFView, ManifesteView
+from .views_itineraires import rechercher_itineraires
+from .views_calendrier import calendrier_tarifs_view
+from .views_api import api_detail, api_index, api_liste, synchronisation_view
+from .views_metriques import metriques_view
+from .views_profilage import ProfilDetailView, ProfilListView, ProfilTelechargerView
 from .reports import rapports_ventes
 from .views_test import test_currency_filter
 
@@ -32,11 +38,24 @@ urlpatterns = [
     path('reservations/<int:pk>/', views.ReservationDetailView.as_view(), name='reservation-detail'),
     path('reservations/<int:pk>/annuler/', views.ReservationAnnulerView.as_view(), name='reservation-annuler'),
     path('reservations/<int:pk>/paiement/', PaiementCreateView.as_view(), name='paiement-create'),
+    path('paiements/notifications/<str:operateur>/', notification_paiement, name='notification-paiement'),
     path('reservations/<int:pk>/remboursement/', views.RemboursementDemandeView.as_view(), name='demande-remboursement'),
+    path('reservations/<int:pk>/billets.pdf', BilletPDFView.as_view(), name='billet-pdf'),
     
     # API Endpoints (AJAX)
     path('api/gares-par-ville/<int:ville_id>/', views.get_gares_par_ville, name='api-gares-par-ville'),
     path('api/trajets-par-gares/', views.get_trajets_par_gares, name='api-trajets-par-gares'),
+    path('api/itineraires/', rechercher_itineraires, name='api-itineraires'),
+    path('api/calendrier-tarifs/', calendrier_tarifs_view, name='api-calendrier-tarifs'),
+    
+    # API de lecture versionnée (partenaires, application mobile)
+    path('api/v1/', api_index, name='api-v1'),
+    path('api/v1/<str:nom>/', api_liste, name='api-v1-liste'),
+    path('api/v1/<str:nom>/<int:pk>/', api_detail, name='api-v1-detail'),
+    path('sync', synchronisation_view, name='synchronisation'),
+    
+    # Supervision (Prometheus)
+    path('metrics', metriques_view, name='metriques'),
     
     # Espace administrateur
     path('admin/reservations/', views.GestionReservationsView.as_view(), name='gestion-reservations'),
@@ -66,7 +85,12 @@ urlpatterns = [
     path('horaires/ajouter/', ajouter_horaire, name='horaire-ajouter'),
     path('horaires/<int:pk>/modifier/', views.HoraireUpdateView.as_view(), name='horaire-update'),
     path('horaires/<int:pk>/supprimer/', views.HoraireDeleteView.as_view(), name='horaire-delete'),
+    path('horaires/<int:pk>/manifeste/', ManifesteView.as_view(), name='horaire-manifeste'),
     
     # Rapports
     path('rapports/ventes/', rapports_ventes, name='rapports-ventes'),
+    path('rapports/rapprochement/', RapprochementPaiementsView.as_view(), name='rapprochement-paiements'),
+    path('rapports/profils/', ProfilListView.as_view(), name='profils'),
+    path('rapports/profils/<int:numero>/', ProfilDetailView.as_view(), name='profil-detail'),
+    path('rapports/profils/<int:numero>/profil.prof', ProfilTelechargerView.as_view(), name='profil-telecharger'),
 ]
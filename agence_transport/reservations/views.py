@@ -3,7 +3,7 @@ from django.template.loader import render_to_string, get_template
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q, F, Sum
 from django.http import JsonResponse, HttpResponse
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, FormView, View
@@ -18,6 +18,9 @@ from django.db.models import Q
 from .models import Horaire, Gare, Trajet, Reservation, Client, Billet, Remboursement, User, Ville, TicketBonus
 from .forms import VilleForm, TrajetForm, HoraireForm, GareForm
 from .forms import ContactForm, ClientForm, ReservationForm, PaiementForm, RemboursementForm, FiltreHorairesForm
+from .pagination import PaginationCurseurMixin
+from .recherche import rechercher_reservations
+from .tarification import appliquer_tarifs
 
 class SearchView(ListView):
     model = Horaire
@@ -26,42 +29,31 @@ class SearchView(ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        # Filtrer uniquement les horaires futurs avec des places disponibles
-        now = timezone.now()
-        queryset = Horaire.objects.filter(
-            date_depart__gt=now,  # Utilisation de __gt pour exclure les départs en cours
-            places_standard__gt=0  # On filtre sur les places standard par défaut
+        # Horaires futurs avec des places standard, entre les gares choisies
+        queryset = Horaire.objects.bookable('STD').between(
+            self.request.GET.get('departure'),
+            self.request.GET.get('arrival'),
+            gares=True
         ).select_related(
             'trajet__depart__ville',
             'trajet__arrivee__ville'
-        )
+        ).with_classes().with_min_price()
         
-        # Get search parameters from GET request
-        departure_id = self.request.GET.get('departure')
-        arrival_id = self.request.GET.get('arrival')
         date = self.request.GET.get('date')
-        
-        # Apply filters if they exist
-        if departure_id:
-            queryset = queryset.filter(trajet__depart_id=departure_id)
-        if arrival_id:
-            queryset = queryset.filter(trajet__arrivee_id=arrival_id)
         if date:
             # S'assurer que la date est valide avant de filtrer
             try:
-                date_obj = timezone.datetime.strptime(date, '%Y-%m-%d').date()
-                queryset = queryset.filter(
-                    date_depart__date=date_obj,
-                    date_depart__gt=now  # S'assurer que c'est dans le futur
-                )
+                queryset = queryset.on_date(timezone.datetime.strptime(date, '%Y-%m-%d').date())
             except (ValueError, TypeError):
                 # En cas d'erreur de format de date, on ignore le filtre
                 pass
             
-        return queryset.order_by('date_depart')
+        return queryset.order_by('date_depart', 'id')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Prix affichés : ceux qui seront facturés
+        context['horaires'] = appliquer_tarifs(context['horaires'])
         # Add all gares to the context for the dropdowns
         context['gares'] = Gare.objects.select_related('ville').all()
         return context
@@ -98,45 +90,28 @@ class ContactView(FormView):
         return super().form_valid(form)
 
 # Vues pour les utilisateurs standards
-class HomeView(ListView):
+class HomeView(PaginationCurseurMixin, ListView):
     model = Horaire
     template_name = 'reservations/home.html'
     context_object_name = 'horaires'
     paginate_by = 10
+    ordre_curseur = ['date_depart', 'id']
 
     def get_queryset(self):
-        # Filtrer uniquement les horaires futurs avec des places disponibles
-        now = timezone.now()
-        queryset = Horaire.objects.filter(
-            date_depart__gt=now  # Utilisation de __gt pour exclure les départs en cours
-        ).annotate(
-            total_places=models.F('places_standard') + models.F('places_business') + models.F('places_premiere')
-        ).filter(
-            total_places__gt=0  # Ne montrer que les horaires avec au moins une place disponible
+        # Horaires futurs avec au moins une place disponible, toutes classes confondues
+        queryset = Horaire.objects.bookable().between(
+            self.request.GET.get('depart'),
+            self.request.GET.get('arrivee')
         ).select_related(
             'trajet__depart__ville', 
             'trajet__arrivee__ville'
-        ).order_by('date_depart')
+        ).with_classes().with_min_price().order_by('date_depart', 'id')
         
-        # Filtrage par ville de départ et d'arrivée
-        depart = self.request.GET.get('depart')
-        arrivee = self.request.GET.get('arrivee')
         date = self.request.GET.get('date')
-        
-        if depart:
-            queryset = queryset.filter(trajet__depart__ville__id=depart)
-        if arrivee:
-            queryset = queryset.filter(trajet__arrivee__ville__id=arrivee)
         if date:
             # S'assurer que la date est valide avant de filtrer
             try:
-                date_obj = timezone.datetime.strptime(date, '%Y-%m-%d').date()
-                next_day = date_obj + timezone.timedelta(days=1)
-                queryset = queryset.filter(
-                    date_depart__date__gte=date_obj,
-                    date_depart__date__lt=next_day,
-                    date_depart__gt=now  # S'assurer que c'est dans le futur
-                )
+                queryset = queryset.on_date(timezone.datetime.strptime(date, '%Y-%m-%d').date())
             except (ValueError, TypeError):
                 # En cas d'erreur de format de date, on ignore le filtre
                 pass
@@ -145,6 +120,8 @@ class HomeView(ListView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # Prix affichés : ceux qui seront facturés
+        context['horaires'] = appliquer_tarifs(context['horaires'])
         context['villes'] = Ville.objects.all()
         return context
 
@@ -161,6 +138,10 @@ class HoraireDetailView(LoginRequiredMixin, DetailView):
 from django.core.mail import send_mail
 from django.conf import settings
 from .emails import envoyer_email_confirmation_reservation
+from .inventaire import retenir_places, liberer_reservation
+from .blocages import creer_blocage
+from .remboursements import demander_remboursement, traiter_remboursements
+from .tarification import coter, prix_reservation
 
 class ReservationCreateView(LoginRequiredMixin, CreateView):
     model = Reservation
@@ -172,19 +153,19 @@ class ReservationCreateView(LoginRequiredMixin, CreateView):
         context = super().get_context_data(**kwargs)
         horaire = get_object_or_404(Horaire, pk=self.kwargs['pk'])
         context['horaire'] = horaire
+        context['tarifs'] = coter(self.request.session, horaire)
         
-        # Vérifier les tickets bonus disponibles
-        tickets_bonus = []
+        # Tickets bonus disponibles : le compteur du client suffit pour le bandeau
+        tickets_bonus = TicketBonus.objects.none()
+        afficher_rappel_bonus = False
         if self.request.user.is_authenticated and hasattr(self.request.user, 'client'):
-            tickets_bonus = TicketBonus.objects.filter(
-                client=self.request.user.client,
-                utilise=False,
-                date_expiration__gt=timezone.now()
-            )
+            client = self.request.user.client
+            tickets_bonus = TicketBonus.objects.filter(client=client).valides()
+            afficher_rappel_bonus = client.tickets_bonus_valides > 0
         
         context.update({
             'tickets_bonus': tickets_bonus,
-            'afficher_rappel_bonus': tickets_bonus.exists()
+            'afficher_rappel_bonus': afficher_rappel_bonus
         })
         
         if 'client_form' not in context:
@@ -204,11 +185,10 @@ class ReservationCreateView(LoginRequiredMixin, CreateView):
                 messages.warning(request, 'Veuillez vous connecter pour effectuer une réservation.')
                 return redirect('account_login')
             
-            # Récupérer l'horaire
-            horaire = get_object_or_404(Horaire, pk=kwargs['pk'])
-            
-            # Vérifier les places disponibles pour les billets standard
-            if horaire.get_places_disponibles('STD') <= 0:
+            # Récupérer l'horaire s'il est encore réservable en classe standard
+            horaire = Horaire.objects.bookable('STD').with_classes().filter(pk=kwargs['pk']).first()
+            if horaire is None:
+                get_object_or_404(Horaire.objects.only('pk'), pk=kwargs['pk'])
                 messages.error(request, 'Désolé, il n\'y a plus de places disponibles pour ce trajet.')
                 return redirect('reservations:home')
             
@@ -229,7 +209,11 @@ class ReservationCreateView(LoginRequiredMixin, CreateView):
             context = {
                 'form': form,
                 'client_form': client_form,
-                'horaire': horaire
+                'horaire': horaire,
+                # Prix affichés, garantis pendant la durée du devis
+                'tarifs': coter(request.session, horaire),
+                # Bandeau de réservation offerte, sans requête sur les tickets
+                'reservation_gratuite': hasattr(request.user, 'client') and request.user.client.tickets_bonus_valides > 0,
             }
             
             return render(request, self.template_name, context)
@@ -289,113 +273,67 @@ class ReservationCreateView(LoginRequiredMixin, CreateView):
             type_billet = form.cleaned_data.get('type_billet', Billet.TypeBillet.STANDARD)
             nombre_billets = form.cleaned_data.get('nombre_billets', 0)
             
-            # Vérifier les places disponibles selon le type de billet
-            places_disponibles = 0
-            message_erreur = ""
-            
-            if type_billet == Billet.TypeBillet.STANDARD:
-                places_disponibles = horaire.places_standard
-                message_erreur = "Désolé, il n'y a pas assez de places disponibles en classe Standard pour ce trajet."
-            elif type_billet == Billet.TypeBillet.BUSINESS:
-                places_disponibles = horaire.places_business
-                message_erreur = "Désolé, il n'y a pas assez de places disponibles en classe Business pour ce trajet."
-            elif type_billet == Billet.TypeBillet.PREMIERE:
-                places_disponibles = horaire.places_premiere
-                message_erreur = "Désolé, il n'y a pas assez de places disponibles en Première Classe pour ce trajet."
-            
-            if places_disponibles < nombre_billets:
-                messages.error(self.request, message_erreur)
-                return self.form_invalid(form, client_form)
+            messages_erreur = {
+                Billet.TypeBillet.STANDARD: "Désolé, il n'y a pas assez de places disponibles en classe Standard pour ce trajet.",
+                Billet.TypeBillet.BUSINESS: "Désolé, il n'y a pas assez de places disponibles en classe Business pour ce trajet.",
+                Billet.TypeBillet.PREMIERE: "Désolé, il n'y a pas assez de places disponibles en Première Classe pour ce trajet.",
+            }
             
-            # Déterminer le prix en fonction du type de billet
-            if type_billet == Billet.TypeBillet.STANDARD:
-                prix_unitaire = horaire.prix_standard
-            elif type_billet == Billet.TypeBillet.BUSINESS:
-                prix_unitaire = horaire.prix_business
-            elif type_billet == Billet.TypeBillet.PREMIERE:
-                prix_unitaire = horaire.prix_premiere
+            # Prix courant du type de billet, plafonné par le prix affiché au client
+            prix_unitaire = prix_reservation(self.request.session, horaire, type_billet)
             
-            # Vérifier si l'utilisateur a un ticket bonus valide à utiliser
-            ticket_bonus = None
-            if hasattr(self.request.user, 'client'):
-                ticket_bonus = TicketBonus.objects.filter(
-                    client=self.request.user.client,
-                    utilise=False,
-                    date_expiration__gt=timezone.now()
-                ).first()
+            with transaction.atomic():
+                # Retenir les places : la mise à jour échoue s'il n'en reste pas assez
+                if not retenir_places(horaire.pk, type_billet, nombre_billets):
+                    messages.error(self.request, messages_erreur[type_billet])
+                    return self.form_invalid(form, client_form)
                 
-                if ticket_bonus and nombre_billets <= ticket_bonus.nombre_places:
-                    # Utiliser le ticket bonus
-                    prix_unitaire = 0
-                    ticket_bonus.utiliser()
-                    messages.success(
-                        self.request, 
-                        f"Votre ticket bonus {ticket_bonus.code} a été utilisé pour cette réservation !"
-                    )
-            
-            # Calculer le prix total
-            prix_total = prix_unitaire * nombre_billets
-            
-            # Création de la réservation
-            reservation = Reservation.objects.create(
-                client=client,
-                horaire=horaire,
-                montant_total=prix_total,  # Utilisation de la variable prix_total définie plus haut
-                reference=f"RES-{timezone.now().strftime('%Y%m%d%H%M%S')}",
-                statut=Reservation.StatutReservation.CONFIRMEE
-            )
-            
-            # Création des billets
-            for i in range(nombre_billets):
-                Billet.objects.create(
-                    reservation=reservation,
-                    type_billet=type_billet,
-                    prix=prix_unitaire,
-                    siege=f"{type_billet}-{i+1}"
-                )
-            
-            # Mise à jour des places disponibles selon le type de billet
-            if type_billet == Billet.TypeBillet.STANDARD:
-                horaire.places_standard -= nombre_billets
-            elif type_billet == Billet.TypeBillet.BUSINESS:
-                horaire.places_business -= nombre_billets
-            elif type_billet == Billet.TypeBillet.PREMIERE:
-                horaire.places_premiere -= nombre_billets
-            
-            # Mettre à jour le compteur de places réservées pour le client
-            # et vérifier si un ticket bonus est gagné
-            tickets_gagnes = client.ajouter_reservation(nombre_billets)
-            
-            # Si des tickets bonus ont été gagnés, les créer
-            for _ in range(tickets_gagnes):
-                ticket = TicketBonus.creer_ticket_bonus(
-                    client=client,
-                    montant=0,  # Ou le montant de réduction si vous le souhaitez
-                    nombre_places=1
-                )
-                # Envoyer une notification au client
-                messages.success(
-                    self.request,
-                    f"Félicitations ! Vous avez gagné un ticket bonus pour votre prochain voyage ! "
-                    f"Code: {ticket.code} (Valable jusqu'au {ticket.date_expiration.strftime('%d/%m/%Y')})"
-                )
-            
-            try:
-                horaire.save()
+                # Vérifier si l'utilisateur a un ticket bonus valide à utiliser
+                ticket_bonus = None
+                if hasattr(self.request.user, 'client') and self.request.user.client.tickets_bonus_valides:
+                    candidat = TicketBonus.objects.filter(
+                        client=self.request.user.client
+                    ).valides().order_by('date_expiration').first()
+                    
+                    # Utiliser le ticket bonus (échoue s'il vient d'être utilisé ailleurs) ;
+                    # il est rendu au client si le paiement n'a pas lieu
+                    if candidat and nombre_billets <= candidat.nombre_places and candidat.utiliser():
+                        ticket_bonus = candidat
+                        prix_unitaire = 0
+                        messages.success(
+                            self.request, 
+                            f"Votre ticket bonus {ticket_bonus.code} a été utilisé pour cette réservation !"
+                        )
                 
-                # Envoyer l'email de confirmation de réservation
-                from .emails import envoyer_email_confirmation_reservation
-                envoyer_email_confirmation_reservation(reservation)
+                # Calculer le prix total
+                prix_total = prix_unitaire * nombre_billets
                 
-                messages.success(
-                    self.request,
-                    f"Réservation effectuée avec succès ! Un email de confirmation a été envoyé à {user.email}."
+                # Création de la réservation, en attente jusqu'au paiement
+                reservation = Reservation.objects.create(
+                    client=client,
+                    horaire=horaire,
+                    montant_total=prix_total,
+                    reference=f"RES-{timezone.now().strftime('%Y%m%d%H%M%S')}",
+                    statut=Reservation.StatutReservation.EN_ATTENTE
                 )
                 
-            except Exception as e:
-                # En cas d'erreur lors de la sauvegarde
-                messages.error(self.request, f"Erreur lors de la mise à jour des places disponibles : {str(e)}")
-                return self.form_invalid(form, client_form)
+                # Création des billets
+                for i in range(nombre_billets):
+                    Billet.objects.create(
+                        reservation=reservation,
+                        type_billet=type_billet,
+                        prix=prix_unitaire,
+                        siege=f"{type_billet}-{i+1}"
+                    )
+                
+                # Les places restent bloquées le temps du paiement
+                blocage = creer_blocage(reservation, type_billet, nombre_billets, ticket_bonus=ticket_bonus)
+            
+            messages.info(
+                self.request,
+                f"Vos places sont réservées jusqu'à {timezone.localtime(blocage.expire_le).strftime('%H:%M')}. "
+                f"Finalisez le paiement pour confirmer votre réservation."
+            )
             
             return redirect('reservations:paiement-create', pk=reservation.pk)
             
@@ -527,63 +465,34 @@ class ReservationDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView)
         reservation = self.get_object()
         return self.request.user == reservation.client.user or self.request.user.is_staff
 
-class MesReservationsView(LoginRequiredMixin, ListView):
+class MesReservationsView(LoginRequiredMixin, PaginationCurseurMixin, ListView):
     model = Reservation
     template_name = 'reservations/mes_reservations.html'
     context_object_name = 'reservations'
     paginate_by = 10
+    ordre_curseur = ['-date_reservation', '-id']
     
     def get_queryset(self):
         # Vérifier si le client existe, sinon le créer
         client, created = Client.objects.get_or_create(user=self.request.user)
         return Reservation.objects.filter(
             client=client
-        ).select_related('horaire__trajet__depart__ville', 'horaire__trajet__arrivee__ville').order_by('-date_reservation')
+        ).select_related(
+            'horaire__trajet__depart__ville', 'horaire__trajet__arrivee__ville'
+        ).with_display_status().order_by('-date_reservation', '-id')
         
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Vérifier si l'utilisateur a un client associé
-        print(f"[DEBUG] Utilisateur: {self.request.user}")
-        print(f"[DEBUG] Client associé: {hasattr(self.request.user, 'client')}")
-        
+        # Tickets bonus valides du client (émis au paiement des réservations)
         if hasattr(self.request.user, 'client'):
-            # Vérifier le nombre de places réservées
-            print(f"[DEBUG] Nombre de places réservées: {self.request.user.client.places_reservees}")
-            
-            # Vérifier les tickets bonus existants
-            tickets_bonus = TicketBonus.objects.filter(
-                client=self.request.user.client,
-                utilise=False,
-                date_expiration__gt=timezone.now()
-            ).order_by('date_expiration')
-            
-            print(f"[DEBUG] Tickets bonus trouvés: {tickets_bonus.count()}")
-            
+            tickets_bonus = []
+            if self.request.user.client.tickets_bonus_valides:
+                tickets_bonus = list(TicketBonus.objects.filter(
+                    client=self.request.user.client
+                ).valides().order_by('date_expiration'))
             context['tickets_bonus'] = tickets_bonus
-            context['afficher_notification_bonus'] = tickets_bonus.exists()
-            
-            # Vérifier si on doit créer un nouveau ticket bonus
-            if self.request.user.client.places_reservees >= 5:
-                print("[DEBUG] Nombre de places suffisant pour un ticket bonus")
-                # Créer un ticket bonus
-                nouveau_ticket = TicketBonus.creer_ticket_bonus(
-                    client=self.request.user.client,
-                    montant=0,  # ou le montant de réduction souhaité
-                    nombre_places=1
-                )
-                print(f"[DEBUG] Nouveau ticket bonus créé: {nouveau_ticket}")
-                
-                # Mettre à jour le contexte avec le nouveau ticket
-                tickets_bonus = TicketBonus.objects.filter(
-                    client=self.request.user.client,
-                    utilise=False,
-                    date_expiration__gt=timezone.now()
-                ).order_by('date_expiration')
-                context['tickets_bonus'] = tickets_bonus
-                context['afficher_notification_bonus'] = True
-        else:
-            print("[DEBUG] Aucun client associé à cet utilisateur")
+            context['afficher_notification_bonus'] = bool(tickets_bonus)
             
         return context
 
@@ -599,11 +508,7 @@ class MesTicketsBonusView(LoginRequiredMixin, ListView):
         client, created = Client.objects.get_or_create(user=self.request.user)
         
         # Return valid tickets (not used and not expired) for the client
-        return TicketBonus.objects.filter(
-            client=client,
-            utilise=False,
-            date_expiration__gt=timezone.now()
-        ).order_by('date_expiration')
+        return TicketBonus.objects.filter(client=client).valides().order_by('date_expiration')
 
 class RemboursementDemandeView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = Remboursement
@@ -639,24 +544,14 @@ class ReservationAnnulerView(LoginRequiredMixin, UserPassesTestMixin, UpdateView
             messages.error(self.request, "Cette réservation ne peut pas être annulée.")
             return redirect('reservations:mes-reservations')
         
-        # Mise à jour du statut de la réservation
-        reservation.statut = 'ANNU'  # Annulée
-        reservation.save()
+        # Annulation de la réservation : les places sont rendues à l'horaire
+        liberer_reservation(reservation, statut=Reservation.StatutReservation.ANNULEE)
         
-        # Si un paiement a été effectué, créer une demande de remboursement
-        if hasattr(reservation, 'paiement') and reservation.paiement.statut == 'PAYE':
-            Remboursement.objects.create(
-                paiement=reservation.paiement,
-                montant=reservation.montant_total * 0.8,  # 80% de remboursement
-                motif="Annulation par l'utilisateur"
-            )
-        
-        # Décrémenter le compteur de places réservées
-        reservation.client.places_reservees = max(0, reservation.client.places_reservees - reservation.billets.count())
-        reservation.client.save()
+        # Si un paiement a été effectué, créer une demande de remboursement selon la politique d'annulation
+        demander_remboursement(reservation, motif="Annulation par l'utilisateur")
         
         messages.success(self.request, "La réservation a été annulée avec succès. Un remboursement sera effectué si applicable.")
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
 
 class ProfilUpdateView(LoginRequiredMixin, UpdateView):
     model = User
@@ -672,11 +567,13 @@ class ProfilUpdateView(LoginRequiredMixin, UpdateView):
         return super().form_valid(form)
 
 # Vues pour l'administration (staff)
-class GestionReservationsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class GestionReservationsView(LoginRequiredMixin, UserPassesTestMixin, PaginationCurseurMixin, ListView):
     model = Reservation
     template_name = 'reservations/admin/gestion_reservations.html'
     context_object_name = 'reservations'
     paginate_by = 20
+    ordre_curseur = ['-date_reservation', '-id']
+    estimer_total = True
     
     def test_func(self):
         return self.request.user.is_staff
@@ -686,14 +583,24 @@ class GestionReservationsView(LoginRequiredMixin, UserPassesTestMixin, ListView)
             'client__user',
             'horaire__trajet__depart__ville',
             'horaire__trajet__arrivee__ville'
-        ).order_by('-date_reservation')
+        ).with_display_status().order_by('-date_reservation', '-id')
         
         statut = self.request.GET.get('statut')
         if statut:
             queryset = queryset.filter(statut=statut)
+
+        # Recherche par préfixe de référence, nom, identifiant ou téléphone
+        recherche = self.request.GET.get('q')
+        if recherche:
+            queryset = rechercher_reservations(queryset, recherche)
             
         return queryset
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['recherche'] = self.request.GET.get('q', '')
+        return context
+
 class GestionRemboursementsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Remboursement
     template_name = 'reservations/admin/gestion_remboursements.html'
@@ -725,19 +632,16 @@ class TraiterRemboursementView(LoginRequiredMixin, UserPassesTestMixin, UpdateVi
     def form_valid(self, form):
         remboursement = self.get_object()
         
-        # Marquer le remboursement comme traité
-        remboursement.traite = True
-        remboursement.date_traitement = timezone.now()
-        remboursement.save()
-        
-        # Mettre à jour le statut du paiement
-        remboursement.paiement.statut = 'REFU'  # Remboursé
-        remboursement.paiement.save()
+        # Remboursement, paiement et réservation mis à jour dans une seule transaction
+        bilan = traiter_remboursements(Remboursement.objects.filter(pk=remboursement.pk))
         
         # Ici, vous pourriez ajouter une logique pour effectuer le remboursement via l'API de paiement
         
-        messages.success(self.request, f"Le remboursement de {remboursement.montant}€ a été traité avec succès.")
-        return redirect('gestion-remboursements')
+        if bilan['traites']:
+            messages.success(self.request, f"Le remboursement de {remboursement.montant}€ a été traité avec succès.")
+        else:
+            messages.error(self.request, "Ce remboursement est déjà traité, ou son paiement n'a pas été encaissé.")
+        return redirect('reservations:gestion-remboursements')
 
 # Vues pour l'API (utilisées pour les requêtes AJAX)
 @login_required
@@ -877,11 +781,13 @@ class GareDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 # Vues pour la gestion des horaires
-class HoraireListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class HoraireListView(LoginRequiredMixin, UserPassesTestMixin, PaginationCurseurMixin, ListView):
     model = Horaire
     template_name = 'reservations/horaires/horaire_list.html'
     context_object_name = 'horaires'
     paginate_by = 15
+    ordre_curseur = ['-date_depart', '-id']
+    estimer_total = True
     
     def test_func(self):
         return self.request.user.is_staff
@@ -890,7 +796,7 @@ class HoraireListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         queryset = Horaire.objects.select_related(
             'trajet__depart__ville', 
             'trajet__arrivee__ville'
-        ).order_by('-date_depart')
+        ).with_classes().order_by('-date_depart', '-id')
         
         # Filtrage par trajet
         trajet_id = self.request.GET.get('trajet')
@@ -901,22 +807,16 @@ class HoraireListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         date_depart = self.request.GET.get('date_depart')
         if date_depart:
             try:
-                date_obj = datetime.strptime(date_depart, '%Y-%m-%d').date()
-                next_day = date_obj + timedelta(days=1)
-                queryset = queryset.filter(
-                    date_depart__date__gte=date_obj,
-                    date_depart__date__lt=next_day
-                )
+                queryset = queryset.on_date(timezone.datetime.strptime(date_depart, '%Y-%m-%d').date())
             except ValueError:
                 pass
                 
         # Filtrage par statut (passé/à venir)
         statut = self.request.GET.get('statut')
-        now = timezone.now()
         if statut == 'passe':
-            queryset = queryset.filter(date_depart__lt=now)
+            queryset = queryset.filter(date_depart__lte=timezone.now())
         elif statut == 'a_venir':
-            queryset = queryset.filter(date_depart__gte=now)
+            queryset = queryset.upcoming()
             
         return queryset
     
@@ -0,0 +1,130 @@
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.utils.http import parse_etags, urlencode
+from django.views.decorators.http import require_GET
+
+from . import api, synchronisation
+from .models import Client
+from .pagination import CurseurInvalide
+
+
+def _cle_cache(nom, ressource, request, *complement):
+    # Paramètres triés : ?a=1&b=2 et ?b=2&a=1 partagent la même entrée
+    requete = urlencode(sorted((cle, valeur) for cle, valeurs in request.GET.lists() for valeur in valeurs))
+    empreinte = hashlib.md5(requete.encode()).hexdigest()
+    return ':'.join(['api', api.VERSION, nom, str(ressource.version()), *map(str, complement), empreinte])
+
+
+def _reponse(request, cle, produire):
+    """
+    Réponse JSON mise en cache sous `cle`, calculée par `produire()` (qui
+    retourne le corps et ses dépendances, ou None pour une réponse 404),
+    avec son ETag.
+    """
+    reglages = api.parametres()
+    entree = cache.get(cle)
+    if entree is None or not api.dependances_a_jour(entree[2]):
+        try:
+            resultat = produire()
+        except api.ParametreInvalide as e:
+            return JsonResponse({'erreur': str(e)}, status=400)
+        except CurseurInvalide:
+            return JsonResponse({'erreur': "Curseur de pagination invalide."}, status=400)
+        if resultat is None:
+            return JsonResponse({'erreur': "Élément introuvable."}, status=404)
+        corps, dependances = resultat
+        entree = (api.etiquette(corps), corps, dependances)
+        cache.set(cle, entree, reglages['DUREE_CACHE'])
+
+    etag, corps, _dependances = entree
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(corps, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = f"public, max-age={reglages['MAX_AGE']}"
+    return response
+
+
+@require_GET
+def api_index(request):
+    """Ressources de l'API et leurs champs"""
+    return JsonResponse({
+        'version': api.VERSION,
+        'ressources': {
+            nom: {'url': reverse('reservations:api-v1-liste', args=[nom]), 'champs': ressource.champs}
+            for nom, ressource in api.RESSOURCES.items()
+        },
+    })
+
+
+@require_GET
+def api_liste(request, nom):
+    """Page d'une ressource de l'API (voir api.py pour les paramètres)"""
+    ressource = api.RESSOURCES.get(nom)
+    if ressource is None:
+        return JsonResponse({'erreur': f"Ressource inconnue : {nom}."}, status=404)
+
+    def produire():
+        reglages = api.parametres()
+        limite = request.GET.get('limite')
+        limite = api.entier(limite, 'limite') if limite else reglages['TAILLE_PAGE']
+        limite = min(max(limite, 1), reglages['TAILLE_PAGE_MAX'])
+        resultats, suivant, precedent, dependances = api.lister(ressource, request.GET, limite, request.GET.get('curseur'))
+
+        def lien(jeton):
+            if jeton is None:
+                return None
+            parametres = request.GET.copy()
+            parametres['curseur'] = jeton
+            return f'{request.path}?{parametres.urlencode()}'
+
+        corps = api.serialiser({'resultats': resultats, 'suivant': lien(suivant), 'precedent': lien(precedent)})
+        return corps, dependances
+
+    return _reponse(request, _cle_cache(nom, ressource, request), produire)
+
+
+@require_GET
+def api_detail(request, nom, pk):
+    """Élément d'une ressource de l'API"""
+    ressource = api.RESSOURCES.get(nom)
+    if ressource is None:
+        return JsonResponse({'erreur': f"Ressource inconnue : {nom}."}, status=404)
+
+    def produire():
+        element, dependances = api.detail(ressource, pk, request.GET)
+        return (api.serialiser(element), dependances) if element is not None else None
+
+    return _reponse(request, _cle_cache(nom, ressource, request, pk), produire)
+
+
+@require_GET
+def synchronisation_view(request):
+    """
+    Modifications depuis le jeton `since` (voir synchronisation.py) ; sans
+    jeton, le jeton courant, point de départ d'une synchronisation complète.
+    """
+    jeton = request.GET.get('since')
+    if not jeton:
+        response = HttpResponse(api.serialiser({
+            'jeton': str(synchronisation.sequence_courante()),
+            'ressources': reverse('reservations:api-v1'),
+        }), content_type='application/json')
+    else:
+        client_id = None
+        if request.user.is_authenticated:
+            client_id = Client.objects.filter(user=request.user).values_list('pk', flat=True).first()
+        try:
+            depuis = synchronisation.lire_jeton(jeton)
+            reponse = synchronisation.flux(depuis, client_id)
+        except synchronisation.JetonInvalide:
+            return JsonResponse(
+                {'erreur': "Jeton trop ancien ou invalide : synchronisation complète nécessaire."}, status=410
+            )
+        response = HttpResponse(api.serialiser(reponse), content_type='application/json')
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,28 @@
+from django.http import JsonResponse
+
+from .api import ParametreInvalide, date_parametre
+from .calendrier import JOURS_PAR_DEFAUT, calendrier_tarifs
+
+
+def calendrier_tarifs_view(request):
+    """
+    Calendrier des tarifs d'une liaison au format JSON.
+
+    Paramètres : depart, arrivee (gares, ou villes avec ?niveau=ville),
+    debut (AAAA-MM-JJ à moins d'un an, aujourd'hui par défaut), jours (30 par défaut, 60 au plus).
+    """
+    depart = request.GET.get('depart')
+    arrivee = request.GET.get('arrivee')
+    if not (depart and arrivee and depart.isdigit() and arrivee.isdigit()):
+        return JsonResponse({'erreur': "Paramètres depart et arrivee requis."}, status=400)
+
+    try:
+        debut = request.GET.get('debut')
+        debut = date_parametre(debut, 'debut') if debut else None
+        jours = int(request.GET.get('jours', JOURS_PAR_DEFAUT))
+    except (ParametreInvalide, ValueError):
+        return JsonResponse({'erreur': "Paramètres debut ou jours invalides."}, status=400)
+
+    par_ville = request.GET.get('niveau') == 'ville'
+    jours = calendrier_tarifs(int(depart), int(arrivee), debut=debut, jours=jours, par_ville=par_ville)
+    return JsonResponse({'depart': int(depart), 'arrivee': int(arrivee), 'jours': jours})
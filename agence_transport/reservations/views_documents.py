@@ -0,0 +1,57 @@
+from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.generic import View
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+
+from .models import Horaire, Reservation
+from .documents import generer_billet_pdf, iter_manifeste_csv, iter_manifeste_pdf
+
+
+class BilletPDFView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Téléchargement des billets d'une réservation au format PDF, seulement
+    une fois payée : une réservation en attente, annulée ou remboursée n'a
+    pas de billet valable
+    """
+    STATUTS_AVEC_BILLETS = (Reservation.StatutReservation.CONFIRMEE, Reservation.StatutReservation.UTILISEE)
+
+    def test_func(self):
+        reservation = get_object_or_404(
+            Reservation.objects.select_related('client'), pk=self.kwargs['pk']
+        )
+        self.reference = reservation.reference
+        self.statut = reservation.statut
+        return self.request.user.is_staff or self.request.user.pk == reservation.client.user_id
+
+    def get(self, request, *args, **kwargs):
+        if self.statut not in self.STATUTS_AVEC_BILLETS:
+            raise Http404("Aucun billet valable pour cette réservation")
+        response = HttpResponse(generer_billet_pdf(self.kwargs['pk']), content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="billet-{self.reference}.pdf"'
+        return response
+
+
+class ManifesteView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Manifeste passagers d'un départ (PDF par défaut, CSV avec ?format=csv).
+
+    La réponse est envoyée en flux pour que les gros manifestes ne soient
+    jamais chargés en entier en mémoire.
+    """
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        horaire = get_object_or_404(
+            Horaire.objects.select_related('trajet__depart__ville', 'trajet__arrivee__ville'),
+            pk=self.kwargs['pk']
+        )
+        nom_fichier = f"manifeste-{horaire.pk}-{horaire.date_depart.strftime('%Y%m%d-%H%M')}"
+
+        if request.GET.get('format') == 'csv':
+            response = StreamingHttpResponse(iter_manifeste_csv(horaire), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="{nom_fichier}.csv"'
+        else:
+            response = StreamingHttpResponse(iter_manifeste_pdf(horaire), content_type='application/pdf')
+            response['Content-Disposition'] = f'inline; filename="{nom_fichier}.pdf"'
+        return response
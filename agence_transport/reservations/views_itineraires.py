@@ -0,0 +1,43 @@
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .api import ParametreInvalide, date_parametre
+from .itineraires import CLASSES, NOMBRE_RESULTATS, planifier
+
+
+def rechercher_itineraires(request):
+    """
+    Itinéraires avec correspondances entre deux gares (ou deux villes avec
+    ?niveau=ville), au format JSON.
+
+    Paramètres : depart, arrivee, date (AAAA-MM-JJ à moins d'un an,
+    optionnelle), classe (STD, BUS ou PRE), nombre.
+    """
+    depart = request.GET.get('depart')
+    arrivee = request.GET.get('arrivee')
+    classe = request.GET.get('classe', 'STD')
+    if not (depart and arrivee and depart.isdigit() and arrivee.isdigit()) or classe not in CLASSES:
+        return JsonResponse({'erreur': "Paramètres depart, arrivee ou classe invalides."}, status=400)
+
+    depart_apres = None
+    date = request.GET.get('date')
+    if date:
+        try:
+            jour = date_parametre(date)
+        except ParametreInvalide as e:
+            return JsonResponse({'erreur': str(e)}, status=400)
+        depart_apres = timezone.make_aware(timezone.datetime.combine(jour, timezone.datetime.min.time()))
+
+    try:
+        nombre = min(max(int(request.GET.get('nombre', NOMBRE_RESULTATS)), 1), 20)
+    except ValueError:
+        nombre = NOMBRE_RESULTATS
+
+    itineraires = planifier(
+        int(depart), int(arrivee),
+        depart_apres=depart_apres,
+        classe=classe,
+        par_ville=request.GET.get('niveau') == 'ville',
+        nombre=nombre
+    )
+    return JsonResponse({'itineraires': [itineraire.to_dict() for itineraire in itineraires]})
@@ -0,0 +1,10 @@
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import metriques
+
+
+def metriques_view(request):
+    """Métriques de fonctionnement au format texte de Prometheus"""
+    if not metriques.acces_autorise(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metriques.exporter(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,16 +1,56 @@
 from django.shortcuts import get_object_or_404, redirect
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.conf import settings
 from django.core.mail import send_mail
-from django.views.generic import CreateView
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.generic import CreateView, FormView
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.utils import timezone
 
-from .models import Paiement, Reservation
-from .forms import PaiementForm
+from django.db import IntegrityError, transaction
 
-class PaiementCreateView(LoginRequiredMixin, CreateView):
+import codecs
+import logging
+
+from .models import Paiement, Reservation, TicketBonus
+from .forms import PaiementForm, RapprochementForm
+from .blocages import BlocageExpire, confirmer_blocage, verifier_blocage
+from .fidelite import crediter_reservation, restituer_tickets
+from .idempotence import IdempotenceMixin
+from .passerelles import ADAPTATEURS, OperateurIndisponible, budget_latence, initier_paiement
+from .confirmations import NotificationInvalide, enregistrer_notification
+from .rapprochement import ANOMALIES, LIBELLES_BILAN, ReleveInvalide, rapprocher, verifier_encodage
+
+logger = logging.getLogger(__name__)
+
+# Opérateur sollicité pour chaque moyen de paiement du formulaire ; le bon
+# d'achat est traité sans opérateur
+OPERATEURS_PAR_MOYEN = {
+    'ECOCASH': Paiement.OperateurPaiement.ECOCASH,
+    'LUMICASH': Paiement.OperateurPaiement.LUMICASH,
+    'IHELA': Paiement.OperateurPaiement.IHELA,
+    'CB': Paiement.OperateurPaiement.CARTE,
+    'PAYPAL': Paiement.OperateurPaiement.PAYPAL,
+}
+
+def bon_achat(reservation, code):
+    """
+    Ticket bon d'achat valable du client de la réservation pour le code
+    `code`, s'il couvre la réservation (montant ou nombre de places) ; sinon
+    None.
+    """
+    bon = TicketBonus.objects.filter(client_id=reservation.client_id, code__iexact=code.strip()).first()
+    if bon is None or not bon.est_valide():
+        return None
+    if bon.montant < reservation.montant_total and reservation.billets.filter(annule=False).count() > bon.nombre_places:
+        return None
+    return bon
+
+
+class PaiementCreateView(LoginRequiredMixin, IdempotenceMixin, CreateView):
     model = Paiement
     form_class = PaiementForm
     template_name = 'reservations/paiement_create.html'
@@ -22,6 +62,9 @@ class PaiementCreateView(LoginRequiredMixin, CreateView):
             pk=self.kwargs['pk'], 
             client=self.request.user.client
         )
+        blocage = getattr(context['reservation'], 'blocage', None)
+        context['expiration_blocage'] = blocage.expire_le if blocage else None
+        context['moyens_mobiles'] = list(PaiementForm.MOYENS_MOBILES)
         return context
     
     def form_valid(self, form):
@@ -31,23 +74,103 @@ class PaiementCreateView(LoginRequiredMixin, CreateView):
             client=self.request.user.client
         )
         
-        # Créer un paiement factice pour le moment
-        paiement = form.save(commit=False)
-        paiement.reservation = reservation
-        paiement.montant = reservation.montant_total
-        paiement.statut = 'EN_ATTENTE'
-        paiement.save()
+        # Requête répétée sans clé d'idempotence : la réservation est déjà payée
+        if Paiement.objects.filter(reservation=reservation).exists():
+            messages.info(self.request, 'Le paiement de cette réservation a déjà été enregistré.')
+            return redirect('reservations:reservation-detail', pk=reservation.pk)
+        
+        bon = None
+        if form.cleaned_data['moyen_paiement'] == 'TICKET':
+            bon = bon_achat(reservation, form.cleaned_data['code_bon'])
+            if bon is None:
+                messages.error(self.request, "Ce bon d'achat n'est pas valable pour cette réservation.")
+                return redirect('reservations:paiement-create', pk=reservation.pk)
+        
+        operateur = OPERATEURS_PAR_MOYEN.get(form.cleaned_data['moyen_paiement'])
+        resultat = None
+        try:
+            # Les places doivent rester bloquées pendant tout l'appel à l'opérateur
+            verifier_blocage(reservation, marge=budget_latence())
+            if operateur:
+                resultat = initier_paiement(operateur, reservation, form.cleaned_data['numero_telephone'] or None)
+        except BlocageExpire:
+            return self.places_liberees(reservation)
+        except OperateurIndisponible as e:
+            logger.warning("Paiement de la réservation %s impossible : %s", reservation.reference, e)
+            messages.error(
+                self.request,
+                'Le service de paiement est momentanément indisponible. Vos places restent réservées : '
+                'veuillez réessayer ou choisir un autre moyen de paiement.'
+            )
+            return redirect('reservations:paiement-create', pk=reservation.pk)
+        
+        if resultat is not None and resultat.refuse:
+            messages.error(self.request, f"Le paiement a été refusé. {resultat.message}".strip())
+            return redirect('reservations:paiement-create', pk=reservation.pk)
+        
+        # Le bon d'achat est utilisé, le blocage des places converti en réservation
+        # confirmée et le paiement enregistré dans une seule transaction
+        expire = False
+        try:
+            with transaction.atomic():
+                if bon is not None and not bon.utiliser():
+                    # Bon utilisé entre-temps par une autre réservation
+                    messages.error(self.request, "Ce bon d'achat n'est plus valable.")
+                    return redirect('reservations:paiement-create', pk=reservation.pk)
+                try:
+                    confirmer_blocage(reservation)
+                except BlocageExpire:
+                    # Places libérées, sans paiement : le bon est rendu au client
+                    expire = True
+                    if bon is not None:
+                        restituer_tickets({bon.pk: reservation.pk})
+                else:
+                    paiement = form.save(commit=False)
+                    paiement.reservation = reservation
+                    paiement.montant = reservation.montant_total
+                    paiement.operateur = operateur
+                    if bon is not None:
+                        paiement.reference_paiement = bon.code
+                        paiement.statut = Paiement.StatutPaiement.PAID
+                    else:
+                        paiement.reference_paiement = resultat.reference or None if resultat else None
+                        if resultat is not None and resultat.accepte:
+                            paiement.statut = Paiement.StatutPaiement.PAID
+                        else:
+                            # L'opérateur n'a pas encore confirmé
+                            paiement.statut = Paiement.StatutPaiement.PENDING
+                    paiement.save()
+                    
+                    # Créditer les places et points de fidélité du client, et émettre
+                    # les tickets bonus des seuils atteints, une fois le paiement
+                    # accepté (sinon à sa confirmation par l'opérateur)
+                    tickets = crediter_reservation(reservation) if paiement.statut == Paiement.StatutPaiement.PAID else []
+        except IntegrityError:
+            # Paiement simultané de la même réservation : un seul est enregistré
+            messages.info(self.request, 'Le paiement de cette réservation a déjà été enregistré.')
+            return redirect('reservations:reservation-detail', pk=reservation.pk)
+        if expire:
+            return self.places_liberees(reservation)
+        
+        if resultat is not None and resultat.en_attente:
+            messages.info(
+                self.request,
+                "Votre paiement est en cours de traitement par l'opérateur ; vous serez informé de sa confirmation."
+            )
         
-        # Mettre à jour le statut de la réservation
-        reservation.statut = 'CONFIRMEE'
-        reservation.save()
+        for ticket in tickets:
+            messages.success(
+                self.request,
+                f"Félicitations ! Vous avez gagné un ticket bonus pour votre prochain voyage ! "
+                f"Code: {ticket.code} (Valable jusqu'au {ticket.date_expiration.strftime('%d/%m/%Y')})"
+            )
         
         try:
             # Envoyer un email de confirmation de réservation
             self.send_confirmation_email(reservation, paiement)
-        except Exception as e:
-            # Enregistrer l'erreur mais continuer le processus
-            print(f"Erreur lors de l'envoi de l'email: {str(e)}")
+        except Exception:
+            # L'erreur est journalisée par send_confirmation_email : le processus continue
+            logger.warning("Réservation %s confirmée sans email de confirmation", reservation.reference)
             messages.warning(
                 self.request,
                 'Votre réservation a été confirmée, mais nous n\'avons pas pu envoyer l\'email de confirmation.'
@@ -59,15 +182,19 @@ class PaiementCreateView(LoginRequiredMixin, CreateView):
         )
         return redirect('reservations:reservation-detail', pk=reservation.pk)
     
+    def places_liberees(self, reservation):
+        messages.error(
+            self.request,
+            'Le délai de paiement est dépassé et vos places ont été libérées. Veuillez refaire votre réservation.'
+        )
+        return redirect('reservations:reservation-create', pk=reservation.horaire_id)
+    
     def send_confirmation_email(self, reservation, paiement):
         """Envoie un email de confirmation de réservation au client"""
         from django.core.mail import EmailMultiAlternatives
         from django.template.loader import render_to_string
         from django.utils.html import strip_tags
         from email.utils import formataddr
-        import logging
-        
-        logger = logging.getLogger(__name__)
         
         try:
             client = reservation.client
@@ -122,9 +249,74 @@ class PaiementCreateView(LoginRequiredMixin, CreateView):
             # Envoyer l'email
             msg.send(fail_silently=False)
             
-            logger.info(f"Email de confirmation envoyé avec succès à {user.email} pour la réservation {reservation.reference}")
+            logger.info("Email de confirmation envoyé pour la réservation %s", reservation.reference)
             
-        except Exception as e:
-            logger.error(f"Erreur lors de l'envoi de l'email de confirmation pour la réservation {reservation.reference}: {str(e)}", 
-                        exc_info=True, stack_info=True)
+        except Exception:
+            logger.exception("Envoi de l'email de confirmation de la réservation %s impossible", reservation.reference)
             raise  # Relancer l'erreur pour la gérer dans la vue
+
+
+@csrf_exempt
+@require_POST
+def notification_paiement(request, operateur):
+    """
+    Notification asynchrone d'un opérateur (webhook). La notification est
+    vérifiée et enregistrée telle quelle, puis traitée plus tard par la
+    commande traiter_notifications_paiement : la réponse est immédiate.
+    """
+    if operateur not in ADAPTATEURS:
+        raise Http404
+    try:
+        enregistrer_notification(operateur, request.body, request.headers)
+    except NotificationInvalide as e:
+        logger.warning("Notification %s rejetée : %s", operateur, e)
+        return HttpResponse(status=400)
+    return HttpResponse(status=200)
+
+
+class RapprochementPaiementsView(LoginRequiredMixin, UserPassesTestMixin, FormView):
+    """
+    Rapprochement d'un relevé d'opérateur envoyé par l'équipe financière :
+    bilan et premières anomalies affichés, ou rapport complet téléchargé.
+    """
+    form_class = RapprochementForm
+    template_name = 'reservations/rapports/rapprochement.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def form_valid(self, form):
+        operateur = form.cleaned_data['operateur']
+        simulation = form.cleaned_data['simulation']
+        rapport = None
+        if form.cleaned_data['telecharger_rapport']:
+            rapport = HttpResponse(content_type='text/csv; charset=utf-8')
+            rapport['Content-Disposition'] = (
+                f'attachment; filename="rapprochement-{operateur}-{timezone.now():%Y%m%d-%H%M}.csv"'
+            )
+
+        # Le relevé est décodé et lu ligne par ligne, sans être chargé en mémoire,
+        # après une première lecture qui vérifie son encodage avant toute correction
+        releve = form.cleaned_data['releve']
+        try:
+            verifier_encodage(releve.chunks())
+            releve.seek(0)
+            lignes = codecs.iterdecode(releve, 'utf-8-sig')
+            bilan, anomalies = rapprocher(lignes, operateur, appliquer=not simulation, rapport=rapport)
+        except ReleveInvalide as e:
+            form.add_error('releve', str(e))
+            return self.form_invalid(form)
+
+        if simulation:
+            messages.info(self.request, f"Simulation : {bilan['corriges']} paiement(s) seraient corrigés.")
+        else:
+            messages.success(self.request, f"{bilan['corriges']} paiement(s) corrigé(s).")
+        if rapport is not None:
+            return rapport
+        return self.render_to_response(self.get_context_data(
+            form=form,
+            bilan=[(libelle, bilan[cle]) for cle, libelle in LIBELLES_BILAN.items()],
+            anomalies=anomalies,
+            anomalies_masquees=sum(bilan[anomalie] for anomalie in ANOMALIES) - len(anomalies),
+            simulation=simulation,
+        ))
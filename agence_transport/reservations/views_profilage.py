@@ -0,0 +1,61 @@
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import Http404, HttpResponse
+from django.views.generic import TemplateView, View
+
+from . import profilage
+
+# Tris proposés pour le rapport : clé de pstats -> libellé
+TRIS = {
+    'cumulative': 'Temps cumulé',
+    'tottime': 'Temps propre',
+    'ncalls': "Nombre d'appels",
+}
+
+
+class ProfilListView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Profils conservés dans le tampon, du plus récent au plus ancien"""
+    template_name = 'reservations/rapports/profils.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        reglages = profilage.parametres()
+        context['profils'] = profilage.profils()
+        context['reglages'] = reglages
+        context['parametre'] = reglages['PARAMETRE']
+        return context
+
+
+class ProfilDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """Requêtes SQL et fonctions les plus coûteuses d'un profil"""
+    template_name = 'reservations/rapports/profil.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        entree = profilage.profil(self.kwargs['numero'])
+        if entree is None:
+            raise Http404("Ce profil a été remplacé ou a expiré.")
+        tri = self.request.GET.get('tri')
+        tri = tri if tri in TRIS else 'cumulative'
+        context.update(profil=entree, rapport=profilage.rapport(entree, tri), tri=tri, tris=TRIS)
+        return context
+
+
+class ProfilTelechargerView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Profil au format de pstats, à ouvrir avec snakeviz ou python -m pstats"""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, numero):
+        entree = profilage.profil(numero)
+        if entree is None:
+            raise Http404("Ce profil a été remplacé ou a expiré.")
+        response = HttpResponse(profilage.donnees_pstats(entree), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profil-{numero}.prof"'
+        return response